@@ -1,13 +1,62 @@
-from django.contrib import admin
-from django.http import HttpResponse
+from django.contrib import admin, messages
+from django.db.models import Count
+from django.http import FileResponse, Http404
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
 from django.utils.html import format_html
-from .models import Restaurant, Table, Reservation, Tag, RestaurantDocument
-from .utils import generate_restaurant_pdf
+from .models import Restaurant, Table, Reservation, ArchivedReservation, Tag, RestaurantDocument, WaitlistEntry
+from . import reports
+from .export import FORMATS, streaming_export
+from .importing import format_from_name, import_file
 
 # ✅ ИМПОРТЫ ДЛЯ ЭКСПОРТА (ПРОСТЫЕ БЕЗ ОШИБОК)
 from import_export.admin import ImportExportModelAdmin
 from import_export import resources
 
+class BulkToolsMixin:
+    """Потоковый экспорт (CSV/JSONL) и массовый импорт поверх import_export.
+
+    Экспорт учитывает фильтры и поиск списка; импорт - restaurant.importing.
+    """
+    change_list_template = 'admin/restaurant/change_list_bulk.html'
+    bulk_import_batch_size = 500
+
+    def get_urls(self):
+        info = self.model._meta.app_label, self.model._meta.model_name
+        urls = [
+            path('export-stream/<str:fmt>/', self.admin_site.admin_view(self.stream_export_view),
+                 name='%s_%s_export_stream' % info),
+            path('bulk-import/', self.admin_site.admin_view(self.bulk_import_view),
+                 name='%s_%s_bulk_import' % info),
+        ]
+        return urls + super().get_urls()
+
+    def stream_export_view(self, request, fmt):
+        if fmt not in FORMATS or not self.has_view_permission(request):
+            raise Http404
+        queryset = self.get_changelist_instance(request).get_queryset(request)
+        return streaming_export(queryset, fmt)
+
+    def bulk_import_view(self, request):
+        if not (self.has_add_permission(request) and self.has_change_permission(request)):
+            raise Http404
+        opts = self.model._meta
+        context = dict(self.admin_site.each_context(request), title='Массовый импорт', opts=opts)
+        upload = request.FILES.get('file')
+        if request.method == 'POST' and upload:
+            result = import_file(
+                opts.model_name, upload.read(), format_from_name(upload.name),
+                batch_size=self.bulk_import_batch_size, user=request.user,
+                dry_run=bool(request.POST.get('dry_run')),
+            )
+            if not result.errors:
+                self.message_user(request, str(result), messages.SUCCESS)
+                return redirect(f'admin:{opts.app_label}_{opts.model_name}_changelist')
+            context['result'] = result
+        return TemplateResponse(request, 'admin/restaurant/bulk_import.html', context)
+
+
 class TableInline(admin.TabularInline):
     model = Table
     extra = 1
@@ -29,7 +78,8 @@ class RestaurantResource(resources.ModelResource):
         from django.utils import timezone
         from datetime import timedelta
         month_ago = timezone.now() - timedelta(days=30)
-        return Restaurant.objects.filter(created_at__gte=month_ago)
+        # число столиков - аннотацией, а не запросом на каждую строку
+        return Restaurant.objects.filter(created_at__gte=month_ago).annotate(table_count=Count('tables'))
     
     # ✅ 2. КАСТОМНЫЙ МЕТОД - ПРЕОБРАЗОВАНИЕ ТИПА КУХНИ
     def dehydrate_cuisine_type(self, restaurant):
@@ -39,12 +89,14 @@ class RestaurantResource(resources.ModelResource):
     # ✅ 3. КАСТОМНЫЙ МЕТОД - ДОБАВИТЬ КОЛИЧЕСТВО СТОЛИКОВ
     def dehydrate_name(self, restaurant):
         """Добавить количество столиков к названию"""
-        table_count = restaurant.tables.count()
+        table_count = getattr(restaurant, 'table_count', None)
+        if table_count is None:
+            table_count = restaurant.tables.count()
         return f"{restaurant.name} ({table_count} столиков)"
 
 # ✅ АДМИНКА РЕСТОРАНОВ С ЭКСПОРТОМ И ИСТОРИЕЙ
 @admin.register(Restaurant)
-class RestaurantAdmin(ImportExportModelAdmin):  # ← ВАЖНО: ImportExportModelAdmin
+class RestaurantAdmin(BulkToolsMixin, ImportExportModelAdmin):  # ← ВАЖНО: ImportExportModelAdmin
     resource_class = RestaurantResource
     
     # БАЗОВЫЕ НАСТРОЙКИ
@@ -54,19 +106,53 @@ class RestaurantAdmin(ImportExportModelAdmin):  # ← ВАЖНО: ImportExportMo
     inlines = [TableInline]
     
     # ✅ ПРОСТЫЕ ДЕЙСТВИЯ БЕЗ ФОРМАТИРОВАНИЯ
-    actions = ['generate_pdf_report']
+    actions = ['generate_pdf_report', 'generate_pdf_zip']
+    
+    def get_urls(self):
+        urls = [
+            path('reports/<str:report_id>/', self.admin_site.admin_view(self.report_status),
+                 name='restaurant_report_status'),
+            path('reports/<str:report_id>/download/', self.admin_site.admin_view(self.report_download),
+                 name='restaurant_report_download'),
+        ]
+        return urls + super().get_urls()
+    
+    def start_report(self, request, queryset, kind):
+        """Отчёт рендерится в фоне; готовый из кэша скачивается сразу"""
+        job = reports.request_report(list(queryset.values_list('pk', flat=True)), kind)
+        if job['status'] == 'ready':
+            return self.report_download(request, job['id'])
+        return redirect('admin:restaurant_report_status', report_id=job['id'])
     
     def generate_pdf_report(self, request, queryset):
-        if len(queryset) == 1:
-            restaurant = queryset.first()
-            buffer = generate_restaurant_pdf(restaurant)
-            
-            response = HttpResponse(buffer, content_type='application/pdf')
-            response['Content-Disposition'] = f'attachment; filename="restaurant_{restaurant.id}.pdf"'
-            return response
-        else:
-            self.message_user(request, "Выберите только один ресторан для генерации PDF")
+        return self.start_report(request, queryset, 'pdf')
     generate_pdf_report.short_description = "Сгенерировать PDF отчет"
+    
+    def generate_pdf_zip(self, request, queryset):
+        return self.start_report(request, queryset, 'zip')
+    generate_pdf_zip.short_description = "Сгенерировать PDF отчеты (ZIP-архив)"
+    
+    def report_status(self, request, report_id):
+        job = reports.get_job(report_id)
+        if job is None:
+            raise Http404('Отчёт не найден')
+        context = dict(
+            self.admin_site.each_context(request),
+            title='Формирование отчёта',
+            opts=self.model._meta,
+            job=job,
+            download_url=reverse('admin:restaurant_report_download', args=[report_id]),
+        )
+        return TemplateResponse(request, 'admin/restaurant/report_status.html', context)
+    
+    def report_download(self, request, report_id):
+        job = reports.get_job(report_id)
+        if job is None or job['status'] != 'ready':
+            raise Http404('Отчёт ещё не готов')
+        content_type = 'application/zip' if job['kind'] == 'zip' else 'application/pdf'
+        # FileResponse отдаёт файл блоками, не читая его целиком в память
+        return FileResponse(open(reports.report_path(job), 'rb'), as_attachment=True,
+                            filename=job['filename'], content_type=content_type)
 
 # ✅ РЕСУРС ДЛЯ ЭКСПОРТА СТОЛИКОВ
 class TableResource(resources.ModelResource):
@@ -74,7 +160,7 @@ class TableResource(resources.ModelResource):
         model = Table
 
 @admin.register(Table)
-class TableAdmin(ImportExportModelAdmin):  # ← ЭКСПОРТ ДЛЯ СТОЛИКОВ
+class TableAdmin(BulkToolsMixin, ImportExportModelAdmin):  # ← ЭКСПОРТ ДЛЯ СТОЛИКОВ
     resource_class = TableResource
     list_display = ['table_number', 'restaurant', 'capacity', 'price_per_hour']
 
@@ -84,10 +170,45 @@ class ReservationResource(resources.ModelResource):
         model = Reservation
 
 @admin.register(Reservation)
-class ReservationAdmin(ImportExportModelAdmin):  # ← ЭКСПОРТ ДЛЯ БРОНИРОВАНИЙ
+class ReservationAdmin(BulkToolsMixin, ImportExportModelAdmin):  # ← ЭКСПОРТ ДЛЯ БРОНИРОВАНИЙ
     resource_class = ReservationResource
     list_display = ['id', 'user', 'table', 'reservation_date', 'status']
 
+    def _get_obj_does_not_exist_redirect(self, request, opts, object_id):
+        # старые ссылки на бронь, перенесённую в архив (restaurant/archive.py)
+        if object_id.isdigit() and ArchivedReservation.objects.filter(pk=object_id).exists():
+            return redirect('admin:restaurant_archivedreservation_change', object_id)
+        return super()._get_obj_does_not_exist_redirect(request, opts, object_id)
+
+
+@admin.register(ArchivedReservation)
+class ArchivedReservationAdmin(admin.ModelAdmin):
+    """Архив только для просмотра; наполняет его manage.py archive_reservations"""
+    list_display = ['id', 'user', 'table', 'reservation_date', 'status', 'archived_at']
+    list_filter = ['status']
+    date_hierarchy = 'reservation_date'
+    list_select_related = ['user', 'table']
+    show_full_result_count = False
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+@admin.register(WaitlistEntry)
+class WaitlistEntryAdmin(admin.ModelAdmin):
+    """Очередь; столики назначает restaurant/waitlist.py"""
+    list_display = ['id', 'user', 'restaurant', 'reservation_date', 'reservation_time', 'guests_count', 'status', 'reservation']
+    list_filter = ['status']
+    date_hierarchy = 'reservation_date'
+    list_select_related = ['user', 'restaurant']
+    raw_id_fields = ['user', 'reservation']
+    readonly_fields = ['reservation', 'assigned_at']
+
 # ✅ ОСТАЛЬНЫЕ МОДЕЛИ (БЕЗ ЭКСПОРТА)
 @admin.register(Tag)
 class TagAdmin(admin.ModelAdmin):
@@ -0,0 +1,101 @@
+"""Архивация старых броней.
+
+Брони с датой раньше горизонта (RESERVATION_ARCHIVE_DAYS дней назад)
+переносятся из Reservation в ArchivedReservation с теми же id. Рабочая
+таблица остаётся маленькой: проверки занятости, предстоящие брони и
+популярность читают только её, а индексы помещаются в память.
+
+Перенос идёт порциями: каждая порция - одна транзакция (вставка в
+архив и удаление из рабочей таблицы), поэтому прерванный запуск просто
+продолжается следующим. Удаление - без сигналов: архивация не отмена,
+счётчики популярности и история изменений не трогаются.
+
+История броней пользователя (user_history) читает обе таблицы, админка
+переадресует ссылку на перенесённую бронь в архив.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, router
+from django.utils import timezone
+
+from . import user_summary
+from .models import ArchivedReservation, Reservation, WaitlistEntry
+from .popularity import WINDOW_DAYS
+from .sqlite_tuning import write_transaction
+
+FIELDS = [
+    'id', 'user_id', 'table_id', 'reservation_date', 'reservation_time', 'duration',
+    'guests_count', 'special_requests', 'status', 'created_at',
+]
+
+BATCH_SIZE = 1000
+
+# Не раньше окна популярности: rollup(rebuild=True) считает его по рабочей таблице
+MIN_DAYS = WINDOW_DAYS + 1
+
+
+def horizon(days=None, today=None):
+    """Дата, раньше которой брони уходят в архив"""
+    if days is None:
+        days = getattr(settings, 'RESERVATION_ARCHIVE_DAYS', 180)
+    if days < MIN_DAYS:
+        raise ValueError(f'Горизонт архивации - не меньше {MIN_DAYS} дней')
+    return (today or timezone.now().date()) - timedelta(days=days)
+
+
+def pending(before):
+    """Брони, которые пора перенести"""
+    return Reservation.objects.filter(reservation_date__lt=before)
+
+
+def archive_batch(before, after_id=0, batch_size=BATCH_SIZE):
+    """Перенести одну порцию (по возрастанию id); возвращает перенесённые id"""
+    with write_transaction():
+        rows = list(
+            pending(before).filter(id__gt=after_id).order_by('id').values(*FIELDS)[:batch_size]
+        )
+        if not rows:
+            return []
+        now = timezone.now()
+        # ignore_conflicts - на случай ручного восстановления части архива
+        ArchivedReservation.objects.bulk_create(
+            [ArchivedReservation(archived_at=now, **row) for row in rows], ignore_conflicts=True
+        )
+        ids = [row['id'] for row in rows]
+        # единственная ссылка на бронь - из листа ожидания
+        WaitlistEntry.objects.filter(reservation_id__in=ids).update(reservation=None)
+        # явный DELETE вместо QuerySet.delete(): тот собрал бы связи через
+        # Collector и отправил pre/post_delete, а архивация - не отмена брони
+        with connections[router.db_for_write(Reservation)].cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {Reservation._meta.db_table} WHERE id IN ({", ".join(["%s"] * len(ids))})', ids
+            )
+        # в сводке у последних броней отмечено, где они лежат
+        user_summary.invalidate_on_commit(row['user_id'] for row in rows)
+    return ids
+
+
+def archive_reservations(before, batch_size=BATCH_SIZE, limit=None):
+    """Перенести брони раньше before; генератор числа броней в каждой порции.
+
+    limit - не больше стольких броней за запуск (остальные - в следующий).
+    """
+    moved, last_id = 0, 0
+    while limit is None or moved < limit:
+        size = batch_size if limit is None else min(batch_size, limit - moved)
+        ids = archive_batch(before, last_id, size)
+        if not ids:
+            break
+        last_id = ids[-1]
+        moved += len(ids)
+        yield len(ids)
+
+
+def user_history(user):
+    """Брони пользователя: рабочая таблица и архив, с ресторанами"""
+    return [
+        model.objects.filter(user=user).select_related('table', 'table__restaurant')
+        for model in (Reservation, ArchivedReservation)
+    ]
+
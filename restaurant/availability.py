@@ -0,0 +1,273 @@
+import asyncio
+import hashlib
+from collections import defaultdict
+from datetime import time, timedelta
+
+from django.db.models import Q
+
+from . import schedule
+from .models import Reservation, Table
+from .utils import alist
+
+# Шаг сетки слотов; границы дня - часы работы ресторана (schedule.py)
+SLOT_STEP = 30  # минут
+
+MINUTES_IN_DAY = 24 * 60
+
+# Сколько дней можно запросить в сетке за раз
+MAX_GRID_DAYS = 31
+GRID_STEPS = (15, 30, 60)
+
+
+def to_minutes(value):
+    """Время -> минуты от полуночи"""
+    return value.hour * 60 + value.minute
+
+
+def from_minutes(minutes):
+    """Минуты от полуночи -> время"""
+    minutes = max(0, min(minutes, MINUTES_IN_DAY - 1))
+    return time(minutes // 60, minutes % 60)
+
+
+def overlapping(start, end):
+    """Q для броней, пересекающих интервал [start, end) в минутах.
+
+    Бронь занимает [reservation_time, reservation_time + duration).
+    Длительность выбирается из DURATION_CHOICES, поэтому условие
+    "конец брони > start" раскладывается на несколько диапазонов по
+    reservation_time - каждый из них покрывается индексом.
+    """
+    q = Q()
+    for duration, _label in Reservation.DURATION_CHOICES:
+        lower = start - duration
+        if lower < 0:
+            q |= Q(duration=duration)
+        else:
+            q |= Q(duration=duration, reservation_time__gt=from_minutes(lower))
+    if end < MINUTES_IN_DAY:
+        q &= Q(reservation_time__lt=from_minutes(end))
+    return q
+
+
+def busy_reservations(date, start, end):
+    """Активные брони на дату, пересекающие интервал [start, end)"""
+    return Reservation.objects.filter(
+        overlapping(start, end),
+        reservation_date=date,
+        status__in=Reservation.ACTIVE_STATUSES,
+    )
+
+
+def free_tables(restaurant, date, at_time, guests_count=1, duration=Reservation.DEFAULT_DURATION):
+    """Свободные столики ресторана на дату и время - один запрос"""
+    start = to_minutes(at_time)
+    busy = busy_reservations(date, start, start + duration).filter(
+        table__restaurant=restaurant
+    ).values('table_id')
+    return Table.objects.filter(
+        restaurant=restaurant,
+        capacity__gte=guests_count,
+    ).exclude(id__in=busy)
+
+
+def is_table_free(table, date, at_time, duration=Reservation.DEFAULT_DURATION, exclude_id=None):
+    """Проверка, свободен ли конкретный столик на интервал"""
+    start = to_minutes(at_time)
+    busy = busy_reservations(date, start, start + duration).filter(table=table)
+    if exclude_id is not None:
+        busy = busy.exclude(id=exclude_id)
+    return not busy.exists()
+
+
+def day_slots(restaurant, date, guests_count=1, duration=Reservation.DEFAULT_DURATION,
+              opens=None, closes=None, step=SLOT_STEP, tables=None):
+    """Все свободные слоты ресторана на день за один проход.
+
+    Границы дня - часы работы ресторана на эту дату (schedule.windows)
+    или явные opens/closes; бронь должна закончиться до закрытия.
+    Возвращает словарь {столик: [время начала, ...]}. Брони за день
+    читаются одним запросом; если столики ресторана уже загружены через
+    prefetch_related('tables'), они берутся из кэша. Можно передать
+    tables, чтобы посчитать слоты только для части столиков.
+    """
+    if tables is None:
+        tables = restaurant.tables.all()
+        intervals = reserved_intervals(restaurant, date)
+    else:
+        intervals = reserved_intervals(restaurant, date, [t.id for t in tables])
+
+    if opens is None:
+        day_windows = schedule.windows(restaurant, date)
+    else:
+        day_windows = [(to_minutes(opens), to_minutes(closes))]
+    starts = schedule.slot_starts(day_windows, duration, step)
+    return {
+        table: table_slots(intervals.get(table.id, []), starts, duration)
+        for table in tables
+        if table.capacity >= guests_count
+    }
+
+
+def reserved_intervals(restaurant, date, table_ids=None):
+    """Активные брони ресторана на дату одним запросом: {table_id: [(start, end), ...]}.
+
+    Интервалы в минутах, отсортированы по началу.
+    """
+    return group_intervals(reserved_rows(restaurant, date, table_ids))
+
+
+def reserved_rows(restaurant, date, table_ids=None):
+    """Запрос (table_id, время, длительность) активных броней на дату по времени начала"""
+    reservations = Reservation.objects.filter(
+        table__restaurant=restaurant,
+        reservation_date=date,
+        status__in=Reservation.ACTIVE_STATUSES,
+    )
+    if table_ids is not None:
+        reservations = reservations.filter(table__in=table_ids)
+    return reservations.order_by('reservation_time').values_list('table_id', 'reservation_time', 'duration')
+
+
+def group_intervals(rows):
+    intervals = {}
+    for table_id, start_time, length in rows:
+        start = to_minutes(start_time)
+        intervals.setdefault(table_id, []).append((start, start + length))
+    return intervals
+
+
+def table_slots(busy, starts, duration):
+    """Свободные начала из starts для столика с занятыми интервалами busy"""
+    free = []
+    i = 0
+    for start in starts:
+        end = start + duration
+        # брони отсортированы по началу - пропускаем уже закончившиеся
+        while i < len(busy) and busy[i][1] <= start:
+            i += 1
+        if not any(b_start < end and b_end > start for b_start, b_end in busy[i:]):
+            free.append(from_minutes(start))
+    return free
+
+
+def batch_conflicts(bookings, released=()):
+    """Проверка пачки броней за один запрос.
+
+    bookings - список (table_id, date, time, duration, reservation_id).
+    Возвращает индексы броней, пересекающихся с активными бронями в БД
+    или с более ранними бронями той же пачки. Брони с reservation_id
+    (обновляемые) не конфликтуют сами с собой. released - id броней
+    пачки, которые становятся неактивными: их прежнее время свободно.
+    """
+    if not bookings:
+        return set()
+    exclude = [b[4] for b in bookings if b[4] is not None] + list(released)
+    rows = Reservation.objects.filter(
+        table_id__in={b[0] for b in bookings},
+        reservation_date__in={b[1] for b in bookings},
+        status__in=Reservation.ACTIVE_STATUSES,
+    ).exclude(id__in=exclude).values_list('table_id', 'reservation_date', 'reservation_time', 'duration')
+
+    busy = defaultdict(list)
+    for table_id, day, start_time, length in rows:
+        start = to_minutes(start_time)
+        busy[(table_id, day)].append((start, start + length))
+
+    conflicts = set()
+    for index, (table_id, day, start_time, length, _pk) in enumerate(bookings):
+        start = to_minutes(start_time)
+        end = start + length
+        intervals = busy[(table_id, day)]
+        if any(b_start < end and b_end > start for b_start, b_end in intervals):
+            conflicts.add(index)
+        else:
+            intervals.append((start, end))
+    return conflicts
+
+
+def busy_mask(intervals):
+    """Битовая маска занятых минут дня: бит m - минута m"""
+    mask = 0
+    for start, end in intervals:
+        end = min(end, MINUTES_IN_DAY)
+        if end > start:
+            mask |= ((1 << (end - start)) - 1) << start
+    return mask
+
+
+def free_slots(mask, starts, duration):
+    """Строка по слоту на каждое начало из starts: '1' - свободно"""
+    window = (1 << duration) - 1
+    return ''.join('0' if (mask >> start) & window else '1' for start in starts)
+
+
+def slot_grid(restaurant, start_date, days=1, duration=Reservation.DEFAULT_DURATION,
+              step=SLOT_STEP, guests_count=1):
+    """Сетка свободных слотов по столикам на несколько дней - два запроса.
+
+    Слоты дня - по часам работы ресторана на эту дату. Занятость каждого столика за день - битовая маска минут, проверка
+    слота - сдвиг и AND. Для каждого дня возвращается строка '1'/'0' на
+    столик и etag - хеш содержимого дня, по которому клиент может не
+    получать повторно неизменившиеся дни.
+    """
+    dates, tables, rows = grid_querysets(restaurant, start_date, days, guests_count)
+    tables = list(tables)
+    return build_grid(restaurant, dates, tables, rows if tables else [], duration, step)
+
+
+async def aslot_grid(restaurant, start_date, days=1, duration=Reservation.DEFAULT_DURATION,
+                     step=SLOT_STEP, guests_count=1):
+    """slot_grid() через асинхронный ORM: столики и брони - параллельно"""
+    dates, tables, rows = grid_querysets(restaurant, start_date, days, guests_count)
+    tables, rows = await asyncio.gather(alist(tables), alist(rows))
+    return build_grid(restaurant, dates, tables, rows, duration, step)
+
+
+def grid_querysets(restaurant, start_date, days, guests_count):
+    """(даты, запрос столиков, запрос броней) - запросы друг от друга не зависят"""
+    dates = [start_date + timedelta(days=offset) for offset in range(days)]
+    tables = (
+        Table.objects.filter(restaurant=restaurant, capacity__gte=guests_count)
+        .order_by('table_number', 'id').values_list('id', 'table_number', 'capacity')
+    )
+    rows = Reservation.objects.filter(
+        table__restaurant=restaurant,
+        table__capacity__gte=guests_count,
+        reservation_date__range=(dates[0], dates[-1]),
+        status__in=Reservation.ACTIVE_STATUSES,
+    ).values_list('table_id', 'reservation_date', 'reservation_time', 'duration')
+    return dates, tables, rows
+
+
+def build_grid(restaurant, dates, tables, rows, duration, step):
+    intervals = defaultdict(list)
+    for table_id, day, start_time, length in rows:
+        start = to_minutes(start_time)
+        intervals[(table_id, day)].append((start, start + length))
+
+    grid_days = []
+    for day in dates:
+        starts = schedule.slot_starts(schedule.windows(restaurant, day), duration, step)
+        times = [from_minutes(start).strftime('%H:%M') for start in starts]
+        grid = {
+            str(table_id): free_slots(busy_mask(intervals[(table_id, day)]), starts, duration)
+            for table_id, _number, _capacity in tables
+        }
+        payload = repr((day, times, duration, tables, sorted(grid.items())))
+        grid_days.append({
+            'date': day.isoformat(),
+            'etag': hashlib.sha1(payload.encode()).hexdigest()[:16],
+            'times': times,
+            'tables': grid,
+        })
+    return {
+        'restaurant': restaurant.pk,
+        'duration': duration,
+        'step': step,
+        'tables': [
+            {'id': table_id, 'table_number': number, 'capacity': capacity}
+            for table_id, number, capacity in tables
+        ],
+        'days': grid_days,
+    }
@@ -0,0 +1,603 @@
+"""Воспроизводимые замеры производительности.
+
+seed() наполняет пустую БД ресторанами, столиками и бронями с
+перекосом, как в жизни: популярность ресторанов убывает по закону Ципфа,
+брони тяготеют к обеду и вечеру ближайших дней, часть отменена.
+Генератор детерминирован (random.Random(seed)), поэтому одинаковые
+параметры дают одинаковые данные.
+
+run_micro() замеряет отдельные функции (время и число запросов),
+run_load() - страницы и API под нагрузкой из нескольких потоков через
+тестовый клиент Django. run_wsgi() и run_asgi() гоняют читающие
+маршруты через настоящие WSGI- и ASGI-обработчики, как это делал бы
+сервер. Результаты - словари для JSON; compare() находит регрессии
+относительно прошлого прогона.
+
+run_contention() - всплеск бронирований из нескольких потоков вместе с
+читателями: сколько записей упёрлось в блокировку SQLite.
+
+Запуск - команды benchmark_suite, benchmark_async и benchmark_sqlite,
+они работают на отдельной временной БД (isolated_database).
+"""
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time as time_module
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import time, timedelta
+from io import BytesIO
+from urllib.parse import urlencode
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import OperationalError, connection, connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import popularity
+from .dashboard import POPULAR_LIMIT
+from .models import Restaurant, Reservation, Table
+from .popularity import top_restaurants
+from .utils import generate_restaurant_pdf
+
+ZIPF_EXPONENT = 1.1
+
+NAME_WORDS = ['Траттория', 'Бистро', 'Кафе', 'Гриль', 'Дом', 'Сад', 'Двор', 'Погребок']
+NAME_PLACES = ['у моря', 'на углу', 'Марио', 'Сакура', 'Восток', 'Прага', 'Арбат', 'Тбилиси']
+OPENING_HOURS = [
+    '10:00-23:00',
+    '12:00-00:00',
+    'Пн-Пт 09:00-22:00; Сб-Вс 11:00-23:00',
+    'Пн-Чт 12:00-23:00; Пт-Сб 12:00-02:00; Вс выходной',
+    'круглосуточно',
+]
+CAPACITIES = [2, 2, 2, 4, 4, 4, 6, 8]
+
+# Час начала брони -> вес: обеденный и вечерний пики
+HOUR_WEIGHTS = {12: 3, 13: 5, 14: 3, 15: 1, 16: 1, 17: 2, 18: 5, 19: 8, 20: 7, 21: 3}
+DURATION_WEIGHTS = {60: 1, 90: 2, 120: 6, 180: 2, 240: 1}
+STATUS_WEIGHTS = {'confirmed': 8, 'pending': 1, 'cancelled': 1}
+
+DAYS_BACK = 21
+DAYS_AHEAD = 14
+
+BATCH_SIZE = 1000
+
+# Маршрут нагрузки -> вес в смеси запросов
+ROUTES = {
+    'home': 3,
+    'restaurant_detail': 5,
+    'search_restaurants': 3,
+    'make_reservation.get': 1,
+    'make_reservation.post': 1,
+    'api.restaurants': 2,
+    'api.tables': 1,
+    'api.reservations': 1,
+    'api.availability': 1,
+}
+
+# Насколько медленнее должен стать замер, чтобы считаться регрессией
+REGRESSION_THRESHOLD = 0.2
+
+
+def zipf_weights(count, exponent=ZIPF_EXPONENT):
+    return [1 / (rank + 1) ** exponent for rank in range(count)]
+
+
+def _pick(rng, weights):
+    """Ключ словаря {значение: вес}"""
+    return rng.choices(list(weights), weights=list(weights.values()))[0]
+
+
+class Dataset:
+    """Что создал seed(): id в порядке популярности и параметры генерации"""
+
+    def __init__(self, params, restaurant_ids, table_ids, user_ids, reservations):
+        self.params = params
+        self.restaurant_ids = restaurant_ids
+        self.table_ids = table_ids  # {restaurant_id: [table_id, ...]}
+        self.user_ids = user_ids
+        self.reservations = reservations
+        self.weights = zipf_weights(len(restaurant_ids))
+
+    def restaurant(self, rng):
+        """id ресторана с учётом популярности"""
+        return rng.choices(self.restaurant_ids, weights=self.weights)[0]
+
+    def table(self, rng):
+        return rng.choice(self.table_ids[self.restaurant(rng)])
+
+    def search_terms(self):
+        return NAME_WORDS + NAME_PLACES
+
+
+def seed(restaurants=50, tables=10, reservations=5000, users=50, seed_value=0):
+    """Наполнить БД; restaurants * tables столиков и до reservations броней.
+
+    Брони пишутся bulk_create (без сигналов), рейтинг популярности
+    пересчитывается в конце. Совпадения слота активной брони
+    пропускаются, поэтому броней может быть чуть меньше.
+    """
+    rng = random.Random(seed_value)
+    params = {'restaurants': restaurants, 'tables': tables, 'reservations': reservations,
+              'users': users, 'seed': seed_value}
+
+    usernames = [f'benchmark{n}' for n in range(users)]
+    User.objects.bulk_create([User(username=username) for username in usernames])
+    user_ids = list(User.objects.filter(username__in=usernames).order_by('pk').values_list('pk', flat=True))
+
+    restaurant_ids = []
+    for n in range(restaurants):
+        restaurant = Restaurant(
+            name=f'{rng.choice(NAME_WORDS)} {rng.choice(NAME_PLACES)} {n}',
+            description='Уютный зал, сезонное меню и живая музыка по пятницам. ' * 3,
+            address=f'ул. Тестовая, {n + 1}',
+            phone=f'+7900{n:07d}',
+            cuisine_type=rng.choice([code for code, _label in Restaurant.CUISINE_TYPES]),
+            opening_hours=rng.choice(OPENING_HOURS),
+        )
+        restaurant.save()  # сигналы: поисковый индекс и интервалы работы
+        restaurant_ids.append(restaurant.pk)
+
+    Table.objects.bulk_create([
+        Table(restaurant_id=restaurant_id, table_number=str(number + 1), capacity=rng.choice(CAPACITIES),
+              price_per_hour=rng.randrange(300, 3000, 50))
+        for restaurant_id in restaurant_ids for number in range(tables)
+    ], batch_size=BATCH_SIZE)
+    table_ids = {}
+    for table_id, restaurant_id in Table.objects.filter(
+            restaurant__in=restaurant_ids).order_by('pk').values_list('pk', 'restaurant_id'):
+        table_ids.setdefault(restaurant_id, []).append(table_id)
+    dataset = Dataset(params, restaurant_ids, table_ids, user_ids, 0)
+
+    today = timezone.now().date()
+    days = [today + timedelta(days=offset) for offset in range(-DAYS_BACK, DAYS_AHEAD + 1)]
+    # выходные заняты вдвое чаще
+    day_weights = [2 if day.weekday() >= 5 else 1 for day in days]
+    taken = set()
+    rows = []
+    for _ in range(reservations):
+        table_id = dataset.table(rng)
+        day = rng.choices(days, weights=day_weights)[0]
+        start = time(_pick(rng, HOUR_WEIGHTS), rng.choice((0, 30)))
+        status = _pick(rng, STATUS_WEIGHTS)
+        if status != 'cancelled':
+            if (table_id, day, start) in taken:
+                continue
+            taken.add((table_id, day, start))
+        rows.append(Reservation(
+            user_id=rng.choice(user_ids), table_id=table_id, reservation_date=day, reservation_time=start,
+            duration=_pick(rng, DURATION_WEIGHTS), guests_count=rng.randint(1, 6), status=status,
+        ))
+    Reservation.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+    popularity.rollup(rebuild=True)
+    dataset.reservations = len(rows)
+    return dataset
+
+
+@contextmanager
+def isolated_database():
+    """Временная БД по миграциям, как у тестов; удаляется после прогона.
+
+    Для SQLite - файл, а не память: потоки нагрузки открывают свои соединения.
+    """
+    old_name = connection.settings_dict['NAME']
+    with tempfile.TemporaryDirectory(prefix='benchmark-') as directory:
+        if connection.vendor == 'sqlite':
+            connection.settings_dict['TEST']['NAME'] = os.path.join(directory, 'db.sqlite3')
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            yield
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def _percentile(ordered, share):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))]
+
+
+def summarize(durations):
+    """Секунды -> медиана, p95, p99 и максимум в мс"""
+    ordered = sorted(durations)
+    return {
+        'count': len(ordered),
+        'median_ms': round(statistics.median(ordered) * 1000, 3),
+        'p95_ms': round(_percentile(ordered, 0.95) * 1000, 3),
+        'p99_ms': round(_percentile(ordered, 0.99) * 1000, 3),
+        'max_ms': round(ordered[-1] * 1000, 3),
+    }
+
+
+def measure(run, repeat):
+    """Время повторов run() и число запросов одного вызова"""
+    run()  # прогрев
+    with CaptureQueriesContext(connection) as queries:
+        run()
+    durations = []
+    for _ in range(repeat):
+        started = time_module.perf_counter()
+        run()
+        durations.append(time_module.perf_counter() - started)
+    result = summarize(durations)
+    result['queries'] = len(queries)
+    return result
+
+
+def micro_benchmarks(dataset):
+    """Имя -> функция без аргументов"""
+    today = timezone.now().date()
+    hot = Restaurant.objects.get(pk=dataset.restaurant_ids[0])
+    return {
+        'get_available_tables': lambda: list(hot.get_available_tables(today)),
+        'available_table_manager': lambda: list(Table.available.all()),
+        'popular_restaurants': lambda: list(top_restaurants(POPULAR_LIMIT)),
+        'generate_restaurant_pdf': lambda: generate_restaurant_pdf(
+            Restaurant.objects.prefetch_related('tables').get(pk=hot.pk)
+        ),
+    }
+
+
+def run_micro(dataset, repeat=20, names=None):
+    benchmarks = micro_benchmarks(dataset)
+    return {
+        name: measure(run, repeat)
+        for name, run in benchmarks.items()
+        if names is None or name in names
+    }
+
+
+def _request(client, route, dataset, rng):
+    """Один запрос маршрута; возвращает код ответа"""
+    if route == 'home':
+        return client.get('/').status_code
+    if route == 'restaurant_detail':
+        return client.get(f'/restaurants/{dataset.restaurant(rng)}/').status_code
+    if route == 'search_restaurants':
+        return client.get('/search/', {'q': rng.choice(dataset.search_terms())}).status_code
+    if route == 'make_reservation.get':
+        return client.get(f'/reservations/{dataset.table(rng)}/book/').status_code
+    if route == 'make_reservation.post':
+        day = timezone.now().date() + timedelta(days=rng.randint(1, DAYS_AHEAD))
+        return client.post(f'/reservations/{dataset.table(rng)}/book/', {
+            'reservation_date': day.isoformat(),
+            'reservation_time': f'{_pick(rng, HOUR_WEIGHTS):02d}:{rng.choice((0, 30)):02d}',
+            'duration': Reservation.DEFAULT_DURATION,
+            'guests_count': 2,
+        }).status_code
+    if route == 'api.restaurants':
+        return client.get('/api/restaurants/', {'expand': 'tables,tags'}).status_code
+    if route == 'api.tables':
+        return client.get('/api/tables/', {'expand': 'restaurant'}).status_code
+    if route == 'api.reservations':
+        return client.get('/api/reservations/', {'expand': 'table.restaurant'}).status_code
+    if route == 'api.availability':
+        return client.get(f'/api/restaurants/{dataset.restaurant(rng)}/availability/', {'days': 7}).status_code
+    raise ValueError(route)
+
+
+def _worker(dataset, routes, count, seed_value):
+    rng = random.Random(seed_value)
+    client = Client(HTTP_HOST='localhost')
+    client.force_login(User.objects.get(pk=rng.choice(dataset.user_ids)))
+    timings, errors = {}, {}
+    try:
+        for _ in range(count):
+            route = _pick(rng, routes)
+            started = time_module.perf_counter()
+            try:
+                failed = _request(client, route, dataset, rng) >= 500
+            except Exception:
+                failed = True
+            timings.setdefault(route, []).append(time_module.perf_counter() - started)
+            if failed:
+                errors[route] = errors.get(route, 0) + 1
+    finally:
+        if threading.current_thread() is not threading.main_thread():
+            connections.close_all()
+    return timings, errors
+
+
+def run_load(dataset, requests=500, concurrency=4, routes=None, seed_value=0):
+    """Смесь запросов ROUTES из concurrency потоков; у каждого свой клиент.
+
+    Кэш очищается перед прогоном. С concurrency=1 всё выполняется в
+    текущем потоке.
+    """
+    routes = routes or ROUTES
+    cache.clear()
+    share, extra = divmod(requests, concurrency)
+    counts = [share + (worker < extra) for worker in range(concurrency)]
+    started = time_module.perf_counter()
+    if concurrency == 1:
+        results = [_worker(dataset, routes, counts[0], seed_value)]
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='benchmark') as executor:
+            results = list(executor.map(
+                lambda worker: _worker(dataset, routes, counts[worker], seed_value + worker),
+                range(concurrency),
+            ))
+    seconds = time_module.perf_counter() - started
+
+    timings, errors = {}, {}
+    for worker_timings, worker_errors in results:
+        for route, durations in worker_timings.items():
+            timings.setdefault(route, []).extend(durations)
+        for route, count in worker_errors.items():
+            errors[route] = errors.get(route, 0) + count
+    report = {}
+    for route in sorted(timings):
+        report[route] = summarize(timings[route])
+        report[route]['errors'] = errors.get(route, 0)
+    return {
+        'requests': requests,
+        'concurrency': concurrency,
+        'seconds': round(seconds, 3),
+        'rps': round(requests / seconds, 1) if seconds else None,
+        'routes': report,
+    }
+
+
+def compare(baseline, current, threshold=REGRESSION_THRESHOLD):
+    """Сравнить медианы двух прогонов: [(раздел, имя, было, стало, отношение, регрессия)]"""
+    rows = []
+    sections = [('micro', baseline.get('micro', {}), current.get('micro', {})),
+                ('load', baseline.get('load', {}).get('routes', {}), current.get('load', {}).get('routes', {}))]
+    for section, before, after in sections:
+        for name in sorted(set(before) & set(after)):
+            old, new = before[name]['median_ms'], after[name]['median_ms']
+            ratio = new / old if old else None
+            rows.append((section, name, old, new, ratio, ratio is not None and ratio > 1 + threshold))
+    return rows
+
+
+# Читающие маршруты, у которых есть асинхронная версия (views_async) -> вес
+READ_ROUTES = {
+    'home': 3,
+    'all_restaurants': 2,
+    'restaurant_detail': 5,
+    'search_restaurants': 3,
+    'api.popular': 1,
+    'api.upcoming': 1,
+    'api.availability': 2,
+}
+
+
+def read_request(route, dataset, rng):
+    """(путь, строка запроса) для маршрута READ_ROUTES"""
+    if route == 'home':
+        return '/', ''
+    if route == 'all_restaurants':
+        return '/restaurants/', ''
+    if route == 'restaurant_detail':
+        return f'/restaurants/{dataset.restaurant(rng)}/', ''
+    if route == 'search_restaurants':
+        return '/search/', urlencode({'q': rng.choice(dataset.search_terms())})
+    if route == 'api.popular':
+        return '/api/restaurants/popular/', 'expand=tags'
+    if route == 'api.upcoming':
+        return '/api/reservations/upcoming/', 'expand=table'
+    if route == 'api.availability':
+        return f'/api/restaurants/{dataset.restaurant(rng)}/availability/', 'days=7'
+    raise ValueError(route)
+
+
+def wsgi_get(application, path, query):
+    """GET к WSGI-приложению, как от сервера; возвращает код ответа"""
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query, 'SCRIPT_NAME': '',
+        'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'HTTP_HOST': 'localhost',
+        'SERVER_PROTOCOL': 'HTTP/1.1', 'REMOTE_ADDR': '127.0.0.1',
+        'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http', 'wsgi.input': BytesIO(),
+        'wsgi.errors': sys.stderr, 'wsgi.multithread': True, 'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    status = []
+    response = application(environ, lambda code, headers, exc_info=None: status.append(code))
+    try:
+        for _chunk in response:
+            pass
+    finally:
+        response.close()
+    return int(status[0].split()[0])
+
+
+async def asgi_get(application, path, query):
+    """GET к ASGI-приложению, как от сервера; возвращает код ответа"""
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+        'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query.encode(),
+        'root_path': '', 'headers': [(b'host', b'localhost')],
+        'client': ('127.0.0.1', 0), 'server': ('localhost', 80),
+    }
+    body_sent = False
+    disconnected = asyncio.Event()
+
+    async def receive():
+        nonlocal body_sent
+        if not body_sent:
+            body_sent = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await disconnected.wait()
+        return {'type': 'http.disconnect'}
+
+    status = []
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    try:
+        await application(scope, receive, send)
+    finally:
+        disconnected.set()
+    return status[0]
+
+
+def _server_report(timings, errors, requests, concurrency, seconds):
+    report = {}
+    for route in sorted(timings):
+        report[route] = summarize(timings[route])
+        report[route]['errors'] = errors.get(route, 0)
+    return {
+        'requests': requests,
+        'concurrency': concurrency,
+        'seconds': round(seconds, 3),
+        'rps': round(requests / seconds, 1) if seconds else None,
+        'overall': summarize([duration for durations in timings.values() for duration in durations]),
+        'routes': report,
+    }
+
+
+def _record(timings, errors, route, started, status):
+    timings.setdefault(route, []).append(time_module.perf_counter() - started)
+    if status >= 500:
+        errors[route] = errors.get(route, 0) + 1
+
+
+def run_wsgi(dataset, requests=500, concurrency=8, seed_value=0):
+    """Смесь READ_ROUTES через WSGI-обработчик из concurrency потоков (как у потокового сервера)"""
+    from django.core.wsgi import get_wsgi_application
+
+    application = get_wsgi_application()
+    share, extra = divmod(requests, concurrency)
+    timings, errors = {}, {}
+
+    def worker(index):
+        rng = random.Random(seed_value + index)
+        try:
+            for _ in range(share + (index < extra)):
+                route = _pick(rng, READ_ROUTES)
+                path, query = read_request(route, dataset, rng)
+                started = time_module.perf_counter()
+                _record(timings, errors, route, started, wsgi_get(application, path, query))
+        finally:
+            connections.close_all()
+
+    cache.clear()
+    started = time_module.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='wsgi') as executor:
+        list(executor.map(worker, range(concurrency)))
+    return _server_report(timings, errors, requests, concurrency, time_module.perf_counter() - started)
+
+
+def run_asgi(dataset, requests=500, concurrency=8, seed_value=0):
+    """Смесь READ_ROUTES через ASGI-обработчик: concurrency одновременных задач в одном цикле событий"""
+    from django.core.asgi import get_asgi_application
+
+    application = get_asgi_application()
+    share, extra = divmod(requests, concurrency)
+    timings, errors = {}, {}
+
+    async def worker(index):
+        rng = random.Random(seed_value + index)
+        for _ in range(share + (index < extra)):
+            route = _pick(rng, READ_ROUTES)
+            path, query = read_request(route, dataset, rng)
+            started = time_module.perf_counter()
+            _record(timings, errors, route, started, await asgi_get(application, path, query))
+
+    async def main():
+        await asyncio.gather(*(worker(index) for index in range(concurrency)))
+
+    cache.clear()
+    started = time_module.perf_counter()
+    asyncio.run(main())
+    return _server_report(timings, errors, requests, concurrency, time_module.perf_counter() - started)
+
+
+def _locked(error):
+    return 'locked' in str(error) or 'busy' in str(error)
+
+
+def run_contention(dataset, writers=4, readers=4, bookings=50, attempts=1, seed_value=0):
+    """Всплеск бронирований: writers потоков бронируют через book_table, readers тем временем
+    читают снимки карточек ресторанов.
+
+    attempts=1 отключает повторы book_table - видна каждая ошибка
+    "database is locked". Читатели работают, пока пишут писатели.
+    """
+    from .booking import BookingConflict, book_table
+    from .snapshot import queryset, load
+
+    today = timezone.now().date()
+    done = threading.Event()
+    lock = threading.Lock()
+    totals = {'booked': 0, 'conflicts': 0, 'write_locked': 0, 'write_errors': 0,
+              'reads': 0, 'read_locked': 0, 'read_errors': 0}
+    write_timings, read_timings = [], []
+
+    def count(key, timings, started):
+        elapsed = time_module.perf_counter() - started
+        with lock:
+            totals[key] += 1
+            timings.append(elapsed)
+
+    def writer(index):
+        rng = random.Random(seed_value + index)
+        try:
+            for _ in range(bookings):
+                reservation = Reservation(
+                    user_id=rng.choice(dataset.user_ids),
+                    table_id=dataset.table(rng),
+                    reservation_date=today + timedelta(days=rng.randint(1, DAYS_AHEAD)),
+                    reservation_time=time(_pick(rng, HOUR_WEIGHTS), rng.choice((0, 30))),
+                    duration=_pick(rng, DURATION_WEIGHTS),
+                    guests_count=2,
+                    status='confirmed',
+                )
+                started = time_module.perf_counter()
+                try:
+                    book_table(reservation, attempts=attempts)
+                    key = 'booked'
+                except BookingConflict:
+                    key = 'conflicts'
+                except OperationalError as error:
+                    key = 'write_locked' if _locked(error) else 'write_errors'
+                count(key, write_timings, started)
+        finally:
+            connections.close_all()
+
+    def reader(index):
+        rng = random.Random(seed_value + writers + index)
+        try:
+            while not done.is_set():
+                started = time_module.perf_counter()
+                try:
+                    load(queryset().get(pk=dataset.restaurant(rng)), today + timedelta(days=rng.randint(0, 3)))
+                    key = 'reads'
+                except OperationalError as error:
+                    key = 'read_locked' if _locked(error) else 'read_errors'
+                count(key, read_timings, started)
+        finally:
+            connections.close_all()
+
+    cache.clear()
+    started = time_module.perf_counter()
+    with ThreadPoolExecutor(max_workers=writers + readers, thread_name_prefix='contention') as executor:
+        reading = [executor.submit(reader, index) for index in range(readers)]
+        writing = [executor.submit(writer, index) for index in range(writers)]
+        for future in writing:
+            future.result()
+        seconds = time_module.perf_counter() - started
+        done.set()
+        for future in reading:
+            future.result()
+
+    return dict(
+        totals,
+        writers=writers,
+        readers=readers,
+        attempts=attempts,
+        seconds=round(seconds, 3),
+        writes_per_s=round(writers * bookings / seconds, 1) if seconds else None,
+        booked_per_s=round(totals['booked'] / seconds, 1) if seconds else None,
+        reads_per_s=round(totals['reads'] / seconds, 1) if seconds else None,
+        write=summarize(write_timings) if write_timings else None,
+        read=summarize(read_timings) if read_timings else None,
+    )
@@ -0,0 +1,78 @@
+import random
+import time as time_module
+
+from django.db import IntegrityError, OperationalError, connection
+from django.db.models import F
+
+from .availability import is_table_free
+from .models import Table
+from .sqlite_tuning import write_transaction
+
+# Повторы при конкурентной записи (SQLite: "database is locked")
+MAX_ATTEMPTS = 8
+BACKOFF = 0.02  # секунд, удваивается на каждой попытке
+
+
+class BookingConflict(Exception):
+    """Столик уже занят на выбранный интервал"""
+
+
+def lock_table(table_id):
+    """Блокировка строки столика до конца транзакции.
+
+    На PostgreSQL/MySQL - SELECT ... FOR UPDATE. SQLite не умеет
+    блокировать строки, поэтому там делаем пустой UPDATE: он сразу берёт
+    блокировку на запись, и последующая проверка видит актуальные данные.
+    """
+    if connection.features.has_select_for_update:
+        list(Table.objects.select_for_update().filter(pk=table_id).values_list('pk', flat=True))
+    else:
+        Table.objects.filter(pk=table_id).update(capacity=F('capacity'))
+
+
+def lock_tables(table_ids):
+    """То же для нескольких столиков (пакетные операции)"""
+    table_ids = sorted(set(table_ids))
+    if connection.features.has_select_for_update:
+        list(Table.objects.select_for_update().filter(pk__in=table_ids).values_list('pk', flat=True))
+    else:
+        Table.objects.filter(pk__in=table_ids).update(capacity=F('capacity'))
+
+
+def book_table(reservation, attempts=MAX_ATTEMPTS):
+    """Сохранение брони без гонок.
+
+    Проверка пересечения и вставка выполняются в одной транзакции под
+    блокировкой столика; уникальный частичный индекс на активные брони
+    страхует от дублей на уровне БД. На SQLite транзакция начинается с
+    BEGIN IMMEDIATE (write_transaction). При "database is locked"
+    транзакция повторяется с экспоненциальной задержкой, всего до
+    attempts попыток.
+    """
+    adding = reservation._state.adding
+    delay = BACKOFF
+    for attempt in range(attempts):
+        try:
+            with write_transaction():
+                lock_table(reservation.table_id)
+                if not is_table_free(
+                    reservation.table_id,
+                    reservation.reservation_date,
+                    reservation.reservation_time,
+                    reservation.duration,
+                    exclude_id=reservation.pk,
+                ):
+                    raise BookingConflict()
+                reservation.save()
+            return reservation
+        except IntegrityError:
+            raise BookingConflict()
+        except OperationalError:
+            if attempt == attempts - 1:
+                raise
+            if adding:
+                # транзакция откатилась - объект снова новый
+                reservation.pk = None
+                reservation._state.adding = True
+            time_module.sleep(delay * (1 + random.random()))
+            delay *= 2
@@ -0,0 +1,332 @@
+"""Пакетное создание, изменение и отмена броней и столиков.
+
+Пачка обрабатывается целиком в одной транзакции: связанные объекты
+загружаются одним запросом на модель, пересечения броней проверяются
+за один проход (availability.batch_conflicts), запись идёт через
+bulk_create/bulk_update вместе с историей. Если хотя бы один элемент
+не прошёл проверку, не сохраняется ничего, а ошибки возвращаются по
+индексам элементов.
+
+bulk_* не вызывают сигналы моделей, поэтому счётчики популярности и
+снимок главной страницы обновляются здесь же, одним шагом на пачку.
+"""
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from simple_history.utils import bulk_create_with_history, bulk_update_with_history
+
+from . import fragments, popularity, user_summary, waitlist
+from .availability import batch_conflicts
+from .booking import lock_tables
+from .dashboard import invalidate_snapshot
+from .models import Restaurant, Table, Reservation
+from .serializers import BulkTableSerializer, BulkReservationSerializer
+from .sqlite_tuning import write_transaction
+
+MAX_ITEMS = 1000
+BATCH_SIZE = 500
+
+CONFLICT_MESSAGE = 'Этот столик уже забронирован на выбранное время'
+CAPACITY_MESSAGE = 'Количество гостей превышает вместимость столика'
+SWAP_MESSAGE = 'Слот занят другой бронью этой пачки до её изменения - отправьте обмен слотами двумя запросами'
+
+
+class BulkValidationError(Exception):
+    """Пачка отклонена; errors - список {'index': i, 'errors': {...}}"""
+
+    def __init__(self, errors):
+        super().__init__(errors)
+        self.errors = errors
+
+
+class ErrorList:
+    def __init__(self):
+        self.by_index = {}
+
+    def add(self, index, field, message):
+        self.by_index.setdefault(index, {}).setdefault(field, []).append(message)
+
+    def merge(self, index, errors):
+        for field, messages in errors.items():
+            for message in messages if isinstance(messages, list) else [messages]:
+                self.add(index, field, message)
+
+    def raise_if_any(self):
+        if self.by_index:
+            raise BulkValidationError([
+                {'index': index, 'errors': errors} for index, errors in sorted(self.by_index.items())
+            ])
+
+
+def check_items(items):
+    if not isinstance(items, list):
+        raise BulkValidationError([{'index': None, 'errors': {'non_field_errors': ['Ожидается список объектов']}}])
+    if len(items) > MAX_ITEMS:
+        raise BulkValidationError([{'index': None, 'errors': {
+            'non_field_errors': [f'Не больше {MAX_ITEMS} элементов за запрос'],
+        }}])
+    errors = ErrorList()
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            errors.add(index, 'non_field_errors', 'Ожидается объект')
+    errors.raise_if_any()
+
+
+def _pk_values(items, field):
+    values = set()
+    for item in items:
+        try:
+            values.add(int(item[field]))
+        except (KeyError, TypeError, ValueError):
+            pass
+    return values
+
+
+def load_related(items, fields):
+    """{модель: {pk: объект}} для FK-полей пачки - один запрос на модель"""
+    related = {}
+    for field, queryset in fields.items():
+        related[queryset.model] = queryset.in_bulk(_pk_values(items, field))
+    return related
+
+
+def load_instances(items, queryset, errors):
+    """Изменяемые объекты по 'id' элементов; отсутствующие и повторы - в errors"""
+    instances = queryset.in_bulk(_pk_values(items, 'id'))
+    found, seen = {}, set()
+    for index, item in enumerate(items):
+        try:
+            instance = instances.get(int(item.get('id')))
+        except (TypeError, ValueError):
+            instance = None
+        if instance is None:
+            errors.add(index, 'id', 'Объект не найден')
+        elif instance.pk in seen:
+            errors.add(index, 'id', 'Объект повторяется в пачке')
+        else:
+            seen.add(instance.pk)
+            found[index] = instance
+    return found
+
+
+def validate(serializer_class, items, related, errors, partial=False):
+    """Валидация всех элементов одним ListSerializer; ошибки - по индексам"""
+    serializer = serializer_class(data=items, many=True, partial=partial, context={'related': related})
+    if serializer.is_valid():
+        return serializer.validated_data
+    item_errors_list = serializer.errors
+    if isinstance(item_errors_list, list):
+        item_errors_list = dict(enumerate(item_errors_list))
+    # некоторые версии DRF возвращают только элементы с ошибками: {индекс: ошибки}
+    for index, item_errors in item_errors_list.items():
+        if item_errors:
+            errors.merge(index, item_errors)
+    return [None] * len(items)
+
+
+def apply_fields(instance, data):
+    changed = []
+    for field, value in data.items():
+        if getattr(instance, field) != value:
+            setattr(instance, field, value)
+            changed.append(field)
+    return changed
+
+
+def _contribution(reservation):
+    return popularity.contribution(
+        reservation.status, reservation.reservation_date, reservation.table.restaurant_id
+    )
+
+
+def _slot(reservation):
+    """Занимаемый слот (для unique_active_reservation_slot) или None"""
+    if reservation.status not in Reservation.ACTIVE_STATUSES:
+        return None
+    return reservation.table_id, reservation.reservation_date, reservation.reservation_time
+
+
+def check_reservations(reservations, errors):
+    """Вместимость и пересечения броней пачки (вызывать под блокировкой)"""
+    bookings, indexes, released = [], [], []
+    for index, reservation in reservations.items():
+        if reservation.guests_count > reservation.table.capacity:
+            errors.add(index, 'guests_count', CAPACITY_MESSAGE)
+        if reservation.status not in Reservation.ACTIVE_STATUSES:
+            if reservation.pk is not None:
+                released.append(reservation.pk)
+        else:
+            bookings.append((
+                reservation.table_id,
+                reservation.reservation_date,
+                reservation.reservation_time,
+                reservation.duration,
+                reservation.pk,
+            ))
+            indexes.append(index)
+    for position in batch_conflicts(bookings, released):
+        errors.add(indexes[position], 'table', CONFLICT_MESSAGE)
+
+
+def _related_reservation_fields():
+    return {
+        'table': Table.objects.select_related('restaurant'),
+        'user': User.objects.all(),
+    }
+
+
+def create_reservations(items, user=None):
+    check_items(items)
+    errors = ErrorList()
+    related = load_related(items, _related_reservation_fields())
+    validated = validate(BulkReservationSerializer, items, related, errors)
+    errors.raise_if_any()
+
+    reservations = {index: Reservation(**data) for index, data in enumerate(validated)}
+    with write_transaction():
+        lock_tables(r.table_id for r in reservations.values())
+        check_reservations(reservations, errors)
+        errors.raise_if_any()
+        created = bulk_create_with_history(
+            list(reservations.values()), Reservation, batch_size=BATCH_SIZE, default_user=user
+        )
+        popularity.apply_bulk((None, _contribution(r)) for r in created)
+        transaction.on_commit(invalidate_snapshot)
+        user_summary.invalidate_on_commit(r.user_id for r in created)
+    return created
+
+
+def update_reservations(items, user=None):
+    check_items(items)
+    errors = ErrorList()
+    queryset = Reservation.objects.select_related('table__restaurant')
+    # предварительное чтение - только чтобы знать, какие столики блокировать
+    instances = load_instances(items, queryset, errors)
+    related = load_related(items, _related_reservation_fields())
+    validated = validate(BulkReservationSerializer, items, related, errors, partial=True)
+    errors.raise_if_any()
+    table_ids = {r.table_id for r in instances.values()}
+    table_ids.update(data['table'].pk for data in validated if 'table' in data)
+
+    with write_transaction():
+        lock_tables(table_ids)
+        # перечитываем под блокировкой: чужая правка между чтением и
+        # блокировкой не затирается, вклад в популярность - от актуального состояния
+        instances = _reload(items, queryset, errors, table_ids)
+
+        changes, fields = [], set()
+        # прежние и новые владельцы - бронь могли передать другому пользователю
+        owners = {instance.user_id for instance in instances.values()}
+        moved = []
+        for index, instance in instances.items():
+            before = _contribution(instance)
+            slot = _slot(instance)
+            fields.update(apply_fields(instance, validated[index]))
+            changes.append((before, _contribution(instance)))
+            if _slot(instance) != slot:
+                moved.append(index)
+
+        check_reservations(instances, errors)
+        errors.raise_if_any()
+        updated = list(instances.values())
+        if fields:
+            try:
+                bulk_update_with_history(
+                    updated, Reservation, sorted(fields), batch_size=BATCH_SIZE, default_user=user
+                )
+            except IntegrityError:
+                # UPDATE проверяет уникальность слота построчно: обмен слотами
+                # внутри пачки упирается в ещё не сдвинутую бронь
+                for index in moved:
+                    errors.add(index, 'table', SWAP_MESSAGE)
+                errors.raise_if_any()
+                raise
+            popularity.apply_bulk(changes)
+            transaction.on_commit(invalidate_snapshot)
+            user_summary.invalidate_on_commit(owners | {r.user_id for r in updated})
+            waitlist.match_on_commit(before for before, after in changes if before != after)
+    return updated
+
+
+def _reload(items, queryset, errors, table_ids):
+    """Брони пачки заново - вызывать под блокировкой table_ids.
+
+    Бронь, которую до блокировки перенесли на другой столик, блокирует
+    и его.
+    """
+    instances = load_instances(items, queryset, errors)
+    errors.raise_if_any()
+    moved = {r.table_id for r in instances.values()} - table_ids
+    if moved:
+        lock_tables(moved)
+        table_ids.update(moved)
+    return instances
+
+
+def cancel_reservations(ids, user=None):
+    if not isinstance(ids, list):
+        raise BulkValidationError([{'index': None, 'errors': {'ids': ['Ожидается список id']}}])
+    items = [{'id': pk} for pk in ids]
+    check_items(items)
+    errors = ErrorList()
+    queryset = Reservation.objects.select_related('table__restaurant')
+    instances = load_instances(items, queryset, errors)
+    errors.raise_if_any()
+    table_ids = {r.table_id for r in instances.values()}
+
+    with write_transaction():
+        lock_tables(table_ids)
+        instances = _reload(items, queryset, errors, table_ids)
+        changes, cancelled = [], []
+        for instance in instances.values():
+            if instance.status != 'cancelled':
+                changes.append((_contribution(instance), None))
+                instance.status = 'cancelled'
+                cancelled.append(instance)
+        if cancelled:
+            bulk_update_with_history(
+                cancelled, Reservation, ['status'], batch_size=BATCH_SIZE, default_user=user
+            )
+            popularity.apply_bulk(changes)
+            transaction.on_commit(invalidate_snapshot)
+            user_summary.invalidate_on_commit(r.user_id for r in cancelled)
+            # освободившиеся дни - одним проходом листа ожидания на каждый
+            waitlist.match_on_commit(before for before, _after in changes)
+    return list(instances.values())
+
+
+def create_tables(items, user=None):
+    check_items(items)
+    errors = ErrorList()
+    related = load_related(items, {'restaurant': Restaurant.objects.all()})
+    validated = validate(BulkTableSerializer, items, related, errors)
+    errors.raise_if_any()
+
+    with transaction.atomic():
+        created = bulk_create_with_history(
+            [Table(**data) for data in validated], Table, batch_size=BATCH_SIZE, default_user=user
+        )
+        fragments.bump(table.restaurant_id for table in created)
+        transaction.on_commit(invalidate_snapshot)
+    return created
+
+
+def update_tables(items, user=None):
+    check_items(items)
+    errors = ErrorList()
+    instances = load_instances(items, Table.objects.all(), errors)
+    related = load_related(items, {'restaurant': Restaurant.objects.all()})
+    validated = validate(BulkTableSerializer, items, related, errors, partial=True)
+    errors.raise_if_any()
+
+    restaurant_ids = {instance.restaurant_id for instance in instances.values()}
+    fields = set()
+    for index, instance in instances.items():
+        fields.update(apply_fields(instance, validated[index]))
+
+    updated = list(instances.values())
+    if fields:
+        with transaction.atomic():
+            bulk_update_with_history(updated, Table, sorted(fields), batch_size=BATCH_SIZE, default_user=user)
+            fragments.bump(restaurant_ids | {instance.restaurant_id for instance in updated})
+            transaction.on_commit(invalidate_snapshot)
+    return updated
@@ -0,0 +1,117 @@
+import threading
+import time as time_module
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import close_old_connections
+from django.db.models import Count, Avg, Max, Min
+from django.utils import timezone
+
+from .models import Restaurant, Table
+from .popularity import top_restaurants
+
+SNAPSHOT_KEY = 'restaurant:dashboard'
+REFRESH_LOCK_KEY = 'restaurant:dashboard:refresh'
+
+# Сколько популярных ресторанов хранить в снимке (главная - 4, тег - до 5)
+POPULAR_LIMIT = 5
+
+
+def get_cache():
+    return caches[getattr(settings, 'DASHBOARD_CACHE_ALIAS', 'default')]
+
+
+def build_snapshot():
+    """Все агрегаты главной страницы в одном словаре"""
+    popular_restaurants = list(top_restaurants(POPULAR_LIMIT))
+
+    available_tables = list(Table.available.select_related('restaurant').order_by('-capacity')[:6])
+
+    affordable_restaurants = list(Restaurant.objects.annotate(
+        min_price=Min('tables__price_per_hour')
+    ).filter(min_price__isnull=False).order_by('min_price')[:3])
+
+    large_tables_restaurants = list(Restaurant.objects.annotate(
+        max_capacity=Max('tables__capacity')
+    ).filter(max_capacity__gte=6).order_by('-max_capacity')[:3])
+
+    cuisine_stats = list(Restaurant.objects.values('cuisine_type').annotate(count=Count('id')))
+
+    # Три агрегата по столикам - одним запросом
+    table_stats = Table.objects.aggregate(
+        avg_price=Avg('price_per_hour'),
+        max_cap=Max('capacity'),
+        min_pr=Min('price_per_hour'),
+    )
+    total_restaurants = sum(row['count'] for row in cuisine_stats)
+
+    return {
+        'popular_restaurants': popular_restaurants,
+        'available_tables': available_tables,
+        'affordable_restaurants': affordable_restaurants,
+        'large_tables_restaurants': large_tables_restaurants,
+        'cuisine_stats': cuisine_stats,
+        'stats': {
+            'total_restaurants': total_restaurants,
+            'has_restaurants': total_restaurants > 0,
+            'avg_table_price': table_stats['avg_price'] or 0,
+            'max_capacity': table_stats['max_cap'] or 0,
+            'min_price': table_stats['min_pr'] or 0,
+        },
+        'built_at': timezone.now(),
+    }
+
+
+def refresh_snapshot():
+    """Пересчитать снимок и положить в кэш"""
+    ttl = getattr(settings, 'DASHBOARD_TTL', 60)
+    stale_ttl = getattr(settings, 'DASHBOARD_STALE_TTL', 600)
+    data = build_snapshot()
+    get_cache().set(SNAPSHOT_KEY, {
+        'data': data,
+        'fresh_until': time_module.time() + ttl,
+    }, ttl + stale_ttl)
+    return data
+
+
+def _refresh_in_background():
+    cache = get_cache()
+    # add() атомарен - пересчитывает только один поток/процесс
+    if not cache.add(REFRESH_LOCK_KEY, True, 30):
+        return
+
+    def run():
+        try:
+            close_old_connections()
+            refresh_snapshot()
+        finally:
+            cache.delete(REFRESH_LOCK_KEY)
+            close_old_connections()
+
+    if getattr(settings, 'DASHBOARD_ASYNC_REFRESH', True):
+        threading.Thread(target=run, daemon=True).start()
+    else:
+        run()
+
+
+def get_snapshot():
+    """Снимок главной страницы - одно чтение из кэша.
+
+    Устаревший снимок (stale-while-revalidate) отдаётся сразу, а пересчёт
+    запускается в фоне. Синхронно считаем только при пустом кэше.
+    """
+    entry = get_cache().get(SNAPSHOT_KEY)
+    if entry is None:
+        return refresh_snapshot()
+    if entry['fresh_until'] < time_module.time():
+        _refresh_in_background()
+    return entry['data']
+
+
+def invalidate_snapshot():
+    """Пометить снимок устаревшим после изменения данных"""
+    cache = get_cache()
+    entry = cache.get(SNAPSHOT_KEY)
+    if entry is not None:
+        entry['fresh_until'] = 0
+        cache.set(SNAPSHOT_KEY, entry, getattr(settings, 'DASHBOARD_STALE_TTL', 600))
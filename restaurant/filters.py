@@ -0,0 +1,46 @@
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework import filters
+from rest_framework.exceptions import ValidationError
+from rest_framework.settings import api_settings
+
+from . import schedule
+from .search import search
+
+
+class FullTextSearchFilter(filters.SearchFilter):
+    """SearchFilter поверх полнотекстового индекса (см. search.py)"""
+
+    def filter_queryset(self, request, queryset, view):
+        query = ' '.join(self.get_search_terms(request))
+        if not query:
+            return queryset
+        return search(query, queryset)
+
+
+class RankedOrderingFilter(filters.OrderingFilter):
+    """Сортировка по умолчанию не перебивает ранжирование поиска"""
+
+    def get_default_ordering(self, view):
+        if view.request.query_params.get(api_settings.SEARCH_PARAM):
+            return None
+        return super().get_default_ordering(view)
+
+
+class OpenAtFilter(filters.BaseFilterBackend):
+    """?open_at=now|ГГГГ-ММ-ДДTЧЧ:ММ [&open_for=минут] - открытые в это время рестораны"""
+
+    def filter_queryset(self, request, queryset, view):
+        value = request.query_params.get('open_at')
+        if not value:
+            return queryset
+        moment = timezone.localtime() if value == 'now' else parse_datetime(value)
+        try:
+            duration = int(request.query_params.get('open_for', 0))
+        except ValueError:
+            duration = -1
+        if moment is None or duration < 0:
+            raise ValidationError({'open_at': 'Ожидается now или ГГГГ-ММ-ДДTЧЧ:ММ, open_for - минуты'})
+        if timezone.is_aware(moment):
+            moment = timezone.localtime(moment)
+        return schedule.open_at(queryset, moment, duration)
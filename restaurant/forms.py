@@ -1,5 +1,6 @@
 from django import forms
-from .models import Restaurant, Table, Reservation
+from .models import Restaurant, Table, Reservation, WaitlistEntry
+from . import schedule
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
 from django.utils import timezone
@@ -84,6 +85,14 @@ class RestaurantForm(forms.ModelForm):
             'website': 'URL официального сайта ресторана',
         }
 
+    def clean_opening_hours(self):
+        opening_hours = self.cleaned_data.get('opening_hours')
+        if schedule.parse(opening_hours) is None:
+            raise forms.ValidationError(
+                "Не удалось разобрать часы работы. Примеры: 10:00-22:00; Пн-Пт 10:00-22:00, Сб-Вс 12:00-02:00"
+            )
+        return opening_hours
+
     def save(self, commit=True):
         restaurant = super().save(commit=False)
         if commit:
@@ -98,9 +107,27 @@ class RestaurantForm(forms.ModelForm):
         js = ('js/restaurant-form.js',)
 
 class ReservationForm(forms.ModelForm):
+    # не поля брони: что делать, если столик на это время занят (restaurant/waitlist.py)
+    join_waitlist = forms.BooleanField(
+        required=False,
+        initial=True,
+        label='Если столик занят - встать в лист ожидания',
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'}),
+    )
+    flexibility = forms.TypedChoiceField(
+        choices=WaitlistEntry.FLEXIBILITY_CHOICES,
+        coerce=int,
+        initial=WaitlistEntry.DEFAULT_FLEXIBILITY,
+        required=False,
+        empty_value=WaitlistEntry.DEFAULT_FLEXIBILITY,
+        label='Подойдёт время',
+        help_text='Любой столик ресторана на нужное число гостей в этом окне',
+        widget=forms.Select(attrs={'class': 'form-control'}),
+    )
+
     class Meta:
         model = Reservation
-        fields = ['reservation_date', 'reservation_time', 'guests_count', 'special_requests']
+        fields = ['reservation_date', 'reservation_time', 'duration', 'guests_count', 'special_requests']
         widgets = {
             'reservation_date': forms.DateInput(attrs={
                 'class': 'form-control', 
@@ -111,6 +138,7 @@ class ReservationForm(forms.ModelForm):
                 'class': 'form-control', 
                 'type': 'time'
             }),
+            'duration': forms.Select(attrs={'class': 'form-control'}),
             'guests_count': forms.NumberInput(attrs={
                 'class': 'form-control',
                 'min': 1,
@@ -125,6 +153,7 @@ class ReservationForm(forms.ModelForm):
         labels = {
             'reservation_date': 'Дата бронирования',
             'reservation_time': 'Время бронирования',
+            'duration': 'Длительность',
             'guests_count': 'Количество гостей',
             'special_requests': 'Особые пожелания',
         }
@@ -132,6 +161,11 @@ class ReservationForm(forms.ModelForm):
             'guests_count': 'Максимальное количество гостей: 20',
         }
 
+    def __init__(self, *args, restaurant=None, **kwargs):
+        """restaurant - время брони проверяется по его часам работы"""
+        super().__init__(*args, **kwargs)
+        self.restaurant = restaurant
+
     def clean_reservation_date(self):
         reservation_date = self.cleaned_data.get('reservation_date')
         if reservation_date and reservation_date < timezone.now().date():
@@ -140,7 +174,8 @@ class ReservationForm(forms.ModelForm):
 
     def clean_reservation_time(self):
         reservation_time = self.cleaned_data.get('reservation_time')
-        if reservation_time:
+        # без ресторана - общее правило; с рестораном проверка в clean() по его часам работы
+        if reservation_time and self.restaurant is None:
             if reservation_time < time(10, 0) or reservation_time > time(23, 0):
                 raise forms.ValidationError("Рестораны работают с 10:00 до 23:00")
         return reservation_time
@@ -153,4 +188,15 @@ class ReservationForm(forms.ModelForm):
 
     def clean(self):
         cleaned_data = super().clean()
+        day = cleaned_data.get('reservation_date')
+        at_time = cleaned_data.get('reservation_time')
+        duration = cleaned_data.get('duration')
+        if self.restaurant is not None and day and at_time and duration:
+            start = at_time.hour * 60 + at_time.minute
+            if not schedule.is_open_for(self.restaurant, day, start, duration):
+                hours = schedule.describe(schedule.windows(self.restaurant, day))
+                self.add_error('reservation_time', forms.ValidationError(
+                    f"В этот день ресторан работает {hours}, бронь должна закончиться до закрытия"
+                    if hours else "В этот день ресторан закрыт"
+                ))
         return cleaned_data
\ No newline at end of file
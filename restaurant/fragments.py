@@ -0,0 +1,54 @@
+"""Версии для кэширования фрагментов шаблонов.
+
+Карточка ресторана и список его столиков кэшируются тегом {% cache %}
+с ключом по Restaurant.cache_version. Версия растёт при сохранении
+ресторана (сигнал pre_save) и при изменении его столиков и тегов
+(bump), поэтому старые фрагменты не удаляются, а просто перестают
+запрашиваться и вытесняются по TTL. Всё, что зависит от броней
+(свободные слоты, последние брони), остаётся динамическим.
+"""
+from django.db.models import Count, F, Max, Min
+
+from . import images
+from .models import Restaurant, Table
+
+
+def bump(restaurant_ids):
+    """Новая версия фрагментов ресторанов - один UPDATE"""
+    restaurant_ids = {pk for pk in restaurant_ids if pk is not None}
+    if restaurant_ids:
+        Restaurant.objects.filter(pk__in=restaurant_ids).update(cache_version=F('cache_version') + 1)
+
+
+def fragment_version(restaurant):
+    """Версия для ключа фрагмента: готовность копий фото меняет разметку без записи в БД"""
+    ready = int(images.get_manifest(restaurant.image_hash) is not None) if restaurant.image else 0
+    return f'{restaurant.cache_version}.{ready}'
+
+
+class LazyTableStats:
+    """Сводка по столикам ресторанов страницы - запрос только при промахе кэша.
+
+    Шаблон вызывает restaurant.table_stats лишь внутри {% cache %}: если
+    все фрагменты страницы в кэше, запроса нет, иначе он один на страницу.
+    """
+
+    def __init__(self, restaurants):
+        self.ids = [restaurant.pk for restaurant in restaurants]
+        self.stats = None
+        for restaurant in restaurants:
+            restaurant.table_stats = lambda pk=restaurant.pk: self.get(pk)
+
+    def get(self, restaurant_id):
+        if self.stats is None:
+            self.stats = {
+                row['restaurant_id']: row
+                for row in Table.objects.filter(restaurant_id__in=self.ids).values('restaurant_id').annotate(
+                    count=Count('id'),
+                    min_capacity=Min('capacity'),
+                    max_capacity=Max('capacity'),
+                    min_price=Min('price_per_hour'),
+                    max_price=Max('price_per_hour'),
+                ).order_by()
+            }
+        return self.stats.get(restaurant_id)
@@ -0,0 +1,225 @@
+"""Запись истории изменений (simple_history) с меньшей нагрузкой на БД.
+
+BufferedHistoricalRecords - замена HistoricalRecords:
+
+- внутри транзакции исторические записи не вставляются по одной, а
+  копятся и пишутся одним bulk_create после коммита (HISTORY_BUFFERED).
+  Записи из откатившейся транзакции или точки сохранения не пишутся;
+- сохранение без изменений не создаёт запись "~", а для изменений в
+  history_change_reason попадает список изменённых полей
+  (HISTORY_SKIP_UNCHANGED). Исходные значения запоминает
+  TrackedFieldsMixin при загрузке объекта из БД;
+- запись можно отключить целиком (SIMPLE_HISTORY_ENABLED) или для
+  отдельных моделей (HISTORY_DISABLED_MODELS = ['restaurant.table']).
+
+Хранение старых записей ограничивает команда prune_history.
+"""
+import logging
+import random
+import threading
+import time as time_module
+import weakref
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import OperationalError, transaction
+from django.utils import timezone
+from simple_history.models import HistoricalRecords
+from simple_history.signals import post_create_historical_record, pre_create_historical_record
+from simple_history.utils import get_change_reason_from_object
+
+BATCH_SIZE = 500
+
+# Повторы вставки после коммита при "database is locked"
+FLUSH_ATTEMPTS = 8
+FLUSH_BACKOFF = 0.02  # секунд, удваивается на каждой попытке
+
+logger = logging.getLogger(__name__)
+
+
+def buffered():
+    return getattr(settings, 'HISTORY_BUFFERED', True)
+
+
+def skip_unchanged():
+    return getattr(settings, 'HISTORY_SKIP_UNCHANGED', True)
+
+
+def disabled_for(model):
+    return model._meta.label_lower in getattr(settings, 'HISTORY_DISABLED_MODELS', ())
+
+
+class TrackedFieldsMixin:
+    """Запоминает значения полей, загруженные из БД, - для поиска изменений"""
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if skip_unchanged():
+            instance._history_loaded = dict(zip(field_names, values))
+        return instance
+
+
+def changed_fields(instance, fields):
+    """Изменённые поля или None, если исходное состояние неизвестно"""
+    loaded = instance.__dict__.get('_history_loaded')
+    if loaded is None:
+        return None
+    changed = []
+    for field in fields:
+        if field.attname in loaded:
+            if getattr(instance, field.attname) != loaded[field.attname]:
+                changed.append(field.name)
+        elif field.attname in instance.__dict__:
+            # поле было отложено (only/defer) и позже задано - считаем изменённым
+            changed.append(field.name)
+    return changed
+
+
+def remember_state(instance, fields):
+    if skip_unchanged():
+        instance._history_loaded = {field.attname: getattr(instance, field.attname) for field in fields}
+
+
+def _new_mark():
+    def mark():
+        """Метка записи: важно не действие, а то, что Django её хранит"""
+    return mark
+
+
+class HistoryBuffer:
+    """Исторические записи одной транзакции на соединении alias.
+
+    При первой записи через transaction.on_commit регистрируется flush,
+    а в thread-local остаётся только слабая ссылка на буфер: держит его
+    сам колбэк. Откатилась транзакция - Django выбросил колбэк, буфер
+    исчез вместе с ним, следующая запись начнёт новый.
+
+    Каждая запись дополнительно регистрирует пустую метку on_commit.
+    Метки откатившихся точек сохранения Django выбрасывает, поэтому к
+    вызову flush (он зарегистрирован раньше всех меток) живы метки только
+    у закоммиченных записей.
+    """
+
+    def __init__(self, alias):
+        self.alias = alias
+        self.records = []
+        self.flushed = False
+
+    def add(self, history_model, history_instance, instance):
+        mark = _new_mark()
+        transaction.on_commit(mark, using=self.alias)
+        self.records.append((history_model, history_instance, instance, weakref.ref(mark)))
+
+    def flush(self):
+        if self.flushed:
+            # вложенные captureOnCommitCallbacks в тестах вызывают колбэк повторно
+            return
+        self.flushed = True
+        records = [record[:3] for record in self.records if record[3]() is not None]
+        self.records = []
+        by_model = defaultdict(list)
+        for history_model, history_instance, _instance in records:
+            by_model[history_model].append(history_instance)
+        delay = FLUSH_BACKOFF
+        for attempt in range(FLUSH_ATTEMPTS):
+            try:
+                with transaction.atomic(using=self.alias):
+                    for history_model, rows in by_model.items():
+                        history_model.objects.using(self.alias).bulk_create(rows, batch_size=BATCH_SIZE)
+                break
+            except OperationalError:
+                if attempt == FLUSH_ATTEMPTS - 1:
+                    # данные уже закоммичены - ошибка уходит вызывающему коду, а не в тишину
+                    logger.exception('Не удалось записать %d исторических записей', len(records))
+                    raise
+                for rows in by_model.values():
+                    for row in rows:
+                        row.pk = None
+                        row._state.adding = True
+                time_module.sleep(delay * (1 + random.random()))
+                delay *= 2
+        for history_model, history_instance, instance in records:
+            post_create_historical_record.send(
+                sender=history_model,
+                instance=instance,
+                history_instance=history_instance,
+                history_date=history_instance.history_date,
+                history_user=history_instance.history_user,
+                history_change_reason=history_instance.history_change_reason,
+                using=self.alias,
+            )
+
+
+_local = threading.local()
+
+
+def get_buffer(alias):
+    """Буфер текущей транзакции потока на соединении alias"""
+    buffers = _local.__dict__.setdefault('buffers', {})
+    ref = buffers.get(alias)
+    buffer = ref() if ref is not None else None
+    if buffer is None or buffer.flushed:
+        buffer = HistoryBuffer(alias)
+        transaction.on_commit(buffer.flush, using=alias)
+        buffers[alias] = weakref.ref(buffer)
+    return buffer
+
+
+class BufferedHistoricalRecords(HistoricalRecords):
+    def create_historical_record(self, instance, history_type, using=None):
+        if disabled_for(type(instance)):
+            return
+        fields = self.fields_included(instance)
+        auto_reason = None
+        if history_type == '~' and skip_unchanged():
+            changed = changed_fields(instance, fields)
+            if changed is not None:
+                if not changed:
+                    return
+                auto_reason = 'Изменено: ' + ', '.join(changed)
+
+        instance._history_auto_reason = auto_reason
+        try:
+            connection = transaction.get_connection(using)
+            if not buffered() or not connection.in_atomic_block or self.m2m_fields:
+                super().create_historical_record(instance, history_type, using=using)
+            else:
+                self.buffer_historical_record(connection, instance, history_type, fields)
+        finally:
+            del instance._history_auto_reason
+        if history_type != '-':
+            remember_state(instance, fields)
+
+    def get_change_reason_for_object(self, instance, history_type, using):
+        """Явная причина (_change_reason) или список изменённых полей"""
+        return get_change_reason_from_object(instance) or getattr(instance, '_history_auto_reason', None)
+
+    def buffer_historical_record(self, connection, instance, history_type, fields):
+        """То же, что create_historical_record, но вставка - после коммита"""
+        history_date = getattr(instance, '_history_date', timezone.now())
+        history_user = self.get_history_user(instance)
+        history_change_reason = self.get_change_reason_for_object(instance, history_type, None)
+        manager = getattr(instance, self.manager_name)
+
+        attrs = {field.attname: getattr(instance, field.attname) for field in fields}
+        if getattr(manager.model, 'history_relation', None) is not None:
+            attrs['history_relation'] = instance
+
+        history_instance = manager.model(
+            history_date=history_date,
+            history_type=history_type,
+            history_user=history_user,
+            history_change_reason=history_change_reason,
+            **attrs,
+        )
+        pre_create_historical_record.send(
+            sender=manager.model,
+            instance=instance,
+            history_date=history_date,
+            history_user=history_user,
+            history_change_reason=history_change_reason,
+            history_instance=history_instance,
+            using=None,
+        )
+        get_buffer(connection.alias).add(manager.model, history_instance, instance)
@@ -0,0 +1,172 @@
+"""Уменьшенные копии фотографий ресторанов.
+
+После загрузки Restaurant.image в пуле воркеров (вне запроса) из
+оригинала строятся варианты VARIANTS в JPEG и WebP. Они лежат в
+IMAGE_VARIANTS_ROOT в каталоге с именем - хешем содержимого оригинала
+(Restaurant.image_hash), поэтому одинаковые файлы обрабатываются один
+раз, а новая фотография получает новый каталог. manifest.json пишется
+последним и означает, что все варианты готовы.
+
+Шаблонный тег restaurant_image выводит <picture> с srcset; пока
+варианты не готовы, отдаётся оригинал.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .utils import write_atomic
+
+logger = logging.getLogger(__name__)
+
+# Имя варианта -> максимальная ширина и высота; порядок - по возрастанию
+VARIANTS = {
+    'thumb': (160, 120),
+    'card': (400, 300),
+    'detail': (1200, 900),
+}
+FORMATS = {'jpeg': 'jpg', 'webp': 'webp'}
+QUALITY = {'jpeg': 82, 'webp': 80}
+
+# Меняется при изменении размеров или качества - старые каталоги перестают подходить
+IMAGE_VERSION = 1
+
+LOCK_TTL = 10 * 60  # секунд, на случай упавшего воркера
+
+_executor = None
+_executor_lock = threading.Lock()
+_manifests = {}  # хеш -> manifest; каталоги неизменны, кэш не устаревает
+
+
+def variants_root():
+    return getattr(settings, 'IMAGE_VARIANTS_ROOT', os.path.join(settings.MEDIA_ROOT, 'variants'))
+
+
+def variants_url():
+    return getattr(settings, 'IMAGE_VARIANTS_URL', settings.MEDIA_URL + 'variants/')
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers = getattr(settings, 'IMAGE_WORKERS', 2)
+            if getattr(settings, 'IMAGE_EXECUTOR', 'thread') == 'process':
+                _executor = ProcessPoolExecutor(max_workers=workers)
+            else:
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='images')
+        return _executor
+
+
+def content_hash(fileobj):
+    """Хеш содержимого файла (читается порциями, позиция возвращается в начало)"""
+    digest = hashlib.sha256(f'v{IMAGE_VERSION}:'.encode())
+    fileobj.seek(0)
+    for chunk in iter(lambda: fileobj.read(64 * 1024), b''):
+        digest.update(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest()[:32]
+
+
+def variant_dir(digest, root=None):
+    return os.path.join(root or variants_root(), digest[:2], digest)
+
+
+def variant_path(digest, name, fmt='jpeg', root=None):
+    return os.path.join(variant_dir(digest, root), f'{name}.{FORMATS[fmt]}')
+
+
+def variant_url(digest, name, fmt='jpeg'):
+    return f'{variants_url()}{digest[:2]}/{digest}/{name}.{FORMATS[fmt]}'
+
+
+def build_variants(source_path, digest, root):
+    """Рендер всех вариантов (выполняется в воркере; без обращений к БД)"""
+    from PIL import Image, ImageOps
+
+    with Image.open(source_path) as original:
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ('RGB', 'L'):
+            # прозрачность - на белом фоне, JPEG её не поддерживает
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image, mask=image.convert('RGBA').getchannel('A'))
+            image = background
+        elif image.mode == 'L':
+            image = image.convert('RGB')
+
+        sizes = {}
+        for name, box in VARIANTS.items():
+            variant = image.copy()
+            variant.thumbnail(box, Image.LANCZOS)  # только уменьшает
+            sizes[name] = variant.size
+            for fmt in FORMATS:
+                options = {'quality': QUALITY[fmt], 'optimize': True}
+                if fmt == 'jpeg':
+                    options['progressive'] = True
+                else:
+                    options['method'] = 4
+                write_atomic(variant_path(digest, name, fmt, root),
+                             lambda output, variant=variant, fmt=fmt, options=options:
+                             variant.save(output, fmt.upper(), **options))
+
+    manifest = {'version': IMAGE_VERSION, 'sizes': sizes}
+    write_atomic(os.path.join(variant_dir(digest, root), 'manifest.json'),
+                 lambda output: output.write(json.dumps(manifest).encode()))
+    return manifest
+
+
+def get_manifest(digest):
+    """manifest готовых вариантов или None"""
+    if not digest:
+        return None
+    manifest = _manifests.get(digest)
+    if manifest is None:
+        try:
+            with open(os.path.join(variant_dir(digest), 'manifest.json')) as source:
+                manifest = json.load(source)
+        except (OSError, ValueError):
+            return None
+        _manifests[digest] = manifest
+    return manifest
+
+
+def _lock_key(digest):
+    return f'restaurant:images:{digest}'
+
+
+def schedule_variants(source_path, digest):
+    """Поставить построение вариантов в очередь; повторно не ставится"""
+    if get_manifest(digest) is not None:
+        return None
+    if not cache.add(_lock_key(digest), True, LOCK_TTL):
+        return None
+    future = get_executor().submit(build_variants, source_path, digest, variants_root())
+    future.add_done_callback(lambda done: _finish(digest, done))
+    return future
+
+
+def _finish(digest, future):
+    error = future.exception()
+    if error is not None:
+        logger.error('Не удалось построить варианты изображения %s: %s', digest, error)
+    cache.delete(_lock_key(digest))
+
+
+def srcset(digest, manifest, fmt):
+    return ', '.join(
+        f'{variant_url(digest, name, fmt)} {width}w'
+        for name, (width, _height) in manifest['sizes'].items()
+    )
+
+
+def small_variant_path(restaurant):
+    """Путь к наименьшему JPEG-варианту или None, если варианты не готовы"""
+    if get_manifest(restaurant.image_hash) is None:
+        return None
+    path = variant_path(restaurant.image_hash, next(iter(VARIANTS)))
+    return path if os.path.exists(path) else None
@@ -0,0 +1,446 @@
+"""Массовый импорт ресторанов, столиков и броней из CSV/JSONL.
+
+В отличие от импорта через ресурсы import_export (SELECT и INSERT/UPDATE
+на каждую строку плюс строка истории), импортёр:
+
+- загружает существующие объекты и связанные ключи одним запросом на
+  модель и сравнивает строки с ними в памяти;
+- пишет bulk_create/bulk_update пачками по batch_size вместе с
+  историческими записями (bulk_create_with_history);
+- работает по принципу "всё или ничего": при любой ошибке в строках
+  ничего не записывается, ошибки возвращаются с номерами строк.
+
+bulk-операции не вызывают сигналы, поэтому поисковый индекс, счётчики
+популярности и снимок главной обновляются здесь же.
+"""
+import csv
+import json
+import os
+import time as time_module
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from simple_history.utils import bulk_create_with_history, bulk_update_with_history
+
+from . import fragments, popularity, schedule, search, user_summary
+from .booking import lock_tables
+from .bulk import ErrorList, check_reservations
+from .dashboard import invalidate_snapshot
+from .models import Restaurant, Table, Reservation
+
+BATCH_SIZE = 500
+
+
+class ImportResult:
+    def __init__(self, model):
+        self.model = model
+        self.created = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.errors = []  # (номер строки, сообщение)
+        self.seconds = 0.0
+        self.dry_run = False
+
+    @property
+    def rows(self):
+        return self.created + self.updated + self.unchanged
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        name = self.model._meta.verbose_name_plural
+        prefix = 'Проверка (без записи)' if self.dry_run else 'Импорт'
+        return (f'{prefix} {name}: создано {self.created}, обновлено {self.updated}, '
+                f'без изменений {self.unchanged} за {self.seconds:.2f} с '
+                f'({self.rows_per_second:.0f} строк/с)')
+
+
+class UnreadableRow:
+    """Строка файла, которую не удалось разобрать; run() вернёт её как ошибку строки"""
+
+    def __init__(self, message):
+        self.message = message
+
+
+def read_rows(stream, fmt):
+    """Строки файла как словари; stream - текстовый поток или итератор строк.
+
+    Битая строка (некорректный JSON, не объект, не UTF-8) не прерывает
+    чтение исключением, а становится UnreadableRow на своём месте.
+    """
+    if fmt not in ('csv', 'jsonl'):
+        raise ValueError(f'Неизвестный формат: {fmt}')
+    rows = []
+    try:
+        if fmt == 'csv':
+            for row in csv.DictReader(stream):
+                rows.append(row)
+        else:
+            for line in stream:
+                if line.strip():
+                    rows.append(parse_json_row(line))
+    except UnicodeDecodeError:
+        # после неверного байта строки файла уже не восстановить
+        rows.append(UnreadableRow('Файл не в кодировке UTF-8'))
+    except csv.Error as error:
+        rows.append(UnreadableRow(f'Некорректный CSV: {error}'))
+    return rows
+
+
+def parse_json_row(line):
+    try:
+        row = json.loads(line)
+    except ValueError as error:
+        return UnreadableRow(f'Некорректный JSON: {error}')
+    if not isinstance(row, dict):
+        return UnreadableRow('Ожидается JSON-объект')
+    return row
+
+
+def decoded_lines(data):
+    """Строки байтов в UTF-8 по одной - ошибка кодировки приходится на свою строку"""
+    for number, line in enumerate(data.splitlines(keepends=True)):
+        yield line.decode('utf-8-sig' if number == 0 else 'utf-8')
+
+
+def format_from_name(filename):
+    extension = os.path.splitext(filename)[1].lstrip('.').lower()
+    return 'jsonl' if extension in ('jsonl', 'ndjson', 'json') else 'csv'
+
+
+class BulkImporter:
+    model = None
+    key_fields = ()   # поля, по которым строка сопоставляется с объектом в БД
+    fields = ()       # импортируемые поля модели (FK - по имени поля)
+
+    def __init__(self, batch_size=BATCH_SIZE, user=None):
+        self.batch_size = batch_size
+        self.user = user
+        self.model_fields = {name: self.model._meta.get_field(name) for name in self.fields}
+
+    # Загрузка связанных объектов и существующих ключей
+
+    def prepare(self, rows):
+        """Предзагрузка справочников для resolve_<поле>() - один запрос на модель"""
+
+    def load_existing(self, rows):
+        """{ключ: объект} для строк, уже существующих в БД"""
+        raise NotImplementedError
+
+    def key(self, values):
+        return tuple(values.get(name) for name in self.key_fields)
+
+    # Разбор строки
+
+    def clean_row(self, row, creating):
+        values = {}
+        errors = []
+        for name, field in self.model_fields.items():
+            if name not in row:
+                continue
+            raw = row[name]
+            if isinstance(raw, str):
+                raw = raw.strip()
+            try:
+                resolve = getattr(self, f'resolve_{name}', None)
+                if resolve is not None:
+                    values[name] = resolve(raw)
+                elif raw in ('', None) and field.null:
+                    values[name] = None
+                elif raw in ('', None) and field.has_default():
+                    values[name] = field.get_default()
+                else:
+                    values[name] = field.clean(self.choice_value(field, raw), None)
+            except ValidationError as error:
+                errors.append(f'{name}: {"; ".join(error.messages)}')
+        if creating:
+            for name, field in self.model_fields.items():
+                if name not in row and not field.has_default() and not field.blank and not field.null:
+                    errors.append(f'{name}: обязательное поле')
+        if errors:
+            raise ValidationError(errors)
+        return values
+
+    def choice_value(self, field, raw):
+        """Для полей с choices принимаем и код, и подпись ("Итальянская")"""
+        if field.choices and isinstance(raw, str):
+            labels = {str(label).lower(): code for code, label in field.flatchoices}
+            return labels.get(raw.lower(), raw)
+        return raw
+
+    def row_key(self, row):
+        """Ключ строки до полного разбора - для поиска существующего объекта"""
+        try:
+            return self.key(self.clean_row({name: row[name] for name in self.key_fields if name in row}, False))
+        except ValidationError:
+            return None
+
+    def differs(self, instance, name, value):
+        field = self.model_fields[name]
+        if field.is_relation:
+            # сравнение по id - без загрузки связанного объекта
+            return getattr(instance, field.attname) != (value.pk if value is not None else None)
+        return getattr(instance, name) != value
+
+    # Запись
+
+    def track(self, instance):
+        """Состояние объекта до изменения (для after_write)"""
+        return None
+
+    def validate_batch(self, objects, errors):
+        """Проверки всей пачки под транзакцией; objects - {номер строки: объект}"""
+
+    def after_write(self, created, updated):
+        """created - новые объекты, updated - [(объект, track() до изменения)]"""
+
+    def run(self, rows, dry_run=False):
+        started = time_module.perf_counter()
+        result = ImportResult(self.model)
+        result.dry_run = dry_run
+        readable = [row for row in rows if isinstance(row, dict)]
+        self.prepare(readable)
+        existing = self.load_existing(readable)
+
+        errors = ErrorList()
+        to_create, to_update, objects, fields, seen = [], [], {}, set(), set()
+        for line, row in enumerate(rows, start=1):
+            if isinstance(row, UnreadableRow):
+                errors.add(line, 'row', row.message)
+                continue
+            if not isinstance(row, dict):
+                errors.add(line, 'row', 'Ожидается объект')
+                continue
+            instance = existing.get(self.row_key(row))
+            try:
+                values = self.clean_row(row, creating=instance is None)
+            except ValidationError as error:
+                for message in error.messages:
+                    errors.add(line, 'row', message)
+                continue
+            key = self.key(values) if instance is None else self.row_key(row)
+            if key in seen and None not in key:
+                errors.add(line, 'row', f'Повтор ключа {key}')
+                continue
+            seen.add(key)
+
+            if instance is None:
+                instance = self.model(**values)
+                to_create.append(instance)
+                objects[line] = instance
+                continue
+            before = self.track(instance)
+            changed = [name for name, value in values.items() if self.differs(instance, name, value)]
+            if not changed:
+                result.unchanged += 1
+                continue
+            for name in changed:
+                setattr(instance, name, values[name])
+            fields.update(changed)
+            to_update.append((instance, before))
+            objects[line] = instance
+
+        with transaction.atomic():
+            if not errors.by_index:
+                self.validate_batch(objects, errors)
+            if errors.by_index or dry_run:
+                transaction.set_rollback(True)
+            else:
+                created = bulk_create_with_history(
+                    to_create, self.model, batch_size=self.batch_size, default_user=self.user
+                )
+                if to_update:
+                    bulk_update_with_history(
+                        [instance for instance, _before in to_update], self.model, sorted(fields),
+                        batch_size=self.batch_size, default_user=self.user,
+                    )
+                self.after_write(created, to_update)
+                transaction.on_commit(invalidate_snapshot)
+
+        result.errors = [
+            (line, message)
+            for line, line_errors in sorted(errors.by_index.items())
+            for messages in line_errors.values() for message in messages
+        ]
+        if not result.errors:
+            result.created = len(to_create)
+            result.updated = len(to_update)
+        result.seconds = time_module.perf_counter() - started
+        return result
+
+
+class RestaurantImporter(BulkImporter):
+    """Ключ - (название, адрес): у сети одинаковые названия, разные адреса"""
+    model = Restaurant
+    key_fields = ('name', 'address')
+    fields = ('name', 'address', 'description', 'phone', 'cuisine_type', 'opening_hours', 'website')
+
+    def load_existing(self, rows):
+        names = {str(row.get('name', '')).strip() for row in rows if isinstance(row, dict)}
+        return {
+            (restaurant.name, restaurant.address): restaurant
+            for restaurant in Restaurant.objects.filter(name__in=names)
+        }
+
+    def track(self, restaurant):
+        return restaurant.opening_hours
+
+    def after_write(self, created, updated):
+        fragments.bump(restaurant.pk for restaurant, _before in updated)
+        schedule.sync(created + [
+            restaurant for restaurant, opening_hours in updated if restaurant.opening_hours != opening_hours
+        ])
+        if not search.supported():
+            return
+        ids = [restaurant.pk for restaurant, _before in updated]
+        tag_names = {}
+        for restaurant_id, name in Restaurant.tags.through.objects.filter(
+            restaurant_id__in=ids
+        ).values_list('restaurant_id', 'tag__name'):
+            tag_names.setdefault(restaurant_id, []).append(name)
+        for restaurant in created:
+            search.index_restaurant(restaurant, tag_names=[])
+        for restaurant, _before in updated:
+            search.index_restaurant(restaurant, tag_names=tag_names.get(restaurant.pk, []))
+
+
+class TableImporter(BulkImporter):
+    """Ключ - (ресторан, номер столика). Ресторан - id или название"""
+    model = Table
+    key_fields = ('restaurant', 'table_number')
+    fields = ('restaurant', 'table_number', 'capacity', 'price_per_hour')
+
+    def prepare(self, rows):
+        references = {str(row.get('restaurant', '')).strip() for row in rows if isinstance(row, dict)}
+        ids = {int(value) for value in references if value.isdigit()}
+        names = references - {str(pk) for pk in ids}
+        restaurants = Restaurant.objects.filter(pk__in=ids) | Restaurant.objects.filter(name__in=names)
+        self.restaurants_by_id = {}
+        self.restaurants_by_name = {}
+        for restaurant in restaurants:
+            self.restaurants_by_id[restaurant.pk] = restaurant
+            self.restaurants_by_name.setdefault(restaurant.name, []).append(restaurant)
+
+    def resolve_restaurant(self, value):
+        value = str(value or '').strip()
+        if value.isdigit() and int(value) in self.restaurants_by_id:
+            return self.restaurants_by_id[int(value)]
+        found = self.restaurants_by_name.get(value, [])
+        if len(found) == 1:
+            return found[0]
+        if len(found) > 1:
+            raise ValidationError(f'Несколько ресторанов с названием "{value}", укажите id')
+        raise ValidationError(f'Ресторан "{value}" не найден')
+
+    def key(self, values):
+        restaurant = values.get('restaurant')
+        return (restaurant.pk if restaurant else None, values.get('table_number'))
+
+    def load_existing(self, rows):
+        restaurant_ids = self.restaurants_by_id.keys()
+        return {
+            (table.restaurant_id, table.table_number): table
+            for table in Table.objects.filter(restaurant_id__in=restaurant_ids)
+        }
+
+    def after_write(self, created, updated):
+        fragments.bump([table.restaurant_id for table in created] +
+                       [table.restaurant_id for table, _before in updated])
+
+
+class ReservationImporter(BulkImporter):
+    """Ключ - id брони: строки с существующим id обновляются, без id - создаются"""
+    model = Reservation
+    key_fields = ('id',)
+    fields = ('user', 'table', 'reservation_date', 'reservation_time', 'duration',
+              'guests_count', 'special_requests', 'status')
+
+    def prepare(self, rows):
+        rows = [row for row in rows if isinstance(row, dict)]
+        users = {str(row.get('user', '')).strip() for row in rows}
+        user_ids = {int(value) for value in users if value.isdigit()}
+        self.users_by_id = {}
+        self.users_by_name = {}
+        for user in User.objects.filter(pk__in=user_ids) | User.objects.filter(username__in=users):
+            self.users_by_id[user.pk] = user
+            self.users_by_name[user.username] = user
+        table_ids = {int(row['table']) for row in rows if str(row.get('table', '')).strip().isdigit()}
+        self.tables = Table.objects.select_related('restaurant').in_bulk(table_ids)
+
+    def resolve_user(self, value):
+        value = str(value or '').strip()
+        user = self.users_by_name.get(value)
+        if user is None and value.isdigit():
+            user = self.users_by_id.get(int(value))
+        if user is None:
+            raise ValidationError(f'Пользователь "{value}" не найден')
+        return user
+
+    def resolve_table(self, value):
+        value = str(value or '').strip()
+        table = self.tables.get(int(value)) if value.isdigit() else None
+        if table is None:
+            raise ValidationError(f'Столик "{value}" не найден')
+        return table
+
+    def key(self, values):
+        return (values.get('id'),)
+
+    def clean_row(self, row, creating):
+        if creating and self.row_key(row) != (None,) and set(row) - {'id'}:
+            raise ValidationError([f'id: бронь {row["id"]} не найдена'])
+        return super().clean_row(row, creating)
+
+    def row_key(self, row):
+        value = str(row.get('id') or '').strip()
+        return (int(value),) if value.isdigit() else (None,)
+
+    def load_existing(self, rows):
+        ids = [key[0] for key in map(self.row_key, rows) if key[0] is not None]
+        return {
+            (reservation.pk,): reservation
+            for reservation in Reservation.objects.select_related('table__restaurant').filter(pk__in=ids)
+        }
+
+    def track(self, reservation):
+        return self.contribution(reservation), reservation.user_id
+
+    def contribution(self, reservation):
+        return popularity.contribution(
+            reservation.status, reservation.reservation_date, reservation.table.restaurant_id
+        )
+
+    def validate_batch(self, objects, errors):
+        lock_tables(reservation.table_id for reservation in objects.values())
+        check_reservations(objects, errors)
+
+    def after_write(self, created, updated):
+        changes = [(None, self.contribution(reservation)) for reservation in created]
+        changes += [(before, self.contribution(reservation)) for reservation, (before, _user_id) in updated]
+        popularity.apply_bulk(changes)
+        # прежние и новые владельцы
+        owners = {reservation.user_id for reservation in created}
+        for reservation, (_before, user_id) in updated:
+            owners.update((user_id, reservation.user_id))
+        user_summary.invalidate_on_commit(owners)
+
+
+IMPORTERS = {
+    'restaurant': RestaurantImporter,
+    'table': TableImporter,
+    'reservation': ReservationImporter,
+}
+
+
+def importer_for(model, **kwargs):
+    return IMPORTERS[model._meta.model_name](**kwargs)
+
+
+def import_file(model_name, stream, fmt, batch_size=BATCH_SIZE, user=None, dry_run=False):
+    if isinstance(stream, (bytes, bytearray)):
+        stream = decoded_lines(stream)
+    rows = read_rows(stream, fmt)
+    return IMPORTERS[model_name](batch_size=batch_size, user=user).run(rows, dry_run=dry_run)
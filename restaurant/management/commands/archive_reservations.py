@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from restaurant import archive
+
+
+class Command(BaseCommand):
+    help = ('Переносит брони старше горизонта в архивную таблицу порциями. '
+            'Прерванный запуск безопасно продолжить повторным (запускать раз в сутки)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=getattr(settings, 'RESERVATION_ARCHIVE_DAYS', 180),
+                            help='Архивировать брони с датой раньше стольких дней назад')
+        parser.add_argument('--batch-size', type=int, default=archive.BATCH_SIZE)
+        parser.add_argument('--limit', type=int, help='Не больше стольких броней за запуск')
+        parser.add_argument('--dry-run', action='store_true', help='Только посчитать брони к переносу')
+
+    def handle(self, *args, **options):
+        try:
+            before = archive.horizon(options['days'])
+        except ValueError as error:
+            raise CommandError(error)
+        if options['dry_run']:
+            self.stdout.write(f'К переносу (дата раньше {before}): {archive.pending(before).count()}')
+            return
+
+        moved = batches = 0
+        for count in archive.archive_reservations(before, options['batch_size'], options['limit']):
+            moved += count
+            batches += 1
+            if options['verbosity'] > 1:
+                self.stdout.write(f'порция {batches}: {count}')
+        left = archive.pending(before).count()
+        self.stdout.write(self.style.SUCCESS(
+            f'Перенесено в архив: {moved} броней ({batches} порций), осталось до {before}: {left}'
+        ))
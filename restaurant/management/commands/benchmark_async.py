@@ -0,0 +1,53 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from restaurant import benchmarks
+
+MODES = {
+    'wsgi': ('restobook.urls', benchmarks.run_wsgi),
+    'asgi': ('restobook.urls_async', benchmarks.run_asgi),
+}
+
+
+class Command(BaseCommand):
+    help = ('Запросов в секунду и p99 читающих страниц и API: синхронные представления через WSGI '
+            '(пул потоков) против асинхронных через ASGI (задачи в цикле событий). Временная БД')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--restaurants', type=int, default=50)
+        parser.add_argument('--tables', type=int, default=10)
+        parser.add_argument('--reservations', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--output', help='Записать результат в JSON')
+
+    def handle(self, *args, **options):
+        result = {}
+        self.stdout.write('Создание временной БД...')
+        with benchmarks.isolated_database():
+            dataset = benchmarks.seed(options['restaurants'], options['tables'], options['reservations'],
+                                      seed_value=options['seed'])
+            result['dataset'] = dict(dataset.params, reservations_created=dataset.reservations)
+            for mode, (urlconf, run) in MODES.items():
+                with override_settings(ROOT_URLCONF=urlconf):
+                    run(dataset, min(options['requests'], 50), options['concurrency'], options['seed'])  # прогрев
+                    result[mode] = run(dataset, options['requests'], options['concurrency'], options['seed'])
+
+        self.stdout.write(f'{"":6} {"запросов/с":>11} {"медиана, мс":>12} {"p99, мс":>9} {"ошибок":>7}')
+        for mode in MODES:
+            run = result[mode]
+            errors = sum(row['errors'] for row in run['routes'].values())
+            self.stdout.write(f'{mode:6} {run["rps"]:11.1f} {run["overall"]["median_ms"]:12.2f} '
+                              f'{run["overall"]["p99_ms"]:9.2f} {errors:7}')
+        self.stdout.write(f'\n{"маршрут":22} {"WSGI p99":>10} {"ASGI p99":>10}')
+        for route in sorted(result['wsgi']['routes']):
+            asgi = result['asgi']['routes'].get(route, {}).get('p99_ms', float('nan'))
+            self.stdout.write(f'{route:22} {result["wsgi"]["routes"][route]["p99_ms"]:10.2f} {asgi:10.2f}')
+
+        if options['output']:
+            with open(options['output'], 'w') as target:
+                json.dump(result, target, ensure_ascii=False, indent=2)
+            self.stdout.write(f'\nРезультат записан в {options["output"]}')
@@ -0,0 +1,74 @@
+import time as time_module
+import tracemalloc
+from datetime import date, time, timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from restaurant.admin import RestaurantResource, TableResource, ReservationResource
+from restaurant.export import export_lines
+from restaurant.models import Restaurant, Table, Reservation
+
+MODELS = {
+    'restaurant': (Restaurant, RestaurantResource),
+    'table': (Table, TableResource),
+    'reservation': (Reservation, ReservationResource),
+}
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает экспорт import_export (весь набор в памяти) с потоковым экспортом: '
+            'время, пиковая память, число строк')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', choices=sorted(MODELS), default='reservation')
+        parser.add_argument('--rows', type=int, default=0,
+                            help='Сгенерировать столько броней во временной транзакции (откатывается)')
+
+    def handle(self, *args, **options):
+        model, resource_class = MODELS[options['model']]
+        try:
+            with transaction.atomic():
+                if options['rows']:
+                    self.generate(options['rows'])
+                queryset = model.objects.all()
+                self.stdout.write(f'{model._meta.verbose_name_plural}: {queryset.count()} строк')
+                self.report('import_export (CSV)', lambda: resource_class().export(queryset=queryset).csv)
+                self.report('поток CSV', lambda: sum(len(block) for block in export_lines(queryset, 'csv')))
+                self.report('поток JSONL', lambda: sum(len(block) for block in export_lines(queryset, 'jsonl')))
+                raise Rollback
+        except Rollback:
+            pass
+
+    def report(self, label, run):
+        tracemalloc.start()
+        started = time_module.perf_counter()
+        run()
+        seconds = time_module.perf_counter() - started
+        _current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self.stdout.write(f'{label:22} {seconds:8.2f} с   пик памяти {peak / 1024 / 1024:8.1f} МБ')
+
+    def generate(self, count):
+        """Брони по часовым слотам 10:00-22:00 на 20 столиках без истории и сигналов"""
+        user, _ = User.objects.get_or_create(username='benchmark')
+        restaurant = Restaurant.objects.create(name='Benchmark', description='', address='', phone='',
+                                               cuisine_type='italian')
+        tables = Table.objects.bulk_create(
+            [Table(restaurant=restaurant, table_number=str(n), capacity=4) for n in range(20)]
+        )
+        slots = [(table, time(hour, 0)) for table in tables for hour in range(10, 23)]
+        start = date.today()
+        Reservation.objects.bulk_create(
+            (
+                Reservation(user=user, table=slots[n % len(slots)][0], reservation_time=slots[n % len(slots)][1],
+                            reservation_date=start + timedelta(days=n // len(slots)), guests_count=2)
+                for n in range(count)
+            ),
+            batch_size=2000,
+        )
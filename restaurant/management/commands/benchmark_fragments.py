@@ -0,0 +1,68 @@
+import time as time_module
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from restaurant.models import Restaurant, Table
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Время ответа списка, карточки и поиска ресторанов без кэша фрагментов '
+            '(кэш очищается перед каждым запросом) и с прогретым кэшем')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--restaurants', type=int, default=0,
+                            help='Сгенерировать столько ресторанов во временной транзакции (откатывается)')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                if options['restaurants']:
+                    self.generate(options['restaurants'])
+                restaurant = Restaurant.objects.order_by('name', 'id').first()
+                if restaurant is None:
+                    self.stderr.write('Нет ресторанов - используйте --restaurants')
+                    return
+                paths = ['/restaurants/', f'/restaurants/{restaurant.pk}/', f'/search/?q={restaurant.name.split()[0]}']
+                client = Client(HTTP_HOST='localhost')
+                self.stdout.write(f'{"путь":40} {"без кэша, мс":>14} {"SQL":>5} {"с кэшем, мс":>13} {"SQL":>5}')
+                for path in paths:
+                    cold = self.measure(client, path, options['repeat'], clear=True)
+                    warm = self.measure(client, path, options['repeat'], clear=False)
+                    self.stdout.write(f'{path:40} {cold[0]:14.1f} {cold[1]:5} {warm[0]:13.1f} {warm[1]:5}')
+                raise Rollback
+        except Rollback:
+            pass
+
+    def measure(self, client, path, repeat, clear):
+        client.get(path)  # прогрев
+        total = 0.0
+        for _ in range(repeat):
+            if clear:
+                cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                started = time_module.perf_counter()
+                client.get(path)
+                total += time_module.perf_counter() - started
+        return total / repeat * 1000, len(queries)
+
+    def generate(self, count):
+        restaurants = [
+            Restaurant(name=f'Benchmark {n}', description='Описание ' * 30, address=f'Адрес {n}',
+                       phone='+70000000000', cuisine_type='italian')
+            for n in range(count)
+        ]
+        for restaurant in restaurants:
+            restaurant.save()
+        Table.objects.bulk_create(
+            Table(restaurant=restaurant, table_number=str(n), capacity=2 + n % 6)
+            for restaurant in restaurants for n in range(12)
+        )
@@ -0,0 +1,54 @@
+import time as time_module
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test.utils import override_settings
+
+from restaurant.models import Restaurant, Table
+
+MODES = {
+    'без истории': {'SIMPLE_HISTORY_ENABLED': False},
+    'история, по записи': {'HISTORY_BUFFERED': False, 'HISTORY_SKIP_UNCHANGED': False},
+    'история, буфер': {'HISTORY_BUFFERED': True, 'HISTORY_SKIP_UNCHANGED': True},
+}
+
+
+class Command(BaseCommand):
+    help = 'Скорость save() столиков с историей и без: создание, изменение и сохранение без изменений'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        count = options['rows']
+        self.stdout.write(f'{"режим":22} {"создание":>12} {"изменение":>12} {"без изменений":>14}  строк/с')
+        for label, overrides in MODES.items():
+            with override_settings(**overrides):
+                restaurant = Restaurant.objects.create(name='Benchmark', description='', address='', phone='',
+                                                       cuisine_type='italian')
+                try:
+                    create = self.measure(lambda: [
+                        Table(restaurant=restaurant, table_number=str(n), capacity=4).save() for n in range(count)
+                    ], count)
+                    tables = list(Table.objects.filter(restaurant=restaurant))
+                    update = self.measure(lambda: [
+                        self.change(table) for table in tables
+                    ], count)
+                    tables = list(Table.objects.filter(restaurant=restaurant))
+                    unchanged = self.measure(lambda: [table.save() for table in tables], count)
+                finally:
+                    ids = list(restaurant.tables.values_list('pk', flat=True))
+                    restaurant.delete()
+                    Table.history.filter(id__in=ids).delete()
+                    Restaurant.history.filter(id=restaurant.pk).delete()
+            self.stdout.write(f'{label:22} {create:>12.0f} {update:>12.0f} {unchanged:>14.0f}')
+
+    def change(self, table):
+        table.capacity += 1
+        table.save()
+
+    def measure(self, run, count):
+        started = time_module.perf_counter()
+        with transaction.atomic():
+            run()
+        return count / (time_module.perf_counter() - started)
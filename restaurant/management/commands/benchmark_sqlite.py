@@ -0,0 +1,64 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from restaurant import benchmarks, sqlite_tuning
+
+
+class Command(BaseCommand):
+    help = ('Всплеск бронирований на SQLite: настройки по умолчанию против профиля из SQLITE_PROFILES '
+            '(WAL, BEGIN IMMEDIATE...). Ошибки "database is locked" и пропускная способность. Временная БД')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--restaurants', type=int, default=10)
+        parser.add_argument('--tables', type=int, default=5)
+        parser.add_argument('--reservations', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--writers', type=int, default=8, help='Потоков, бронирующих столики')
+        parser.add_argument('--readers', type=int, default=4, help='Потоков, читающих карточки ресторанов')
+        parser.add_argument('--bookings', type=int, default=50, help='Броней на поток')
+        parser.add_argument('--attempts', type=int, default=1,
+                            help='Попыток book_table; 1 - без повторов, видна каждая блокировка')
+        parser.add_argument('--profile', default='production', help='Профиль для сравнения')
+        parser.add_argument('--output', help='Записать результат в JSON')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('Бенчмарк только для SQLite')
+        if options['profile'] not in settings.SQLITE_PROFILES:
+            raise CommandError(f'Нет профиля {options["profile"]}: {", ".join(settings.SQLITE_PROFILES)}')
+
+        result = {}
+        for name in ('', options['profile']):
+            label = name or 'default'
+            self.stdout.write(f'Профиль {label}: создание временной БД...')
+            with benchmarks.isolated_database(), sqlite_tuning.profile(name):
+                dataset = benchmarks.seed(options['restaurants'], options['tables'], options['reservations'],
+                                          seed_value=options['seed'])
+                result[label] = benchmarks.run_contention(
+                    dataset, options['writers'], options['readers'], options['bookings'],
+                    options['attempts'], options['seed'],
+                )
+                result[label]['pragmas'] = sqlite_tuning.pragmas()
+
+        self.stdout.write(f'\n{"профиль":12} {"журнал":>7} {"записей/с":>10} {"броней":>7} {"locked":>7} '
+                          f'{"p99 записи":>11} {"чтений/с":>9} {"locked":>7} {"p99 чтения":>11}')
+        for label, run in result.items():
+            self.stdout.write(
+                f'{label:12} {run["pragmas"]["journal_mode"]:>7} {run["writes_per_s"]:10.1f} {run["booked"]:7} '
+                f'{run["write_locked"]:7} {self.p99(run["write"]):11.2f} {run["reads_per_s"]:9.1f} '
+                f'{run["read_locked"]:7} {self.p99(run["read"]):11.2f}'
+            )
+        errors = sum(run['write_errors'] + run['read_errors'] for run in result.values())
+        if errors:
+            self.stderr.write(f'Прочих ошибок БД: {errors}')
+
+        if options['output']:
+            with open(options['output'], 'w') as target:
+                json.dump(result, target, ensure_ascii=False, indent=2)
+            self.stdout.write(f'\nРезультат записан в {options["output"]}')
+
+    def p99(self, summary):
+        return summary['p99_ms'] if summary else float('nan')
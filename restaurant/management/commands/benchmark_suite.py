@@ -0,0 +1,101 @@
+import json
+import platform
+import subprocess
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from restaurant import benchmarks
+
+
+class Command(BaseCommand):
+    help = ('Набор замеров: генерация данных, микробенчмарки и нагрузка на страницы и API. '
+            'Работает на отдельной временной БД; результат - JSON для сравнения между коммитами')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--restaurants', type=int, default=50)
+        parser.add_argument('--tables', type=int, default=10, help='Столиков на ресторан')
+        parser.add_argument('--reservations', type=int, default=5000)
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--repeat', type=int, default=20, help='Повторов каждого микробенчмарка')
+        parser.add_argument('--requests', type=int, default=500, help='Запросов нагрузки, 0 - без нагрузки')
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--output', help='Файл JSON (по умолчанию benchmark-<коммит>.json)')
+        parser.add_argument('--compare', help='JSON прошлого прогона для сравнения')
+        parser.add_argument('--threshold', type=float, default=benchmarks.REGRESSION_THRESHOLD,
+                            help='Доля замедления медианы, считающаяся регрессией')
+        parser.add_argument('--fail-on-regression', action='store_true')
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as source:
+                baseline = json.load(source)
+
+        commit = self.commit()
+        result = {
+            'commit': commit,
+            'created_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+        }
+        self.stdout.write('Создание временной БД...')
+        with benchmarks.isolated_database():
+            dataset = benchmarks.seed(options['restaurants'], options['tables'], options['reservations'],
+                                      options['users'], options['seed'])
+            result['dataset'] = dict(dataset.params, reservations_created=dataset.reservations)
+            self.stdout.write(f'Данные: {options["restaurants"]} ресторанов, '
+                              f'{options["restaurants"] * options["tables"]} столиков, {dataset.reservations} броней')
+
+            result['micro'] = benchmarks.run_micro(dataset, options['repeat'])
+            self.stdout.write(f'{"микробенчмарк":28} {"медиана, мс":>12} {"p95, мс":>10} {"SQL":>5}')
+            for name, row in result['micro'].items():
+                self.stdout.write(f'{name:28} {row["median_ms"]:12.2f} {row["p95_ms"]:10.2f} {row["queries"]:5}')
+
+            if options['requests']:
+                result['load'] = benchmarks.run_load(dataset, options['requests'], options['concurrency'],
+                                                     seed_value=options['seed'])
+                load = result['load']
+                self.stdout.write(f'\nНагрузка: {load["requests"]} запросов, {load["concurrency"]} потоков, '
+                                  f'{load["rps"]} запросов/с')
+                self.stdout.write(f'{"маршрут":28} {"запросов":>9} {"медиана, мс":>12} {"p95, мс":>10} {"ошибок":>7}')
+                for route, row in load['routes'].items():
+                    self.stdout.write(f'{route:28} {row["count"]:9} {row["median_ms"]:12.2f} '
+                                      f'{row["p95_ms"]:10.2f} {row["errors"]:7}')
+
+        output = options['output'] or f'benchmark-{(commit or "local")[:12]}.json'
+        with open(output, 'w') as target:
+            json.dump(result, target, ensure_ascii=False, indent=2)
+        self.stdout.write(f'\nРезультат записан в {output}')
+
+        if baseline is not None:
+            self.report_comparison(baseline, result, options)
+
+    def report_comparison(self, baseline, result, options):
+        rows = benchmarks.compare(baseline, result, options['threshold'])
+        self.stdout.write(f'\nСравнение с {baseline.get("commit") or options["compare"]}:')
+        for section in ('dataset', 'database'):
+            if baseline.get(section) != result.get(section):
+                self.stderr.write(f'Внимание: {section} отличается от прошлого прогона - сравнение неточное')
+        load_params = [(run.get('load') or {}).get(key) for run in (baseline, result) for key in ('requests', 'concurrency')]
+        if load_params[:2] != load_params[2:]:
+            self.stderr.write('Внимание: параметры нагрузки отличаются от прошлого прогона')
+        regressions = 0
+        for section, name, old, new, ratio, regression in rows:
+            regressions += regression
+            mark = '  РЕГРЕССИЯ' if regression else ''
+            ratio = f'{ratio:.2f}x' if ratio is not None else '-'
+            self.stdout.write(f'{section:6} {name:28} {old:10.2f} -> {new:10.2f} мс {ratio:>7}{mark}')
+        if regressions and options['fail_on_regression']:
+            raise CommandError(f'Регрессий: {regressions}')
+
+    def commit(self):
+        try:
+            return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                  check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
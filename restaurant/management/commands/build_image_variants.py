@@ -0,0 +1,36 @@
+import time as time_module
+
+from django.core.management.base import BaseCommand
+
+from restaurant import images
+from restaurant.models import Restaurant
+
+
+class Command(BaseCommand):
+    help = 'Строит уменьшенные копии фотографий ресторанов (для уже загруженных изображений)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Перестроить уже готовые варианты')
+
+    def handle(self, *args, **options):
+        started = time_module.perf_counter()
+        built = skipped = failed = 0
+        for restaurant in Restaurant.objects.exclude(image='').exclude(image__isnull=True).iterator(chunk_size=200):
+            try:
+                if not restaurant.image_hash:
+                    with restaurant.image.open('rb') as source:
+                        restaurant.image_hash = images.content_hash(source)
+                    # update() - без записи в историю и сигналов
+                    Restaurant.objects.filter(pk=restaurant.pk).update(image_hash=restaurant.image_hash)
+                if not options['force'] and images.get_manifest(restaurant.image_hash) is not None:
+                    skipped += 1
+                    continue
+                images.build_variants(restaurant.image.path, restaurant.image_hash, images.variants_root())
+                built += 1
+            except (OSError, ValueError) as error:
+                failed += 1
+                self.stderr.write(f'{restaurant.name}: {error}')
+        self.stdout.write(
+            f'Построено: {built}, уже готовы: {skipped}, ошибок: {failed} '
+            f'за {time_module.perf_counter() - started:.1f} с'
+        )
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from restaurant.importing import BATCH_SIZE, IMPORTERS, format_from_name, import_file
+
+
+class Command(BaseCommand):
+    help = 'Массовый импорт ресторанов, столиков или броней из CSV/JSONL (bulk_create/bulk_update пачками)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', choices=sorted(IMPORTERS))
+        parser.add_argument('path', help='Файл .csv или .jsonl')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='По умолчанию - по расширению файла')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--dry-run', action='store_true', help='Проверить файл без записи в БД')
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or format_from_name(options['path'])
+        try:
+            # байты: строку с неверной кодировкой importing отметит как ошибку
+            with open(options['path'], 'rb') as stream:
+                result = import_file(options['model'], stream.read(), fmt,
+                                     batch_size=options['batch_size'], dry_run=options['dry_run'])
+        except (OSError, ValueError) as error:
+            raise CommandError(str(error))
+
+        if result.errors:
+            for line, message in result.errors[:50]:
+                self.stderr.write(f'Строка {line}: {message}')
+            raise CommandError(f'Импорт отменён, ошибок: {len(result.errors)}')
+        self.stdout.write(self.style.SUCCESS(str(result)))
@@ -0,0 +1,88 @@
+import re
+from datetime import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min, Max
+from django.utils import timezone
+
+from restaurant.availability import busy_reservations, to_minutes
+from restaurant.models import Restaurant, Table, Reservation
+from restaurant.popularity import top_restaurants
+from restaurant.search import search
+
+# Полный проход по таблице без индекса (SQLite / PostgreSQL / MySQL).
+# "SCAN ... USING INDEX" у SQLite - обход индекса по порядку, он допустим.
+FULL_SCAN = re.compile(r'\bSCAN \w+\s*$|Seq Scan|type: ALL')
+
+
+def hot_queries():
+    """Горячие запросы из views.py и views_api.py.
+
+    Возвращает список (название, queryset, разрешён_полный_проход).
+    Агрегаты по всем ресторанам пока неизбежно читают всю таблицу -
+    они помечены и не валят проверку.
+    """
+    today = timezone.now().date()
+    restaurant_id = Restaurant.objects.values_list('id', flat=True).first() or 1
+    table_id = Table.objects.values_list('id', flat=True).first() or 1
+    user_id = User.objects.values_list('id', flat=True).first() or 1
+    start = to_minutes(time(19, 0))
+
+    return [
+        ('home: popular_restaurants', top_restaurants(4), False),
+        ('home: available_tables', Table.available.select_related('restaurant').order_by('-capacity')[:6], True),
+        ('home: affordable_restaurants', Restaurant.objects.annotate(
+            min_price=Min('tables__price_per_hour')
+        ).filter(min_price__isnull=False).order_by('min_price')[:3], True),
+        ('home: large_tables_restaurants', Restaurant.objects.annotate(
+            max_capacity=Max('tables__capacity')
+        ).filter(max_capacity__gte=6).order_by('-max_capacity')[:3], True),
+        ('home/search: ranked results', search('паста'), False),
+        ('all_restaurants: page', Restaurant.objects.order_by('name')[:6], False),
+        ('restaurant_detail: tables', Table.objects.filter(restaurant_id=restaurant_id), False),
+        ('restaurant_detail: available_tables', Table.objects.filter(restaurant_id=restaurant_id).exclude(
+            id__in=busy_reservations(today, start, start + 120).filter(
+                table__restaurant_id=restaurant_id).values('table_id')
+        ), False),
+        ('restaurant_detail: reservations', Reservation.objects.filter(
+            table__restaurant_id=restaurant_id)[:5], False),
+        ('make_reservation: conflict', busy_reservations(today, start, start + 120).filter(
+            table_id=table_id), False),
+        ('user_reservations', Reservation.objects.filter(user_id=user_id).select_related(
+            'table', 'table__restaurant').order_by('-reservation_date', '-reservation_time')[:10], False),
+        ('api: restaurants ?cuisine_type', Restaurant.objects.filter(
+            cuisine_type='italian').order_by('name')[:10], False),
+        ('api: reservations ?table&date', Reservation.objects.filter(
+            table_id=table_id, reservation_date=today)[:10], False),
+        ('api: reservations/upcoming', Reservation.objects.filter(
+            reservation_date__gte=today, status__in=['confirmed', 'pending']
+        ).order_by('reservation_date', 'reservation_time')[:10], False),
+    ]
+
+
+class Command(BaseCommand):
+    help = 'Печатает EXPLAIN для горячих запросов и проверяет отсутствие полных проходов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Завершиться с ошибкой, если запрос читает всю таблицу')
+
+    def handle(self, *args, **options):
+        failures = []
+        for name, queryset, allow_scan in hot_queries():
+            plan = queryset.explain()
+            full_scan = any(FULL_SCAN.search(line) for line in plan.splitlines())
+            if full_scan and allow_scan:
+                marker = self.style.WARNING('SCAN (допустимо)')
+            elif full_scan:
+                marker = self.style.ERROR('SCAN')
+                failures.append(name)
+            else:
+                marker = self.style.SUCCESS('OK')
+            self.stdout.write(f'== {name} [{marker}]')
+            self.stdout.write(plan)
+            self.stdout.write('')
+
+        if options['check'] and failures:
+            raise CommandError('Полный проход по таблице: ' + ', '.join(failures))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from restaurant import waitlist
+
+
+class Command(BaseCommand):
+    help = ('Лист ожидания: закрывает заявки на прошедшие даты и проходит очереди всех дней. '
+            'Отмены запускают проход сами; команда подбирает столики, освободившиеся '
+            'без сигналов (правка в обход ORM, новые столики). Запускать по расписанию')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--no-expire', action='store_true', help='Не закрывать заявки на прошедшие даты')
+
+    def handle(self, *args, **options):
+        if not options['no_expire']:
+            self.stdout.write(f'Закрыто просроченных заявок: {waitlist.expire()}')
+
+        assigned = waitlist.match(waitlist.pending_days())
+        if assigned:
+            self.stdout.write(f'{"ресторан":>10} {"дата":>12} {"назначено":>10}')
+            for (restaurant_id, day), count in assigned.items():
+                self.stdout.write(f'{restaurant_id:>10} {day.isoformat():>12} {count:>10}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Очередей: {len(assigned)}, назначено столиков: {sum(assigned.values())}'
+        ))
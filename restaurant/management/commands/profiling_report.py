@@ -0,0 +1,77 @@
+import json
+from urllib.request import Request, urlopen
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.test.utils import override_settings
+
+from restaurant.profiling import REGISTRY
+
+
+class Command(BaseCommand):
+    help = ('Профиль запросов по представлениям: время, число SQL, N+1, рендер шаблонов. '
+            'Либо прогоняет указанные пути в этом процессе, либо читает /metrics/ работающего сервера')
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', help='Пути для прогона, например / /restaurants/ /api/tables/')
+        parser.add_argument('--repeat', type=int, default=5, help='Сколько раз запрашивать каждый путь')
+        parser.add_argument('--user', help='Имя пользователя, от которого выполнять запросы')
+        parser.add_argument('--url', help='Адрес /metrics/ работающего сервера')
+        parser.add_argument('--token', default='', help='PROFILING_TOKEN для --url')
+        parser.add_argument('--format', choices=['table', 'json', 'prometheus'], default='table')
+
+    def handle(self, *args, **options):
+        if options['url']:
+            data = self.fetch(options['url'], options['token'], options['format'])
+        elif options['paths']:
+            self.run_paths(options['paths'], options['repeat'], options['user'])
+            data = REGISTRY.prometheus() if options['format'] == 'prometheus' else REGISTRY.as_dict()
+        else:
+            raise CommandError('Укажите пути для прогона или --url')
+
+        if options['format'] == 'prometheus':
+            self.stdout.write(data)
+        elif options['format'] == 'json':
+            self.stdout.write(json.dumps(data, ensure_ascii=False, indent=2))
+        else:
+            self.write_table(data)
+
+    def fetch(self, url, token, output):
+        if output != 'prometheus':
+            url += ('&' if '?' in url else '?') + 'format=json'
+        request = Request(url, headers={'Authorization': f'Bearer {token}'} if token else {})
+        with urlopen(request, timeout=10) as response:
+            body = response.read().decode()
+        return body if output == 'prometheus' else json.loads(body)
+
+    def run_paths(self, paths, repeat, username):
+        REGISTRY.reset()
+        with override_settings(PROFILING_ENABLED=True):
+            client = Client(HTTP_HOST='localhost')
+            if username:
+                try:
+                    client.force_login(User.objects.get(username=username))
+                except User.DoesNotExist:
+                    raise CommandError(f'Пользователь {username} не найден')
+            for path in paths:
+                for _ in range(repeat):
+                    response = client.get(path)
+                    if response.status_code >= 400:
+                        self.stderr.write(f'{path}: HTTP {response.status_code}')
+                        break
+
+    def write_table(self, data):
+        header = f'{"Представление":40} {"запр.":>6} {"p50 мс":>7} {"p95 мс":>7} {"SQL ср.":>8} {"SQL макс":>8} {"шабл. мс":>8} {"N+1":>5}'
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for view, stats in sorted(data.items(), key=lambda item: -item[1]['queries']['sum']):
+            requests = stats['requests'] or 1
+            self.stdout.write(
+                f'{view[:40]:40} {stats["requests"]:>6} '
+                f'{stats["duration_ms"]["p50"]:>7} {stats["duration_ms"]["p95"]:>7} '
+                f'{stats["queries"]["sum"] / requests:>8.1f} {stats["max_queries"]:>8} '
+                f'{stats["template_ms"]["sum"] / requests:>8.1f} {stats["n_plus_one_requests"]:>5}'
+            )
+            for example in stats['n_plus_one_examples']:
+                self.stdout.write(f'    x{example["count"]}: {example["sql"][:110]}')
@@ -0,0 +1,74 @@
+import gzip
+import json
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from restaurant.models import Restaurant, Table, Reservation
+
+MODELS = [Restaurant, Table, Reservation]
+
+
+class Command(BaseCommand):
+    help = ('Удаляет исторические записи старше срока хранения, сохраняя их в архив .jsonl.gz. '
+            'Для каждого объекта остаётся последняя запись до срока - состояние на эту дату')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=getattr(settings, 'HISTORY_RETENTION_DAYS', 365))
+        parser.add_argument('--archive-dir', default=getattr(settings, 'HISTORY_ARCHIVE_DIR', None))
+        parser.add_argument('--no-archive', action='store_true', help='Удалять без архивации')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='Только посчитать записи к удалению')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        archive_dir = None if options['no_archive'] else options['archive_dir']
+        for model in MODELS:
+            removed = self.prune(model.history.model, cutoff, archive_dir, options['batch_size'], options['dry_run'])
+            verb = 'к удалению' if options['dry_run'] else 'удалено'
+            self.stdout.write(f'{model._meta.verbose_name_plural}: {verb} {removed} исторических записей')
+
+    def prune(self, history, cutoff, archive_dir, batch_size, dry_run):
+        old = history.objects.filter(history_date__lt=cutoff)
+        # Последняя запись до срока у существующих объектов - точка отсчёта
+        # истории и остаётся; удаляются более ранние и записи удаления.
+        # Отбор - в SQL (EXISTS по индексу id), без списка id в памяти
+        newer = old.filter(id=OuterRef('id'), history_id__gt=OuterRef('history_id'))
+        doomed = old.filter(Q(Exists(newer)) | Q(history_type='-'))
+        if dry_run:
+            return doomed.count()
+
+        archive = path = None
+        if archive_dir:
+            os.makedirs(archive_dir, exist_ok=True)
+            stamp = timezone.now().strftime('%Y%m%d-%H%M%S')
+            path = os.path.join(archive_dir, f'{history._meta.db_table}-{stamp}.jsonl.gz')
+            archive = gzip.open(path, 'wt', encoding='utf-8')
+
+        removed, last_id = 0, 0
+        try:
+            while True:
+                # keyset по history_id - каждая порция читается по индексу
+                rows = list(doomed.filter(history_id__gt=last_id).order_by('history_id').values()[:batch_size])
+                if not rows:
+                    break
+                last_id = rows[-1]['history_id']
+                if archive:
+                    for row in rows:
+                        archive.write(json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n')
+                    archive.flush()  # в архиве раньше, чем удалено из БД
+                with transaction.atomic():
+                    history.objects.filter(history_id__in=[row['history_id'] for row in rows]).delete()
+                removed += len(rows)
+        finally:
+            if archive:
+                archive.close()
+                if not removed:
+                    os.remove(path)
+        return removed
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from restaurant import search
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает полнотекстовый индекс ресторанов'
+
+    def handle(self, *args, **options):
+        if not search.supported():
+            raise CommandError('Полнотекстовый индекс поддерживается только на SQLite и PostgreSQL')
+        search.create_index()
+        count = search.rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f'Проиндексировано ресторанов: {count}'))
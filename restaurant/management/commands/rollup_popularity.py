@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from restaurant.popularity import rollup
+
+
+class Command(BaseCommand):
+    help = 'Сдвигает недельное окно рейтинга популярных ресторанов (запускать раз в сутки)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Пересчитать дневные счётчики по таблице броней')
+
+    def handle(self, *args, **options):
+        changed = rollup(rebuild=options['rebuild'])
+        self.stdout.write(self.style.SUCCESS(f'Рейтинг обновлён, изменено ресторанов: {changed}'))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from restaurant import sqlite_tuning
+
+
+class Command(BaseCommand):
+    help = ('Обслуживание SQLite: перенос WAL в файл БД (checkpoint) и PRAGMA optimize. '
+            'Запускать по расписанию, например раз в час')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', default='TRUNCATE', choices=sqlite_tuning.CHECKPOINT_MODES,
+                            help='Режим wal_checkpoint; TRUNCATE заодно обнуляет файл -wal')
+        parser.add_argument('--no-optimize', action='store_true', help='Без PRAGMA optimize')
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        using = options['database']
+        if not sqlite_tuning.is_sqlite(using):
+            raise CommandError('Команда только для SQLite')
+        for name, value in sqlite_tuning.pragmas(using).items():
+            self.stdout.write(f'{name:14} {value}')
+
+        busy, frames, moved = sqlite_tuning.checkpoint(options['mode'], using)
+        if frames < 0:
+            self.stdout.write('checkpoint: БД не в режиме WAL')
+        elif busy:
+            self.stderr.write(f'checkpoint {options["mode"]} не завершён: БД занята, перенесено {moved} из {frames} страниц')
+        else:
+            self.stdout.write(f'checkpoint {options["mode"]}: перенесено {moved} из {frames} страниц')
+
+        if not options['no_optimize']:
+            sqlite_tuning.optimize(using)
+            self.stdout.write('PRAGMA optimize выполнен')
+        self.stdout.write(self.style.SUCCESS('Готово'))
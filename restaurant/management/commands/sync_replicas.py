@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from restaurant.routing import replicas, sync_sqlite_replicas
+
+
+class Command(BaseCommand):
+    help = ('Обновляет SQLite-реплики (SQLITE_REPLICAS) копией основной БД. '
+            'Для локальной проверки чтения с реплик; Postgres реплицируется сам')
+
+    def handle(self, *args, **options):
+        if not replicas():
+            raise CommandError('Реплики не настроены: задайте SQLITE_REPLICAS=путь,...')
+        if connection.vendor != 'sqlite':
+            raise CommandError('Основная БД не SQLite - реплики обновляет репликация Postgres')
+        for alias, path in sync_sqlite_replicas():
+            self.stdout.write(f'{alias:12} {path}')
+        self.stdout.write(self.style.SUCCESS('Реплики обновлены'))
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurant', '0006_historicalreservation_historicalrestaurant_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='historicalreservation',
+            name='duration',
+            field=models.PositiveSmallIntegerField(choices=[(60, '1 час'), (90, '1,5 часа'), (120, '2 часа'), (180, '3 часа'), (240, '4 часа')], default=120, verbose_name='длительность (мин.)'),
+        ),
+        migrations.AddField(
+            model_name='reservation',
+            name='duration',
+            field=models.PositiveSmallIntegerField(choices=[(60, '1 час'), (90, '1,5 часа'), (120, '2 часа'), (180, '3 часа'), (240, '4 часа')], default=120, verbose_name='длительность (мин.)'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:31
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurant', '0007_reservation_duration'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='reservation',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ('confirmed', 'pending'))), fields=('table', 'reservation_date', 'reservation_time'), name='unique_active_reservation_slot'),
+        ),
+    ]
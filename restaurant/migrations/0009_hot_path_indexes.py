@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:32
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurant', '0008_reservation_unique_active_slot'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['table', 'reservation_date', 'status'], name='res_table_date_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['user', '-reservation_date', '-reservation_time'], name='res_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['-reservation_date', '-reservation_time'], name='res_date_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(condition=models.Q(('status__in', ('confirmed', 'pending'))), fields=['reservation_date', 'reservation_time'], name='res_active_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='restaurant',
+            index=models.Index(fields=['name'], name='restaurant_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='restaurant',
+            index=models.Index(fields=['cuisine_type', 'name'], name='restaurant_cuisine_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='restaurant',
+            index=models.Index(fields=['created_at'], name='restaurant_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='table',
+            index=models.Index(fields=['restaurant', 'capacity'], name='table_restaurant_capacity_idx'),
+        ),
+    ]
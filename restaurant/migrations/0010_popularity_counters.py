@@ -0,0 +1,69 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:34
+
+import django.db.models.deletion
+from datetime import timedelta
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+
+def backfill_counters(apps, schema_editor):
+    Reservation = apps.get_model('restaurant', 'Reservation')
+    ReservationCounter = apps.get_model('restaurant', 'ReservationCounter')
+    RestaurantPopularity = apps.get_model('restaurant', 'RestaurantPopularity')
+
+    rows = Reservation.objects.filter(
+        status__in=['confirmed', 'pending']
+    ).values('table__restaurant_id', 'reservation_date').annotate(total=Count('id')).order_by()
+    ReservationCounter.objects.bulk_create([
+        ReservationCounter(restaurant_id=row['table__restaurant_id'],
+                           date=row['reservation_date'], count=row['total'])
+        for row in rows
+    ], batch_size=500)
+
+    week_ago = timezone.now().date() - timedelta(days=7)
+    totals = ReservationCounter.objects.filter(date__gte=week_ago).values(
+        'restaurant_id').annotate(total=Sum('count')).order_by()
+    RestaurantPopularity.objects.bulk_create([
+        RestaurantPopularity(restaurant_id=row['restaurant_id'], week_count=row['total'])
+        for row in totals
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurant', '0009_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RestaurantPopularity',
+            fields=[
+                ('restaurant', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='popularity', serialize=False, to='restaurant.restaurant')),
+                ('week_count', models.IntegerField(default=0, verbose_name='броней за неделю')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='обновлено')),
+            ],
+            options={
+                'verbose_name': 'популярность ресторана',
+                'verbose_name_plural': 'популярность ресторанов',
+                'indexes': [models.Index(fields=['-week_count'], name='popularity_week_count_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ReservationCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='дата')),
+                ('count', models.IntegerField(default=0, verbose_name='количество броней')),
+                ('restaurant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservation_counters', to='restaurant.restaurant')),
+            ],
+            options={
+                'verbose_name': 'счётчик броней',
+                'verbose_name_plural': 'счётчики броней',
+                'constraints': [models.UniqueConstraint(fields=('restaurant', 'date'), name='unique_restaurant_counter_date')],
+            },
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,153 @@
+import re
+
+from django.db import migrations
+
+# Копия индекса restaurant.search и стеммера restaurant.stemmer на момент
+# миграции: живые модули могут измениться, а миграция должна давать тот же
+# результат. После изменения стеммера индекс пересобирается командой
+# rebuild_search_index.
+INDEX_TABLE = 'restaurant_search'
+FIELDS = ['name', 'cuisine', 'tags', 'address', 'description']
+PG_WEIGHTS = {'name': 'A', 'cuisine': 'B', 'tags': 'B', 'address': 'C', 'description': 'D'}
+
+VOWELS = 'аеиоуыэюя'
+PERFECTIVE_GERUND = re.compile(r'((?<=[ая])(в|вши|вшись)|(ив|ивши|ившись|ыв|ывши|ывшись))$')
+REFLEXIVE = re.compile(r'(с[яь])$')
+ADJECTIVE = re.compile(r'(ее|ие|ые|ое|ими|ыми|ей|ий|ый|ой|ем|им|ым|ом|его|ого|ему|ому|их|ых|ую|юю|ая|яя|ою|ею)$')
+PARTICIPLE = re.compile(r'((?<=[ая])(ем|нн|вш|ющ|щ)|(ивш|ывш|ующ))$')
+VERB = re.compile(
+    r'((?<=[ая])(ла|на|ете|йте|ли|й|л|ем|н|ло|но|ет|ют|ны|ть|ешь|нно)|'
+    r'(ила|ыла|ена|ейте|уйте|ите|или|ыли|ей|уй|ил|ыл|им|ым|ен|ило|ыло|ено|ят|ует|уют|ит|ыт|ены|ить|ыть|ишь|ую|ю))$'
+)
+NOUN = re.compile(
+    r'(а|ев|ов|ие|ье|е|иями|ями|ами|еи|ии|и|ией|ей|ой|ий|й|иям|ям|ием|ем|ам|ом|о|у|ах|иях|ях|ы|ь|ию|ью|ю|ия|ья|я)$'
+)
+SUPERLATIVE = re.compile(r'(ейш|ейше)$')
+DERIVATIONAL = re.compile(r'(ост|ость)$')
+CYRILLIC = re.compile(r'[а-я]')
+WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def _regions(word):
+    rv = len(word)
+    for i, ch in enumerate(word):
+        if ch in VOWELS:
+            rv = i + 1
+            break
+
+    def next_region(start):
+        for i in range(start + 1, len(word)):
+            if word[i] not in VOWELS and word[i - 1] in VOWELS:
+                return i + 1
+        return len(word)
+
+    r1 = next_region(0)
+    r2 = next_region(r1)
+    return rv, r2
+
+
+def stem(word):
+    word = word.lower().replace('ё', 'е')
+    if not CYRILLIC.search(word):
+        return word
+
+    rv_start, r2_start = _regions(word)
+    prefix, rv = word[:rv_start], word[rv_start:]
+
+    rv, count = PERFECTIVE_GERUND.subn('', rv, 1)
+    if not count:
+        rv = REFLEXIVE.sub('', rv, 1)
+        rv, count = ADJECTIVE.subn('', rv, 1)
+        if count:
+            rv = PARTICIPLE.sub('', rv, 1)
+        else:
+            rv, count = VERB.subn('', rv, 1)
+            if not count:
+                rv = NOUN.sub('', rv, 1)
+
+    if rv.endswith('и'):
+        rv = rv[:-1]
+
+    r2_offset = max(0, r2_start - rv_start)
+    match = DERIVATIONAL.search(rv)
+    if match and match.start() >= r2_offset:
+        rv = rv[:match.start()]
+
+    if rv.endswith('нн'):
+        rv = rv[:-1]
+    else:
+        rv, count = SUPERLATIVE.subn('', rv, 1)
+        if count and rv.endswith('нн'):
+            rv = rv[:-1]
+        elif rv.endswith('ь'):
+            rv = rv[:-1]
+
+    return prefix + rv
+
+
+def normalize(text):
+    words = [w.lower().replace('ё', 'е') for w in WORD.findall(text or '')]
+    stems = [stem(word) for word in WORD.findall(text or '')]
+    return ' '.join(dict.fromkeys(stems + words))
+
+
+def document(restaurant):
+    return {
+        'name': normalize(restaurant.name),
+        'cuisine': normalize(f'{restaurant.cuisine_type} {restaurant.get_cuisine_type_display()}'),
+        'tags': normalize(' '.join(tag.name for tag in restaurant.tags.all())),
+        'address': normalize(restaurant.address),
+        'description': normalize(restaurant.description),
+    }
+
+
+def create_search_index(apps, schema_editor):
+    db = schema_editor.connection
+    if db.vendor not in ('sqlite', 'postgresql'):
+        return
+    Restaurant = apps.get_model('restaurant', 'Restaurant')
+    restaurants = Restaurant.objects.using(db.alias).prefetch_related('tags')
+    with db.cursor() as cursor:
+        if db.vendor == 'sqlite':
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {INDEX_TABLE} USING fts5("
+                f"{', '.join(FIELDS)}, tokenize='unicode61 remove_diacritics 2')"
+            )
+            insert = (
+                f"INSERT INTO {INDEX_TABLE} (rowid, {', '.join(FIELDS)}) "
+                f"VALUES (%s, {', '.join(['%s'] * len(FIELDS))})"
+            )
+        else:
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {INDEX_TABLE} ("
+                f"restaurant_id bigint PRIMARY KEY REFERENCES restaurant_restaurant(id) ON DELETE CASCADE, "
+                f"document tsvector NOT NULL)"
+            )
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {INDEX_TABLE}_gin ON {INDEX_TABLE} USING GIN (document)"
+            )
+            vector = ' || '.join(
+                f"setweight(to_tsvector('simple', %s), '{PG_WEIGHTS[field]}')" for field in FIELDS
+            )
+            insert = f"INSERT INTO {INDEX_TABLE} (restaurant_id, document) VALUES (%s, {vector})"
+        for restaurant in restaurants.iterator(chunk_size=500):
+            doc = document(restaurant)
+            cursor.execute(insert, [restaurant.pk] + [doc[field] for field in FIELDS])
+
+
+def drop_search_index(apps, schema_editor):
+    db = schema_editor.connection
+    if db.vendor in ('sqlite', 'postgresql'):
+        with db.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {INDEX_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurant', '0010_popularity_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
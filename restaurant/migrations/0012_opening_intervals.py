@@ -0,0 +1,156 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:57
+
+import re
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Копия разборщика restaurant.schedule на момент миграции: живой модуль
+# может измениться, а заполнение должно давать тот же результат.
+MINUTES_IN_DAY = 24 * 60
+DAY_START = 10 * 60
+DAY_END = 23 * 60
+
+_DAY_PATTERNS = [
+    r'пн|пон\w*|mon\w*|mo',
+    r'вт|вто\w*|tue\w*|tu',
+    r'ср|сре\w*|wed\w*|we',
+    r'чт|чет\w*|thu\w*|th',
+    r'пт|пят\w*|fri\w*|fr',
+    r'сб|суб\w*|sat\w*|sa',
+    r'вс|вос\w*|sun\w*|su',
+]
+_DAY = '|'.join(f'(?:{pattern})' for pattern in _DAY_PATTERNS)
+_TIME = r'(\d{1,2})[:.](\d{2})'
+_TOKEN_RE = re.compile(
+    rf'(?P<range>{_TIME}\s*[-–—]\s*{_TIME})'
+    rf'|(?P<days>\b(?:{_DAY})\b\.?(?:\s*[-–—]\s*\b(?:{_DAY})\b\.?)?)'
+    r'|(?P<closed>выходн\w*|закрыт\w*|closed)'
+    r'|(?P<always>круглосуточно|24\s*/\s*7|24\s*час\w*)',
+    re.IGNORECASE,
+)
+
+
+def _weekday(token):
+    token = token.strip(' .').lower()
+    for index, pattern in enumerate(_DAY_PATTERNS):
+        if re.fullmatch(pattern, token):
+            return index
+    raise ValueError(token)
+
+
+def _day_range(token):
+    parts = re.split(r'\s*[-–—]\s*', token.strip())
+    first = _weekday(parts[0])
+    last = _weekday(parts[-1])
+    return [(first + offset) % 7 for offset in range((last - first) % 7 + 1)]
+
+
+def _minutes(hours, minutes):
+    hours, minutes = int(hours), int(minutes)
+    if hours > 24 or minutes > 59 or (hours == 24 and minutes):
+        raise ValueError
+    return hours * 60 + minutes
+
+
+def _merge(intervals):
+    merged = []
+    for opens, closes in sorted(intervals):
+        if merged and opens <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], closes)
+        else:
+            merged.append([opens, closes])
+    return [tuple(interval) for interval in merged]
+
+
+def parse(text):
+    days = {weekday: [] for weekday in range(7)}
+    current, pending, seen_days, found = None, [], False, False
+    for match in _TOKEN_RE.finditer(text or ''):
+        if match.group('days'):
+            try:
+                pending.extend(_day_range(match.group('days')))
+            except ValueError:
+                return None
+            current, seen_days = None, True
+            continue
+        if pending:
+            current, pending = pending, []
+        targets = current if current is not None else range(7)
+        if match.group('closed'):
+            for weekday in targets:
+                days[weekday] = []
+            found = True
+        elif match.group('always'):
+            for weekday in targets:
+                days[weekday].append((0, MINUTES_IN_DAY))
+            found = True
+        else:
+            try:
+                opens = _minutes(match.group(2), match.group(3))
+                closes = _minutes(match.group(4), match.group(5))
+            except ValueError:
+                return None
+            if opens >= MINUTES_IN_DAY:
+                return None
+            for weekday in targets:
+                if closes > opens:
+                    days[weekday].append((opens, closes))
+                else:
+                    days[weekday].append((opens, MINUTES_IN_DAY))
+                    if closes:
+                        days[(weekday + 1) % 7].append((0, closes))
+            found = True
+    if not found or pending:
+        return None
+    if not seen_days and not any(days.values()):
+        return None
+    return {weekday: _merge(intervals) for weekday, intervals in days.items()}
+
+
+def parse_or_default(text):
+    return parse(text) or {weekday: [(DAY_START, DAY_END)] for weekday in range(7)}
+
+
+def backfill_intervals(apps, schema_editor):
+    Restaurant = apps.get_model('restaurant', 'Restaurant')
+    OpeningInterval = apps.get_model('restaurant', 'OpeningInterval')
+    batch = []
+    for pk, opening_hours in Restaurant.objects.values_list('pk', 'opening_hours').iterator(chunk_size=500):
+        for weekday, intervals in parse_or_default(opening_hours).items():
+            batch.extend(
+                OpeningInterval(restaurant_id=pk, weekday=weekday, opens=opens, closes=closes)
+                for opens, closes in intervals
+            )
+        if len(batch) >= 1000:
+            OpeningInterval.objects.bulk_create(batch)
+            batch = []
+    OpeningInterval.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurant', '0011_restaurant_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OpeningInterval',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('weekday', models.PositiveSmallIntegerField(choices=[(0, 'понедельник'), (1, 'вторник'), (2, 'среда'), (3, 'четверг'), (4, 'пятница'), (5, 'суббота'), (6, 'воскресенье')], verbose_name='день недели')),
+                ('opens', models.PositiveSmallIntegerField(verbose_name='открытие (мин.)')),
+                ('closes', models.PositiveSmallIntegerField(verbose_name='закрытие (мин.)')),
+                ('restaurant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='opening_intervals', to='restaurant.restaurant')),
+            ],
+            options={
+                'verbose_name': 'интервал работы',
+                'verbose_name_plural': 'интервалы работы',
+                'ordering': ['restaurant', 'weekday', 'opens'],
+                'indexes': [models.Index(fields=['weekday', 'opens', 'closes', 'restaurant'], name='opening_weekday_time_idx')],
+                'constraints': [models.CheckConstraint(condition=models.Q(('opens__lt', models.F('closes'))), name='opening_interval_not_empty')],
+            },
+        ),
+        migrations.RunPython(backfill_intervals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurant', '0012_opening_intervals'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='historicalrestaurant',
+            name='image_hash',
+            field=models.CharField(blank=True, editable=False, max_length=32, verbose_name='хеш изображения'),
+        ),
+        migrations.AddField(
+            model_name='restaurant',
+            name='image_hash',
+            field=models.CharField(blank=True, editable=False, max_length=32, verbose_name='хеш изображения'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurant', '0013_restaurant_image_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='restaurant',
+            name='cache_version',
+            field=models.PositiveIntegerField(default=1, editable=False, verbose_name='версия кэша'),
+        ),
+    ]
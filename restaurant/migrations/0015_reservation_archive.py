@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:36
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurant', '0014_restaurant_cache_version'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedReservation',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('reservation_date', models.DateField(verbose_name='дата бронирования')),
+                ('reservation_time', models.TimeField(verbose_name='время бронирования')),
+                ('duration', models.PositiveSmallIntegerField(choices=[(60, '1 час'), (90, '1,5 часа'), (120, '2 часа'), (180, '3 часа'), (240, '4 часа')], default=120, verbose_name='длительность (мин.)')),
+                ('guests_count', models.IntegerField(verbose_name='количество гостей')),
+                ('special_requests', models.TextField(blank=True, verbose_name='особые пожелания')),
+                ('status', models.CharField(choices=[('confirmed', 'Подтверждено'), ('pending', 'Ожидание'), ('cancelled', 'Отменено')], max_length=20, verbose_name='статус')),
+                ('created_at', models.DateTimeField(verbose_name='дата создания')),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='дата архивации')),
+                ('table', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_reservations', to='restaurant.table')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_reservations', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'архивное бронирование',
+                'verbose_name_plural': 'архив бронирований',
+                'ordering': ['-reservation_date', '-reservation_time'],
+                'indexes': [models.Index(fields=['user', '-reservation_date', '-reservation_time'], name='archive_user_date_idx'), models.Index(fields=['table', 'reservation_date'], name='archive_table_date_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:43
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurant', '0015_reservation_archive'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WaitlistEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reservation_date', models.DateField(verbose_name='дата бронирования')),
+                ('reservation_time', models.TimeField(verbose_name='желаемое время')),
+                ('flexibility', models.PositiveSmallIntegerField(choices=[(0, 'Только в это время'), (30, '± 30 минут'), (60, '± 1 час'), (120, '± 2 часа')], default=30, verbose_name='подойдёт время')),
+                ('duration', models.PositiveSmallIntegerField(choices=[(60, '1 час'), (90, '1,5 часа'), (120, '2 часа'), (180, '3 часа'), (240, '4 часа')], default=120, verbose_name='длительность (мин.)')),
+                ('guests_count', models.IntegerField(verbose_name='количество гостей')),
+                ('special_requests', models.TextField(blank=True, verbose_name='особые пожелания')),
+                ('status', models.CharField(choices=[('waiting', 'В очереди'), ('assigned', 'Столик назначен'), ('expired', 'Истекла'), ('cancelled', 'Отменена')], default='waiting', max_length=20, verbose_name='статус')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='дата создания')),
+                ('assigned_at', models.DateTimeField(blank=True, null=True, verbose_name='назначено')),
+                ('reservation', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='waitlist_entry', to='restaurant.reservation', verbose_name='бронь')),
+                ('restaurant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='waitlist_entries', to='restaurant.restaurant')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='waitlist_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'заявка в листе ожидания',
+                'verbose_name_plural': 'лист ожидания',
+                'ordering': ['created_at', 'id'],
+                'indexes': [models.Index(condition=models.Q(('status', 'waiting')), fields=['restaurant', 'reservation_date', 'guests_count'], name='waitlist_queue_idx'), models.Index(fields=['user', 'status'], name='waitlist_user_status_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('status', 'waiting')), fields=('user', 'restaurant', 'reservation_date', 'reservation_time'), name='unique_waiting_entry')],
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:10
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurant', '0016_waitlist'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportJob',
+            fields=[
+                ('id', models.CharField(max_length=32, primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('pdf', 'PDF'), ('merged', 'Общий PDF'), ('zip', 'ZIP-архив')], max_length=10, verbose_name='вид')),
+                ('status', models.CharField(choices=[('pending', 'Формируется'), ('ready', 'Готов'), ('failed', 'Ошибка')], default='pending', max_length=10, verbose_name='статус')),
+                ('count', models.PositiveIntegerField(verbose_name='ресторанов')),
+                ('filename', models.CharField(max_length=100, verbose_name='имя файла')),
+                ('error', models.TextField(blank=True, verbose_name='ошибка')),
+                ('started_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='запущено')),
+            ],
+            options={
+                'verbose_name': 'отчёт',
+                'verbose_name_plural': 'отчёты',
+            },
+        ),
+    ]
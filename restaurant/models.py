@@ -4,16 +4,19 @@ from django.urls import reverse
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django.db.models import F, Q
-from simple_history.models import HistoricalRecords  # история 
+from .history import BufferedHistoricalRecords, TrackedFieldsMixin  # история 
+
+# Статусы брони, которые занимают столик; на них же условия индексов и ограничения
+ACTIVE_RESERVATION_STATUSES = ('confirmed', 'pending')
 
 class AvailableTableManager(models.Manager):
-    """Кастомный менеджер для доступных столиков"""
+    """Кастомный менеджер для доступных столиков (свободных прямо сейчас)"""
     def get_queryset(self):
-        today = timezone.now().date()
-        return super().get_queryset().exclude(
-            reservations__reservation_date=today,
-            reservations__status__in=['confirmed', 'pending']
-        )
+        from .availability import busy_reservations, to_minutes
+        now = timezone.localtime()
+        start = to_minutes(now.time())
+        busy = busy_reservations(now.date(), start, start + 1).values('table_id')
+        return super().get_queryset().exclude(id__in=busy)
 
 class Tag(models.Model):
     """Теги для ресторанов"""
@@ -28,7 +31,7 @@ class Tag(models.Model):
     def __str__(self):
         return self.name
 
-class Restaurant(models.Model):
+class Restaurant(TrackedFieldsMixin, models.Model):
     CUISINE_TYPES = [
         ('italian', _('Итальянская')),
         ('japanese', _('Японская')),
@@ -46,6 +49,10 @@ class Restaurant(models.Model):
     cuisine_type = models.CharField(max_length=50, choices=CUISINE_TYPES, verbose_name=_('тип кухни'))
     opening_hours = models.CharField(max_length=100, default='10:00-22:00', verbose_name=_('часы работы'))
     image = models.ImageField(upload_to='restaurants/%Y/%m/%d/', blank=True, null=True, verbose_name=_('изображение'))
+    # хеш содержимого image - каталог уменьшенных копий (images.py)
+    image_hash = models.CharField(max_length=32, blank=True, editable=False, verbose_name=_('хеш изображения'))
+    # версия кэша фрагментов шаблонов (fragments.py); растёт при изменении ресторана, столиков, тегов
+    cache_version = models.PositiveIntegerField(default=1, editable=False, verbose_name=_('версия кэша'))
     website = models.URLField(blank=True, verbose_name=_('веб-сайт'))
     created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, verbose_name=_('создатель'))
     created_at = models.DateTimeField(default=timezone.now, verbose_name=_('дата создания'))
@@ -54,12 +61,17 @@ class Restaurant(models.Model):
     tags = models.ManyToManyField(Tag, blank=True, related_name='restaurants', verbose_name=_('теги'))
     
     # ✅ ДОБАВЛЕНО: История изменений
-    history = HistoricalRecords()
+    history = BufferedHistoricalRecords(excluded_fields=['cache_version'])
 
     class Meta:
         verbose_name = _('ресторан')
         verbose_name_plural = _('рестораны')
         ordering = ['name']
+        indexes = [
+            models.Index(fields=['name'], name='restaurant_name_idx'),
+            models.Index(fields=['cuisine_type', 'name'], name='restaurant_cuisine_name_idx'),
+            models.Index(fields=['created_at'], name='restaurant_created_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -67,26 +79,71 @@ class Restaurant(models.Model):
     def get_absolute_url(self):
         return reverse('restaurant_detail', kwargs={'restaurant_id': self.id})
     
-    def get_available_tables(self, date, guests_count=2):
-        """Собственный метод: получение доступных столиков"""
-        busy_tables = Reservation.objects.filter(
-            table__restaurant=self,
-            reservation_date=date,
-            status__in=['confirmed', 'pending']
-        ).values_list('table_id', flat=True)
-        
-        return self.tables.exclude(id__in=busy_tables).filter(capacity__gte=guests_count)
+    def get_available_tables(self, date, guests_count=2, at_time=None, duration=None):
+        """Собственный метод: получение доступных столиков.
+
+        С at_time проверяется только интервал брони (время + длительность),
+        без него - весь рабочий день ресторана на эту дату.
+        """
+        from . import schedule
+        from .availability import free_tables, from_minutes
+        if duration is None:
+            duration = Reservation.DEFAULT_DURATION
+        if at_time is None:
+            day_windows = schedule.windows(self, date)
+            if not day_windows:
+                return Table.objects.none()
+            at_time = from_minutes(day_windows[0][0])
+            duration = day_windows[-1][1] - day_windows[0][0]
+        return free_tables(self, date, at_time, guests_count, duration)
     
     def increase_prices(self, percentage):
         """Использование F expression для обновления цен"""
         from django.db.models import F
+        from .fragments import bump
         self.tables.update(price_per_hour=F('price_per_hour') * (1 + percentage/100))
+        bump([self.pk])
     
     def can_edit(self, user):
         if not user or not user.is_authenticated:
             return False
         return user.is_staff
 
+class OpeningInterval(models.Model):
+    """Интервал работы ресторана в день недели, минуты [opens, closes).
+
+    Строится из Restaurant.opening_hours (см. schedule.py), вручную не правится.
+    """
+    WEEKDAYS = [
+        (0, _('понедельник')),
+        (1, _('вторник')),
+        (2, _('среда')),
+        (3, _('четверг')),
+        (4, _('пятница')),
+        (5, _('суббота')),
+        (6, _('воскресенье')),
+    ]
+
+    restaurant = models.ForeignKey(Restaurant, on_delete=models.CASCADE, related_name='opening_intervals')
+    weekday = models.PositiveSmallIntegerField(choices=WEEKDAYS, verbose_name=_('день недели'))
+    opens = models.PositiveSmallIntegerField(verbose_name=_('открытие (мин.)'))
+    closes = models.PositiveSmallIntegerField(verbose_name=_('закрытие (мин.)'))
+
+    class Meta:
+        verbose_name = _('интервал работы')
+        verbose_name_plural = _('интервалы работы')
+        ordering = ['restaurant', 'weekday', 'opens']
+        indexes = [
+            # "открыто в момент T": weekday = ? AND opens <= T AND closes >= T + N
+            models.Index(fields=['weekday', 'opens', 'closes', 'restaurant'], name='opening_weekday_time_idx'),
+        ]
+        constraints = [
+            models.CheckConstraint(condition=Q(opens__lt=F('closes')), name='opening_interval_not_empty'),
+        ]
+
+    def __str__(self):
+        return f'{self.restaurant_id}: {self.get_weekday_display()} {self.opens}-{self.closes}'
+
 class RestaurantDocument(models.Model):
     """Модель для документов ресторана"""
     restaurant = models.ForeignKey(Restaurant, on_delete=models.CASCADE, related_name='documents')
@@ -102,7 +159,7 @@ class RestaurantDocument(models.Model):
     def __str__(self):
         return self.title
 
-class Table(models.Model):
+class Table(TrackedFieldsMixin, models.Model):
     restaurant = models.ForeignKey(Restaurant, on_delete=models.CASCADE, related_name='tables')
     table_number = models.CharField(max_length=10, verbose_name=_('номер столика'))
     capacity = models.IntegerField(verbose_name=_('вместимость'))
@@ -112,12 +169,15 @@ class Table(models.Model):
     available = AvailableTableManager()
     
     # ✅ ДОБАВЛЕНО: История изменений
-    history = HistoricalRecords()
+    history = BufferedHistoricalRecords()
 
     class Meta:
         verbose_name = _('столик')
         verbose_name_plural = _('столики')
         ordering = ['table_number']
+        indexes = [
+            models.Index(fields=['restaurant', 'capacity'], name='table_restaurant_capacity_idx'),
+        ]
 
     def __str__(self):
         return f"Столик {self.table_number}"
@@ -125,29 +185,64 @@ class Table(models.Model):
     def get_absolute_url(self):
         return reverse('restaurant_detail', kwargs={'restaurant_id': self.restaurant.id})
 
-class Reservation(models.Model):
+class Reservation(TrackedFieldsMixin, models.Model):
     STATUS_CHOICES = [
         ('confirmed', _('Подтверждено')),
         ('pending', _('Ожидание')),
         ('cancelled', _('Отменено')),
     ]
+    ACTIVE_STATUSES = ACTIVE_RESERVATION_STATUSES
+
+    DURATION_CHOICES = [
+        (60, _('1 час')),
+        (90, _('1,5 часа')),
+        (120, _('2 часа')),
+        (180, _('3 часа')),
+        (240, _('4 часа')),
+    ]
+    DEFAULT_DURATION = 120
+
+    # ArchivedReservation.archived = True: в общей истории броней шаблон их различает
+    archived = False
     
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='user_reservations')
     table = models.ForeignKey(Table, on_delete=models.CASCADE, related_name='reservations')
     reservation_date = models.DateField(verbose_name=_('дата бронирования'))
     reservation_time = models.TimeField(verbose_name=_('время бронирования'))
+    duration = models.PositiveSmallIntegerField(choices=DURATION_CHOICES, default=DEFAULT_DURATION, verbose_name=_('длительность (мин.)'))
     guests_count = models.IntegerField(verbose_name=_('количество гостей'))
     special_requests = models.TextField(blank=True, verbose_name=_('особые пожелания'))
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', verbose_name=_('статус'))
     created_at = models.DateTimeField(default=timezone.now, verbose_name=_('дата создания'))
     
     # ✅ ДОБАВЛЕНО: История изменений
-    history = HistoricalRecords()
+    history = BufferedHistoricalRecords()
 
     class Meta:
         verbose_name = _('бронирование')
         verbose_name_plural = _('бронирования')
         ordering = ['-reservation_date', '-reservation_time']
+        constraints = [
+            # Два активных бронирования одного столика на одно время невозможны
+            models.UniqueConstraint(
+                fields=['table', 'reservation_date', 'reservation_time'],
+                condition=Q(status__in=ACTIVE_RESERVATION_STATUSES),
+                name='unique_active_reservation_slot',
+            ),
+        ]
+        indexes = [
+            # Проверка занятости: столик + дата + статус
+            models.Index(fields=['table', 'reservation_date', 'status'], name='res_table_date_status_idx'),
+            # Брони пользователя в порядке Meta.ordering
+            models.Index(fields=['user', '-reservation_date', '-reservation_time'], name='res_user_date_idx'),
+            models.Index(fields=['-reservation_date', '-reservation_time'], name='res_date_time_idx'),
+            # Только активные брони: предстоящие и популярность
+            models.Index(
+                fields=['reservation_date', 'reservation_time'],
+                condition=Q(status__in=ACTIVE_RESERVATION_STATUSES),
+                name='res_active_date_idx',
+            ),
+        ]
 
     def __str__(self):
         return f"Бронь #{self.id}"
@@ -158,4 +253,162 @@ class Reservation(models.Model):
     def can_edit(self, user):
         if not user or not user.is_authenticated:
             return False
-        return user.is_staff or user == self.user
\ No newline at end of file
+        return user.is_staff or user == self.user
+
+
+class ArchivedReservation(models.Model):
+    """Бронь старше горизонта архивации (restaurant/archive.py).
+
+    Те же поля и id, что у Reservation, без истории и ограничений -
+    архив только читается.
+    """
+    archived = True
+
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_reservations')
+    table = models.ForeignKey(Table, on_delete=models.CASCADE, related_name='archived_reservations')
+    reservation_date = models.DateField(verbose_name=_('дата бронирования'))
+    reservation_time = models.TimeField(verbose_name=_('время бронирования'))
+    duration = models.PositiveSmallIntegerField(choices=Reservation.DURATION_CHOICES, default=Reservation.DEFAULT_DURATION, verbose_name=_('длительность (мин.)'))
+    guests_count = models.IntegerField(verbose_name=_('количество гостей'))
+    special_requests = models.TextField(blank=True, verbose_name=_('особые пожелания'))
+    status = models.CharField(max_length=20, choices=Reservation.STATUS_CHOICES, verbose_name=_('статус'))
+    created_at = models.DateTimeField(verbose_name=_('дата создания'))
+    archived_at = models.DateTimeField(default=timezone.now, verbose_name=_('дата архивации'))
+
+    class Meta:
+        verbose_name = _('архивное бронирование')
+        verbose_name_plural = _('архив бронирований')
+        ordering = ['-reservation_date', '-reservation_time']
+        indexes = [
+            models.Index(fields=['user', '-reservation_date', '-reservation_time'], name='archive_user_date_idx'),
+            models.Index(fields=['table', 'reservation_date'], name='archive_table_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"Бронь #{self.id} (архив)"
+
+class WaitlistEntry(models.Model):
+    """Заявка в листе ожидания: занятое время в ресторане (restaurant/waitlist.py).
+
+    Очередь - по ресторану и дате; подойдёт любой столик ресторана
+    вместимостью не меньше guests_count с началом в окне
+    reservation_time ± flexibility.
+    """
+    STATUS_CHOICES = [
+        ('waiting', _('В очереди')),
+        ('assigned', _('Столик назначен')),
+        ('expired', _('Истекла')),
+        ('cancelled', _('Отменена')),
+    ]
+    FLEXIBILITY_CHOICES = [
+        (0, _('Только в это время')),
+        (30, _('± 30 минут')),
+        (60, _('± 1 час')),
+        (120, _('± 2 часа')),
+    ]
+    DEFAULT_FLEXIBILITY = 30
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='waitlist_entries')
+    restaurant = models.ForeignKey(Restaurant, on_delete=models.CASCADE, related_name='waitlist_entries')
+    reservation_date = models.DateField(verbose_name=_('дата бронирования'))
+    reservation_time = models.TimeField(verbose_name=_('желаемое время'))
+    flexibility = models.PositiveSmallIntegerField(choices=FLEXIBILITY_CHOICES, default=DEFAULT_FLEXIBILITY, verbose_name=_('подойдёт время'))
+    duration = models.PositiveSmallIntegerField(choices=Reservation.DURATION_CHOICES, default=Reservation.DEFAULT_DURATION, verbose_name=_('длительность (мин.)'))
+    guests_count = models.IntegerField(verbose_name=_('количество гостей'))
+    special_requests = models.TextField(blank=True, verbose_name=_('особые пожелания'))
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='waiting', verbose_name=_('статус'))
+    # бронь, созданная при назначении столика
+    reservation = models.OneToOneField(Reservation, on_delete=models.SET_NULL, null=True, blank=True, related_name='waitlist_entry', verbose_name=_('бронь'))
+    created_at = models.DateTimeField(default=timezone.now, verbose_name=_('дата создания'))
+    assigned_at = models.DateTimeField(null=True, blank=True, verbose_name=_('назначено'))
+
+    class Meta:
+        verbose_name = _('заявка в листе ожидания')
+        verbose_name_plural = _('лист ожидания')
+        ordering = ['created_at', 'id']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'restaurant', 'reservation_date', 'reservation_time'],
+                condition=Q(status='waiting'),
+                name='unique_waiting_entry',
+            ),
+        ]
+        indexes = [
+            # очередь ресторана на дату: только ожидающие
+            models.Index(
+                fields=['restaurant', 'reservation_date', 'guests_count'],
+                condition=Q(status='waiting'),
+                name='waitlist_queue_idx',
+            ),
+            models.Index(fields=['user', 'status'], name='waitlist_user_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"Заявка #{self.id}: {self.restaurant_id}, {self.reservation_date} {self.reservation_time}"
+
+class ReservationCounter(models.Model):
+    """Количество активных броней ресторана на дату (обновляется инкрементально)"""
+    restaurant = models.ForeignKey(Restaurant, on_delete=models.CASCADE, related_name='reservation_counters')
+    date = models.DateField(verbose_name=_('дата'))
+    count = models.IntegerField(default=0, verbose_name=_('количество броней'))
+
+    class Meta:
+        verbose_name = _('счётчик броней')
+        verbose_name_plural = _('счётчики броней')
+        constraints = [
+            models.UniqueConstraint(fields=['restaurant', 'date'], name='unique_restaurant_counter_date'),
+        ]
+
+    def __str__(self):
+        return f"{self.restaurant_id}: {self.date} - {self.count}"
+
+
+class RestaurantPopularity(models.Model):
+    """Скользящая сумма броней за неделю - рейтинг популярных ресторанов"""
+    restaurant = models.OneToOneField(Restaurant, on_delete=models.CASCADE, primary_key=True, related_name='popularity')
+    week_count = models.IntegerField(default=0, verbose_name=_('броней за неделю'))
+    updated_at = models.DateTimeField(auto_now=True, verbose_name=_('обновлено'))
+
+    class Meta:
+        verbose_name = _('популярность ресторана')
+        verbose_name_plural = _('популярность ресторанов')
+        indexes = [
+            models.Index(fields=['-week_count'], name='popularity_week_count_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.restaurant_id}: {self.week_count}"
+
+
+class ReportJob(models.Model):
+    """Задание на PDF-отчёт (reports.py) - общее для всех процессов сервера.
+
+    id - хеш содержимого отчёта; готовность определяется по файлу в
+    REPORTS_ROOT, здесь - вид отчёта, ошибка и время запуска.
+    """
+    STATUS_CHOICES = [
+        ('pending', _('Формируется')),
+        ('ready', _('Готов')),
+        ('failed', _('Ошибка')),
+    ]
+    KIND_CHOICES = [
+        ('pdf', _('PDF')),
+        ('merged', _('Общий PDF')),
+        ('zip', _('ZIP-архив')),
+    ]
+
+    id = models.CharField(max_length=32, primary_key=True)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES, verbose_name=_('вид'))
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending', verbose_name=_('статус'))
+    count = models.PositiveIntegerField(verbose_name=_('ресторанов'))
+    filename = models.CharField(max_length=100, verbose_name=_('имя файла'))
+    error = models.TextField(blank=True, verbose_name=_('ошибка'))
+    started_at = models.DateTimeField(default=timezone.now, verbose_name=_('запущено'))
+
+    class Meta:
+        verbose_name = _('отчёт')
+        verbose_name_plural = _('отчёты')
+
+    def __str__(self):
+        return f"{self.filename}: {self.status}"
@@ -0,0 +1,289 @@
+"""Keyset (курсорная) пагинация.
+
+Вместо OFFSET страница выбирается условием "строго после последней
+строки предыдущей страницы" по уникальной сортировке, например
+(name, id) или (reservation_date, reservation_time, id). Такой запрос
+идёт по индексу и одинаково быстр на любой глубине. COUNT(*) не
+выполняется, если общее количество не запрошено явно.
+
+Поля сортировки должны быть NOT NULL.
+"""
+import asyncio
+import base64
+import json
+from operator import attrgetter
+from urllib.parse import urlencode
+
+from django.core.exceptions import FieldDoesNotExist
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from rest_framework.pagination import BasePagination
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+from .utils import alist, resolved
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def unique_ordering(queryset):
+    """Сортировка queryset'а, дополненная id для однозначности"""
+    ordering = list(queryset.query.order_by) or list(queryset.model._meta.ordering)
+    if not all(isinstance(field, str) for field in ordering):
+        raise ValueError('Keyset-пагинация поддерживает только сортировку по полям')
+    names = [field.lstrip('-') for field in ordering]
+    if 'id' not in names and 'pk' not in names:
+        descending = bool(ordering) and ordering[-1].startswith('-')
+        ordering.append('-id' if descending else 'id')
+    return ordering
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor, previous_cursor, count=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.count = count
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    def __init__(self, queryset, per_page, ordering=None):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = list(ordering) if ordering else unique_ordering(queryset)
+        self.fields = [(field.lstrip('-'), field.startswith('-')) for field in self.ordering]
+
+    # Курсор: base64(JSON) со значениями полей сортировки и направлением
+
+    def encode_cursor(self, obj, backwards=False):
+        values = [getattr(obj, name) for name, _desc in self.fields]
+        payload = json.dumps({'v': values, 'b': backwards}, cls=DjangoJSONEncoder)
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+            values = payload['v']
+            if len(values) != len(self.fields):
+                raise ValueError
+            return [self.to_python(name, value) for (name, _desc), value in zip(self.fields, values)], bool(payload['b'])
+        except (ValueError, KeyError, TypeError):
+            raise InvalidCursor(cursor)
+
+    def to_python(self, name, value):
+        try:
+            field = self.queryset.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            # аннотация (например, ранг поиска) - значение как есть
+            return value
+        try:
+            return field.to_python(value)
+        except Exception:
+            raise ValueError(value)
+
+    def keyset_filter(self, values, backwards):
+        """(a, b, c) > (va, vb, vc) с учётом направления каждого поля"""
+        condition = Q()
+        equal = Q()
+        for (name, desc), value in zip(self.fields, values):
+            after = desc == backwards  # по возрастанию вперёд - "больше"
+            lookup = f'{name}__gt' if after else f'{name}__lt'
+            condition |= equal & Q(**{lookup: value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def page(self, cursor=None, with_count=False):
+        queryset, values, backwards = self.page_queryset(cursor)
+        rows = list(queryset)
+        count = self.queryset.count() if with_count else None
+        return self.build_page(rows, values, backwards, count)
+
+    async def apage(self, cursor=None, with_count=False):
+        """page() через асинхронный ORM; строки и количество - параллельно"""
+        queryset, values, backwards = self.page_queryset(cursor)
+        rows, count = await asyncio.gather(
+            alist(queryset),
+            self.queryset.acount() if with_count else resolved(),
+        )
+        return self.build_page(rows, values, backwards, count)
+
+    def page_queryset(self, cursor, queryset=None):
+        """(запрос страницы с лишней строкой, значения курсора, назад ли)"""
+        values, backwards = (None, False)
+        if cursor:
+            values, backwards = self.decode_cursor(cursor)
+
+        ordering = self.ordering
+        if backwards:
+            ordering = [f[1:] if f.startswith('-') else f'-{f}' for f in ordering]
+        queryset = (self.queryset if queryset is None else queryset).order_by(*ordering)
+        if values is not None:
+            queryset = queryset.filter(self.keyset_filter(values, backwards))
+        return queryset[:self.per_page + 1], values, backwards
+
+    def build_page(self, rows, values, backwards, count):
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+            has_next, has_previous = bool(rows), has_more
+        else:
+            has_next, has_previous = has_more, values is not None
+
+        next_cursor = self.encode_cursor(rows[-1]) if has_next and rows else None
+        previous_cursor = self.encode_cursor(rows[0], backwards=True) if has_previous and rows else None
+        return KeysetPage(rows, next_cursor, previous_cursor, count)
+
+
+class MergedKeysetPaginator(KeysetPaginator):
+    """Keyset-пагинация по нескольким querysets с общими полями сортировки.
+
+    Из каждого берётся страница с лишней строкой по тому же курсору,
+    строки сливаются в Python. Нужна уникальность id между querysets
+    (рабочая таблица броней и архив).
+    """
+
+    def __init__(self, querysets, per_page, ordering=None):
+        super().__init__(querysets[0], per_page, ordering)
+        self.querysets = list(querysets)
+
+    def page(self, cursor=None, with_count=False):
+        rows = []
+        for queryset in self.querysets:
+            page_queryset, values, backwards = self.page_queryset(cursor, queryset)
+            rows.extend(page_queryset)
+        # устойчивая сортировка с конца: по каждому полю в своём направлении
+        for name, desc in reversed(self.fields):
+            rows.sort(key=attrgetter(name), reverse=desc != backwards)
+        count = sum(queryset.count() for queryset in self.querysets) if with_count else None
+        return self.build_page(rows[:self.per_page + 1], values, backwards, count)
+
+    def first_page(self, rows):
+        """Первая страница из уже выбранных строк (до per_page + 1, в порядке сортировки)"""
+        return self.build_page(list(rows[:self.per_page + 1]), None, False, None)
+
+
+def page_url(request, cursor):
+    """Ссылка на страницу для HTML-шаблонов"""
+    params = request.GET.copy()
+    params.pop('cursor', None)
+    if cursor:
+        params['cursor'] = cursor
+    return '?' + urlencode(params, doseq=True) if params else request.path
+
+
+def paginate(request, queryset, per_page):
+    """Страница для HTML-представлений; неверный курсор - первая страница.
+
+    Список querysets - общая лента из нескольких (MergedKeysetPaginator).
+    """
+    if isinstance(queryset, (list, tuple)):
+        paginator = MergedKeysetPaginator(queryset, per_page)
+    else:
+        paginator = KeysetPaginator(queryset, per_page)
+    try:
+        page = paginator.page(request.GET.get('cursor'), with_count=bool(request.GET.get('count')))
+    except InvalidCursor:
+        page = paginator.page()
+    return with_urls(request, page)
+
+
+async def apaginate(request, queryset, per_page):
+    """paginate() для асинхронных представлений"""
+    paginator = KeysetPaginator(queryset, per_page)
+    try:
+        page = await paginator.apage(request.GET.get('cursor'), with_count=bool(request.GET.get('count')))
+    except InvalidCursor:
+        page = await paginator.apage()
+    return with_urls(request, page)
+
+
+def with_urls(request, page):
+    page.next_url = page_url(request, page.next_cursor) if page.has_next() else None
+    page.previous_url = page_url(request, page.previous_cursor) if page.has_previous() else None
+    return page
+
+
+class KeysetPagination(BasePagination):
+    """Курсорная пагинация для /api/*. Количество - только по ?count=true"""
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+
+    def get_page_size(self, request):
+        """?page_size= в пределах max_page_size, иначе PAGE_SIZE из настроек DRF"""
+        if self.page_size_query_param:
+            try:
+                size = int(request.query_params[self.page_size_query_param])
+            except (KeyError, ValueError):
+                pass
+            else:
+                if size > 0:
+                    return min(size, self.max_page_size) if self.max_page_size else size
+        return self.page_size
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+        paginator = KeysetPaginator(queryset, page_size)
+        with_count = request.query_params.get(self.count_query_param, '').lower() in ('1', 'true')
+        try:
+            self.page = paginator.page(request.query_params.get(self.cursor_query_param), with_count)
+        except InvalidCursor:
+            raise NotFound('Неверный курсор')
+        return list(self.page)
+
+    def get_link(self, cursor):
+        if cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        payload = {
+            'next': self.get_link(self.page.next_cursor),
+            'previous': self.get_link(self.page.previous_cursor),
+        }
+        if self.page.count is not None:
+            payload['count'] = self.page.count
+        payload['results'] = data
+        return Response(payload)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'count': {'type': 'integer'},
+                'results': schema,
+            },
+        }
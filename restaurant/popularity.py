@@ -0,0 +1,144 @@
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.db.models import Count, F, Sum
+from django.utils import timezone
+
+from .models import Restaurant, Reservation, ReservationCounter, RestaurantPopularity
+
+# Окно рейтинга: брони с датой не раньше недели назад (в т.ч. будущие)
+WINDOW_DAYS = 7
+
+
+def window_start(today=None):
+    return (today or timezone.now().date()) - timedelta(days=WINDOW_DAYS)
+
+
+def record(restaurant_id, date, delta):
+    """Изменить счётчики ресторана на delta броней на дату"""
+    counter, _ = ReservationCounter.objects.get_or_create(restaurant_id=restaurant_id, date=date)
+    ReservationCounter.objects.filter(pk=counter.pk).update(count=F('count') + delta)
+
+    if date >= window_start():
+        popularity, _ = RestaurantPopularity.objects.get_or_create(restaurant_id=restaurant_id)
+        RestaurantPopularity.objects.filter(pk=popularity.pk).update(
+            week_count=F('week_count') + delta, updated_at=timezone.now()
+        )
+
+
+def contribution(status, date, restaurant_id):
+    """Во что бронь превращается в счётчиках: (ресторан, дата) или None"""
+    if status in Reservation.ACTIVE_STATUSES:
+        return (restaurant_id, date)
+    return None
+
+
+def apply_change(before, after):
+    """Перенести вклад брони из состояния before в after"""
+    if before == after:
+        return
+    if before is not None:
+        record(before[0], before[1], -1)
+    if after is not None:
+        record(after[0], after[1], 1)
+
+
+def apply_bulk(changes):
+    """apply_change для пачки броней.
+
+    Дельты суммируются по (ресторан, дата); недостающие счётчики
+    создаются одним bulk_create, а обновления группируются по величине
+    дельты - число запросов не зависит от размера пачки.
+    """
+    deltas = Counter()
+    for before, after in changes:
+        if before == after:
+            continue
+        if before is not None:
+            deltas[before] -= 1
+        if after is not None:
+            deltas[after] += 1
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    ReservationCounter.objects.bulk_create(
+        [ReservationCounter(restaurant_id=restaurant_id, date=date) for restaurant_id, date in deltas],
+        ignore_conflicts=True,
+    )
+    counters = ReservationCounter.objects.filter(
+        restaurant_id__in={key[0] for key in deltas}, date__in={key[1] for key in deltas}
+    ).values_list('restaurant_id', 'date', 'pk')
+    _add_grouped(ReservationCounter.objects, 'count', {
+        pk: deltas[(restaurant_id, date)] for restaurant_id, date, pk in counters if (restaurant_id, date) in deltas
+    })
+
+    start = window_start()
+    weekly = Counter()
+    for (restaurant_id, date), delta in deltas.items():
+        if date >= start:
+            weekly[restaurant_id] += delta
+    weekly = {restaurant_id: delta for restaurant_id, delta in weekly.items() if delta}
+    if weekly:
+        RestaurantPopularity.objects.bulk_create(
+            [RestaurantPopularity(restaurant_id=restaurant_id) for restaurant_id in weekly],
+            ignore_conflicts=True,
+        )
+        _add_grouped(RestaurantPopularity.objects, 'week_count', weekly, updated_at=timezone.now())
+
+
+def _add_grouped(manager, field, deltas, **extra):
+    """field += delta для {pk: delta}, один UPDATE на каждое значение delta"""
+    groups = defaultdict(list)
+    for pk, delta in deltas.items():
+        groups[delta].append(pk)
+    for delta, pks in groups.items():
+        manager.filter(pk__in=pks).update(**{field: F(field) + delta}, **extra)
+
+
+def top_restaurants(count):
+    """Топ-N популярных ресторанов - чтение N строк по индексу"""
+    return Restaurant.objects.filter(
+        popularity__week_count__gt=0
+    ).annotate(
+        reservation_count=F('popularity__week_count')
+    ).order_by('-popularity__week_count')[:count]
+
+
+def rollup(today=None, rebuild=False):
+    """Плановый пересчёт рейтинга.
+
+    Сдвигает недельное окно: сумма за неделю пересчитывается по дневным
+    счётчикам. С rebuild=True дневные счётчики сначала строятся заново
+    по таблице броней (восстановление после ручных правок в БД).
+    """
+    if rebuild:
+        ReservationCounter.objects.all().delete()
+        rows = Reservation.objects.filter(
+            status__in=Reservation.ACTIVE_STATUSES
+        ).values('table__restaurant_id', 'reservation_date').annotate(total=Count('id')).order_by()
+        ReservationCounter.objects.bulk_create([
+            ReservationCounter(restaurant_id=row['table__restaurant_id'],
+                               date=row['reservation_date'], count=row['total'])
+            for row in rows
+        ], batch_size=500)
+
+    totals = dict(ReservationCounter.objects.filter(
+        date__gte=window_start(today)
+    ).values_list('restaurant_id').annotate(total=Sum('count')).order_by())
+
+    existing = {p.restaurant_id: p for p in RestaurantPopularity.objects.all()}
+    now = timezone.now()
+    to_update, to_create = [], []
+    for restaurant_id in set(existing) | set(totals):
+        week_count = totals.get(restaurant_id, 0)
+        popularity = existing.get(restaurant_id)
+        if popularity is None:
+            to_create.append(RestaurantPopularity(restaurant_id=restaurant_id, week_count=week_count))
+        elif popularity.week_count != week_count:
+            popularity.week_count = week_count
+            popularity.updated_at = now
+            to_update.append(popularity)
+    RestaurantPopularity.objects.bulk_create(to_create, batch_size=500)
+    RestaurantPopularity.objects.bulk_update(to_update, ['week_count', 'updated_at'], batch_size=500)
+    return len(to_create) + len(to_update)
@@ -0,0 +1,317 @@
+"""Профилирование запросов: время ответа, SQL, N+1, рендер шаблонов.
+
+Включается настройкой PROFILING_ENABLED. Выключенный ProfilingMiddleware
+бросает MiddlewareNotUsed и Django убирает его из цепочки - накладных
+расходов нет. Включённый для каждого запроса записывает имя
+представления, общее время, число и суммарное время SQL-запросов,
+дубли (тот же SQL с теми же параметрами) и похожие запросы (тот же SQL
+с разными параметрами - признак N+1), а также время рендера шаблонов.
+
+Метрики агрегируются в памяти процесса (REGISTRY) в гистограммы по
+представлениям и отдаются эндпоинтом /metrics/ (Prometheus или JSON) и
+командой manage.py profiling_report. При нескольких воркерах у каждого
+процесса свои гистограммы - Prometheus суммирует их сам.
+"""
+import contextvars
+import threading
+import time
+from collections import Counter
+from inspect import iscoroutinefunction
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed, PermissionDenied
+from django.db import connections
+from django.http import HttpResponse, JsonResponse
+from django.template import base as template_base
+from django.utils.decorators import sync_and_async_middleware
+
+# Границы корзин гистограмм
+TIME_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)  # мс
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 30, 50, 100)
+
+# Сколько одинаковых по SQL запросов за один запрос считаем N+1
+SIMILAR_THRESHOLD = 5
+
+# Сколько примеров подозрительного SQL хранить на представление
+MAX_EXAMPLES = 5
+
+_current = contextvars.ContextVar('profiling_request', default=None)
+
+
+def enabled():
+    return getattr(settings, 'PROFILING_ENABLED', False)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последняя - +Inf
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            index = len(self.buckets)
+        self.counts[index] += 1
+        self.total += value
+        self.count += 1
+
+    def cumulative(self):
+        """[(граница, число наблюдений <= границы)] как в Prometheus"""
+        result, running = [], 0
+        for bound, count in zip(list(self.buckets) + ['+Inf'], self.counts):
+            running += count
+            result.append((bound, running))
+        return result
+
+    def quantile(self, q):
+        """Оценка квантиля по верхней границе корзины"""
+        if not self.count:
+            return 0
+        target = q * self.count
+        for bound, running in self.cumulative():
+            if running >= target:
+                return bound if bound != '+Inf' else self.buckets[-1]
+        return self.buckets[-1]
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'sum': round(self.total, 3),
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'buckets': {str(bound): count for bound, count in self.cumulative()},
+        }
+
+
+class ViewStats:
+    def __init__(self):
+        self.duration = Histogram(TIME_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.sql_time = Histogram(TIME_BUCKETS)
+        self.template_time = Histogram(TIME_BUCKETS)
+        self.duplicate_queries = 0
+        self.similar_queries = 0
+        self.n_plus_one_requests = 0
+        self.max_queries = 0
+        self.examples = Counter()
+
+    def add(self, record):
+        self.duration.observe(record.duration)
+        self.queries.observe(len(record.queries))
+        self.sql_time.observe(record.sql_time)
+        self.template_time.observe(record.template_time)
+        duplicates, similar = record.repeated()
+        self.duplicate_queries += duplicates
+        self.similar_queries += sum(count for count in similar.values())
+        if similar:
+            self.n_plus_one_requests += 1
+        self.max_queries = max(self.max_queries, len(record.queries))
+        for sql, count in similar.items():
+            self.examples[sql] = max(self.examples[sql], count)
+        for sql, _ in self.examples.most_common()[MAX_EXAMPLES:]:
+            del self.examples[sql]
+
+    def as_dict(self):
+        return {
+            'requests': self.duration.count,
+            'duration_ms': self.duration.as_dict(),
+            'queries': self.queries.as_dict(),
+            'sql_ms': self.sql_time.as_dict(),
+            'template_ms': self.template_time.as_dict(),
+            'max_queries': self.max_queries,
+            'duplicate_queries': self.duplicate_queries,
+            'similar_queries': self.similar_queries,
+            'n_plus_one_requests': self.n_plus_one_requests,
+            'n_plus_one_examples': [
+                {'sql': sql, 'count': count} for sql, count in self.examples.most_common()
+            ],
+        }
+
+
+class Registry:
+    """Гистограммы по представлениям (потокобезопасно)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+
+    def add(self, record):
+        with self.lock:
+            stats = self.views.get(record.view)
+            if stats is None:
+                stats = self.views[record.view] = ViewStats()
+            stats.add(record)
+
+    def reset(self):
+        with self.lock:
+            self.views = {}
+
+    def as_dict(self):
+        with self.lock:
+            return {view: stats.as_dict() for view, stats in sorted(self.views.items())}
+
+    def prometheus(self):
+        """Метрики в текстовом формате Prometheus"""
+        lines = []
+        with self.lock:
+            views = sorted(self.views.items())
+            for name, attr, help_text in (
+                ('restobook_request_duration_ms', 'duration', 'Время ответа, мс'),
+                ('restobook_request_queries', 'queries', 'SQL-запросов на запрос'),
+                ('restobook_request_sql_ms', 'sql_time', 'Время SQL на запрос, мс'),
+                ('restobook_request_template_ms', 'template_time', 'Время рендера шаблонов, мс'),
+            ):
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} histogram')
+                for view, stats in views:
+                    histogram = getattr(stats, attr)
+                    for bound, count in histogram.cumulative():
+                        lines.append(f'{name}_bucket{{view="{view}",le="{bound}"}} {count}')
+                    lines.append(f'{name}_sum{{view="{view}"}} {histogram.total:.3f}')
+                    lines.append(f'{name}_count{{view="{view}"}} {histogram.count}')
+            for name, attr, help_text in (
+                ('restobook_duplicate_queries_total', 'duplicate_queries', 'Повторы одинаковых запросов'),
+                ('restobook_similar_queries_total', 'similar_queries', 'Похожие запросы (N+1)'),
+                ('restobook_n_plus_one_requests_total', 'n_plus_one_requests', 'Запросы с признаками N+1'),
+            ):
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} counter')
+                for view, stats in views:
+                    lines.append(f'{name}{{view="{view}"}} {getattr(stats, attr)}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class RequestRecord:
+    """Замеры одного HTTP-запроса"""
+
+    def __init__(self):
+        self.view = '<unresolved>'
+        self.duration = 0.0
+        self.queries = []  # (sql, params, мс)
+        self.template_time = 0.0
+        self.template_depth = 0
+
+    @property
+    def sql_time(self):
+        return sum(duration for _sql, _params, duration in self.queries)
+
+    def repeated(self):
+        """(лишних повторов с теми же параметрами, похожие {sql: n})"""
+        exact = Counter((sql, repr(params)) for sql, params, _ in self.queries)
+        by_sql = Counter(sql for sql, _params, _ in self.queries)
+        duplicates = sum(count - 1 for count in exact.values())
+        similar = {sql: count for sql, count in by_sql.items() if count >= SIMILAR_THRESHOLD}
+        return duplicates, similar
+
+    def execute(self, execute, sql, params, many, context):
+        """connection.execute_wrapper: время каждого SQL-запроса"""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, params, (time.perf_counter() - start) * 1000))
+
+
+_original_render = template_base.Template.render
+
+
+def _profiled_render(self, context):
+    record = _current.get()
+    if record is None:
+        return _original_render(self, context)
+    # вложенные {% include %} уже входят во время внешнего шаблона
+    record.template_depth += 1
+    start = time.perf_counter()
+    try:
+        return _original_render(self, context)
+    finally:
+        record.template_depth -= 1
+        if not record.template_depth:
+            record.template_time += (time.perf_counter() - start) * 1000
+
+
+def install_template_timer():
+    template_base.Template.render = _profiled_render
+
+
+def _install(record):
+    """Перехват SQL на соединениях текущего потока"""
+    wrappers = [connection.execute_wrapper(record.execute) for connection in connections.all()]
+    for wrapper in wrappers:
+        wrapper.__enter__()
+    return wrappers
+
+
+def _uninstall(wrappers):
+    for wrapper in reversed(wrappers):
+        wrapper.__exit__(None, None, None)
+
+
+def _register(request, record, start):
+    record.duration = (time.perf_counter() - start) * 1000
+    match = getattr(request, 'resolver_match', None)
+    if match is not None:
+        record.view = match.view_name or match._func_path
+    REGISTRY.add(record)
+
+
+@sync_and_async_middleware
+def ProfilingMiddleware(get_response):
+    """Метрики запроса для синхронных и асинхронных представлений"""
+    if not enabled():
+        raise MiddlewareNotUsed()
+    install_template_timer()
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            record = RequestRecord()
+            token = _current.set(record)
+            start = time.perf_counter()
+            # соединения у каждого потока свои: перехват ставится в том
+            # потоке, где sync_to_async выполняет запросы к БД
+            wrappers = await sync_to_async(_install)(record)
+            try:
+                response = await get_response(request)
+            finally:
+                await sync_to_async(_uninstall)(wrappers)
+                _current.reset(token)
+            _register(request, record, start)
+            return response
+    else:
+        def middleware(request):
+            record = RequestRecord()
+            token = _current.set(record)
+            start = time.perf_counter()
+            wrappers = _install(record)
+            try:
+                response = get_response(request)
+            finally:
+                _uninstall(wrappers)
+                _current.reset(token)
+            _register(request, record, start)
+            return response
+    return middleware
+
+
+def metrics(request):
+    """Метрики профилирования: Prometheus-текст, ?format=json - JSON.
+
+    Доступ - сотрудникам или по токену PROFILING_TOKEN
+    (заголовок "Authorization: Bearer <токен>").
+    """
+    token = getattr(settings, 'PROFILING_TOKEN', '')
+    authorized = request.user.is_staff or (
+        token and request.headers.get('Authorization') == f'Bearer {token}'
+    )
+    if not authorized:
+        raise PermissionDenied
+    if request.GET.get('format') == 'json':
+        return JsonResponse(REGISTRY.as_dict(), json_dumps_params={'ensure_ascii': False, 'indent': 2})
+    return HttpResponse(REGISTRY.prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
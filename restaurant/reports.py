@@ -0,0 +1,182 @@
+"""Фоновая генерация PDF-отчётов по ресторанам.
+
+Данные отчёта собираются в запросе одним запросом к БД (рестораны +
+столики) и превращаются в словари; рендер идёт в пуле потоков или
+процессов (REPORT_EXECUTOR) вне потока запроса, брокер не нужен.
+
+Готовые файлы лежат в REPORTS_ROOT под именем - хешем содержимого
+(поля ресторана, столики, время изменения картинки), поэтому повторный
+отчёт по неизменённому ресторану отдаётся сразу, а любое изменение
+данных даёт новый файл. Состояние задания хранится в БД (ReportJob),
+поэтому страницу статуса может отдать любой процесс сервера. Задание,
+которое не завершилось за REPORT_TIMEOUT (процесс с пулом перезапущен,
+рендер завис), считается неудавшимся и по повторному запросу
+запускается заново.
+
+Виды отчётов: pdf (один ресторан), merged (все выбранные в одном PDF),
+zip (архив из PDF по каждому ресторану; отдельные PDF берутся из кэша).
+"""
+import hashlib
+import json
+import os
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Prefetch
+from django.utils import timezone
+
+from .models import ReportJob, Restaurant, Table
+from .utils import render_pdf, restaurant_report_data, write_atomic
+
+KINDS = ('pdf', 'merged', 'zip')
+EXTENSIONS = {'pdf': 'pdf', 'merged': 'pdf', 'zip': 'zip'}
+
+# Меняется при изменении вёрстки отчёта - старые файлы перестают подходить
+REPORT_VERSION = 1
+
+JOB_TTL = 60 * 60  # сколько хранить состояние задания, секунд
+TIMEOUT_MESSAGE = 'Отчёт не сформирован за отведённое время'
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def report_timeout():
+    return timedelta(seconds=getattr(settings, 'REPORT_TIMEOUT', 10 * 60))
+
+
+def reports_root():
+    return getattr(settings, 'REPORTS_ROOT', os.path.join(settings.MEDIA_ROOT, 'reports'))
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers = getattr(settings, 'REPORT_WORKERS', 2)
+            if getattr(settings, 'REPORT_EXECUTOR', 'thread') == 'process':
+                _executor = ProcessPoolExecutor(max_workers=workers)
+            else:
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='reports')
+        return _executor
+
+
+def content_hash(*parts):
+    payload = json.dumps([REPORT_VERSION, *parts], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()[:32]
+
+
+def report_documents(restaurant_ids):
+    """Данные отчётов по ресторанам - два запроса на любую выборку"""
+    restaurants = Restaurant.objects.filter(pk__in=restaurant_ids).order_by('name', 'id').prefetch_related(
+        Prefetch('tables', queryset=Table.objects.order_by('table_number'))
+    )
+    return [restaurant_report_data(restaurant, restaurant.tables.all()) for restaurant in restaurants]
+
+
+def job_id(kind, documents):
+    if kind == 'pdf':
+        return content_hash(kind, documents[0])
+    return content_hash(kind, [content_hash('pdf', data) for data in documents])
+
+
+def report_path(job):
+    return os.path.join(reports_root(), f"{job['id']}.{EXTENSIONS[job['kind']]}")
+
+
+def build_report(kind, documents, path, root):
+    """Рендер отчёта в файл (выполняется в воркере; без обращений к БД)"""
+    if kind == 'zip':
+        parts = []
+        for data in documents:
+            part = os.path.join(root, f"{content_hash('pdf', data)}.pdf")
+            if not os.path.exists(part):
+                write_atomic(part, lambda output, data=data: render_pdf([data], output))
+            parts.append((data, part))
+
+        def write_zip(output):
+            with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as archive:
+                for data, part in parts:
+                    archive.write(part, f"restaurant_{data['id']}.pdf")
+        write_atomic(path, write_zip)
+    else:
+        write_atomic(path, lambda output: render_pdf(documents, output))
+    return path
+
+
+def request_report(restaurant_ids, kind='pdf'):
+    """Поставить отчёт в очередь; готовый отчёт из кэша возвращается сразу.
+
+    Возвращает описание задания: {'id', 'kind', 'status', 'count', ...};
+    status - 'ready', 'pending' или 'failed'.
+    """
+    if kind not in KINDS:
+        raise ValueError(kind)
+    documents = report_documents(restaurant_ids)
+    if not documents:
+        raise ValueError('Не выбрано ни одного ресторана')
+    if kind == 'pdf' and len(documents) > 1:
+        kind = 'merged'
+
+    job = {'id': job_id(kind, documents), 'kind': kind, 'count': len(documents)}
+    if len(documents) == 1:
+        job['filename'] = f"restaurant_{documents[0]['id']}.{EXTENSIONS[kind]}"
+    else:
+        job['filename'] = f"restaurants_{len(documents)}.{EXTENSIONS[kind]}"
+
+    path = report_path(job)
+    now = timezone.now()
+    ReportJob.objects.filter(started_at__lt=now - timedelta(seconds=JOB_TTL)).exclude(pk=job['id']).delete()
+    if os.path.exists(path):
+        job['status'] = 'ready'
+        ReportJob.objects.update_or_create(pk=job['id'], defaults=_fields(job, started_at=now))
+        return job
+
+    job['status'] = 'pending'
+    _record, created = ReportJob.objects.get_or_create(pk=job['id'], defaults=_fields(job, started_at=now))
+    # условный UPDATE атомарен - одинаковый отчёт не рендерится дважды
+    # параллельно, а зависшее задание перезапускается
+    if not created and not ReportJob.objects.filter(pk=job['id']).exclude(
+        status='pending', started_at__gte=now - report_timeout()
+    ).update(**_fields(job, started_at=now, error='')):
+        return get_job(job['id']) or job
+
+    future = get_executor().submit(build_report, kind, documents, path, reports_root())
+    future.add_done_callback(lambda done: _finish(job, done))
+    return job
+
+
+def _fields(job, **extra):
+    return dict({name: job[name] for name in ('kind', 'status', 'count', 'filename')}, **extra)
+
+
+def _finish(job, future):
+    """Ошибка рендера - в БД; успех виден по файлу отчёта"""
+    error = future.exception()
+    if error:
+        ReportJob.objects.filter(pk=job['id'], status='pending').update(status='failed', error=str(error))
+
+
+def get_job(report_id):
+    """Состояние задания или None; готовность проверяется по файлу на диске"""
+    record = ReportJob.objects.filter(pk=report_id).first()
+    if record is None:
+        return None
+    job = {
+        'id': record.pk, 'kind': record.kind, 'status': record.status,
+        'count': record.count, 'filename': record.filename, 'error': record.error,
+    }
+    if os.path.exists(report_path(job)):
+        return dict(job, status='ready')
+    if job['status'] == 'ready':
+        return None  # файл удалён - отчёт нужно запросить заново
+    if job['status'] == 'pending' and record.started_at < timezone.now() - report_timeout():
+        ReportJob.objects.filter(pk=report_id, status='pending', started_at=record.started_at).update(
+            status='failed', error=TIMEOUT_MESSAGE
+        )
+        return dict(job, status='failed', error=TIMEOUT_MESSAGE)
+    return job
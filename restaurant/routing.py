@@ -0,0 +1,224 @@
+"""Чтение с реплик и "липкость" к основной БД.
+
+Реплики - алиасы DATABASE_REPLICAS в DATABASES (см. settings.py). На
+реплику идут только чтения внутри HTTP-запросов с безопасным методом
+(GET/HEAD/OPTIONS): списки, карточки, поиск, GET к API. Всё остальное -
+на основную БД:
+
+- запись и всё, что прочитано после неё в том же запросе;
+- чтения внутри transaction.atomic (select_for_update в book_table);
+- представления с декоратором @primary_db (бронирование и отмена);
+- запросы клиента в течение REPLICA_STICKY_SECONDS после его записи
+  (кука), чтобы он увидел свою бронь, пока реплика догоняет;
+- команды, сигналы и фоновые потоки вне запроса.
+
+За один запрос используется одна реплика. Недоступная реплика
+пропускается до следующей проверки (REPLICA_HEALTH_INTERVAL).
+"""
+import random
+import sqlite3
+import threading
+import time as time_module
+from contextvars import ContextVar
+from functools import wraps
+from inspect import iscoroutinefunction
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.db.utils import ConnectionDoesNotExist
+from django.utils.decorators import sync_and_async_middleware
+
+STICKY_COOKIE = 'db_primary_until'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_state = ContextVar('db_routing', default=None)
+
+
+def replicas():
+    return list(getattr(settings, 'DATABASE_REPLICAS', ()))
+
+
+def sticky_seconds():
+    return getattr(settings, 'REPLICA_STICKY_SECONDS', 5)
+
+
+class RequestState:
+    """Маршрутизация одного запроса"""
+
+    def __init__(self, replica_allowed):
+        self.replica_allowed = replica_allowed
+        self.replica = None
+        self.wrote = False
+
+
+class ReplicaHealth:
+    """Доступность реплик; проверка - не чаще раза в REPLICA_HEALTH_INTERVAL секунд"""
+
+    def __init__(self):
+        self.status = {}  # алиас -> (доступна, время проверки)
+        self.lock = threading.Lock()
+
+    def interval(self):
+        return getattr(settings, 'REPLICA_HEALTH_INTERVAL', 10)
+
+    def is_healthy(self, alias):
+        ok, checked = self.status.get(alias, (None, 0.0))
+        if ok is not None and time_module.monotonic() - checked < self.interval():
+            return ok
+        with self.lock:
+            ok = self.check(alias)
+            self.status[alias] = (ok, time_module.monotonic())
+        return ok
+
+    def check(self, alias):
+        try:
+            with connections[alias].cursor() as cursor:
+                cursor.execute('SELECT 1')
+            return True
+        except (DatabaseError, ConnectionDoesNotExist):
+            return False
+
+
+health = ReplicaHealth()
+
+
+def pick_replica():
+    candidates = [alias for alias in replicas() if health.is_healthy(alias)]
+    return random.choice(candidates) if candidates else DEFAULT_DB_ALIAS
+
+
+class ReplicaRouter:
+    # Сессия создаётся на GET-запросе и читается следующим - реплика могла не догнать
+    PRIMARY_APPS = ('sessions',)
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or not state.replica_allowed or state.wrote:
+            return DEFAULT_DB_ALIAS
+        if model._meta.app_label in self.PRIMARY_APPS:
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        if state.replica is None:
+            state.replica = pick_replica()
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None and model._meta.app_label not in self.PRIMARY_APPS:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        pool = {DEFAULT_DB_ALIAS, *replicas()}
+        if obj1._state.db in pool and obj2._state.db in pool:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # реплики - копии основной БД, схема приходит вместе с данными
+        if db in replicas():
+            return False
+        return None
+
+
+def primary_db(view):
+    """Все запросы представления - к основной БД"""
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def wrapper(*args, **kwargs):
+            pin()
+            return await view(*args, **kwargs)
+    else:
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            pin()
+            return view(*args, **kwargs)
+    return wrapper
+
+
+def pin():
+    """Дальше в этом запросе - только основная БД"""
+    state = _state.get()
+    if state is not None:
+        state.replica_allowed = False
+
+
+def _sticky(request):
+    try:
+        return float(request.COOKIES.get(STICKY_COOKIE, 0)) > time_module.time()
+    except ValueError:
+        return False
+
+
+def _begin(request):
+    allowed = bool(replicas()) and request.method in SAFE_METHODS and not _sticky(request)
+    state = RequestState(allowed)
+    return state, _state.set(state)
+
+
+def _finish(request, response, state):
+    if replicas() and (state.wrote or request.method not in SAFE_METHODS):
+        seconds = sticky_seconds()
+        response.set_cookie(STICKY_COOKIE, str(time_module.time() + seconds), max_age=seconds,
+                            httponly=True, samesite='Lax')
+    return response
+
+
+@sync_and_async_middleware
+def ReplicaRoutingMiddleware(get_response):
+    """Включает чтение с реплик для безопасных запросов и ставит куку после записи"""
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            state, token = _begin(request)
+            try:
+                response = await get_response(request)
+            finally:
+                _state.reset(token)
+            return _finish(request, response, state)
+    else:
+        def middleware(request):
+            state, token = _begin(request)
+            try:
+                response = get_response(request)
+            finally:
+                _state.reset(token)
+            return _finish(request, response, state)
+    return middleware
+
+
+def sqlite_replica_path(alias):
+    """Файл SQLite-реплики (NAME вида file:путь?mode=ro) или None"""
+    config = connections[alias].settings_dict
+    if config['ENGINE'] != 'django.db.backends.sqlite3':
+        return None
+    name = str(config['NAME'])
+    if name.startswith('file:'):
+        name = name[len('file:'):].split('?', 1)[0]
+    return name
+
+
+def sync_sqlite_replicas():
+    """Копирует основную SQLite-БД в файлы реплик (backup API, без остановки чтения).
+
+    Возвращает [(алиас, путь)]; реплики на других движках пропускаются.
+    """
+    primary = connections[DEFAULT_DB_ALIAS]
+    if primary.vendor != 'sqlite':
+        return []
+    primary.ensure_connection()
+    synced = []
+    for alias in replicas():
+        path = sqlite_replica_path(alias)
+        if path is None:
+            continue
+        target = sqlite3.connect(path)
+        try:
+            primary.connection.backup(target)
+            # копия WAL-базы тоже в WAL, а его без записи -shm не открыть
+            target.execute('PRAGMA journal_mode=DELETE')
+        finally:
+            target.close()
+        health.status.pop(alias, None)
+        synced.append((alias, path))
+    return synced
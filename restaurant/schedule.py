@@ -0,0 +1,215 @@
+"""Часы работы ресторанов в разобранном виде.
+
+Restaurant.opening_hours - свободный текст ('10:00-22:00',
+'Пн-Пт 10:00-22:00; Сб-Вс 12:00-02:00', 'круглосуточно'). При сохранении
+ресторана строка разбирается в интервалы OpeningInterval: день недели
+и минуты [opens, closes). Интервал через полночь делится на два - до
+конца дня и с 00:00 следующего дня, поэтому "открыто в момент T" и
+"открыто ещё N минут после T" - запросы по индексу
+(weekday, opens, closes) без разбора строк.
+
+Нераспознанная строка даёт прежнее правило - ежедневно с DAY_START
+до DAY_END.
+"""
+import re
+from datetime import timedelta
+
+from django.db.models import Exists, OuterRef
+
+from .models import OpeningInterval
+
+MINUTES_IN_DAY = 24 * 60
+
+# Прежнее правило ReservationForm: 10:00-23:00
+DAY_START = 10 * 60
+DAY_END = 23 * 60
+
+_DAY_PATTERNS = [
+    r'пн|пон\w*|mon\w*|mo',
+    r'вт|вто\w*|tue\w*|tu',
+    r'ср|сре\w*|wed\w*|we',
+    r'чт|чет\w*|thu\w*|th',
+    r'пт|пят\w*|fri\w*|fr',
+    r'сб|суб\w*|sat\w*|sa',
+    r'вс|вос\w*|sun\w*|su',
+]
+_DAY = '|'.join(f'(?:{pattern})' for pattern in _DAY_PATTERNS)
+_TIME = r'(\d{1,2})[:.](\d{2})'
+_TOKEN_RE = re.compile(
+    rf'(?P<range>{_TIME}\s*[-–—]\s*{_TIME})'
+    rf'|(?P<days>\b(?:{_DAY})\b\.?(?:\s*[-–—]\s*\b(?:{_DAY})\b\.?)?)'
+    r'|(?P<closed>выходн\w*|закрыт\w*|closed)'
+    r'|(?P<always>круглосуточно|24\s*/\s*7|24\s*час\w*)',
+    re.IGNORECASE,
+)
+
+
+def _weekday(token):
+    token = token.strip(' .').lower()
+    for index, pattern in enumerate(_DAY_PATTERNS):
+        if re.fullmatch(pattern, token):
+            return index
+    raise ValueError(token)
+
+
+def _day_range(token):
+    parts = re.split(r'\s*[-–—]\s*', token.strip())
+    first = _weekday(parts[0])
+    last = _weekday(parts[-1])
+    return [(first + offset) % 7 for offset in range((last - first) % 7 + 1)]
+
+
+def _minutes(hours, minutes):
+    hours, minutes = int(hours), int(minutes)
+    if hours > 24 or minutes > 59 or (hours == 24 and minutes):
+        raise ValueError
+    return hours * 60 + minutes
+
+
+def _merge(intervals):
+    """Слить пересекающиеся и смежные интервалы одного дня"""
+    merged = []
+    for opens, closes in sorted(intervals):
+        if merged and opens <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], closes)
+        else:
+            merged.append([opens, closes])
+    return [tuple(interval) for interval in merged]
+
+
+def parse(text):
+    """Строка часов работы -> {день недели: [(opens, closes), ...]} или None.
+
+    Дни без упоминания закрыты, если в строке есть дни недели; строка из
+    одного интервала относится ко всем дням.
+    """
+    days = {weekday: [] for weekday in range(7)}
+    current, pending, seen_days, found = None, [], False, False
+    for match in _TOKEN_RE.finditer(text or ''):
+        if match.group('days'):
+            try:
+                pending.extend(_day_range(match.group('days')))
+            except ValueError:
+                return None
+            current, seen_days = None, True
+            continue
+        if pending:
+            current, pending = pending, []
+        targets = current if current is not None else range(7)
+        if match.group('closed'):
+            for weekday in targets:
+                days[weekday] = []
+            found = True
+        elif match.group('always'):
+            for weekday in targets:
+                days[weekday].append((0, MINUTES_IN_DAY))
+            found = True
+        else:
+            try:
+                opens = _minutes(match.group(2), match.group(3))
+                closes = _minutes(match.group(4), match.group(5))
+            except ValueError:
+                return None
+            if opens >= MINUTES_IN_DAY:
+                return None
+            for weekday in targets:
+                if closes > opens:
+                    days[weekday].append((opens, closes))
+                else:
+                    # через полночь: '18:00-02:00', '10:00-00:00'
+                    days[weekday].append((opens, MINUTES_IN_DAY))
+                    if closes:
+                        days[(weekday + 1) % 7].append((0, closes))
+            found = True
+    if not found or pending:
+        return None
+    if not seen_days and not any(days.values()):
+        return None
+    return {weekday: _merge(intervals) for weekday, intervals in days.items()}
+
+
+def parse_or_default(text):
+    return parse(text) or {weekday: [(DAY_START, DAY_END)] for weekday in range(7)}
+
+
+def build_intervals(restaurant_id, text):
+    return [
+        OpeningInterval(restaurant_id=restaurant_id, weekday=weekday, opens=opens, closes=closes)
+        for weekday, intervals in parse_or_default(text).items()
+        for opens, closes in intervals
+    ]
+
+
+def sync(restaurants):
+    """Пересобрать интервалы для ресторанов - два запроса на любое число"""
+    restaurants = list(restaurants)
+    if not restaurants:
+        return
+    OpeningInterval.objects.filter(restaurant__in=[r.pk for r in restaurants]).delete()
+    OpeningInterval.objects.bulk_create([
+        interval
+        for restaurant in restaurants
+        for interval in build_intervals(restaurant.pk, restaurant.opening_hours)
+    ])
+    for restaurant in restaurants:
+        # устаревший кэш prefetch_related('opening_intervals')
+        getattr(restaurant, '_prefetched_objects_cache', {}).pop('opening_intervals', None)
+
+
+def windows(restaurant, day):
+    """Интервалы работы на дату [(opens, closes)] в минутах.
+
+    Берутся из prefetch_related('opening_intervals'), если он сделан.
+    """
+    weekday = day.weekday()
+    return sorted(
+        (interval.opens, interval.closes)
+        for interval in restaurant.opening_intervals.all()
+        if interval.weekday == weekday
+    )
+
+
+def slot_starts(day_windows, duration, step):
+    """Допустимые начала брони: бронь целиком внутри одного интервала"""
+    starts = set()
+    for opens, closes in day_windows:
+        starts.update(range(opens, closes - duration + 1, step))
+    return sorted(starts)
+
+
+def is_open_for(restaurant, day, start, duration):
+    """Открыт ли ресторан на [start, start + duration) в минутах"""
+    end = start + duration
+    if end > MINUTES_IN_DAY:
+        # продолжение после полуночи - в интервале следующего дня с 00:00
+        return (is_open_for(restaurant, day, start, MINUTES_IN_DAY - start)
+                and is_open_for(restaurant, day + timedelta(days=1), 0, end - MINUTES_IN_DAY))
+    return any(opens <= start and end <= closes for opens, closes in windows(restaurant, day))
+
+
+def describe(day_windows):
+    """[(600, 1320)] -> '10:00–22:00'"""
+    def clock(minutes):
+        return f'{minutes // 60:02d}:{minutes % 60:02d}'
+    return ', '.join(f'{clock(opens)}–{clock(closes)}' for opens, closes in day_windows)
+
+
+def _interval_exists(weekday, **lookups):
+    return Exists(OpeningInterval.objects.filter(restaurant=OuterRef('pk'), weekday=weekday, **lookups))
+
+
+def open_at(queryset, moment, duration=0):
+    """Рестораны, открытые в момент moment и ещё duration минут после него.
+
+    moment - datetime (локальное время). Каждое условие - EXISTS по
+    индексу (weekday, opens, closes).
+    """
+    weekday = moment.weekday()
+    start = moment.hour * 60 + moment.minute
+    end = start + max(duration, 1)
+    if end <= MINUTES_IN_DAY:
+        return queryset.filter(_interval_exists(weekday, opens__lte=start, closes__gte=end))
+    return queryset.filter(
+        _interval_exists(weekday, opens__lte=start, closes=MINUTES_IN_DAY),
+        _interval_exists((weekday + 1) % 7, opens=0, closes__gte=end - MINUTES_IN_DAY),
+    )
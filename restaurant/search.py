@@ -0,0 +1,241 @@
+"""Полнотекстовый поиск ресторанов.
+
+Индекс - отдельная таблица restaurant_search с одной строкой на ресторан:
+на SQLite это виртуальная таблица FTS5, на PostgreSQL - tsvector с
+GIN-индексом. Текст заранее приводится к основам (stemmer.py), поэтому
+русская морфология работает на обоих движках одинаково. Индекс
+поддерживается сигналами (signals.py) после коммита изменений.
+"""
+from asgiref.sync import sync_to_async
+from django.db import connection, connections, router, transaction
+from django.db.models import Case, IntegerField, Q, When
+
+from .models import Restaurant
+from .stemmer import tokens, WORD
+
+INDEX_TABLE = 'restaurant_search'
+
+# Веса полей при ранжировании: название важнее описания
+WEIGHTS = {
+    'name': 10.0,
+    'cuisine': 5.0,
+    'tags': 4.0,
+    'address': 2.0,
+    'description': 1.0,
+}
+FIELDS = list(WEIGHTS)
+PG_WEIGHTS = {'name': 'A', 'cuisine': 'B', 'tags': 'B', 'address': 'C', 'description': 'D'}
+
+# Сколько лучших совпадений поднимать из индекса; остальные не показываются,
+# о чём search_results() сообщает флагом truncated
+MAX_RESULTS = 1000
+
+
+def supported(db=None):
+    return (db or connection).vendor in ('sqlite', 'postgresql')
+
+
+def normalize(text):
+    """Текст для индекса: основы слов + сами слова (для префиксного поиска)"""
+    words = [w.lower().replace('ё', 'е') for w in WORD.findall(text or '')]
+    stems = tokens(text)
+    return ' '.join(dict.fromkeys(stems + words))
+
+
+def document(restaurant, tag_names=None):
+    """Поля индекса для ресторана"""
+    if tag_names is None:
+        tag_names = [tag.name for tag in restaurant.tags.all()]
+    return {
+        'name': normalize(restaurant.name),
+        'cuisine': normalize(f'{restaurant.cuisine_type} {restaurant.get_cuisine_type_display()}'),
+        'tags': normalize(' '.join(tag_names)),
+        'address': normalize(restaurant.address),
+        'description': normalize(restaurant.description),
+    }
+
+
+def create_index(schema_editor=None):
+    """Создать таблицу индекса (вызывается из миграции - в её БД)"""
+    db = schema_editor.connection if schema_editor else connection
+    with db.cursor() as cursor:
+        if db.vendor == 'sqlite':
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {INDEX_TABLE} USING fts5("
+                f"{', '.join(FIELDS)}, tokenize='unicode61 remove_diacritics 2')"
+            )
+        elif db.vendor == 'postgresql':
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {INDEX_TABLE} ("
+                f"restaurant_id bigint PRIMARY KEY REFERENCES restaurant_restaurant(id) ON DELETE CASCADE, "
+                f"document tsvector NOT NULL)"
+            )
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {INDEX_TABLE}_gin ON {INDEX_TABLE} USING GIN (document)"
+            )
+
+
+def drop_index(schema_editor=None):
+    db = schema_editor.connection if schema_editor else connection
+    with db.cursor() as cursor:
+        cursor.execute(f'DROP TABLE IF EXISTS {INDEX_TABLE}')
+
+
+def index_restaurant(restaurant, tag_names=None, using=None):
+    """Добавить или обновить ресторан в индексе"""
+    db = connections[using] if using else connection
+    if not supported(db):
+        return
+    doc = document(restaurant, tag_names)
+    with db.cursor() as cursor:
+        if db.vendor == 'sqlite':
+            cursor.execute(f'DELETE FROM {INDEX_TABLE} WHERE rowid = %s', [restaurant.pk])
+            cursor.execute(
+                f"INSERT INTO {INDEX_TABLE} (rowid, {', '.join(FIELDS)}) "
+                f"VALUES (%s, {', '.join(['%s'] * len(FIELDS))})",
+                [restaurant.pk] + [doc[field] for field in FIELDS],
+            )
+        else:
+            vector = ' || '.join(
+                f"setweight(to_tsvector('simple', %s), '{PG_WEIGHTS[field]}')" for field in FIELDS
+            )
+            cursor.execute(
+                f"INSERT INTO {INDEX_TABLE} (restaurant_id, document) VALUES (%s, {vector}) "
+                f"ON CONFLICT (restaurant_id) DO UPDATE SET document = EXCLUDED.document",
+                [restaurant.pk] + [doc[field] for field in FIELDS],
+            )
+
+
+def remove_restaurant(restaurant_id):
+    if not supported():
+        return
+    with connection.cursor() as cursor:
+        column = 'rowid' if connection.vendor == 'sqlite' else 'restaurant_id'
+        cursor.execute(f'DELETE FROM {INDEX_TABLE} WHERE {column} = %s', [restaurant_id])
+
+
+def reindex(restaurant_ids=None):
+    """Переиндексировать рестораны по id (None - все) с тегами одним запросом"""
+    restaurants = Restaurant.objects.prefetch_related('tags')
+    if restaurant_ids is not None:
+        restaurants = restaurants.filter(pk__in=restaurant_ids)
+    for restaurant in restaurants:
+        index_restaurant(restaurant)
+
+
+def reindex_on_commit(restaurant_ids=None):
+    """reindex() после коммита: откаченное изменение ресторана или тегов индекс не трогает"""
+    if restaurant_ids is not None:
+        restaurant_ids = set(restaurant_ids)
+        if not restaurant_ids:
+            return
+    if supported():
+        transaction.on_commit(lambda: reindex(restaurant_ids))
+
+
+def remove_on_commit(restaurant_id):
+    if supported():
+        transaction.on_commit(lambda: remove_restaurant(restaurant_id))
+
+
+def rebuild_index():
+    """Переиндексировать все рестораны"""
+    count = 0
+    # одной транзакцией: поиск не видит пустой или наполовину заполненный индекс
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {INDEX_TABLE}')
+        for restaurant in Restaurant.objects.prefetch_related('tags').iterator(chunk_size=500):
+            index_restaurant(restaurant)
+            count += 1
+    return count
+
+
+def query_terms(query):
+    """Основы слов запроса без дублей"""
+    return list(dict.fromkeys(term for term in tokens(query) if term))
+
+
+def ranked_ids(query, limit=MAX_RESULTS):
+    """id ресторанов, подходящих под запрос, в порядке релевантности.
+
+    Все слова запроса должны встретиться (AND), каждое - как префикс.
+    """
+    terms = query_terms(query)
+    if not terms:
+        return []
+    # индекс читается там же, где и рестораны - на реплике, если она есть
+    db = connections[router.db_for_read(Restaurant)]
+    with db.cursor() as cursor:
+        if db.vendor == 'sqlite':
+            match = ' '.join('"%s"*' % term.replace('"', '') for term in terms)
+            weights = ', '.join(str(WEIGHTS[field]) for field in FIELDS)
+            cursor.execute(
+                f'SELECT rowid FROM {INDEX_TABLE} WHERE {INDEX_TABLE} MATCH %s '
+                f'ORDER BY bm25({INDEX_TABLE}, {weights}) LIMIT %s',
+                [match, limit],
+            )
+        else:
+            tsquery = ' & '.join("'%s':*" % term.replace("'", '') for term in terms)
+            cursor.execute(
+                f"SELECT restaurant_id FROM {INDEX_TABLE} "
+                f"WHERE document @@ to_tsquery('simple', %s) "
+                f"ORDER BY ts_rank(document, to_tsquery('simple', %s)) DESC LIMIT %s",
+                [tsquery, tsquery, limit],
+            )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def search(query, queryset=None):
+    """Рестораны по запросу, отсортированные по релевантности.
+
+    Возвращает QuerySet, поэтому результат можно дальше фильтровать и
+    пагинировать. На движках без полнотекстового индекса - icontains.
+    Из индекса берутся не больше MAX_RESULTS лучших совпадений.
+    """
+    return search_results(query, queryset)[0]
+
+
+def search_results(query, queryset=None):
+    """(search(), truncated); truncated - совпадений больше MAX_RESULTS, в результате только лучшие"""
+    if queryset is None:
+        queryset = Restaurant.objects.all()
+    if not supported():
+        return fallback(query, queryset), False
+    return capped(queryset, ranked_ids(query, MAX_RESULTS + 1))
+
+
+async def asearch(query, queryset=None):
+    return (await asearch_results(query, queryset))[0]
+
+
+async def asearch_results(query, queryset=None):
+    """search_results() для асинхронных представлений: запрос к индексу - в потоке ORM"""
+    if queryset is None:
+        queryset = Restaurant.objects.all()
+    if not supported():
+        return fallback(query, queryset), False
+    return capped(queryset, await sync_to_async(ranked_ids)(query, MAX_RESULTS + 1))
+
+
+def fallback(query, queryset):
+    return queryset.filter(
+        Q(name__icontains=query) |
+        Q(cuisine_type__icontains=query) |
+        Q(address__icontains=query) |
+        Q(description__icontains=query) |
+        Q(tags__name__icontains=query)
+    ).distinct()
+
+
+def capped(queryset, ids):
+    """ids подняты с запасом в одну строку - по ней видно, что лимит достигнут"""
+    return by_rank(queryset, ids[:MAX_RESULTS]), len(ids) > MAX_RESULTS
+
+
+def by_rank(queryset, ids):
+    if not ids:
+        return queryset.none()
+    rank = Case(*[When(id=pk, then=pos) for pos, pk in enumerate(ids)], output_field=IntegerField())
+    # ранг - обычная аннотация, поэтому по нему работает keyset-пагинация
+    return queryset.filter(id__in=ids).annotate(search_rank=rank).order_by('search_rank', 'id')
@@ -1,17 +1,191 @@
+from django.contrib.auth.models import User
+from django.db.models import Prefetch
 from rest_framework import serializers
-from .models import Restaurant, Table, Reservation
+from rest_framework.permissions import SAFE_METHODS
 
-class RestaurantSerializer(serializers.ModelSerializer):
+from .models import Restaurant, Table, Reservation, Tag
+
+
+def parse_expand(value):
+    """'tables,table.restaurant' -> {'tables': {}, 'table': {'restaurant': {}}}"""
+    tree = {}
+    for path in (value or '').split(','):
+        node = tree
+        for name in filter(None, path.strip().split('.')):
+            node = node.setdefault(name, {})
+    return tree
+
+
+def parse_fields(value):
+    fields = [name.strip() for name in (value or '').split(',') if name.strip()]
+    return fields or None
+
+
+class ExpandableModelSerializer(serializers.ModelSerializer):
+    """Сериализатор с ?expand=связь,связь.вложенная и ?fields=id,name.
+
+    expandable_fields: имя -> (имя класса сериализатора, kwargs). Развёрнутые
+    связи доступны только на чтение. optimize_queryset() строит по той же
+    форме ответа select_related/prefetch_related/only, поэтому число
+    запросов не зависит от размера страницы.
+    """
+    expandable_fields = {}
+
+    def __init__(self, *args, **kwargs):
+        expand = kwargs.pop('expand', None)
+        only = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+
+        request = self.context.get('request')
+        if expand is None and only is None and request is not None and request.method in SAFE_METHODS:
+            expand = parse_expand(request.query_params.get('expand'))
+            only = parse_fields(request.query_params.get('fields'))
+        self.expand = expand or {}
+
+        for name, nested in self.expand.items():
+            if name in self.expandable_fields:
+                serializer_class, options = self.get_expandable(name)
+                self.fields[name] = serializer_class(read_only=True, expand=nested, fields=None, **options)
+
+        if only:
+            for name in set(self.fields) - set(only):
+                self.fields.pop(name)
+
+    @classmethod
+    def get_expandable(cls, name):
+        serializer_name, options = cls.expandable_fields[name]
+        return globals()[serializer_name], options
+
+    @classmethod
+    def optimize_queryset(cls, queryset, expand=None, fields=None):
+        """select_related/prefetch_related/only под форму ответа"""
+        selects, prefetches = cls.query_plan(expand or {}, fields)
+        if selects:
+            queryset = queryset.select_related(*selects)
+        if prefetches:
+            queryset = queryset.prefetch_related(*prefetches)
+        if fields and not selects:
+            model = cls.Meta.model
+            concrete = {f.name for f in model._meta.concrete_fields}
+            loaded = [name for name in cls.declared_field_names(fields) if name in concrete]
+            queryset = queryset.only(model._meta.pk.name, *loaded)
+        return queryset
+
+    @classmethod
+    def query_plan(cls, expand, fields=None, prefix=''):
+        """(select_related, prefetch_related) для ответа заданной формы.
+
+        Развёрнутые FK идут в select_related (вложенные - через __),
+        развёрнутые "многие" связи - в Prefetch с собственным планом,
+        а плоские M2M (список id) - в обычный prefetch.
+        """
+        selects, prefetches = [], []
+        declared = cls.declared_field_names(fields)
+        for field in cls.Meta.model._meta.get_fields():
+            name = field.name
+            if name in expand and name in cls.expandable_fields and (not fields or name in fields):
+                serializer_class, _options = cls.get_expandable(name)
+                if field.many_to_one or field.one_to_one:
+                    selects.append(prefix + name)
+                    sub_selects, sub_prefetches = serializer_class.query_plan(
+                        expand[name], prefix=f'{prefix}{name}__'
+                    )
+                    selects.extend(sub_selects)
+                    prefetches.extend(sub_prefetches)
+                else:
+                    related = serializer_class.optimize_queryset(
+                        field.related_model.objects.all(), expand[name]
+                    )
+                    prefetches.append(Prefetch(prefix + name, queryset=related))
+            elif field.many_to_many and name in declared:
+                prefetches.append(prefix + name)
+        return selects, prefetches
+
+    @classmethod
+    def declared_field_names(cls, fields=None):
+        names = getattr(cls.Meta, 'fields', '__all__')
+        if names == '__all__':
+            # прямые поля модели, без обратных связей
+            names = [f.name for f in cls.Meta.model._meta.get_fields() if not f.auto_created or f.concrete]
+        names = set(names) - set(getattr(cls.Meta, 'exclude', ()))
+        if fields:
+            names &= set(fields)
+        return names
+
+
+class TagSerializer(ExpandableModelSerializer):
     class Meta:
-        model = Restaurant
+        model = Tag
         fields = '__all__'
 
-class TableSerializer(serializers.ModelSerializer):
+
+class RestaurantSerializer(ExpandableModelSerializer):
+    expandable_fields = {
+        'tables': ('TableSerializer', {'many': True}),
+        'tags': ('TagSerializer', {'many': True}),
+    }
+
+    class Meta:
+        model = Restaurant
+        # служебные поля: ключ вариантов фотографии и версия кэша считаются сервером
+        exclude = ['image_hash', 'cache_version']
+
+
+class TableSerializer(ExpandableModelSerializer):
+    expandable_fields = {
+        'restaurant': ('RestaurantSerializer', {}),
+        'reservations': ('ReservationSerializer', {'many': True}),
+    }
+
     class Meta:
         model = Table
         fields = '__all__'
 
-class ReservationSerializer(serializers.ModelSerializer):
+
+class ReservationSerializer(ExpandableModelSerializer):
+    expandable_fields = {
+        'table': ('TableSerializer', {}),
+    }
+
     class Meta:
         model = Reservation
-        fields = '__all__'
\ No newline at end of file
+        fields = '__all__'
+
+
+class CachedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """PK-поле, берущее объекты из заранее загруженного context['related'].
+
+    Пакетная валидация загружает связанные объекты одним запросом вместо
+    запроса на каждый элемент.
+    """
+
+    def to_internal_value(self, data):
+        cache = self.context.get('related', {}).get(self.queryset.model)
+        if cache is None:
+            return super().to_internal_value(data)
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            pk = int(data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        obj = cache.get(pk)
+        if obj is None:
+            self.fail('does_not_exist', pk_value=data)
+        return obj
+
+
+class BulkTableSerializer(TableSerializer):
+    restaurant = CachedPrimaryKeyRelatedField(queryset=Restaurant.objects.all())
+
+    class Meta(TableSerializer.Meta):
+        validators = []
+
+
+class BulkReservationSerializer(ReservationSerializer):
+    table = CachedPrimaryKeyRelatedField(queryset=Table.objects.all())
+    user = CachedPrimaryKeyRelatedField(queryset=User.objects.all())
+
+    class Meta(ReservationSerializer.Meta):
+        # пересечения проверяются всей пачкой в availability.batch_conflicts
+        validators = []
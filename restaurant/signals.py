@@ -0,0 +1,214 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from . import fragments, images, popularity, schedule, search, user_summary, waitlist
+from .dashboard import invalidate_snapshot
+from .models import Restaurant, Table, Reservation, Tag
+
+
+@receiver([post_save, post_delete], sender=Restaurant)
+@receiver([post_save, post_delete], sender=Table)
+@receiver([post_save, post_delete], sender=Reservation)
+def invalidate_dashboard(sender, **kwargs):
+    """Снимок главной страницы устаревает при любом изменении данных"""
+    transaction.on_commit(invalidate_snapshot)
+
+
+@receiver(pre_save, sender=Reservation)
+def remember_reservation_state(sender, instance, **kwargs):
+    """Запомнить прежний вклад брони в счётчики популярности и прежнего владельца"""
+    before = previous_user = None
+    if instance.pk and not instance._state.adding:
+        row = Reservation.objects.filter(pk=instance.pk).values_list(
+            'status', 'reservation_date', 'table__restaurant_id', 'user_id'
+        ).first()
+        if row:
+            before = popularity.contribution(*row[:3])
+            previous_user = row[3]
+    instance._popularity_before = before
+    instance._previous_user_id = previous_user
+
+
+@receiver([post_save, post_delete], sender=Reservation)
+def invalidate_user_summary(sender, instance, **kwargs):
+    """Сводка броней владельца (и прежнего, если бронь передали) устарела"""
+    user_summary.invalidate_on_commit({instance.user_id, instance.__dict__.pop('_previous_user_id', None)})
+
+
+@receiver(post_save, sender=Reservation)
+def update_popularity(sender, instance, **kwargs):
+    after = popularity.contribution(instance.status, instance.reservation_date, instance.table.restaurant_id)
+    popularity.apply_change(getattr(instance, '_popularity_before', None), after)
+
+
+@receiver(post_delete, sender=Reservation)
+def remove_from_popularity(sender, instance, **kwargs):
+    before = popularity.contribution(instance.status, instance.reservation_date, instance.table.restaurant_id)
+    popularity.apply_change(before, None)
+
+
+@receiver(post_save, sender=Reservation)
+def offer_freed_table(sender, instance, **kwargs):
+    """Бронь больше не занимает столик в этот день - проход листа ожидания"""
+    before = getattr(instance, '_popularity_before', None)
+    after = popularity.contribution(instance.status, instance.reservation_date, instance.table.restaurant_id)
+    if before is not None and before != after:
+        waitlist.match_on_commit([before])
+
+
+@receiver(post_delete, sender=Reservation)
+def offer_deleted_table(sender, instance, **kwargs):
+    waitlist.match_on_commit([
+        popularity.contribution(instance.status, instance.reservation_date, instance.table.restaurant_id)
+    ])
+
+
+@receiver(post_save, sender=Restaurant)
+def index_restaurant(sender, instance, **kwargs):
+    """Поддержка поискового индекса в актуальном состоянии"""
+    search.reindex_on_commit([instance.pk])
+
+
+@receiver(pre_save, sender=Restaurant)
+def remember_opening_hours(sender, instance, update_fields=None, **kwargs):
+    """Изменились ли часы работы с загрузки - после записи состояние уже обновлено"""
+    if update_fields is not None and 'opening_hours' not in update_fields:
+        instance._opening_hours_changed = False
+        return
+    loaded = instance.__dict__.get('_history_loaded')
+    if loaded is None or 'opening_hours' not in loaded:
+        # исходное состояние неизвестно (новый объект, отложенное поле)
+        instance._opening_hours_changed = True
+    else:
+        instance._opening_hours_changed = loaded['opening_hours'] != instance.opening_hours
+
+
+@receiver(post_save, sender=Restaurant)
+def sync_opening_intervals(sender, instance, created=False, **kwargs):
+    """Разобранные часы работы (OpeningInterval) следуют за opening_hours"""
+    if created or instance.__dict__.pop('_opening_hours_changed', True):
+        schedule.sync([instance])
+
+
+@receiver(pre_save, sender=Restaurant)
+def hash_restaurant_image(sender, instance, **kwargs):
+    """Хеш новой фотографии считается до записи файла в хранилище"""
+    image = instance.image
+    if not image:
+        instance.image_hash = ''
+        return
+    if image._committed and instance.image_hash:
+        loaded = instance.__dict__.get('_history_loaded') or {}
+        if loaded.get('image', image.name) == image.name:
+            return
+    try:
+        if image._committed:
+            with image.storage.open(image.name, 'rb') as source:
+                instance.image_hash = images.content_hash(source)
+        else:
+            # загруженный файл не закрываем - его ещё сохранит FileField
+            instance.image_hash = images.content_hash(image.file)
+    except (OSError, ValueError):
+        instance.image_hash = ''
+        return
+    instance._image_changed = True
+
+
+@receiver(post_save, sender=Restaurant)
+def schedule_image_variants(sender, instance, **kwargs):
+    if not instance.__dict__.pop('_image_changed', False) or not instance.image_hash:
+        return
+    path, digest = instance.image.path, instance.image_hash
+    transaction.on_commit(lambda: images.schedule_variants(path, digest))
+
+
+@receiver(post_delete, sender=Restaurant)
+def unindex_restaurant(sender, instance, **kwargs):
+    search.remove_on_commit(instance.pk)
+
+
+@receiver(m2m_changed, sender=Restaurant.tags.through)
+def reindex_restaurant_tags(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        search.reindex_on_commit([instance.pk])
+    else:
+        # post_clear со стороны тега - pk_set нет, переиндексируются все
+        search.reindex_on_commit(pk_set)
+
+
+@receiver(post_save, sender=Tag)
+def reindex_tag_restaurants(sender, instance, created, **kwargs):
+    if created:
+        return
+    search.reindex_on_commit(list(instance.restaurants.values_list('id', flat=True)))
+
+
+@receiver(pre_delete, sender=Tag)
+def remember_tag_restaurants(sender, instance, **kwargs):
+    instance._restaurant_ids = list(instance.restaurants.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Tag)
+def reindex_after_tag_delete(sender, instance, **kwargs):
+    search.reindex_on_commit(getattr(instance, '_restaurant_ids', []))
+
+
+# Версия кэша фрагментов (fragments.py)
+
+@receiver(pre_save, sender=Restaurant)
+def bump_restaurant_version(sender, instance, update_fields=None, **kwargs):
+    if instance._state.adding or (update_fields is not None and 'cache_version' not in update_fields):
+        return
+    # F() - рост версии не теряется при параллельных изменениях столиков
+    instance.cache_version = F('cache_version') + 1
+
+
+@receiver(post_save, sender=Restaurant)
+def reload_restaurant_version(sender, instance, created, update_fields=None, **kwargs):
+    if created:
+        return
+    if update_fields is not None and 'cache_version' not in update_fields:
+        fragments.bump([instance.pk])
+    # поле становится отложенным и перечитывается при первом обращении
+    instance.__dict__.pop('cache_version', None)
+
+
+@receiver(pre_save, sender=Table)
+def remember_table_restaurant(sender, instance, **kwargs):
+    loaded = instance.__dict__.get('_history_loaded') or {}
+    instance._fragment_restaurants = {instance.restaurant_id, loaded.get('restaurant_id')}
+
+
+@receiver(post_save, sender=Table)
+def bump_table_restaurant(sender, instance, **kwargs):
+    fragments.bump(instance.__dict__.pop('_fragment_restaurants', {instance.restaurant_id}))
+
+
+@receiver(post_delete, sender=Table)
+def bump_deleted_table_restaurant(sender, instance, **kwargs):
+    fragments.bump([instance.restaurant_id])
+
+
+@receiver(m2m_changed, sender=Restaurant.tags.through)
+def bump_tagged_restaurants(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        instance._cleared_restaurant_ids = list(instance.restaurants.values_list('id', flat=True))
+    elif action in ('post_add', 'post_remove'):
+        fragments.bump(pk_set if reverse else [instance.pk])
+    elif action == 'post_clear':
+        fragments.bump(instance.__dict__.pop('_cleared_restaurant_ids', []) if reverse else [instance.pk])
+
+
+@receiver(post_save, sender=Tag)
+def bump_tag_restaurants(sender, instance, created, **kwargs):
+    if not created:
+        fragments.bump(instance.restaurants.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Tag)
+def bump_after_tag_delete(sender, instance, **kwargs):
+    fragments.bump(getattr(instance, '_restaurant_ids', []))
@@ -0,0 +1,109 @@
+"""Снимок данных страницы ресторана.
+
+restaurant_detail раньше считал статистику отдельными count/exists/
+aggregate, повторно выбирал id столиков и отдельно запрашивал свободные
+столики - около десяти запросов. load() собирает всё за фиксированное
+число запросов, не зависящее от числа столиков и броней:
+
+- ресторан с автором, столики и интервалы работы (prefetch);
+- активные брони на дату - из них и слоты, и свободные на день столики;
+- последние брони вместе со столиками.
+
+Статистика считается в Python по загруженным столикам. Снимок состоит
+из обычных объектов и моделей, поэтому его можно положить в кэш.
+"""
+import asyncio
+import hashlib
+
+from . import schedule
+from .availability import SLOT_STEP, group_intervals, reserved_rows, table_slots
+from .models import Reservation, Restaurant
+from .utils import alist
+
+RECENT_RESERVATIONS = 5
+
+# Гостей по умолчанию для "свободных столиков на сегодня" (как в get_available_tables)
+DEFAULT_GUESTS = 2
+
+
+def queryset():
+    """Рестораны со всем, что нужно снимку"""
+    return Restaurant.objects.select_related('created_by').prefetch_related('tables', 'opening_intervals')
+
+
+class TableStats:
+    """Сводка по столикам ресторана"""
+
+    def __init__(self, tables):
+        self.tables_count = len(tables)
+        self.tables_exist = bool(tables)
+        self.avg_capacity = sum(t.capacity for t in tables) / len(tables) if tables else 0
+        self.min_price = min((t.price_per_hour for t in tables), default=0)
+        self.max_capacity = max((t.capacity for t in tables), default=0)
+
+
+class RestaurantSnapshot:
+    """Данные страницы ресторана на дату.
+
+    tables - столики с атрибутом free_slots, table_slots - {столик: слоты},
+    available_tables - столики на DEFAULT_GUESTS без броней в часы работы,
+    slots_version - хеш слотов для ключа кэша фрагмента.
+    """
+
+    def __init__(self, restaurant, day, tables, table_slots, available_tables, reservations):
+        self.restaurant = restaurant
+        self.day = day
+        self.tables = tables
+        self.table_slots = table_slots
+        self.available_tables = available_tables
+        self.reservations = reservations
+        self.stats = TableStats(tables)
+        self.slots_version = hashlib.md5(repr(sorted(
+            (table.pk, slots) for table, slots in table_slots.items()
+        )).encode()).hexdigest()
+
+
+def load(restaurant, day, duration=Reservation.DEFAULT_DURATION):
+    """Снимок для ресторана из queryset() - ещё два запроса к броням"""
+    rows, recent = reservation_querysets(restaurant, day)
+    return build(restaurant, day, list(rows), list(recent), duration)
+
+
+async def aload(restaurant_id, day, duration=Reservation.DEFAULT_DURATION):
+    """load() через асинхронный ORM: ресторан и брони запрашиваются параллельно.
+
+    Нет ресторана - Restaurant.DoesNotExist.
+    """
+    rows, recent = reservation_querysets(restaurant_id, day)
+    restaurant, rows, recent = await asyncio.gather(
+        queryset().aget(pk=restaurant_id), alist(rows), alist(recent),
+    )
+    return build(restaurant, day, rows, recent, duration)
+
+
+def reservation_querysets(restaurant, day):
+    """Брони на дату для слотов и последние брони; нужен только id ресторана"""
+    recent = Reservation.objects.filter(table__restaurant=restaurant).select_related('table')
+    return reserved_rows(restaurant, day), recent[:RECENT_RESERVATIONS]
+
+
+def build(restaurant, day, rows, reservations, duration):
+    tables = list(restaurant.tables.all())
+    intervals = group_intervals(rows)
+
+    day_windows = schedule.windows(restaurant, day)
+    starts = schedule.slot_starts(day_windows, duration, SLOT_STEP)
+    slots = {}
+    for table in tables:
+        table.free_slots = slots[table] = table_slots(intervals.get(table.id, []), starts, duration)
+
+    # как get_available_tables(day): ни одна бронь не пересекает рабочий день
+    available = []
+    if day_windows:
+        opens, closes = day_windows[0][0], day_windows[-1][1]
+        available = [
+            table for table in tables
+            if table.capacity >= DEFAULT_GUESTS
+            and not any(start < closes and end > opens for start, end in intervals.get(table.id, []))
+        ]
+    return RestaurantSnapshot(restaurant, day, tables, slots, available, reservations)
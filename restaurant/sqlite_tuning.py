@@ -0,0 +1,125 @@
+"""SQLite под нагрузкой: профиль PRAGMA, BEGIN IMMEDIATE и обслуживание.
+
+С журналом отката (по умолчанию) писатель на время коммита блокирует
+всех читателей, а читатель - коммит писателя, отсюда "database is
+locked" при наплыве броней. Профиль production (settings.SQLITE_PROFILES)
+включает WAL: читатели работают со снимком и писателя не ждут.
+
+Транзакция SQLite по умолчанию начинается как читающая и берёт
+блокировку на запись только на первом изменении. Если к этому моменту
+другой писатель уже закоммитил, SQLite в WAL сразу отвечает "locked",
+не дожидаясь busy_timeout. write_transaction() начинает транзакцию
+бронирования с BEGIN IMMEDIATE: блокировка берётся сразу, а очередь
+писателей ждёт её через busy_timeout. Глобально (OPTIONS
+transaction_mode) не включаем - тогда блокировку на запись брали бы и
+читающие транзакции.
+
+WAL-файл сбрасывается в БД автоматически, но под постоянной нагрузкой
+может расти - manage.py sqlite_maintenance делает checkpoint и
+PRAGMA optimize (запускать по расписанию).
+"""
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+CHECKPOINT_MODES = ('PASSIVE', 'FULL', 'RESTART', 'TRUNCATE')
+
+# Что показывать в отчётах
+REPORTED_PRAGMAS = ('journal_mode', 'synchronous', 'busy_timeout', 'mmap_size', 'cache_size', 'temp_store')
+
+
+def init_command(pragmas):
+    """OPTIONS['init_command'] для набора PRAGMA"""
+    return ';'.join(f'PRAGMA {name}={value}' for name, value in pragmas.items())
+
+
+def is_sqlite(using=None):
+    return connections[using or DEFAULT_DB_ALIAS].vendor == 'sqlite'
+
+
+@contextmanager
+def write_transaction(using=None):
+    """transaction.atomic(), который на SQLite начинается с BEGIN IMMEDIATE.
+
+    Только для внешней транзакции и при settings.SQLITE_IMMEDIATE_WRITES;
+    вложенный блок - обычная точка сохранения.
+    """
+    connection = connections[using or DEFAULT_DB_ALIAS]
+    immediate = (
+        connection.vendor == 'sqlite'
+        and getattr(settings, 'SQLITE_IMMEDIATE_WRITES', False)
+        and not connection.in_atomic_block
+    )
+    if not immediate:
+        with transaction.atomic(using=using):
+            yield
+        return
+    # режим читается из OPTIONS при подключении - подключаемся заранее
+    connection.ensure_connection()
+    previous = connection.transaction_mode
+    connection.transaction_mode = 'IMMEDIATE'
+    try:
+        with transaction.atomic(using=using):
+            # BEGIN уже выполнен, дальше - прежний режим
+            connection.transaction_mode = previous
+            yield
+    finally:
+        connection.transaction_mode = previous
+
+
+def pragmas(using=None):
+    """Текущие значения REPORTED_PRAGMAS"""
+    values = {}
+    with connections[using or DEFAULT_DB_ALIAS].cursor() as cursor:
+        for name in REPORTED_PRAGMAS:
+            cursor.execute(f'PRAGMA {name}')
+            row = cursor.fetchone()  # mmap_size у БД в памяти пуст
+            values[name] = row[0] if row else None
+    return values
+
+
+def checkpoint(mode='TRUNCATE', using=None):
+    """Перенос WAL в файл БД. Возвращает (занято, кадров в журнале, перенесено).
+
+    "Занято" = 1, если checkpoint не завершился из-за активных
+    читателей или писателя; вне WAL кадров -1.
+    """
+    mode = mode.upper()
+    if mode not in CHECKPOINT_MODES:
+        raise ValueError(f'Режим checkpoint: {", ".join(CHECKPOINT_MODES)}')
+    with connections[using or DEFAULT_DB_ALIAS].cursor() as cursor:
+        cursor.execute(f'PRAGMA wal_checkpoint({mode})')
+        return tuple(cursor.fetchone())
+
+
+def optimize(using=None):
+    """PRAGMA optimize: обновить статистику планировщика, где она устарела"""
+    with connections[using or DEFAULT_DB_ALIAS].cursor() as cursor:
+        cursor.execute('PRAGMA optimize')
+
+
+@contextmanager
+def profile(name, using=None):
+    """Временно переключить соединения на профиль (для бенчмарка).
+
+    name - ключ settings.SQLITE_PROFILES или '' для настроек SQLite по
+    умолчанию (журнал отката, синхронная запись, DEFERRED-транзакции).
+    Меняет OPTIONS, которые читают новые соединения, в том числе в
+    других потоках; текущее соединение переоткрывается.
+    """
+    from django.test.utils import override_settings
+
+    connection = connections[using or DEFAULT_DB_ALIAS]
+    chosen = dict(settings.SQLITE_PROFILES[name]) if name else {'journal_mode': 'DELETE'}
+    options = connection.settings_dict['OPTIONS']
+    saved = dict(options)
+    options['init_command'] = init_command(chosen)
+    connection.close()
+    try:
+        with override_settings(SQLITE_IMMEDIATE_WRITES=bool(name)):
+            yield chosen
+    finally:
+        connection.close()
+        options.clear()
+        options.update(saved)
@@ -0,0 +1,92 @@
+"""Стеммер русского языка (алгоритм Snowball) для полнотекстового поиска.
+
+Слова латиницей возвращаются без изменений (только в нижнем регистре).
+"""
+import re
+
+VOWELS = 'аеиоуыэюя'
+
+PERFECTIVE_GERUND = re.compile(r'((?<=[ая])(в|вши|вшись)|(ив|ивши|ившись|ыв|ывши|ывшись))$')
+REFLEXIVE = re.compile(r'(с[яь])$')
+ADJECTIVE = re.compile(r'(ее|ие|ые|ое|ими|ыми|ей|ий|ый|ой|ем|им|ым|ом|его|ого|ему|ому|их|ых|ую|юю|ая|яя|ою|ею)$')
+PARTICIPLE = re.compile(r'((?<=[ая])(ем|нн|вш|ющ|щ)|(ивш|ывш|ующ))$')
+VERB = re.compile(
+    r'((?<=[ая])(ла|на|ете|йте|ли|й|л|ем|н|ло|но|ет|ют|ны|ть|ешь|нно)|'
+    r'(ила|ыла|ена|ейте|уйте|ите|или|ыли|ей|уй|ил|ыл|им|ым|ен|ило|ыло|ено|ят|ует|уют|ит|ыт|ены|ить|ыть|ишь|ую|ю))$'
+)
+NOUN = re.compile(
+    r'(а|ев|ов|ие|ье|е|иями|ями|ами|еи|ии|и|ией|ей|ой|ий|й|иям|ям|ием|ем|ам|ом|о|у|ах|иях|ях|ы|ь|ию|ью|ю|ия|ья|я)$'
+)
+SUPERLATIVE = re.compile(r'(ейш|ейше)$')
+DERIVATIONAL = re.compile(r'(ост|ость)$')
+CYRILLIC = re.compile(r'[а-я]')
+
+
+def _regions(word):
+    """Начала областей RV и R2"""
+    rv = len(word)
+    for i, ch in enumerate(word):
+        if ch in VOWELS:
+            rv = i + 1
+            break
+
+    def next_region(start):
+        for i in range(start + 1, len(word)):
+            if word[i] not in VOWELS and word[i - 1] in VOWELS:
+                return i + 1
+        return len(word)
+
+    r1 = next_region(0)
+    r2 = next_region(r1)
+    return rv, r2
+
+
+def stem(word):
+    word = word.lower().replace('ё', 'е')
+    if not CYRILLIC.search(word):
+        return word
+
+    rv_start, r2_start = _regions(word)
+    prefix, rv = word[:rv_start], word[rv_start:]
+
+    # Шаг 1
+    rv, count = PERFECTIVE_GERUND.subn('', rv, 1)
+    if not count:
+        rv = REFLEXIVE.sub('', rv, 1)
+        rv, count = ADJECTIVE.subn('', rv, 1)
+        if count:
+            rv = PARTICIPLE.sub('', rv, 1)
+        else:
+            rv, count = VERB.subn('', rv, 1)
+            if not count:
+                rv = NOUN.sub('', rv, 1)
+
+    # Шаг 2
+    if rv.endswith('и'):
+        rv = rv[:-1]
+
+    # Шаг 3 - словообразовательный суффикс, только в R2
+    r2_offset = max(0, r2_start - rv_start)
+    match = DERIVATIONAL.search(rv)
+    if match and match.start() >= r2_offset:
+        rv = rv[:match.start()]
+
+    # Шаг 4
+    if rv.endswith('нн'):
+        rv = rv[:-1]
+    else:
+        rv, count = SUPERLATIVE.subn('', rv, 1)
+        if count and rv.endswith('нн'):
+            rv = rv[:-1]
+        elif rv.endswith('ь'):
+            rv = rv[:-1]
+
+    return prefix + rv
+
+
+WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def tokens(text):
+    """Слова текста в нормальной форме (основы)"""
+    return [stem(word) for word in WORD.findall(text or '')]
@@ -1,7 +1,11 @@
 from django import template
 from django.utils import timezone
-from django.db.models import Count, Q  # ✅ ДОБАВИТЬ ИМПОРТ Q
-from ..models import Restaurant, Reservation
+from django.utils.html import format_html
+from ..models import Restaurant
+from ..dashboard import get_snapshot, POPULAR_LIMIT
+from ..popularity import top_restaurants
+from .. import images, user_summary
+from ..fragments import fragment_version as _fragment_version
 
 register = template.Library()
 
@@ -13,21 +17,18 @@ def current_time(format_string):
 @register.simple_tag(takes_context=True)
 def user_reservation_count(context):
     """✅ Шаблонный тег с контекстными переменными - КОЛИЧЕСТВО БРОНИЙ"""
-    request = context['request']
-    if request.user.is_authenticated:
-        return Reservation.objects.filter(user=request.user).count()
-    return 0
+    # из сводки в кэше (user_summary.py), без запросов к броням
+    summary = user_summary.for_request(context['request'])
+    return summary.total if summary else 0
 
 @register.inclusion_tag('restaurant/popular_restaurants.html')
 def show_popular_restaurants(count=5):
     """✅ Шаблонный тег, возвращающий набор запросов - ПОПУЛЯРНЫЕ РЕСТОРАНЫ"""
-    week_ago = timezone.now().date() - timezone.timedelta(days=7)
+    # Топ-N уже посчитан в снимке главной страницы
+    if count <= POPULAR_LIMIT:
+        return {'restaurants': get_snapshot()['popular_restaurants'][:count]}
     
-    # ✅ ИСПРАВЛЕННАЯ СТРОКА - убрано models.Q, используется просто Q
-    restaurants = Restaurant.objects.annotate(
-        reservation_count=Count('tables__reservations', 
-                              filter=Q(tables__reservations__reservation_date__gte=week_ago))
-    ).filter(reservation_count__gt=0).order_by('-reservation_count')[:count]
+    restaurants = top_restaurants(count)
     
     return {'restaurants': restaurants}
 
@@ -46,7 +47,35 @@ def restaurant_count():
 @register.simple_tag(takes_context=True)
 def user_has_reservations(context):
     """✅ Дополнительный тег - проверка есть ли брони у пользователя"""
-    request = context['request']
-    if request.user.is_authenticated:
-        return Reservation.objects.filter(user=request.user).exists()
-    return False
\ No newline at end of file
+    summary = user_summary.for_request(context['request'])
+    return bool(summary and summary.total)
+
+# Подсказка браузеру, какой ширины будет картинка в вёрстке
+IMAGE_SIZES = {
+    'thumb': '160px',
+    'card': '(max-width: 576px) 100vw, 400px',
+    'detail': '(max-width: 1200px) 100vw, 1200px',
+}
+
+@register.simple_tag
+def restaurant_image(restaurant, size='card', css_class=''):
+    """<picture> с WebP/JPEG srcset; пока копии не готовы - оригинал"""
+    if not restaurant.image:
+        return ''
+    manifest = images.get_manifest(restaurant.image_hash)
+    if manifest is None:
+        return format_html('<img src="{}" alt="{}" class="{}" loading="lazy">',
+                           restaurant.image.url, restaurant.name, css_class)
+    width, height = manifest['sizes'][size]
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" width="{}" height="{}" alt="{}" class="{}" loading="lazy"></picture>',
+        images.srcset(restaurant.image_hash, manifest, 'webp'), IMAGE_SIZES[size],
+        images.variant_url(restaurant.image_hash, size), images.srcset(restaurant.image_hash, manifest, 'jpeg'),
+        IMAGE_SIZES[size], width, height, restaurant.name, css_class,
+    )
+
+@register.filter
+def fragment_version(restaurant):
+    """Версия для {% cache %}: restaurant|fragment_version"""
+    return _fragment_version(restaurant)
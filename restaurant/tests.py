@@ -1,3 +1,1745 @@
-from django.test import TestCase
+import gzip
+import json
+import os
+import tempfile
+import time as time_module
+import zipfile
+from inspect import iscoroutinefunction
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, time, timedelta
+from io import BytesIO, StringIO
+from unittest.mock import patch
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.template import Context, Template
+from django.core.management import CommandError, call_command
+from django.contrib.sessions.models import Session
+from django.db import DatabaseError, connection, connections, router, transaction
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from .booking import book_table, lock_tables, BookingConflict
+from .dashboard import get_snapshot
+from .popularity import top_restaurants, rollup
+from .search import rebuild_index, search, search_results
+from . import schedule, snapshot
+from .availability import day_slots, free_tables, from_minutes
+from .forms import ReservationForm
+from .pagination import KeysetPaginator, MergedKeysetPaginator
+from .serializers import RestaurantSerializer
+from . import archive, benchmarks, bulk, images, reports, routing, sqlite_tuning, user_summary, waitlist
+from .export import export_lines
+from .history import HistoryBuffer
+from .importing import import_file
+from .profiling import REGISTRY, ProfilingMiddleware, RequestRecord, SIMILAR_THRESHOLD
+from .models import (
+    ArchivedReservation, OpeningInterval, Reservation, ReservationCounter, Restaurant, RestaurantPopularity, Table, Tag,
+    ReportJob, WaitlistEntry,
+)
+
+
+def create_restaurant(name='Тестовый ресторан', **kwargs):
+    fields = {
+        'description': 'Описание',
+        'address': 'Москва',
+        'phone': '+70000000000',
+        'cuisine_type': 'italian',
+    }
+    fields.update(kwargs)
+    # поисковый индекс обновляется после коммита
+    with TestCase.captureOnCommitCallbacks(execute=True):
+        return Restaurant.objects.create(name=name, **fields)
+
+
+class BookingTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('guest', password='secret')
+        self.restaurant = create_restaurant()
+        self.table = Table.objects.create(restaurant=self.restaurant, table_number='1', capacity=4)
+        self.day = date.today() + timedelta(days=1)
+
+    def reservation(self, at_time, duration=120):
+        return Reservation(
+            user=self.user, table=self.table, reservation_date=self.day,
+            reservation_time=at_time, duration=duration, guests_count=2,
+        )
+
+    def test_overlapping_booking_rejected(self):
+        book_table(self.reservation(time(18, 0)))
+        with self.assertRaises(BookingConflict):
+            book_table(self.reservation(time(19, 0)))
+
+    def test_adjacent_booking_allowed(self):
+        book_table(self.reservation(time(18, 0)))
+        book_table(self.reservation(time(20, 0)))
+        self.assertEqual(Reservation.objects.count(), 2)
+
+    def test_cancelled_booking_frees_slot(self):
+        first = book_table(self.reservation(time(18, 0)))
+        Reservation.objects.filter(pk=first.pk).update(status='cancelled')
+        book_table(self.reservation(time(18, 0)))
+        self.assertEqual(Reservation.objects.filter(status='pending').count(), 1)
+
+    def test_api_update_checks_overlap(self):
+        book_table(self.reservation(time(18, 0)))
+        later = book_table(self.reservation(time(20, 0)))
+        url = f'/api/reservations/{later.pk}/'
+        response = self.client.patch(url, {'reservation_time': '18:30'}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('table', response.json())
+        later.refresh_from_db()
+        self.assertEqual(later.reservation_time, time(20, 0))
+        # сдвиг внутри своего же интервала - не пересечение с собой
+        response = self.client.patch(url, {'reservation_time': '20:30'}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.patch(url, {'reservation_time': '18:30', 'status': 'cancelled'},
+                                     content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+
+class ConcurrentBookingTests(TransactionTestCase):
+    """Стресс-тест: параллельные брони одного столика на одно время"""
+    attempts = 200
+    workers = 16
+
+    def test_exactly_one_booking_succeeds(self):
+        restaurant = create_restaurant()
+        table = Table.objects.create(restaurant=restaurant, table_number='1', capacity=4)
+        users = [User(username=f'guest{i}') for i in range(self.attempts)]
+        User.objects.bulk_create(users)
+        user_ids = list(User.objects.values_list('id', flat=True))
+        day = date.today() + timedelta(days=1)
+
+        def attempt(user_id):
+            try:
+                book_table(Reservation(
+                    user_id=user_id, table_id=table.id, reservation_date=day,
+                    reservation_time=time(19, 0), guests_count=2,
+                ))
+                return True
+            except BookingConflict:
+                return False
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            results = list(pool.map(attempt, user_ids))
+
+        self.assertEqual(results.count(True), 1)
+        self.assertEqual(Reservation.objects.filter(table=table).count(), 1)
+
+
+class QueryPlanTests(TestCase):
+    def test_hot_queries_use_indexes(self):
+        """CI: ни один горячий запрос не читает всю таблицу"""
+        call_command('explain_queries', '--check', stdout=StringIO())
+
+
+@override_settings(DASHBOARD_ASYNC_REFRESH=False)
+class DashboardTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        restaurant = create_restaurant()
+        Table.objects.create(restaurant=restaurant, table_number='1', capacity=6, price_per_hour=700)
+
+    def test_home_renders_from_cache(self):
+        self.client.get(reverse('home'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('home'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['stats']['total_restaurants'], 1)
+
+    def test_changes_mark_snapshot_stale(self):
+        self.assertEqual(get_snapshot()['stats']['total_restaurants'], 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            create_restaurant('Второй ресторан')
+        # устаревший снимок отдаётся сразу и пересчитывается
+        self.assertEqual(get_snapshot()['stats']['total_restaurants'], 1)
+        self.assertEqual(get_snapshot()['stats']['total_restaurants'], 2)
+
+
+class PopularityTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('guest', password='secret')
+        self.first = create_restaurant('Первый')
+        self.second = create_restaurant('Второй')
+        self.tables = {
+            r: Table.objects.create(restaurant=r, table_number='1', capacity=4)
+            for r in (self.first, self.second)
+        }
+        self.day = date.today() + timedelta(days=1)
+
+    def book(self, restaurant, hour):
+        return Reservation.objects.create(
+            user=self.user, table=self.tables[restaurant], reservation_date=self.day,
+            reservation_time=time(hour, 0), guests_count=2,
+        )
+
+    def test_counters_follow_create_cancel_delete(self):
+        self.book(self.first, 12)
+        self.book(self.first, 15)
+        cancelled = self.book(self.second, 12)
+        self.assertEqual([(r, r.reservation_count) for r in top_restaurants(5)],
+                         [(self.first, 2), (self.second, 1)])
+
+        cancelled.status = 'cancelled'
+        cancelled.save()
+        self.first.tables.first().reservations.first().delete()
+        self.assertEqual([(r, r.reservation_count) for r in top_restaurants(5)], [(self.first, 1)])
+
+    def test_cancel_view_updates_counters(self):
+        reservation = self.book(self.first, 12)
+        self.client.force_login(self.user)
+        self.client.post(reverse('cancel_reservation', args=[reservation.id]))
+        self.assertEqual(list(top_restaurants(5)), [])
+
+    def test_rollup_rebuild_matches_incremental(self):
+        self.book(self.first, 12)
+        self.book(self.second, 12)
+        Reservation.objects.filter(table__restaurant=self.second).update(status='cancelled')
+        rollup(rebuild=True)
+        self.assertEqual([(r, r.reservation_count) for r in top_restaurants(5)], [(self.first, 1)])
+
+    def test_top_restaurants_reads_n_rows(self):
+        self.book(self.first, 12)
+        with self.assertNumQueries(1):
+            list(top_restaurants(3))
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.pasta = create_restaurant('Паста и вино', description='Домашняя итальянская паста')
+        self.sushi = create_restaurant('Сакура', cuisine_type='japanese',
+                                       description='Суши и роллы, итальянский десерт')
+        self.khinkali = create_restaurant('Хинкальная', cuisine_type='georgian',
+                                          description='Хинкали на углях')
+
+    def test_russian_stemming_and_prefix(self):
+        self.assertEqual(list(search('итальянской пасты')), [self.pasta])
+        self.assertEqual(list(search('хинк')), [self.khinkali])
+
+    def test_name_ranked_above_description(self):
+        self.assertEqual(list(search('итальянск')), [self.pasta, self.sushi])
+
+    def test_index_follows_changes(self):
+        tag = Tag.objects.create(name='Веранда')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.sushi.tags.add(tag)
+        self.assertEqual(list(search('веранде')), [self.sushi])
+
+        tag.name = 'Терраса'
+        with self.captureOnCommitCallbacks(execute=True):
+            tag.save()
+        self.assertEqual(list(search('веранда')), [])
+        self.assertEqual(list(search('терраса')), [self.sushi])
+
+        self.sushi.name = 'Токио'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.sushi.save()
+        self.assertEqual(list(search('токио')), [self.sushi])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.sushi.delete()
+        self.assertEqual(list(search('терраса')), [])
+
+    def test_rolled_back_save_leaves_index(self):
+        self.pasta.name = 'Пельменная'
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    self.pasta.save()
+                    raise DatabaseError('откат')
+            except DatabaseError:
+                pass
+        self.assertEqual(list(search('пельменная')), [])
+        self.assertEqual(list(search('паста')), [self.pasta])
+
+    def test_truncated_results_reported(self):
+        with patch('restaurant.search.MAX_RESULTS', 2):
+            results, truncated = search_results('итальянск')
+            self.assertEqual((len(results), truncated), (2, False))
+            create_restaurant('Итальянский дворик')
+            results, truncated = search_results('итальянск')
+            self.assertEqual((len(results), truncated), (2, True))
+            response = self.client.get(reverse('search_restaurants'), {'q': 'итальянск'})
+        self.assertContains(response, 'Найдено ресторанов: больше 2')
+
+    def test_failed_rebuild_keeps_index(self):
+        with patch('restaurant.search.index_restaurant', side_effect=[None, DatabaseError('сбой')]):
+            with self.assertRaises(DatabaseError):
+                rebuild_index()
+        self.assertEqual(list(search('хинк')), [self.khinkali])
+
+    def test_api_search_uses_index(self):
+        response = self.client.get('/api/restaurants/', {'search': 'грузинская'})
+        self.assertEqual([r['name'] for r in response.json()['results']], ['Хинкальная'])
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        # одинаковые названия - порядок держится на id
+        for i in range(7):
+            create_restaurant(f'Ресторан {i // 2}')
+
+    def walk(self, paginator):
+        seen, cursor = [], None
+        while True:
+            page = paginator.page(cursor)
+            seen.extend(page)
+            if not page.has_next():
+                return seen
+            cursor = page.next_cursor
+
+    def test_pages_cover_ordering_without_gaps(self):
+        expected = list(Restaurant.objects.order_by('name', 'id'))
+        self.assertEqual(self.walk(KeysetPaginator(Restaurant.objects.all(), 3)), expected)
+
+    def test_previous_page(self):
+        paginator = KeysetPaginator(Restaurant.objects.all(), 3)
+        first = paginator.page()
+        second = paginator.page(first.next_cursor)
+        back = paginator.page(second.previous_cursor)
+        self.assertEqual(list(back), list(first))
+        self.assertFalse(back.has_previous())
+
+    def test_descending_reservations(self):
+        user = User.objects.create_user('guest')
+        table = Table.objects.create(restaurant=Restaurant.objects.first(), table_number='1', capacity=4)
+        day = date.today()
+        Reservation.objects.bulk_create([
+            Reservation(user=user, table=table, reservation_date=day + timedelta(days=i % 3),
+                        reservation_time=time(12 + i % 2, 0), guests_count=2, status='cancelled')
+            for i in range(8)
+        ])
+        queryset = Reservation.objects.order_by('-reservation_date', '-reservation_time')
+        self.assertEqual(self.walk(KeysetPaginator(queryset, 3)), list(queryset.order_by(
+            '-reservation_date', '-reservation_time', '-id')))
+
+    def test_api_cursor_and_optional_count(self):
+        response = self.client.get('/api/restaurants/').json()
+        self.assertNotIn('count', response)
+        self.assertEqual(len(response['results']), 7)
+        response = self.client.get('/api/restaurants/', {'count': 'true'}).json()
+        self.assertEqual(response['count'], 7)
+        self.assertEqual(self.client.get('/api/restaurants/', {'cursor': 'garbage'}).status_code, 404)
+
+    def test_api_page_size(self):
+        response = self.client.get('/api/restaurants/', {'page_size': 3}).json()
+        self.assertEqual(len(response['results']), 3)
+        self.assertEqual(len(self.client.get(response['next']).json()['results']), 3)
+        with patch('restaurant.pagination.KeysetPagination.max_page_size', 2):
+            self.assertEqual(len(self.client.get('/api/restaurants/', {'page_size': 50}).json()['results']), 2)
+        with patch('restaurant.pagination.KeysetPagination.page_size', 4):
+            self.assertEqual(len(self.client.get('/api/restaurants/', {'page_size': 'x'}).json()['results']), 4)
+
+    def test_html_views(self):
+        response = self.client.get(reverse('all_restaurants'))
+        self.assertEqual(len(response.context['restaurants']), 6)
+        response = self.client.get(reverse('all_restaurants') + response.context['restaurants'].next_url)
+        self.assertEqual(len(response.context['restaurants']), 1)
+        response = self.client.get(reverse('search_restaurants'), {'q': 'ресторан'})
+        self.assertEqual(response.context['search_stats']['count'], 7)
+
+
+class ApiQueryCountTests(TestCase):
+    """Число запросов на эндпоинт не зависит от размера страницы"""
+    endpoints = [
+        '/api/restaurants/',
+        '/api/restaurants/?expand=tables,tags',
+        '/api/restaurants/?expand=tables.reservations&fields=id,name,tables',
+        '/api/restaurants/popular/?expand=tags',
+        '/api/tables/?expand=restaurant.tags,reservations',
+        '/api/reservations/?expand=table.restaurant',
+        '/api/reservations/upcoming/?expand=table',
+    ]
+
+    def setUp(self):
+        self.user = User.objects.create_user('guest')
+        self.tags = [Tag.objects.create(name=f'Тег {i}') for i in range(3)]
+        self.seeded = 0
+
+    def seed(self, count):
+        day = date.today() + timedelta(days=1)
+        for _ in range(count):
+            self.seeded += 1
+            restaurant = create_restaurant(f'Ресторан {self.seeded}')
+            restaurant.tags.set(self.tags[:2])
+            for number in range(2):
+                table = Table.objects.create(restaurant=restaurant, table_number=str(number), capacity=4)
+                Reservation.objects.create(user=self.user, table=table, reservation_date=day,
+                                           reservation_time=time(12, 0), guests_count=2)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        return len(queries)
+
+    def test_query_count_is_constant(self):
+        self.seed(1)
+        small = {url: self.count_queries(url) for url in self.endpoints}
+        self.seed(4)
+        large = {url: self.count_queries(url) for url in self.endpoints}
+        self.assertEqual(small, large)
+
+    def test_expand_and_fields(self):
+        self.seed(1)
+        data = self.client.get('/api/restaurants/?expand=tables,tags&fields=id,name,tables').json()
+        restaurant = data['results'][0]
+        self.assertEqual(set(restaurant), {'id', 'name', 'tables'})
+        self.assertEqual(len(restaurant['tables']), 2)
+        self.assertIn('capacity', restaurant['tables'][0])
+
+        data = self.client.get('/api/reservations/?expand=table.restaurant').json()
+        self.assertEqual(data['results'][0]['table']['restaurant']['name'], 'Ресторан 1')
+
+
+class BulkApiTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('guest')
+        self.restaurant = create_restaurant()
+        self.tables = [
+            Table.objects.create(restaurant=self.restaurant, table_number=str(n), capacity=4) for n in range(10)
+        ]
+        self.day = date.today() + timedelta(days=1)
+
+    def post(self, url, data, method='post'):
+        return getattr(self.client, method)(url, data, content_type='application/json')
+
+    def item(self, table, hour, minute=0, **kwargs):
+        item = {
+            'user': self.user.pk, 'table': table.pk, 'reservation_date': self.day.isoformat(),
+            'reservation_time': f'{hour:02d}:{minute:02d}', 'duration': 60, 'guests_count': 2,
+        }
+        item.update(kwargs)
+        return item
+
+    def test_create_1000_in_bounded_queries(self):
+        items = [
+            self.item(table, 10 + slot) for table in self.tables for slot in range(12)
+        ]
+        items += [self.item(self.tables[0], 10, 0, reservation_date=(self.day + timedelta(days=d)).isoformat())
+                  for d in range(1, 1000 - len(items) + 1)]
+        self.assertEqual(len(items), 1000)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post('/api/reservations/bulk/', items)
+        self.assertEqual(response.status_code, 201, response.content[:500])
+        self.assertEqual(response.json()['count'], 1000)
+        self.assertEqual(Reservation.objects.count(), 1000)
+        self.assertEqual(Reservation.history.count(), 1000)
+        self.assertLess(len(queries), 60)
+
+    def test_errors_reported_per_item_and_nothing_saved(self):
+        Reservation.objects.create(user=self.user, table=self.tables[0], reservation_date=self.day,
+                                   reservation_time=time(18, 0), guests_count=2)
+        items = [
+            self.item(self.tables[1], 18),
+            self.item(self.tables[0], 18, 30),          # пересекается с существующей
+            self.item(self.tables[2], 12, guests_count=10),
+            self.item(self.tables[3], 12),
+            self.item(self.tables[3], 12, 30),          # пересекается с элементом 3
+            dict(self.item(self.tables[4], 12), table=999999),
+        ]
+        response = self.post('/api/reservations/bulk/', items)
+        self.assertEqual(response.status_code, 400)
+        errors = {entry['index']: entry['errors'] for entry in response.json()['errors']}
+        self.assertEqual(set(errors), {5})  # сначала поля, затем доступность
+
+        response = self.post('/api/reservations/bulk/', items[:5])
+        self.assertEqual(response.status_code, 400)
+        errors = {entry['index']: set(entry['errors']) for entry in response.json()['errors']}
+        self.assertEqual(errors, {1: {'table'}, 2: {'guests_count'}, 4: {'table'}})
+        self.assertEqual(Reservation.objects.count(), 1)
+
+    def test_update_and_cancel(self):
+        response = self.post('/api/reservations/bulk/', [self.item(t, 12) for t in self.tables[:3]])
+        ids = [row['id'] for row in response.json()['results']]
+        self.assertEqual(RestaurantPopularity.objects.get(restaurant=self.restaurant).week_count, 3)
+
+        response = self.post('/api/reservations/bulk/', [
+            {'id': ids[0], 'reservation_time': '15:00'},
+            {'id': ids[1], 'table': self.tables[0].pk},
+        ], method='patch')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Reservation.objects.get(pk=ids[0]).reservation_time, time(15, 0))
+
+        response = self.post('/api/reservations/bulk/', [{'id': ids[1], 'reservation_time': '15:30'}], method='patch')
+        self.assertEqual(response.status_code, 400)
+
+        response = self.post('/api/reservations/bulk_cancel/', {'ids': ids[:2]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Reservation.objects.filter(status='cancelled').count(), 2)
+        self.assertEqual(RestaurantPopularity.objects.get(restaurant=self.restaurant).week_count, 1)
+        self.assertEqual(Reservation.history.filter(status='cancelled').count(), 2)
+
+    def test_update_frees_slots_within_batch(self):
+        response = self.post('/api/reservations/bulk/', [self.item(self.tables[0], hour) for hour in (12, 14)])
+        first, second = [row['id'] for row in response.json()['results']]
+
+        # отменяемая бронь освобождает время для другой брони той же пачки
+        response = self.post('/api/reservations/bulk/', [
+            {'id': first, 'status': 'cancelled'},
+            {'id': second, 'reservation_time': '12:00'},
+        ], method='patch')
+        self.assertEqual(response.status_code, 200, response.content)
+
+        Reservation.objects.filter(pk=first).update(status='confirmed', reservation_time=time(14, 0))
+        response = self.post('/api/reservations/bulk/', [
+            {'id': first, 'reservation_time': '12:00'},
+            {'id': second, 'reservation_time': '14:00'},
+        ], method='patch')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual({entry['index'] for entry in response.json()['errors']}, {0, 1})
+        self.assertEqual(Reservation.objects.get(pk=first).reservation_time, time(14, 0))
+
+    def test_update_rereads_rows_under_lock(self):
+        response = self.post('/api/reservations/bulk/', [self.item(self.tables[0], 12)])
+        pk = response.json()['results'][0]['id']
+
+        def edit_then_lock(table_ids):
+            # другой запрос отменяет бронь между предварительным чтением и блокировкой
+            reservation = Reservation.objects.get(pk=pk)
+            reservation.status = 'cancelled'
+            reservation.special_requests = 'Отменил гость'
+            reservation.save()
+            lock_tables(table_ids)
+
+        with patch('restaurant.bulk.lock_tables', side_effect=edit_then_lock):
+            response = self.post('/api/reservations/bulk/', [{'id': pk, 'status': 'confirmed'}], method='patch')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Reservation.objects.get(pk=pk).special_requests, 'Отменил гость')
+        # вклад считается от перечитанного состояния: отмена -1, подтверждение +1
+        self.assertEqual(RestaurantPopularity.objects.get(restaurant=self.restaurant).week_count, 1)
+
+    def test_bulk_cancel_accepts_list_body(self):
+        response = self.post('/api/reservations/bulk/', [self.item(self.tables[0], 12)])
+        ids = [row['id'] for row in response.json()['results']]
+        self.assertEqual(self.post('/api/reservations/bulk_cancel/', ids).status_code, 200)
+        self.assertEqual(self.post('/api/reservations/bulk_cancel/', 'строка').status_code, 400)
+        self.assertEqual(Reservation.objects.get().status, 'cancelled')
+
+    def test_tables(self):
+        response = self.post('/api/tables/bulk/', [
+            {'restaurant': self.restaurant.pk, 'table_number': f'N{n}', 'capacity': 2} for n in range(5)
+        ])
+        self.assertEqual(response.status_code, 201)
+        ids = [row['id'] for row in response.json()['results']]
+        response = self.post('/api/tables/bulk/', [{'id': pk, 'capacity': 6} for pk in ids], method='patch')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Table.objects.filter(capacity=6).count(), 5)
+        response = self.post('/api/tables/bulk/', [{'restaurant': 0, 'capacity': 2}])
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(PROFILING_ENABLED=True, PROFILING_TOKEN='secret-token')
+class ProfilingTests(TestCase):
+    def setUp(self):
+        REGISTRY.reset()
+        for number in range(3):
+            create_restaurant(f'Ресторан {number}')
+
+    def test_records_view_queries_and_templates(self):
+        self.client.get(reverse('all_restaurants'))
+        self.client.get(reverse('all_restaurants'))
+        stats = REGISTRY.as_dict()['all_restaurants']
+        self.assertEqual(stats['requests'], 2)
+        self.assertGreater(stats['queries']['sum'], 0)
+        self.assertGreater(stats['template_ms']['sum'], 0)
+
+    def test_similar_queries_flagged(self):
+        record = RequestRecord()
+        record.queries = [('SELECT * FROM t WHERE id = %s', (n,), 1.0) for n in range(SIMILAR_THRESHOLD)]
+        record.queries += [('SELECT 1', (), 1.0)] * 2
+        duplicates, similar = record.repeated()
+        self.assertEqual(duplicates, 1)
+        self.assertEqual(similar, {'SELECT * FROM t WHERE id = %s': SIMILAR_THRESHOLD})
+
+    def test_metrics_endpoint(self):
+        self.client.get('/api/restaurants/')
+        self.assertEqual(self.client.get(reverse('profiling_metrics')).status_code, 403)
+        auth = {'HTTP_AUTHORIZATION': 'Bearer secret-token'}
+        text = self.client.get(reverse('profiling_metrics'), **auth).content.decode()
+        self.assertIn('restobook_request_queries_count{view="restaurant-list"} 1', text)
+        data = self.client.get(reverse('profiling_metrics'), {'format': 'json'}, **auth).json()
+        self.assertEqual(data['restaurant-list']['requests'], 1)
+
+    def test_management_command(self):
+        out = StringIO()
+        call_command('profiling_report', '/restaurants/', '--repeat', '2', stdout=out)
+        self.assertIn('all_restaurants', out.getvalue())
+
+    @override_settings(ROOT_URLCONF='restobook.urls_async')
+    async def test_async_views_recorded(self):
+        async def get_response(request):
+            return HttpResponse()
+
+        self.assertTrue(iscoroutinefunction(ProfilingMiddleware(get_response)))
+        await self.async_client.get(reverse('all_restaurants'))
+        stats = REGISTRY.as_dict()['all_restaurants']
+        self.assertEqual(stats['requests'], 1)
+        self.assertGreater(stats['queries']['sum'], 0)
+        self.assertGreater(stats['template_ms']['sum'], 0)
+
+    @override_settings(PROFILING_ENABLED=False)
+    def test_disabled_records_nothing(self):
+        self.client.get(reverse('all_restaurants'))
+        self.assertEqual(REGISTRY.as_dict(), {})
+
+
+class ReportTests(TestCase):
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+        override = override_settings(REPORTS_ROOT=self.root.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.restaurants = [create_restaurant(f'Ресторан {n}') for n in range(3)]
+        for restaurant in self.restaurants:
+            Table.objects.create(restaurant=restaurant, table_number='1', capacity=4)
+        self.admin = User.objects.create_superuser('admin', password='secret')
+
+    def wait(self, job):
+        for _ in range(200):
+            job = reports.get_job(job['id'])
+            if job['status'] != 'pending':
+                return job
+            time_module.sleep(0.05)
+        self.fail('Отчёт не сформирован')
+
+    def test_cached_by_content(self):
+        job = reports.request_report([self.restaurants[0].pk])
+        self.assertEqual(self.wait(job)['status'], 'ready')
+        self.assertEqual(reports.request_report([self.restaurants[0].pk])['status'], 'ready')
+
+        Table.objects.create(restaurant=self.restaurants[0], table_number='2', capacity=2)
+        changed = reports.request_report([self.restaurants[0].pk])
+        self.assertNotEqual(changed['id'], job['id'])
+        self.wait(changed)  # рендер не должен пережить временный каталог теста
+
+    def test_stale_job_fails_and_restarts(self):
+        job = reports.request_report([self.restaurants[1].pk])
+        self.wait(job)
+        os.remove(reports.report_path(job))
+        ReportJob.objects.filter(pk=job['id']).update(
+            status='pending', started_at=timezone.now() - reports.report_timeout() - timedelta(seconds=1)
+        )
+        stale = reports.get_job(job['id'])
+        self.assertEqual((stale['status'], stale['error']), ('failed', reports.TIMEOUT_MESSAGE))
+        self.assertEqual(reports.request_report([self.restaurants[1].pk])['status'], 'pending')
+        self.assertEqual(self.wait(job)['status'], 'ready')
+
+    def test_zip_and_merged(self):
+        ids = [restaurant.pk for restaurant in self.restaurants]
+        job = self.wait(reports.request_report(ids, 'zip'))
+        with zipfile.ZipFile(reports.report_path(job)) as archive:
+            self.assertEqual(len(archive.namelist()), 3)
+        merged = self.wait(reports.request_report(ids, 'pdf'))
+        self.assertEqual(merged['kind'], 'merged')
+        with open(reports.report_path(merged), 'rb') as report:
+            self.assertTrue(report.read(4) == b'%PDF')
+
+    def test_admin_action_and_status_page(self):
+        self.client.force_login(self.admin)
+        changelist = reverse('admin:restaurant_restaurant_changelist')
+        response = self.client.post(changelist, {
+            'action': 'generate_pdf_zip',
+            '_selected_action': [restaurant.pk for restaurant in self.restaurants],
+        })
+        self.assertEqual(response.status_code, 302)
+        report_id = response.url.rstrip('/').split('/')[-1]
+        self.wait({'id': report_id})
+        response = self.client.get(response.url)
+        self.assertContains(response, 'Отчёт готов')
+        response = self.client.get(reverse('admin:restaurant_report_download', args=[report_id]))
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'PK'))
+
+
+class ExportImportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('guest')
+        self.restaurant = create_restaurant('Экспорт')
+        self.tables = [Table.objects.create(restaurant=self.restaurant, table_number=str(n), capacity=4)
+                       for n in range(3)]
+        day = date.today() + timedelta(days=1)
+        for table in self.tables:
+            Reservation.objects.create(user=self.user, table=table, reservation_date=day,
+                                       reservation_time=time(12, 0), guests_count=2)
+
+    def test_streaming_export_query_count_is_constant(self):
+        with CaptureQueriesContext(connection) as queries:
+            lines = ''.join(export_lines(Restaurant.objects.all(), 'csv')).splitlines()
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(lines[0], 'id,name,cuisine_type,address,phone,created_at')
+        self.assertIn('Экспорт (3 столиков)', lines[1])
+
+        jsonl = ''.join(export_lines(Reservation.objects.all(), 'jsonl')).splitlines()
+        self.assertEqual(len(jsonl), 3)
+
+    def test_admin_streaming_export(self):
+        self.client.force_login(User.objects.create_superuser('admin', password='secret'))
+        response = self.client.get(reverse('admin:restaurant_reservation_export_stream', args=['csv']))
+        self.assertTrue(response.streaming)
+        self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 4)
+
+    def test_import_creates_updates_and_reports_throughput(self):
+        rows = 'restaurant,table_number,capacity,price_per_hour\n'
+        rows += 'Экспорт,0,6,700\n'                      # обновление
+        rows += 'Экспорт,1,4,500.00\n'                   # без изменений
+        rows += ''.join(f'{self.restaurant.pk},N{n},2,300\n' for n in range(50))
+        with CaptureQueriesContext(connection) as queries:
+            result = import_file('table', rows.encode(), 'csv', batch_size=20)
+        self.assertEqual(result.errors, [])
+        self.assertEqual((result.created, result.updated, result.unchanged), (50, 1, 1))
+        self.assertGreater(result.rows_per_second, 0)
+        self.assertLess(len(queries), 20)
+        self.assertEqual(Table.objects.get(restaurant=self.restaurant, table_number='0').capacity, 6)
+        self.assertEqual(Table.history.filter(table_number__startswith='N').count(), 50)
+
+        with CaptureQueriesContext(connection) as queries:
+            result = import_file('table', rows.encode(), 'csv', batch_size=20)
+        self.assertEqual(result.unchanged, 52)
+        self.assertLess(len(queries), 10)
+
+    def test_import_is_all_or_nothing(self):
+        rows = 'user,table,reservation_date,reservation_time,guests_count\n'
+        day = (date.today() + timedelta(days=1)).isoformat()
+        rows += f'guest,{self.tables[0].pk},{day},15:00,2\n'
+        rows += f'guest,{self.tables[0].pk},{day},12:30,2\n'    # пересекается с существующей
+        rows += f'nobody,{self.tables[1].pk},{day},15:00,2\n'
+        result = import_file('reservation', rows.encode(), 'csv')
+        self.assertEqual([line for line, _message in result.errors], [3])
+        self.assertEqual(Reservation.objects.count(), 3)
+
+        rows = rows.splitlines()
+        result = import_file('reservation', '\n'.join(rows[:2] + rows[3:]).encode(), 'csv')
+        self.assertEqual([line for line, _message in result.errors], [2])
+
+        result = import_file('reservation', '\n'.join(rows[:2]).encode(), 'csv')
+        self.assertEqual(result.created, 1)
+        self.assertEqual(RestaurantPopularity.objects.get(restaurant=self.restaurant).week_count, 4)
+
+    def test_restaurant_import_updates_search_index(self):
+        rows = [{'name': 'Сеть', 'address': f'Адрес {n}', 'description': 'Пельмени', 'phone': '1',
+                 'cuisine_type': 'Русская'} for n in range(3)]
+        result = import_file('restaurant', '\n'.join(json.dumps(row) for row in rows).encode(), 'jsonl')
+        self.assertEqual(result.created, 3)
+        self.assertEqual(search('пельмени').count(), 3)
+        self.assertEqual(Restaurant.objects.filter(cuisine_type='russian').count(), 3)
+
+    def test_broken_lines_are_row_errors(self):
+        lines = [
+            json.dumps({'user': 'guest', 'table': self.tables[0].pk, 'guests_count': 2,
+                        'reservation_date': (date.today() + timedelta(days=1)).isoformat(),
+                        'reservation_time': '15:00'}),
+            '{"user": "guest",',
+            '',
+            '[1, 2]',
+        ]
+        result = import_file('reservation', '\n'.join(lines).encode(), 'jsonl')
+        self.assertEqual([line for line, _message in result.errors], [2, 3])
+        self.assertTrue(result.errors[0][1].startswith('Некорректный JSON'))
+        self.assertEqual(result.errors[1][1], 'Ожидается JSON-объект')
+
+        result = import_file('table', 'restaurant,table_number,capacity\nЭкспорт,7,2\n'.encode() + b'\xff\n', 'csv')
+        self.assertEqual(result.errors, [(2, 'Файл не в кодировке UTF-8')])
+        self.assertFalse(Table.objects.filter(table_number='7').exists())
+
+        with tempfile.NamedTemporaryFile(suffix='.jsonl') as upload:
+            upload.write(b'{"name": \xff}\n')
+            upload.flush()
+            with self.assertRaisesMessage(CommandError, 'ошибок: 1'):
+                call_command('bulk_import', 'restaurant', upload.name, stderr=StringIO())
+
+
+class HistoryTests(TestCase):
+    # TestCase не коммитит транзакцию - колбэки on_commit выполняются вручную
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.restaurant = create_restaurant('История')
+
+    def test_history_is_written_once_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            tables = [Table.objects.create(restaurant=self.restaurant, table_number=str(n), capacity=2)
+                      for n in range(5)]
+            self.assertEqual(Table.history.count(), 0)
+            with CaptureQueriesContext(connection) as queries:
+                for table in tables:
+                    table.capacity = 4
+                    table.save()
+            # UPDATE столика и сброс cache_version ресторана на каждое сохранение, истории нет
+            self.assertEqual(len(queries), 10)
+        self.assertEqual(len([callback for callback in callbacks
+                              if isinstance(getattr(callback, '__self__', None), HistoryBuffer)]), 1)
+        self.assertEqual(Table.history.filter(history_type='+').count(), 5)
+        self.assertEqual(Table.history.filter(history_type='~').count(), 5)
+
+    def test_unchanged_save_is_skipped_and_reason_lists_fields(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            table = Table.objects.create(restaurant=self.restaurant, table_number='1', capacity=2)
+            table.save()
+            table = Table.objects.get(pk=table.pk)
+            table.save()
+            table.capacity = 6
+            table.price_per_hour = 100
+            table.save()
+        records = list(Table.history.order_by('history_id'))
+        self.assertEqual([record.history_type for record in records], ['+', '~'])
+        self.assertEqual(records[1].history_change_reason, 'Изменено: capacity, price_per_hour')
+
+    def test_rolled_back_savepoint_writes_no_history(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Table.objects.create(restaurant=self.restaurant, table_number='1', capacity=2)
+            try:
+                with transaction.atomic():
+                    Table.objects.create(restaurant=self.restaurant, table_number='2', capacity=2)
+                    raise ValueError
+            except ValueError:
+                pass
+            Table.objects.create(restaurant=self.restaurant, table_number='3', capacity=2)
+        self.assertEqual(sorted(Table.history.values_list('table_number', flat=True)), ['1', '3'])
+
+    @override_settings(HISTORY_DISABLED_MODELS=['restaurant.table'])
+    def test_disabled_model(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Table.objects.create(restaurant=self.restaurant, table_number='1', capacity=2)
+        self.assertEqual(Table.history.count(), 0)
+
+    def test_prune_history_keeps_last_state(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            table = Table.objects.create(restaurant=self.restaurant, table_number='1', capacity=2)
+            for capacity in range(3, 6):
+                table.capacity = capacity
+                table.save()
+            gone = Table.objects.create(restaurant=self.restaurant, table_number='2', capacity=2)
+            gone.delete()
+        Table.history.update(history_date=timezone.now() - timedelta(days=400))
+        table.capacity = 8
+        with self.captureOnCommitCallbacks(execute=True):
+            table.save()
+
+        with tempfile.TemporaryDirectory() as archive_dir:
+            call_command('prune_history', days=365, archive_dir=archive_dir, stdout=StringIO())
+            archived = os.listdir(archive_dir)
+            self.assertEqual(len(archived), 1)
+            with gzip.open(os.path.join(archive_dir, archived[0]), 'rt') as archive:
+                self.assertEqual(len(archive.readlines()), 5)
+        remaining = list(Table.history.order_by('history_id').values_list('capacity', 'history_type'))
+        self.assertEqual(remaining, [(5, '~'), (8, '~')])
+
+
+class AvailabilityTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('guest')
+        self.restaurant = create_restaurant('Слоты', opening_hours='12:00-16:00')
+        self.small = Table.objects.create(restaurant=self.restaurant, table_number='1', capacity=2)
+        self.large = Table.objects.create(restaurant=self.restaurant, table_number='2', capacity=6)
+        self.day = date.today() + timedelta(days=1)
+
+    def book(self, table, start, duration, status='confirmed'):
+        return Reservation.objects.create(user=self.user, table=table, reservation_date=self.day,
+                                          reservation_time=from_minutes(start), duration=duration,
+                                          guests_count=2, status=status)
+
+    def is_free(self, start, duration=60):
+        return self.small in free_tables(self.restaurant, self.day, from_minutes(start), duration=duration)
+
+    def test_adjacent_bookings_do_not_overlap(self):
+        start = 14 * 60
+        for duration, _label in Reservation.DURATION_CHOICES:
+            Reservation.objects.all().delete()
+            with self.subTest(duration=duration):
+                self.book(self.small, start, duration)
+                # [start, start + duration) - полуоткрытый интервал
+                self.assertTrue(self.is_free(start - 60))
+                self.assertTrue(self.is_free(start + duration))
+                self.assertFalse(self.is_free(start - 59))
+                self.assertFalse(self.is_free(start + duration - 1))
+
+    def test_bookings_crossing_the_start(self):
+        start = 16 * 60
+        for duration, _label in Reservation.DURATION_CHOICES:
+            with self.subTest(duration=duration):
+                # началась раньше и заканчивается на минуту позже начала запроса
+                Reservation.objects.all().delete()
+                self.book(self.small, start - duration + 1, duration)
+                self.assertFalse(self.is_free(start))
+                # заканчивается ровно в начале запроса
+                Reservation.objects.all().delete()
+                self.book(self.small, start - duration, duration)
+                self.assertTrue(self.is_free(start))
+
+    def test_inactive_bookings_ignored(self):
+        self.book(self.small, 14 * 60, 120, status='cancelled')
+        self.assertTrue(self.is_free(14 * 60))
+
+    def test_day_slots(self):
+        self.book(self.small, 13 * 60, 60)
+        self.book(self.large, 12 * 60, 240, status='cancelled')
+        slots = day_slots(self.restaurant, self.day, duration=60, step=30)
+        at = lambda *hours: [time(int(hour), int(hour % 1 * 60)) for hour in hours]
+        self.assertEqual(slots[self.small], at(12, 14, 14.5, 15))
+        self.assertEqual(slots[self.large], at(12, 12.5, 13, 13.5, 14, 14.5, 15))
+        self.assertEqual(list(day_slots(self.restaurant, self.day, guests_count=4, duration=60)), [self.large])
+        slots = day_slots(self.restaurant, self.day, duration=120, opens=time(12, 0), closes=time(15, 0), step=60)
+        self.assertEqual(slots[self.small], at())
+        self.assertEqual(slots[self.large], at(12, 13))
+
+
+class AvailabilityGridTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('guest')
+        self.restaurant = create_restaurant('Сетка', opening_hours='12:00-22:00')
+        self.tables = [Table.objects.create(restaurant=self.restaurant, table_number=str(n), capacity=2 + n)
+                       for n in range(3)]
+        self.day = date.today() + timedelta(days=1)
+        Reservation.objects.create(user=self.user, table=self.tables[0], reservation_date=self.day,
+                                   reservation_time=time(14, 0), duration=60, guests_count=2)
+        self.url = f'/api/restaurants/{self.restaurant.pk}/availability/'
+
+    def test_grid_follows_opening_hours_and_reservations(self):
+        response = self.client.get(self.url, {'start': self.day.isoformat(), 'days': 2, 'duration': 60, 'step': 60})
+        data = response.json()
+        self.assertEqual(data['days'][0]['times'], [f'{hour}:00' for hour in range(12, 22)])
+        first = data['days'][0]['tables']
+        self.assertEqual(first[str(self.tables[0].pk)], '1101111111')
+        self.assertEqual(first[str(self.tables[1].pk)], '1' * 10)
+        self.assertEqual(data['days'][1]['tables'][str(self.tables[0].pk)], '1' * 10)
+
+        response = self.client.get(self.url, {'start': self.day.isoformat(), 'days': 1, 'duration': 60,
+                                              'step': 30, 'guests': 4})
+        self.assertEqual(list(response.json()['days'][0]['tables']), [str(self.tables[2].pk)])
+
+    def test_query_count_does_not_depend_on_range(self):
+        counts = []
+        for days in (1, 31):
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(self.url, {'days': days})
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+        self.assertLessEqual(counts[0], 4)
+
+    def test_etag_and_not_modified_days(self):
+        params = {'start': self.day.isoformat(), 'days': 2}
+        response = self.client.get(self.url, params)
+        etag = response['ETag']
+        day_etags = [day['etag'] for day in response.json()['days']]
+        self.assertEqual(self.client.get(self.url, params, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        Reservation.objects.create(user=self.user, table=self.tables[1], reservation_date=self.day + timedelta(days=1),
+                                   reservation_time=time(18, 0), guests_count=2)
+        response = self.client.get(self.url, params, HTTP_IF_NONE_MATCH=', '.join(f'"{tag}"' for tag in day_etags))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        first, second = response.json()['days']
+        self.assertTrue(first['not_modified'])
+        self.assertNotIn('tables', first)
+        self.assertIn('tables', second)
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.client.get(self.url, {'days': 100}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'duration': 45}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'start': 'завтра'}).status_code, 400)
+
+
+class ScheduleTests(TestCase):
+    def test_parse(self):
+        self.assertEqual(schedule.parse('10:00-22:00')[4], [(600, 1320)])
+        parsed = schedule.parse('Пн-Пт 12:00-15:00, 18:00-23:00; Сб-Вс 12:00-02:00')
+        self.assertEqual(parsed[1], [(720, 900), (1080, 1380)])
+        self.assertEqual(parsed[5], [(720, 1440)])
+        self.assertEqual(parsed[6], [(0, 120), (720, 1440)])
+        # ночь с воскресенья на понедельник
+        self.assertEqual(parsed[0], [(0, 120), (720, 900), (1080, 1380)])
+        self.assertEqual(schedule.parse('Пн выходной, Вт-Вс 10:00-22:00')[0], [])
+        self.assertEqual(schedule.parse('круглосуточно')[3], [(0, 1440)])
+        self.assertIsNone(schedule.parse('по договорённости'))
+
+    def test_intervals_follow_opening_hours(self):
+        restaurant = create_restaurant(opening_hours='Пт 18:00-02:00')
+        self.assertEqual(OpeningInterval.objects.filter(restaurant=restaurant).count(), 2)
+        restaurant.opening_hours = 'непонятно'
+        restaurant.save()
+        self.assertEqual(
+            set(restaurant.opening_intervals.values_list('opens', 'closes')), {(schedule.DAY_START, schedule.DAY_END)}
+        )
+
+    def test_unchanged_hours_are_not_resynced(self):
+        create_restaurant(opening_hours='Пт 18:00-02:00')
+        restaurant = Restaurant.objects.get()
+        restaurant.description = 'Новое описание'
+        with CaptureQueriesContext(connection) as queries:
+            restaurant.save()
+        self.assertFalse([q for q in queries.captured_queries if 'restaurant_openinginterval' in q['sql']])
+        self.assertEqual(OpeningInterval.objects.filter(restaurant=restaurant).count(), 2)
+
+    def test_open_at_queries(self):
+        late = create_restaurant('Поздний', opening_hours='Пт 18:00-02:00')
+        create_restaurant('Дневной', opening_hours='10:00-22:00')
+        friday = timezone.make_naive(timezone.now()).replace(hour=21, minute=30)
+        friday += timedelta(days=(4 - friday.weekday()) % 7)
+        open_names = lambda moment, duration=0: set(
+            schedule.open_at(Restaurant.objects.all(), moment, duration).values_list('name', flat=True)
+        )
+        self.assertEqual(open_names(friday), {'Поздний', 'Дневной'})
+        self.assertEqual(open_names(friday, 60), {'Поздний'})
+        self.assertEqual(open_names(friday, 270), {'Поздний'})
+        self.assertEqual(open_names(friday, 300), set())
+        self.assertEqual(open_names(friday + timedelta(days=1)), {'Дневной'})
+
+        response = self.client.get('/api/restaurants/', {'open_at': friday.strftime('%Y-%m-%dT%H:%M'), 'open_for': 60})
+        self.assertEqual([row['id'] for row in response.json()['results']], [late.pk])
+
+    def test_reservation_form_uses_schedule(self):
+        restaurant = create_restaurant(opening_hours='Пн-Пт 12:00-15:00; Сб-Вс выходной')
+        restaurant = Restaurant.objects.prefetch_related('opening_intervals').get(pk=restaurant.pk)
+        monday = date.today() + timedelta(days=7 - date.today().weekday())
+        data = {'reservation_date': monday, 'reservation_time': '13:00', 'duration': 120, 'guests_count': 2}
+        self.assertTrue(ReservationForm(data, restaurant=restaurant).is_valid())
+        form = ReservationForm(dict(data, reservation_time='14:00'), restaurant=restaurant)
+        self.assertIn('12:00–15:00', form.errors['reservation_time'][0])
+        form = ReservationForm(dict(data, reservation_date=monday + timedelta(days=5)), restaurant=restaurant)
+        self.assertEqual(form.errors['reservation_time'], ['В этот день ресторан закрыт'])
+
+
+def make_image(color, size=(1600, 1200)):
+    from PIL import Image
+
+    buffer = BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'PNG')
+    return SimpleUploadedFile('photo.png', buffer.getvalue(), content_type='image/png')
+
+
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+        override = override_settings(MEDIA_ROOT=self.root.name, IMAGE_VARIANTS_ROOT=os.path.join(self.root.name, 'v'))
+        override.enable()
+        self.addCleanup(override.disable)
+        # свой пул на тест: задания дожидаются до удаления каталога
+        executor = ThreadPoolExecutor(max_workers=2)
+        patcher = patch('restaurant.images.get_executor', return_value=executor)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(executor.shutdown)
+
+    def upload(self, color):
+        with self.captureOnCommitCallbacks(execute=True):
+            restaurant = create_restaurant(image=make_image(color))
+        for _ in range(200):
+            if images.get_manifest(restaurant.image_hash):
+                return restaurant
+            time_module.sleep(0.05)
+        self.fail('Варианты не построены')
+
+    def test_variants_built_off_request_and_shared_by_content(self):
+        restaurant = self.upload((200, 10, 10))
+        manifest = images.get_manifest(restaurant.image_hash)
+        self.assertEqual(manifest['sizes'], {'thumb': [160, 120], 'card': [400, 300], 'detail': [1200, 900]})
+        for name in images.VARIANTS:
+            for fmt in images.FORMATS:
+                self.assertTrue(os.path.exists(images.variant_path(restaurant.image_hash, name, fmt)))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            twin = create_restaurant('Двойник', image=make_image((200, 10, 10)))
+        self.assertEqual(twin.image_hash, restaurant.image_hash)
+        self.assertNotEqual(twin.image.name, restaurant.image.name)
+
+    def test_srcset_tag_and_pdf_use_variants(self):
+        restaurant = self.upload((10, 200, 10))
+        html = Template("{% load restaurant_extras %}{% restaurant_image r 'card' %}").render(Context({'r': restaurant}))
+        self.assertIn('type="image/webp"', html)
+        self.assertIn(f'{restaurant.image_hash}/thumb.webp 160w', html)
+        self.assertIn(f'{restaurant.image_hash}/card.jpg"', html)
+
+        from .utils import restaurant_report_data
+        self.assertEqual(restaurant_report_data(restaurant)['image_path'],
+                         images.variant_path(restaurant.image_hash, 'thumb'))
+
+    def test_image_hash_not_exposed_by_api(self):
+        restaurant = create_restaurant()
+        url = f'/api/restaurants/{restaurant.pk}/'
+        self.assertNotIn('image_hash', self.client.get(url).json())
+        serializer = RestaurantSerializer(restaurant, data={'image_hash': 'f' * 64}, partial=True)
+        self.assertTrue(serializer.is_valid())
+        self.assertNotIn('image_hash', serializer.validated_data)
+
+    def test_original_served_until_ready(self):
+        restaurant = create_restaurant(image=make_image((10, 10, 200)))  # on_commit не выполнен
+        html = Template("{% load restaurant_extras %}{% restaurant_image r %}").render(Context({'r': restaurant}))
+        self.assertIn(restaurant.image.url, html)
+        self.assertNotIn('<picture>', html)
+
+
+class FragmentCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.restaurant = create_restaurant('Фрагмент')
+        self.table = Table.objects.create(restaurant=self.restaurant, table_number='1', capacity=4)
+
+    def version(self):
+        return Restaurant.objects.values_list('cache_version', flat=True).get(pk=self.restaurant.pk)
+
+    def test_version_bumped_by_restaurant_table_and_tag_changes(self):
+        version = self.version()
+        self.table.capacity = 6
+        self.table.save()
+        self.assertEqual(self.version(), version + 1)
+        self.restaurant.tags.add(Tag.objects.create(name='Веранда'))
+        self.assertEqual(self.version(), version + 2)
+        self.restaurant.phone = '+71111111111'
+        self.restaurant.save()
+        self.assertEqual(self.restaurant.cache_version, version + 3)
+        self.restaurant.increase_prices(10)
+        self.assertEqual(self.version(), version + 4)
+
+    def test_version_not_exposed_by_api(self):
+        url = f'/api/restaurants/{self.restaurant.pk}/'
+        self.assertNotIn('cache_version', self.client.get(url).json())
+        version = self.version()
+        self.client.patch(url, {'cache_version': 0}, content_type='application/json')
+        self.assertEqual(self.version(), version + 1)
+
+    def test_cards_cached_until_version_changes(self):
+        self.assertContains(self.client.get('/restaurants/'), 'Москва')
+        # update() не меняет версию - карточка отдаётся из кэша
+        Restaurant.objects.filter(pk=self.restaurant.pk).update(address='Казань')
+        self.assertNotContains(self.client.get('/restaurants/'), 'Казань')
+        restaurant = Restaurant.objects.get(pk=self.restaurant.pk)
+        restaurant.save()
+        self.assertContains(self.client.get('/restaurants/'), 'Казань')
+
+    def test_search_card_shows_cached_table_stats(self):
+        self.assertContains(self.client.get('/search/', {'q': 'Фрагмент'}), 'Столиков: 1')
+        with CaptureQueriesContext(connection) as warm:
+            self.client.get('/search/', {'q': 'Фрагмент'})
+        self.assertFalse([query for query in warm.captured_queries if 'restaurant_table' in query['sql']])
+        Table.objects.create(restaurant=self.restaurant, table_number='2', capacity=2)
+        self.assertContains(self.client.get('/search/', {'q': 'Фрагмент'}), 'Столиков: 2')
+
+    def test_detail_slots_stay_dynamic(self):
+        url = f'/restaurants/{self.restaurant.pk}/'
+        self.assertContains(self.client.get(url), '12:00')
+        user = User.objects.create_user('guest')
+        today = timezone.now().date()
+        for hour in range(0, 24, 4):
+            Reservation.objects.create(user=user, table=self.table, reservation_date=today,
+                                       reservation_time=time(hour, 0), duration=240, guests_count=2)
+        self.assertContains(self.client.get(url), 'нет свободных слотов')
+
+
+class RestaurantSnapshotTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user('guest')
+        self.restaurant = create_restaurant('Снимок', opening_hours='12:00-22:00')
+        self.today = timezone.now().date()
+
+    def add_tables(self, count):
+        start = self.restaurant.tables.count()
+        for number in range(start, start + count):
+            table = Table.objects.create(restaurant=self.restaurant, table_number=str(number),
+                                         capacity=2 + number, price_per_hour=400 + number * 100)
+            Reservation.objects.create(user=self.user, table=table, reservation_date=self.today,
+                                       reservation_time=time(18, 0), guests_count=2)
+
+    def load(self):
+        return snapshot.load(snapshot.queryset().get(pk=self.restaurant.pk), self.today)
+
+    def test_loader_query_count(self):
+        self.add_tables(1)
+        with self.assertNumQueries(5):
+            self.load()
+        self.add_tables(4)
+        with self.assertNumQueries(5):
+            data = self.load()
+        self.assertEqual(len(data.reservations), 5)
+        with self.assertNumQueries(0):
+            [reservation.table.table_number for reservation in data.reservations]
+
+    def test_detail_view_query_count(self):
+        url = f'/restaurants/{self.restaurant.pk}/'
+        self.add_tables(1)
+        self.client.get(url)  # сессия создаётся при первом просмотре
+        cache.clear()
+        with CaptureQueriesContext(connection) as small:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.add_tables(4)
+        cache.clear()
+        with self.assertNumQueries(len(small)):
+            self.client.get(url)
+        self.assertLessEqual(len(small), 6)
+
+    def test_stats_and_availability_match_queries(self):
+        self.add_tables(3)
+        Table.objects.create(restaurant=self.restaurant, table_number='free', capacity=4)
+        data = self.load()
+        self.assertEqual(data.stats.tables_count, 4)
+        self.assertEqual(data.stats.max_capacity, 4)
+        self.assertEqual(data.stats.min_price, 400)
+        self.assertAlmostEqual(data.stats.avg_capacity, 3.25)
+        self.assertEqual(
+            {table.pk for table in data.available_tables},
+            set(self.restaurant.get_available_tables(self.today).values_list('pk', flat=True)),
+        )
+        self.assertEqual(
+            {table.pk: slots for table, slots in data.table_slots.items()},
+            {table.pk: slots for table, slots in day_slots(self.restaurant, self.today).items()},
+        )
+
+
+class BenchmarkSuiteTests(TestCase):
+    def setUp(self):
+        self.dataset = benchmarks.seed(restaurants=6, tables=3, reservations=300, users=3, seed_value=1)
+
+    def test_seed_is_skewed_towards_popular_restaurants(self):
+        self.assertEqual(Restaurant.objects.count(), 6)
+        self.assertEqual(Table.objects.count(), 18)
+        self.assertEqual(Reservation.objects.count(), self.dataset.reservations)
+        self.assertGreater(self.dataset.reservations, 250)
+        per_restaurant = dict(Reservation.objects.values_list('table__restaurant').annotate(n=Count('id')))
+        ids = self.dataset.restaurant_ids
+        self.assertGreater(per_restaurant[ids[0]], 2 * per_restaurant.get(ids[-1], 0))
+        self.assertEqual(top_restaurants(1)[0].pk, ids[0])
+
+    def test_micro_and_load_results(self):
+        micro = benchmarks.run_micro(self.dataset, repeat=2)
+        self.assertEqual(set(micro), {'get_available_tables', 'available_table_manager',
+                                      'popular_restaurants', 'generate_restaurant_pdf'})
+        self.assertGreater(micro['get_available_tables']['queries'], 0)
+        load = benchmarks.run_load(self.dataset, requests=30, concurrency=1)
+        self.assertEqual(sum(row['count'] for row in load['routes'].values()), 30)
+        self.assertFalse([route for route, row in load['routes'].items() if row['errors']])
+        json.dumps({'micro': micro, 'load': load})
+
+    def test_compare_flags_regressions(self):
+        before = {'micro': {'a': {'median_ms': 10.0}, 'b': {'median_ms': 10.0}}}
+        after = {'micro': {'a': {'median_ms': 11.0}, 'b': {'median_ms': 15.0}}}
+        rows = {name: regression for _section, name, _old, _new, _ratio, regression in benchmarks.compare(before, after)}
+        self.assertEqual(rows, {'a': False, 'b': True})
+
+
+@override_settings(ROOT_URLCONF='restobook.urls_async')
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user('guest')
+        self.restaurant = create_restaurant('Асинхронный', opening_hours='12:00-22:00')
+        self.table = Table.objects.create(restaurant=self.restaurant, table_number='1', capacity=4)
+        day = timezone.now().date() + timedelta(days=1)
+        Reservation.objects.create(user=self.user, table=self.table, reservation_date=day,
+                                   reservation_time=time(19, 0), guests_count=2, status='confirmed')
+        rollup(rebuild=True)
+
+    def sync_get(self, url, **extra):
+        with override_settings(ROOT_URLCONF='restobook.urls'):
+            return self.client.get(url, **extra)
+
+    async def test_pages_render(self):
+        for url in ['/', '/restaurants/', f'/restaurants/{self.restaurant.pk}/', '/search/?q=Асинхронный']:
+            response = await self.async_client.get(url)
+            self.assertEqual(response.status_code, 200, url)
+            self.assertContains(response, 'Асинхронный')
+        response = await self.async_client.get('/search/?q=Асинхронный')
+        self.assertEqual(response.context['search_stats']['count'], 1)
+        self.assertEqual((await self.async_client.get('/restaurants/999999/')).status_code, 404)
+
+    def test_detail_remembers_view_and_query_count(self):
+        url = f'/restaurants/{self.restaurant.pk}/'
+        get = async_to_sync(self.async_client.get)
+        get(url)
+        self.assertEqual(self.async_client.session['recently_viewed_restaurants'], [self.restaurant.pk])
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = get(url)
+        self.assertEqual(response.context['stats'].tables_count, 1)
+        # сессия + ресторан, столики, интервалы работы и два запроса к броням
+        self.assertEqual(len(queries), 6)
+
+    async def test_api_matches_sync_viewsets(self):
+        for url in ['/api/restaurants/popular/?expand=tags',
+                    '/api/reservations/upcoming/?expand=table',
+                    f'/api/restaurants/{self.restaurant.pk}/availability/?days=3']:
+            response = await self.async_client.get(url)
+            self.assertEqual(response.status_code, 200, url)
+            expected = await sync_to_async(self.sync_get)(url)
+            self.assertEqual(response.json(), expected.json(), url)
+        self.assertEqual(response['ETag'], expected['ETag'])
+
+    async def test_availability_errors_and_etag(self):
+        url = f'/api/restaurants/{self.restaurant.pk}/availability/'
+        self.assertEqual((await self.async_client.get(url, {'days': 99})).status_code, 400)
+        self.assertEqual((await self.async_client.get('/api/restaurants/999999/availability/')).status_code, 404)
+        etag = (await self.async_client.get(url))['ETag']
+        self.assertEqual((await self.async_client.get(url, headers={'If-None-Match': etag})).status_code, 304)
+        self.assertEqual((await self.async_client.post(url)).status_code, 405)
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'], REPLICA_HEALTH_INTERVAL=60)
+class ReplicaRoutingTests(TransactionTestCase):
+    """Реплика - отдельный SQLite-файл, который обновляет sync_sqlite_replicas"""
+
+    def setUp(self):
+        replica = tempfile.NamedTemporaryFile(suffix='.sqlite3', delete=False)
+        replica.close()
+        self.addCleanup(os.remove, replica.name)
+        # соединение вне DATABASES: тестовый раннер не подменяет его на default
+        connections['replica1'] = DatabaseWrapper(
+            dict(connections['default'].settings_dict, NAME=f'file:{replica.name}?mode=ro'), 'replica1'
+        )
+        self.addCleanup(self.drop_replica)
+        self.restaurant = create_restaurant('На реплике')
+        routing.sync_sqlite_replicas()
+        self.factory = RequestFactory()
+
+    def drop_replica(self):
+        connections['replica1'].close()
+        del connections['replica1']
+        routing.health.status.clear()
+
+    def handle(self, request, view=None):
+        """Прогоняет запрос через middleware; возвращает ответ и алиас чтения в представлении"""
+        seen = {}
+
+        def get_response(request):
+            if view:
+                view()
+            seen['db'] = router.db_for_read(Restaurant)
+            seen['count'] = Restaurant.objects.count()
+            return HttpResponse()
+
+        response = routing.ReplicaRoutingMiddleware(get_response)(request)
+        return response, seen
+
+    def test_safe_request_reads_replica_until_synced(self):
+        response, seen = self.handle(self.factory.get('/'))
+        self.assertEqual(seen, {'db': 'replica1', 'count': 1})
+        self.assertNotIn(routing.STICKY_COOKIE, response.cookies)
+        # вне запроса (команды, сигналы) - всегда основная БД
+        self.assertEqual(router.db_for_read(Restaurant), 'default')
+
+        create_restaurant('Новый')
+        self.assertEqual(self.handle(self.factory.get('/'))[1]['count'], 1)  # реплика отстаёт
+        routing.sync_sqlite_replicas()
+        self.assertEqual(self.handle(self.factory.get('/'))[1]['count'], 2)
+
+    def test_writes_pin_request_and_set_sticky_cookie(self):
+        response, seen = self.handle(self.factory.get('/'), view=lambda: create_restaurant('Новый'))
+        self.assertEqual(seen, {'db': 'default', 'count': 2})
+        self.assertIn(routing.STICKY_COOKIE, response.cookies)
+
+        response, seen = self.handle(self.factory.post('/'))
+        self.assertEqual(seen['db'], 'default')
+        self.assertIn(routing.STICKY_COOKIE, response.cookies)
+
+        request = self.factory.get('/')
+        request.COOKIES[routing.STICKY_COOKIE] = response.cookies[routing.STICKY_COOKIE].value
+        self.assertEqual(self.handle(request)[1]['db'], 'default')
+        request.COOKIES[routing.STICKY_COOKIE] = str(time_module.time() - 1)
+        self.assertEqual(self.handle(request)[1]['db'], 'replica1')
+
+    def test_atomic_primary_db_and_sessions_stay_on_primary(self):
+        def in_atomic():
+            with transaction.atomic():
+                self.assertEqual(router.db_for_read(Restaurant), 'default')
+
+        self.assertEqual(self.handle(self.factory.get('/'), view=in_atomic)[1]['db'], 'replica1')
+        self.assertEqual(self.handle(self.factory.get('/'), view=routing.pin)[1]['db'], 'default')
+        self.assertEqual(routing.primary_db(lambda request: 1).__name__, '<lambda>')
+
+        def session_read():
+            self.assertEqual(router.db_for_read(Session), 'default')
+            router.db_for_write(Session)
+
+        response, seen = self.handle(self.factory.get('/'), view=session_read)
+        self.assertEqual(seen['db'], 'replica1')
+        self.assertNotIn(routing.STICKY_COOKIE, response.cookies)
+
+    def test_unhealthy_replica_falls_back_to_primary(self):
+        self.assertTrue(routing.health.check('replica1'))
+        self.assertFalse(routing.health.check('missing'))
+        routing.health.status['replica1'] = (False, time_module.monotonic())
+        self.assertEqual(self.handle(self.factory.get('/'))[1], {'db': 'default', 'count': 1})
+        with override_settings(REPLICA_HEALTH_INTERVAL=0):
+            self.assertEqual(self.handle(self.factory.get('/'))[1]['db'], 'replica1')
+
+    def test_make_reservation_reads_primary(self):
+        user = User.objects.create_user('guest', password='pass')
+        table = Table.objects.create(restaurant=self.restaurant, table_number='1', capacity=4)
+        self.client.force_login(user)
+        # столика ещё нет на реплике - страница брони всё равно открывается
+        self.assertEqual(self.client.get(reverse('make_reservation', args=[table.pk])).status_code, 200)
+
+
+class SqliteTuningTests(TransactionTestCase):
+    def setUp(self):
+        self.restaurant = create_restaurant()
+        self.table = Table.objects.create(restaurant=self.restaurant, table_number='1', capacity=4)
+        self.user = User.objects.create_user('guest')
+
+    def reservation(self, hour=19):
+        return Reservation(user=self.user, table=self.table, reservation_date=date.today() + timedelta(days=1),
+                           reservation_time=time(hour, 0), guests_count=2)
+
+    def begins(self, run):
+        with CaptureQueriesContext(connection) as queries:
+            run()
+        return [query['sql'] for query in queries if query['sql'].startswith('BEGIN')]
+
+    def test_booking_begins_immediate_only_when_enabled(self):
+        # вторая транзакция - запись истории после коммита
+        self.assertEqual(self.begins(lambda: book_table(self.reservation(12))), ['BEGIN', 'BEGIN'])
+        with override_settings(SQLITE_IMMEDIATE_WRITES=True):
+            self.assertEqual(self.begins(lambda: book_table(self.reservation(15))), ['BEGIN IMMEDIATE', 'BEGIN'])
+            # вложенный блок - точка сохранения, режим соединения не меняется
+            with transaction.atomic():
+                self.assertEqual(self.begins(lambda: book_table(self.reservation(19))), [])
+        self.assertIsNone(connection.transaction_mode)
+        self.assertEqual(Reservation.objects.count(), 3)
+
+    def test_concurrent_immediate_bookings_keep_one(self):
+        day = date.today() + timedelta(days=1)
+        users = User.objects.bulk_create([User(username=f'guest{i}') for i in range(40)])
+
+        def attempt(user):
+            try:
+                book_table(Reservation(user_id=user.pk, table_id=self.table.pk, reservation_date=day,
+                                       reservation_time=time(19, 0), guests_count=2))
+                return True
+            except BookingConflict:
+                return False
+
+        with override_settings(SQLITE_IMMEDIATE_WRITES=True), ThreadPoolExecutor(max_workers=8) as pool:
+            results = list(pool.map(attempt, users))
+        self.assertEqual(results.count(True), 1)
+
+    def test_profile_pragmas_and_maintenance(self):
+        from django.conf import settings
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'tuned.sqlite3')
+            options = {'init_command': sqlite_tuning.init_command(settings.SQLITE_PROFILES['production'])}
+            connections['tuned'] = DatabaseWrapper(
+                dict(connections['default'].settings_dict, NAME=path, OPTIONS=options), 'tuned'
+            )
+            try:
+                values = sqlite_tuning.pragmas('tuned')
+                self.assertEqual(values['journal_mode'], 'wal')
+                self.assertEqual(values['synchronous'], 1)  # NORMAL
+                self.assertEqual(values['busy_timeout'], 5000)
+                with connections['tuned'].cursor() as cursor:
+                    cursor.execute('CREATE TABLE t (x integer)')
+                    cursor.execute('INSERT INTO t VALUES (1)')
+                self.assertGreater(os.path.getsize(path + '-wal'), 0)
+                out = StringIO()
+                call_command('sqlite_maintenance', database='tuned', stdout=out)
+                self.assertIn('checkpoint TRUNCATE: перенесено', out.getvalue())
+                self.assertEqual(os.path.getsize(path + '-wal'), 0)
+            finally:
+                connections['tuned'].close()
+                del connections['tuned']
+        # тестовая БД в памяти - без WAL
+        out = StringIO()
+        call_command('sqlite_maintenance', no_optimize=True, stdout=out)
+        self.assertIn('не в режиме WAL', out.getvalue())
+        with self.assertRaises(ValueError):
+            sqlite_tuning.checkpoint('FAST')
+
+    def test_contention_benchmark_counts_every_attempt(self):
+        dataset = benchmarks.seed(restaurants=2, tables=2, reservations=20, users=2, seed_value=1)
+        result = benchmarks.run_contention(dataset, writers=2, readers=1, bookings=3)
+        attempts = result['booked'] + result['conflicts'] + result['write_locked'] + result['write_errors']
+        self.assertEqual(attempts, 6)
+        self.assertGreater(result['booked'], 0)
+        json.dumps(result)
+
+
+class ReservationArchiveTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('guest', password='pass')
+        self.restaurant = create_restaurant('Архивный')
+        self.table = Table.objects.create(restaurant=self.restaurant, table_number='1', capacity=4)
+        today = timezone.now().date()
+        self.old = [
+            Reservation.objects.create(user=self.user, table=self.table, reservation_date=today - timedelta(days=days),
+                                       reservation_time=time(hour, 0), guests_count=2, status=status)
+            for days, hour, status in [(200, 19, 'confirmed'), (300, 19, 'cancelled'), (200, 13, 'pending')]
+        ]
+        self.recent = [
+            Reservation.objects.create(user=self.user, table=self.table, reservation_date=today + timedelta(days=days),
+                                       reservation_time=time(12, 0), guests_count=2, status='confirmed')
+            for days in (-1, 1)
+        ]
+        self.before = archive.horizon(180)
+
+    def test_moves_old_reservations_in_batches_without_signals(self):
+        history = Reservation.history.count()
+        counters = list(ReservationCounter.objects.values_list('date', 'count'))
+        self.assertEqual(list(archive.archive_reservations(self.before, batch_size=2)), [2, 1])
+        self.assertEqual(set(Reservation.objects.values_list('pk', flat=True)), {r.pk for r in self.recent})
+        archived = ArchivedReservation.objects.get(pk=self.old[1].pk)
+        self.assertEqual((archived.status, archived.table_id, archived.user_id), ('cancelled', self.table.pk, self.user.pk))
+        self.assertEqual(archived.get_status_display(), 'Отменено')
+        self.assertEqual(Reservation.history.count(), history)
+        self.assertEqual(list(ReservationCounter.objects.values_list('date', 'count')), counters)
+        self.assertEqual(list(archive.archive_reservations(self.before)), [])
+
+    def test_limit_and_resume(self):
+        self.assertEqual(sum(archive.archive_reservations(self.before, batch_size=1, limit=2)), 2)
+        self.assertEqual(archive.pending(self.before).count(), 1)
+        out = StringIO()
+        call_command('archive_reservations', days=180, stdout=out)
+        self.assertIn('Перенесено в архив: 1', out.getvalue())
+        self.assertEqual(ArchivedReservation.objects.count(), 3)
+        with self.assertRaises(ValueError):
+            archive.horizon(3)
+
+    def test_history_pages_across_hot_and_archive(self):
+        list(archive.archive_reservations(self.before))
+        expected = [r.pk for r in sorted(self.old + self.recent, key=lambda r: (r.reservation_date, r.reservation_time, r.pk),
+                                        reverse=True)]
+        querysets = [queryset.order_by('-reservation_date', '-reservation_time', '-id')
+                     for queryset in archive.user_history(self.user)]
+        paginator = MergedKeysetPaginator(querysets, 2)
+        page, seen = paginator.page(with_count=True), []
+        self.assertEqual(page.count, 5)
+        while True:
+            seen.extend(r.pk for r in page)
+            if not page.has_next():
+                break
+            last = page
+            page = paginator.page(page.next_cursor)
+        self.assertEqual(seen, expected)
+        self.assertEqual([r.pk for r in paginator.page(page.previous_cursor)], [r.pk for r in last])
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('user_reservations'))
+        self.assertEqual([r.pk for r in response.context['reservations']], expected)
+        self.assertContains(response, 'В архиве', count=3)
+
+    def test_admin_redirects_to_archive(self):
+        list(archive.archive_reservations(self.before))
+        self.client.force_login(User.objects.create_superuser('admin', password='pass'))
+        pk = self.old[0].pk
+        response = self.client.get(reverse('admin:restaurant_reservation_change', args=[pk]))
+        self.assertRedirects(response, reverse('admin:restaurant_archivedreservation_change', args=[pk]))
+        self.assertEqual(self.client.get(reverse('admin:restaurant_archivedreservation_changelist')).status_code, 200)
+
+
+class UserSummaryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user('guest', password='pass')
+        self.restaurant = create_restaurant('Сводка')
+        self.table = Table.objects.create(restaurant=self.restaurant, table_number='7', capacity=4)
+        self.today = timezone.now().date()
+
+    def reserve(self, days, hour=19, status='confirmed', user=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Reservation.objects.create(user=user or self.user, table=self.table, guests_count=2,
+                                              reservation_date=self.today + timedelta(days=days),
+                                              reservation_time=time(hour, 0), status=status)
+
+    def render_tags(self):
+        request = RequestFactory().get('/')
+        request.user = self.user
+        template = Template('{% load restaurant_extras %}{% user_reservation_count %}|{% user_has_reservations %}')
+        return template.render(Context({'request': request}))
+
+    def test_tags_read_cached_summary(self):
+        self.assertEqual(self.render_tags(), '0|False')
+        self.reserve(2)
+        self.reserve(5, status='pending')
+        self.assertEqual(self.render_tags(), '2|True')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.render_tags(), '2|True')
+
+        summary = user_summary.get(self.user.pk)
+        self.assertEqual(summary.counts, {'confirmed': 1, 'pending': 1})
+        self.assertEqual(summary.active, 2)
+        self.assertEqual(summary.upcoming['reservation_date'], self.today + timedelta(days=2))
+        self.assertEqual(summary.upcoming['table__table_number'], '7')
+
+    def test_invalidated_on_cancel_reassign_and_archive(self):
+        reservation = self.reserve(2)
+        old = self.reserve(-200)
+        self.client.force_login(self.user)
+        self.client.post(reverse('cancel_reservation', args=[reservation.pk]))
+        summary = user_summary.get(self.user.pk)
+        self.assertEqual(summary.counts, {'cancelled': 1, 'confirmed': 1})
+        self.assertIsNone(summary.upcoming)
+
+        other = User.objects.create_user('other')
+        self.assertEqual(user_summary.get(other.pk).total, 0)
+        reservation.user = other
+        with self.captureOnCommitCallbacks(execute=True):
+            reservation.save()
+        self.assertEqual(user_summary.get(self.user.pk).total, 1)
+        self.assertEqual(user_summary.get(other.pk).total, 1)
+
+        self.assertEqual(user_summary.get(self.user.pk).recent, [(old.pk, False)])
+        with self.captureOnCommitCallbacks(execute=True):
+            list(archive.archive_reservations(archive.horizon(180)))
+        summary = user_summary.get(self.user.pk)
+        self.assertEqual(summary.recent, [(old.pk, True)])
+        self.assertEqual(summary.total, 1)
+
+    def test_first_page_from_recent_ids(self):
+        reservations = [self.reserve(days, hour) for days in range(1, 7) for hour in (12, 19)]
+        expected = [r.pk for r in sorted(reservations, key=lambda r: (r.reservation_date, r.reservation_time), reverse=True)]
+        self.client.force_login(self.user)
+        self.client.get(reverse('user_reservations'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('user_reservations'))
+        page = response.context['reservations']
+        self.assertEqual([r.pk for r in page], expected[:10])
+        self.assertContains(response, 'Всего броней: <strong>12</strong>')
+        # сессия, пользователь и брони первой страницы по id
+        self.assertEqual(len(queries), 3)
+        rest = self.client.get(reverse('user_reservations') + page.next_url)
+        self.assertEqual([r.pk for r in rest.context['reservations']], expected[10:])
+
+
+class WaitlistTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.owner = User.objects.create_user('owner', password='pass')
+        self.guest = User.objects.create_user('guest', password='pass')
+        self.restaurant = create_restaurant('Очередь')
+        self.day = timezone.now().date() + timedelta(days=1)
+
+    def reserve(self, table, user=None, at=time(19, 0)):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Reservation.objects.create(user=user or self.owner, table=table, guests_count=2, status='confirmed',
+                                              reservation_date=self.day, reservation_time=at)
+
+    def entry(self, pk, guests, at=time(19, 0), flexibility=0, duration=120):
+        return WaitlistEntry(pk=pk, guests_count=guests, reservation_time=at, flexibility=flexibility, duration=duration)
+
+    def book_form(self, **extra):
+        data = {'reservation_date': self.day.isoformat(), 'reservation_time': '19:00', 'duration': 120,
+                'guests_count': 2, 'special_requests': '', 'join_waitlist': 'on', 'flexibility': 0}
+        data.update(extra)
+        return data
+
+    def test_matcher_best_fit_and_window(self):
+        entries = [self.entry(1, 2), self.entry(2, 4), self.entry(3, 3), self.entry(4, 2)]
+        matcher = waitlist.Matcher([(10, 6), (11, 2), (12, 4)], {}, lambda start, duration: True)
+        matches = {entry.pk: (table_id, start) for entry, table_id, start in matcher.assign(entries)}
+        # меньший столик - самой большой помещающейся компании, среди равных - первой в очереди
+        self.assertEqual(matches, {1: (11, 1140), 2: (12, 1140), 3: (10, 1140)})
+
+        busy = {11: [(1140, 1260)]}
+        matcher = waitlist.Matcher([(11, 2)], busy, lambda start, duration: start >= 1080)
+        [(entry, table_id, start)] = matcher.assign([self.entry(1, 2, flexibility=60, duration=60)])
+        self.assertEqual(start, 1080)
+        self.assertFalse(matcher.timelines[11].is_free(1100, 1120))
+        self.assertTrue(matcher.timelines[11].is_free(1260, 1300))
+
+    def test_cancel_assigns_table_to_waiting_guest(self):
+        table = Table.objects.create(restaurant=self.restaurant, table_number='1', capacity=4)
+        taken = self.reserve(table)
+        self.client.force_login(self.guest)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('make_reservation', args=[table.pk]), self.book_form())
+        self.assertRedirects(response, reverse('user_reservations'))
+        entry = WaitlistEntry.objects.get(user=self.guest)
+        self.assertEqual(entry.status, 'waiting')
+        self.assertContains(self.client.get(reverse('user_reservations')), 'Лист ожидания')
+
+        self.client.force_login(self.owner)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('cancel_reservation', args=[taken.pk]))
+        entry.refresh_from_db()
+        self.assertEqual(entry.status, 'assigned')
+        assigned = entry.reservation
+        self.assertEqual((assigned.user, assigned.table, assigned.status), (self.guest, table, 'pending'))
+        self.assertEqual(assigned.history.count(), 1)
+        self.assertEqual(ReservationCounter.objects.get(restaurant=self.restaurant, date=self.day).count, 1)
+        summary = user_summary.get(self.guest.pk)
+        self.assertEqual((summary.total, list(summary.waiting)), (1, []))
+
+    def test_join_takes_other_free_table_at_once(self):
+        small = Table.objects.create(restaurant=self.restaurant, table_number='1', capacity=2)
+        large = Table.objects.create(restaurant=self.restaurant, table_number='2', capacity=4)
+        self.reserve(small)
+        self.client.force_login(self.guest)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('make_reservation', args=[small.pk]), self.book_form())
+        self.assertEqual(Reservation.objects.get(user=self.guest).table, large)
+
+        # без галочки - прежняя ошибка и никакой очереди
+        other = User.objects.create_user('other')
+        self.client.force_login(other)
+        data = self.book_form()
+        del data['join_waitlist']
+        response = self.client.post(reverse('make_reservation', args=[small.pk]), data)
+        self.assertRedirects(response, reverse('make_reservation', args=[small.pk]), fetch_redirect_response=False)
+        self.assertFalse(WaitlistEntry.objects.filter(user=other).exists())
+
+    def test_batched_pass_over_long_queue(self):
+        tables = [Table.objects.create(restaurant=self.restaurant, table_number=str(n), capacity=2 + n % 5)
+                  for n in range(20)]
+        taken = [self.reserve(table).pk for table in tables]
+        users = User.objects.bulk_create([User(username=f'waiting{n}') for n in range(300)])
+        WaitlistEntry.objects.bulk_create([
+            WaitlistEntry(user=user, restaurant=self.restaurant, reservation_date=self.day,
+                          reservation_time=time(19, 0), flexibility=0, guests_count=1 + n % 6)
+            for n, user in enumerate(users)
+        ])
+        with self.captureOnCommitCallbacks() as callbacks:
+            bulk.cancel_reservations(taken)
+        with CaptureQueriesContext(connection) as queries:
+            for callback in callbacks:
+                callback()
+        # запросов - не по заявке и не по столику
+        self.assertLess(len(queries), 30)
+        assigned = Reservation.objects.filter(status='pending').select_related('table')
+        self.assertEqual(assigned.count(), 20)
+        for reservation in assigned:
+            # самая большая помещающаяся компания (размеры 1..6 есть в очереди)
+            self.assertEqual(reservation.guests_count, min(reservation.table.capacity, 6))
+        self.assertEqual(WaitlistEntry.objects.filter(status='assigned').count(), 20)
+
+    def test_save_signal_leave_and_expire(self):
+        table = Table.objects.create(restaurant=self.restaurant, table_number='1', capacity=4)
+        taken = self.reserve(table)
+        first = WaitlistEntry.objects.create(user=self.guest, restaurant=self.restaurant, reservation_date=self.day,
+                                             reservation_time=time(20, 0), flexibility=60, guests_count=2)
+        second = WaitlistEntry.objects.create(user=self.owner, restaurant=self.restaurant, reservation_date=self.day,
+                                              reservation_time=time(19, 0), guests_count=2)
+        self.client.force_login(self.owner)
+        self.client.post(reverse('leave_waitlist', args=[second.pk]))
+        second.refresh_from_db()
+        self.assertEqual(second.status, 'cancelled')
+
+        taken.status = 'cancelled'
+        with self.captureOnCommitCallbacks(execute=True):
+            taken.save()
+        first.refresh_from_db()
+        self.assertEqual(first.status, 'assigned')
+        # желаемое 20:00 свободно и без сдвига
+        self.assertEqual(first.reservation.reservation_time, time(20, 0))
+
+        old = WaitlistEntry.objects.create(user=self.guest, restaurant=self.restaurant, guests_count=2,
+                                           reservation_date=timezone.now().date() - timedelta(days=1),
+                                           reservation_time=time(19, 0))
+        out = StringIO()
+        call_command('process_waitlist', stdout=out)
+        old.refresh_from_db()
+        self.assertEqual(old.status, 'expired')
+        self.assertIn('Закрыто просроченных заявок: 1', out.getvalue())
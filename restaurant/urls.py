@@ -1,5 +1,5 @@
 from django.urls import path, include
-from . import views
+from . import views, profiling
 from .views_api import RestaurantViewSet, TableViewSet, ReservationViewSet
 from rest_framework.routers import DefaultRouter
 
@@ -23,4 +23,6 @@ urlpatterns = [
     path('reservations/', views.user_reservations, name='user_reservations'),
     path('reservations/<int:table_id>/book/', views.make_reservation, name='make_reservation'),
     path('reservations/<int:reservation_id>/cancel/', views.cancel_reservation, name='cancel_reservation'),
+    path('waitlist/<int:entry_id>/leave/', views.leave_waitlist, name='leave_waitlist'),
+    path('metrics/', profiling.metrics, name='profiling_metrics'),
 ] + router.urls
\ No newline at end of file
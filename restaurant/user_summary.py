@@ -0,0 +1,136 @@
+"""Сводка броней пользователя в кэше.
+
+Теги user_reservation_count/user_has_reservations и шапка страницы
+"Мои бронирования" раньше запрашивали Reservation на каждой странице.
+Сводка - количество по статусам (с архивом), ближайшая бронь, id
+последних броней и заявки в листе ожидания - строится при промахе кэша несколькими запросами и
+лежит в кэше до изменения броней пользователя. В пределах запроса она
+запоминается на request, так что повторные теги кэш не трогают.
+
+Сброс - после коммита: сигналы сохранения и удаления брони, а также
+пути без сигналов (отмена через update(), пакетные операции, импорт,
+архивация, лист ожидания) вызывают invalidate() явно. USER_SUMMARY_TTL ограничивает
+жизнь сводки, если пересчёт разошёлся с параллельным сбросом.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import ArchivedReservation, Reservation, WaitlistEntry
+
+KEY = 'restaurant:user-summary:{}'
+
+# Сколько последних броней помнить: первая страница "Мои бронирования" и запас
+RECENT_LIMIT = 11
+
+ORDERING = ('-reservation_date', '-reservation_time', '-id')
+
+
+class ReservationSummary:
+    """counts - {статус: количество} по рабочей таблице и архиву;
+    upcoming - ближайшая активная бронь (словарь) или None;
+    recent - [(id, в архиве)] последних броней в порядке истории;
+    waiting - заявки в листе ожидания (словари).
+    """
+    waiting = ()
+
+    def __init__(self, counts, upcoming, recent, day, waiting=()):
+        self.counts = counts
+        self.upcoming = upcoming
+        self.recent = recent
+        self.day = day
+        self.waiting = waiting
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+    @property
+    def active(self):
+        return sum(self.counts.get(status, 0) for status in Reservation.ACTIVE_STATUSES)
+
+    def by_status(self):
+        """[(подпись, количество)] в порядке Reservation.STATUS_CHOICES"""
+        return [(label, self.counts.get(status, 0)) for status, label in Reservation.STATUS_CHOICES]
+
+
+def cache_key(user_id):
+    return KEY.format(user_id)
+
+
+def build(user_id, today=None):
+    today = today or timezone.now().date()
+    counts = {}
+    for model in (Reservation, ArchivedReservation):
+        for row in model.objects.filter(user_id=user_id).values('status').annotate(n=Count('id')).order_by():
+            counts[row['status']] = counts.get(row['status'], 0) + row['n']
+
+    upcoming = Reservation.objects.filter(
+        user_id=user_id, reservation_date__gte=today, status__in=Reservation.ACTIVE_STATUSES,
+    ).order_by('reservation_date', 'reservation_time').values(
+        'id', 'reservation_date', 'reservation_time', 'guests_count', 'status',
+        'table__table_number', 'table__restaurant_id', 'table__restaurant__name',
+    ).first()
+
+    # последние из каждой таблицы, слитые как в MergedKeysetPaginator
+    fields = ('reservation_date', 'reservation_time', 'id')
+    rows = []
+    for model, archived in ((Reservation, False), (ArchivedReservation, True)):
+        rows += [
+            row + (archived,)
+            for row in model.objects.filter(user_id=user_id).order_by(*ORDERING).values_list(*fields)[:RECENT_LIMIT]
+        ]
+    rows.sort(reverse=True)
+    recent = [(pk, archived) for _date, _time, pk, archived in rows[:RECENT_LIMIT]]
+
+    waiting = list(WaitlistEntry.objects.filter(user_id=user_id, status='waiting').order_by(
+        'reservation_date', 'reservation_time'
+    ).values(
+        'id', 'reservation_date', 'reservation_time', 'flexibility', 'guests_count',
+        'restaurant_id', 'restaurant__name',
+    ))
+    return ReservationSummary(counts, upcoming, recent, today, waiting)
+
+
+def get(user_id):
+    today = timezone.now().date()
+    summary = cache.get(cache_key(user_id))
+    # ближайшая бронь зависит от даты
+    if summary is None or summary.day != today:
+        summary = build(user_id, today)
+        cache.set(cache_key(user_id), summary, getattr(settings, 'USER_SUMMARY_TTL', 3600))
+    return summary
+
+
+def for_request(request):
+    """Сводка текущего пользователя, одна на запрос; None для анонимного"""
+    if not request.user.is_authenticated:
+        return None
+    summary = getattr(request, '_reservation_summary', None)
+    if summary is None:
+        summary = request._reservation_summary = get(request.user.pk)
+    return summary
+
+
+def recent_reservations(summary, limit=RECENT_LIMIT):
+    """Последние брони из сводки с ресторанами: запрос по первичному ключу на каждую таблицу"""
+    recent = summary.recent[:limit]
+    objects = {}
+    for model, archived in ((Reservation, False), (ArchivedReservation, True)):
+        ids = [pk for pk, in_archive in recent if in_archive == archived]
+        if ids:
+            objects.update(model.objects.select_related('table', 'table__restaurant').in_bulk(ids))
+    return [objects[pk] for pk, _archived in recent if pk in objects]
+
+
+def invalidate(user_ids):
+    user_ids = {pk for pk in user_ids if pk is not None}
+    if user_ids:
+        cache.delete_many([cache_key(pk) for pk in user_ids])
+
+
+def invalidate_on_commit(user_ids):
+    user_ids = set(user_ids)
+    transaction.on_commit(lambda: invalidate(user_ids))
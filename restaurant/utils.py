@@ -1,48 +1,119 @@
+from functools import lru_cache
 from io import BytesIO
-from django.http import HttpResponse
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.utils import ImageReader
 import os
+import tempfile
 
-def generate_restaurant_pdf(restaurant):
-    """Генерация PDF документа для ресторана"""
-    buffer = BytesIO()
-    p = canvas.Canvas(buffer, pagesize=A4)
+
+def write_atomic(path, write):
+    """Запись во временный файл и переименование - читатели не видят половину файла"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as output:
+            write(output)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+async def alist(queryset):
+    """Выполнить QuerySet через асинхронный интерфейс ORM (с prefetch_related)"""
+    return [obj async for obj in queryset]
+
+
+async def resolved(value=None):
+    """Готовое значение в asyncio.gather на месте необязательного запроса"""
+    return value
+
+
+def restaurant_report_data(restaurant, tables=None):
+    """Данные отчёта в виде словаря: его можно хешировать и передавать в процесс-воркер"""
+    if tables is None:
+        tables = restaurant.tables.all()
+    from .images import small_variant_path
+    image_path, image_mtime = None, None
+    if restaurant.image:
+        try:
+            # в отчёт идёт маленькая копия; пока её нет - оригинал
+            image_path = small_variant_path(restaurant) or restaurant.image.path
+            image_mtime = os.path.getmtime(image_path)
+        except (OSError, ValueError):
+            image_path = None
+    return {
+        'id': restaurant.id,
+        'name': restaurant.name,
+        'cuisine': restaurant.get_cuisine_type_display(),
+        'address': restaurant.address,
+        'phone': restaurant.phone,
+        'opening_hours': restaurant.opening_hours,
+        'image_path': image_path,
+        'image_mtime': image_mtime,
+        'tables': [
+            (table.table_number, table.capacity, str(table.price_per_hour)) for table in tables
+        ],
+    }
+
+
+@lru_cache(maxsize=64)
+def load_image(path, mtime):
+    """Изображение читается с диска один раз на (путь, время изменения)"""
+    return ImageReader(path)
+
+
+def draw_restaurant(p, data):
+    """Страница(ы) отчёта одного ресторана на холсте p"""
     width, height = A4
     
     # Заголовок
     p.setFont("Helvetica-Bold", 16)
-    p.drawString(50, height - 50, f"Ресторан: {restaurant.name}")
+    p.drawString(50, height - 50, f"Ресторан: {data['name']}")
     
     # Информация о ресторане
     p.setFont("Helvetica", 12)
-    p.drawString(50, height - 80, f"Тип кухни: {restaurant.get_cuisine_type_display()}")
-    p.drawString(50, height - 100, f"Адрес: {restaurant.address}")
-    p.drawString(50, height - 120, f"Телефон: {restaurant.phone}")
-    p.drawString(50, height - 140, f"Часы работы: {restaurant.opening_hours}")
+    p.drawString(50, height - 80, f"Тип кухни: {data['cuisine']}")
+    p.drawString(50, height - 100, f"Адрес: {data['address']}")
+    p.drawString(50, height - 120, f"Телефон: {data['phone']}")
+    p.drawString(50, height - 140, f"Часы работы: {data['opening_hours']}")
     
     # Изображение ресторана
-    if restaurant.image and os.path.exists(restaurant.image.path):
+    if data['image_path']:
         try:
-            image = ImageReader(restaurant.image.path)
+            image = load_image(data['image_path'], data['image_mtime'])
             p.drawImage(image, 400, height - 150, width=100, height=75)
-        except:
+        except Exception:
             p.drawString(400, height - 150, "Изображение недоступно")
     
     # Список столиков
     p.drawString(50, height - 180, "Столики:")
     y_position = height - 200
     
-    for table in restaurant.tables.all():
+    for table_number, capacity, price in data['tables']:
         if y_position < 100:
             p.showPage()
+            p.setFont("Helvetica", 12)
             y_position = height - 50
-        p.drawString(70, y_position, f"• Столик {table.table_number}: {table.capacity} чел., {table.price_per_hour} руб./час")
+        p.drawString(70, y_position, f"• Столик {table_number}: {capacity} чел., {price} руб./час")
         y_position -= 20
     
     p.showPage()
+
+
+def render_pdf(documents, output):
+    """PDF с отчётами по списку ресторанов (данные restaurant_report_data)"""
+    p = canvas.Canvas(output, pagesize=A4)
+    for data in documents:
+        draw_restaurant(p, data)
     p.save()
-    
+
+
+def generate_restaurant_pdf(restaurant):
+    """Генерация PDF документа для ресторана"""
+    buffer = BytesIO()
+    render_pdf([restaurant_report_data(restaurant)], buffer)
     buffer.seek(0)
-    return buffer
\ No newline at end of file
+    return buffer
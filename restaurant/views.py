@@ -1,17 +1,23 @@
 from django.shortcuts import render, get_object_or_404, redirect
-from django.db.models import Count, Q, Avg, Max, Min, F
+from django.db.models import Count, F
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import login, logout, authenticate
 from django.contrib.auth.forms import AuthenticationForm
 from django.contrib import messages
 from django.utils import timezone
-from datetime import date, timedelta, time
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+from datetime import date, time
 from django.http import HttpResponseRedirect, Http404, HttpResponse
-from django.db import transaction
 
 from .models import Restaurant, Table, Reservation, Tag
 from .forms import RestaurantForm, ReservationForm, CustomUserCreationForm
+from .availability import day_slots
+from .booking import book_table, BookingConflict
+from .dashboard import get_snapshot, invalidate_snapshot
+from . import archive, fragments, popularity, schedule, snapshot, user_summary, waitlist
+from .fragments import LazyTableStats
+from .search import search, search_results
+from .pagination import MergedKeysetPaginator, paginate, with_urls
+from .routing import primary_db
 
 def home(request):
     today = date.today()
@@ -20,79 +26,36 @@ def home(request):
     recently_viewed = request.session.get('recently_viewed_restaurants', [])
     recent_restaurants = Restaurant.objects.filter(id__in=recently_viewed)
     
-    # Chaining filters и Limiting QuerySets
-    week_ago = today - timedelta(days=7)
-    popular_restaurants = Restaurant.objects.annotate(
-        reservation_count=Count('tables__reservations', 
-                              filter=Q(tables__reservations__reservation_date__gte=week_ago))
-    ).filter(reservation_count__gt=0).order_by('-reservation_count')[:4]
-    
-    # Использование кастомного менеджера
-    available_tables = Table.available.select_related('restaurant').order_by('-capacity')[:6]
-    
-    # Цепочка методов с агрегацией
-    affordable_restaurants = Restaurant.objects.annotate(
-        min_price=Min('tables__price_per_hour')
-    ).filter(min_price__isnull=False).order_by('min_price')[:3]
-    
-    large_tables_restaurants = Restaurant.objects.annotate(
-        max_capacity=Max('tables__capacity')
-    ).filter(max_capacity__gte=6).order_by('-max_capacity')[:3]
-    
-    # values() и values_list() для оптимизации
-    cuisine_stats = Restaurant.objects.values('cuisine_type').annotate(
-        count=Count('id')
-    )
-    restaurant_ids = Restaurant.objects.values_list('id', flat=True)[:10]
-    
-    # count() и exists()
-    stats = {
-        'total_restaurants': Restaurant.objects.count(),
-        'has_restaurants': Restaurant.objects.exists(),
-        'avg_table_price': Table.objects.aggregate(avg_price=Avg('price_per_hour'))['avg_price'] or 0,
-        'max_capacity': Table.objects.aggregate(max_cap=Max('capacity'))['max_cap'] or 0,
-        'min_price': Table.objects.aggregate(min_pr=Min('price_per_hour'))['min_pr'] or 0,
-    }
+    # Популярные рестораны, свободные столики и статистика - из кэша
+    dashboard = get_snapshot()
     
     # Поиск с __icontains и __contains
     search_results = None
     search_query = ""
     if 'q' in request.GET:
         search_query = request.GET['q']
-        search_results = Restaurant.objects.filter(
-            Q(name__icontains=search_query) | 
-            Q(cuisine_type__icontains=search_query) |
-            Q(address__contains=search_query) |
-            Q(description__icontains=search_query)
-        ).distinct()
+        search_results = search(search_query)
     
     context = {
-        'popular_restaurants': popular_restaurants,
-        'available_tables': available_tables,
-        'affordable_restaurants': affordable_restaurants,
-        'large_tables_restaurants': large_tables_restaurants,
-        'stats': stats,
+        'popular_restaurants': dashboard['popular_restaurants'][:4],
+        'available_tables': dashboard['available_tables'],
+        'affordable_restaurants': dashboard['affordable_restaurants'],
+        'large_tables_restaurants': dashboard['large_tables_restaurants'],
+        'stats': dashboard['stats'],
         'search_results': search_results,
         'search_query': search_query,
         'today': today,
         'recent_restaurants': recent_restaurants,
-        'cuisine_stats': cuisine_stats,
+        'cuisine_stats': dashboard['cuisine_stats'],
     }
     return render(request, 'restaurant/home.html', context)
 
 def all_restaurants(request):
-    """Пагинация с try/except"""
-    restaurant_list = Restaurant.objects.all()
+    """Курсорная пагинация по (name, id)"""
+    restaurant_list = Restaurant.objects.order_by('name', 'id')
     
-    paginator = Paginator(restaurant_list, 6)
-    page = request.GET.get('page')
-    
-    try:
-        restaurants = paginator.page(page)
-    except PageNotAnInteger:
-        restaurants = paginator.page(1)
-    except EmptyPage:
-        restaurants = paginator.page(paginator.num_pages)
+    # Keyset-пагинация: без COUNT(*) и OFFSET
+    restaurants = paginate(request, restaurant_list, 6)
     
     # values() для оптимизации
     restaurant_data = Restaurant.objects.values('id', 'name', 'cuisine_type')[:10]
@@ -105,10 +68,7 @@ def all_restaurants(request):
 
 def restaurant_detail(request, restaurant_id):
     # get_object_or_404 автоматически вызывает Http404
-    restaurant = get_object_or_404(
-        Restaurant.objects.select_related('created_by').prefetch_related('tags', 'tables'), 
-        id=restaurant_id
-    )
+    restaurant = get_object_or_404(snapshot.queryset(), id=restaurant_id)
     
     # Сохранение в сессии для истории просмотров
     recently_viewed = request.session.get('recently_viewed_restaurants', [])
@@ -117,28 +77,18 @@ def restaurant_detail(request, restaurant_id):
         recently_viewed = recently_viewed[:5]
         request.session['recently_viewed_restaurants'] = recently_viewed
     
-    # Использование собственного метода модели
-    available_tables = restaurant.get_available_tables(timezone.now().date())
-    
-    # values_list() для оптимизации
-    table_ids = restaurant.tables.values_list('id', flat=True)
-    
-    reservations = Reservation.objects.filter(table__in=table_ids)[:5]
-    
-    stats = {
-        'tables_count': restaurant.tables.count(),
-        'tables_exist': restaurant.tables.exists(),
-        'avg_capacity': restaurant.tables.aggregate(avg_cap=Avg('capacity'))['avg_cap'] or 0,
-        'min_price': restaurant.tables.aggregate(min_pr=Min('price_per_hour'))['min_pr'] or 0,
-        'max_capacity': restaurant.tables.aggregate(max_cap=Max('capacity'))['max_cap'] or 0,
-    }
+    # Слоты, свободные столики, статистика и последние брони - два запроса к броням
+    data = snapshot.load(restaurant, timezone.now().date())
     
     context = {
         'restaurant': restaurant,
-        'tables': restaurant.tables.all(),
-        'available_tables': available_tables,
-        'reservations': reservations,
-        'stats': stats,
+        'tables': data.tables,
+        'available_tables': data.available_tables,
+        'table_slots': data.table_slots,
+        # ключ кэша списка столиков: меняется вместе со свободными слотами
+        'slots_version': data.slots_version,
+        'reservations': data.reservations,
+        'stats': data.stats,
     }
     return render(request, 'restaurant/restaurant_detail.html', context)
 
@@ -218,39 +168,36 @@ def restaurant_delete(request, restaurant_id):
 def search_restaurants(request):
     restaurants = None
     query = ""
+    open_now = bool(request.GET.get('open_now'))
     
     if 'q' in request.GET:
         query = request.GET['q']
-        # __icontains и __contains
-        restaurants = Restaurant.objects.filter(
-            Q(name__icontains=query) | 
-            Q(cuisine_type__icontains=query) |
-            Q(address__contains=query) |
-            Q(description__icontains=query)
-        ).distinct()
-    
-    if restaurants:
-        paginator = Paginator(restaurants, 8)
-        page = request.GET.get('page')
-        
-        try:
-            restaurants = paginator.page(page)
-        except PageNotAnInteger:
-            restaurants = paginator.page(1)
-        except EmptyPage:
-            restaurants = paginator.page(paginator.num_pages)
+        candidates = Restaurant.objects.all()
+        if open_now:
+            # открыт сейчас и ещё хотя бы на стандартную бронь
+            candidates = schedule.open_at(candidates, timezone.localtime(), Reservation.DEFAULT_DURATION)
+        # Полнотекстовый поиск с ранжированием
+        restaurants, truncated = search_results(query, candidates)
     
     search_stats = {}
-    if restaurants:
-        # values() и annotate
-        search_stats = {
-            'count': restaurants.paginator.count if hasattr(restaurants, 'paginator') else restaurants.count(),
-            'cuisine_types': restaurants.object_list.values('cuisine_type').annotate(count=Count('id')) if hasattr(restaurants, 'object_list') else restaurants.values('cuisine_type').annotate(count=Count('id')),
-        }
+    if restaurants is not None:
+        results = restaurants
+        # Результатов не больше search.MAX_RESULTS - точное количество дёшево
+        restaurants = paginate(request, results, 8)
+        # сводка по столикам - одним запросом и только для карточек не из кэша
+        LazyTableStats(restaurants)
+        if restaurants:
+            # order_by() сбрасывает сортировку по релевантности перед GROUP BY
+            search_stats = {
+                'count': results.count(),
+                'cuisine_types': results.order_by().values('cuisine_type').annotate(count=Count('id')),
+                'truncated': truncated,
+            }
     
     context = {
         'restaurants': restaurants,
         'query': query,
+        'open_now': open_now,
         'search_stats': search_stats,
     }
     return render(request, 'restaurant/search.html', context)
@@ -306,34 +253,44 @@ def custom_logout(request):
     messages.success(request, 'Вы успешно вышли из системы.')
     return redirect('home')
 
+@primary_db
 @login_required
-@transaction.atomic
 def make_reservation(request, table_id):
-    table = get_object_or_404(Table, id=table_id)
+    table = get_object_or_404(
+        Table.objects.select_related('restaurant').prefetch_related('restaurant__opening_intervals'), id=table_id
+    )
     
     if request.method == 'POST':
-        form = ReservationForm(request.POST)
+        form = ReservationForm(request.POST, restaurant=table.restaurant)
         if form.is_valid():
             reservation = form.save(commit=False)
             reservation.user = request.user
             reservation.table = table
             
-            # exists() для проверки
-            conflicting_exists = Reservation.objects.filter(
-                table=table,
-                reservation_date=reservation.reservation_date,
-                reservation_time=reservation.reservation_time,
-                status__in=['confirmed', 'pending']
-            ).exists()
-            
-            if conflicting_exists:
-                messages.error(request, '❌ Этот столик уже забронирован на выбранное время')
-                # Возврат на ту же страницу
-                return redirect('make_reservation', table_id=table.id)
-            elif reservation.guests_count > table.capacity:
+            if reservation.guests_count > table.capacity:
                 messages.error(request, f'❌ Столик вмещает только {table.capacity} гостей')
             else:
-                reservation.save()
+                # Проверка пересечения и сохранение - атомарно, под блокировкой столика
+                try:
+                    book_table(reservation)
+                except BookingConflict:
+                    if not form.cleaned_data['join_waitlist']:
+                        messages.error(request, '❌ Этот столик уже забронирован на выбранное время')
+                        # Возврат на ту же страницу
+                        return redirect('make_reservation', table_id=table.id)
+                    entry = waitlist.join(reservation, form.cleaned_data['flexibility'])
+                    entry.refresh_from_db()
+                    if entry.status == 'assigned':
+                        # проход очереди сразу нашёл другой столик
+                        assigned = entry.reservation
+                        messages.success(
+                            request,
+                            f'✅ Выбранный столик занят, назначен столик №{assigned.table.table_number} '
+                            f'на {assigned.reservation_date} в {assigned.reservation_time}',
+                        )
+                        return redirect('user_reservations')
+                    messages.info(request, '⏳ Столик занят - вы в листе ожидания. Бронь появится здесь, как только столик освободится')
+                    return redirect('user_reservations')
                 messages.success(request, f'✅ Столик успешно забронирован на {reservation.reservation_date} в {reservation.reservation_time}')
                 return redirect('restaurant_detail', restaurant_id=table.restaurant.id)
     else:
@@ -341,36 +298,49 @@ def make_reservation(request, table_id):
             'reservation_date': timezone.now().date(),
             'guests_count': 2
         }
-        form = ReservationForm(initial=initial_data)
+        form = ReservationForm(initial=initial_data, restaurant=table.restaurant)
+    
+    # Свободные слоты столика на выбранную дату
+    slots_date = form['reservation_date'].value() or timezone.now().date()
+    if isinstance(slots_date, str):
+        try:
+            slots_date = date.fromisoformat(slots_date)
+        except ValueError:
+            slots_date = timezone.now().date()
+    free_slots = day_slots(table.restaurant, slots_date, tables=[table]).get(table, [])
     
     context = {
         'form': form,
         'table': table,
-        'restaurant': table.restaurant
+        'restaurant': table.restaurant,
+        'free_slots': free_slots,
+        'slots_date': slots_date,
     }
     return render(request, 'restaurant/make_reservation.html', context)
 
 @login_required
 def user_reservations(request):
-    reservations = Reservation.objects.filter(user=request.user).select_related(
-        'table', 'table__restaurant'
-    ).order_by('-reservation_date', '-reservation_time')
-    
-    paginator = Paginator(reservations, 10)
-    page = request.GET.get('page')
-    
-    try:
-        reservations = paginator.page(page)
-    except PageNotAnInteger:
-        reservations = paginator.page(1)
-    except EmptyPage:
-        reservations = paginator.page(paginator.num_pages)
+    summary = user_summary.for_request(request)
+    # рабочая таблица и архив - одной лентой
+    querysets = [
+        queryset.order_by(*user_summary.ORDERING)
+        for queryset in archive.user_history(request.user)
+    ]
+    
+    if 'cursor' in request.GET or request.GET.get('count'):
+        reservations = paginate(request, querysets, 10)
+    else:
+        # первая страница - по id последних броней из сводки
+        paginator = MergedKeysetPaginator(querysets, 10)
+        reservations = with_urls(request, paginator.first_page(user_summary.recent_reservations(summary)))
     
     context = {
-        'reservations': reservations
+        'reservations': reservations,
+        'summary': summary,
     }
     return render(request, 'restaurant/user_reservations.html', context)
 
+@primary_db
 @login_required
 def cancel_reservation(request, reservation_id):
     # Явный Http404
@@ -382,6 +352,13 @@ def cancel_reservation(request, reservation_id):
     if request.method == 'POST':
         # update() для массового обновления
         Reservation.objects.filter(id=reservation_id).update(status='cancelled')
+        # update() не отправляет сигналы
+        before = popularity.contribution(reservation.status, reservation.reservation_date, reservation.table.restaurant_id)
+        popularity.apply_change(before, None)
+        invalidate_snapshot()
+        user_summary.invalidate([reservation.user_id])
+        # освободившийся столик - первым в очереди на этот день
+        waitlist.match_on_commit([before])
         messages.success(request, '✅ Бронирование отменено')
         return redirect('user_reservations')
     
@@ -390,6 +367,16 @@ def cancel_reservation(request, reservation_id):
     }
     return render(request, 'restaurant/cancel_reservation.html', context)
 
+@primary_db
+@login_required
+def leave_waitlist(request, entry_id):
+    if request.method == 'POST':
+        if waitlist.leave(request.user, entry_id):
+            messages.success(request, '✅ Заявка убрана из листа ожидания')
+        else:
+            messages.error(request, '❌ Заявки уже нет в листе ожидания')
+    return redirect('user_reservations')
+
 def increase_prices(request, restaurant_id):
     """Демонстрация F expressions"""
     if request.method == 'POST' and request.user.is_staff:
@@ -400,6 +387,8 @@ def increase_prices(request, restaurant_id):
         Table.objects.filter(restaurant=restaurant).update(
             price_per_hour=F('price_per_hour') * (1 + percentage/100)
         )
+        fragments.bump([restaurant.pk])
+        invalidate_snapshot()
         
         messages.success(request, f'✅ Цены увеличены на {percentage}%')
         return redirect('restaurant_detail', restaurant_id=restaurant.id)
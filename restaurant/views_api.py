@@ -1,20 +1,96 @@
-from rest_framework import viewsets, filters
+from rest_framework import viewsets
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.exceptions import ValidationError
 from django_filters.rest_framework import DjangoFilterBackend
-from django.db.models import Count, Q
+from django.shortcuts import get_object_or_404
 from django.utils import timezone
-from datetime import timedelta
+from django.utils.dateparse import parse_date
+from django.utils.http import parse_etags, quote_etag
+import hashlib
 
 from .models import Restaurant, Table, Reservation
-from .serializers import RestaurantSerializer, TableSerializer, ReservationSerializer
+from .serializers import RestaurantSerializer, TableSerializer, ReservationSerializer, parse_expand, parse_fields
+from .booking import book_table, BookingConflict
+from .availability import slot_grid, MAX_GRID_DAYS, GRID_STEPS, SLOT_STEP
+from .popularity import top_restaurants
+from .filters import FullTextSearchFilter, RankedOrderingFilter, OpenAtFilter
+from . import bulk
 
-class RestaurantViewSet(viewsets.ModelViewSet):
+def grid_options(params):
+    """Параметры сетки слотов из запроса: (kwargs для slot_grid, ошибка)"""
+    try:
+        start = parse_date(params['start']) if 'start' in params else timezone.localdate()
+        days = int(params.get('days', 7))
+        duration = int(params.get('duration', Reservation.DEFAULT_DURATION))
+        step = int(params.get('step', SLOT_STEP))
+        guests = int(params.get('guests', 1))
+    except ValueError:
+        start = None
+    if start is None:
+        return None, 'Некорректные параметры'
+    if not 1 <= days <= MAX_GRID_DAYS:
+        return None, f'days - от 1 до {MAX_GRID_DAYS}'
+    if duration not in dict(Reservation.DURATION_CHOICES) or step not in GRID_STEPS:
+        return None, 'Недопустимая длительность или шаг'
+    return {'start_date': start, 'days': days, 'duration': duration, 'step': step, 'guests_count': guests}, None
+
+def grid_etag(grid, if_none_match):
+    """(ETag сетки, не изменилось ли ничего); совпавшие дни отдаются без сетки"""
+    etag = quote_etag(hashlib.sha1(
+        ':'.join(day['etag'] for day in grid['days']).encode()
+    ).hexdigest()[:16])
+    known = set(parse_etags(if_none_match))
+    if etag in known or '*' in known or all(quote_etag(day['etag']) in known for day in grid['days']):
+        return etag, True
+    for day in grid['days']:
+        if quote_etag(day['etag']) in known:
+            day['not_modified'] = True
+            del day['tables']
+    return etag, False
+
+class ExpandableViewSetMixin:
+    """get_queryset() с select_related/prefetch_related под ?expand= и ?fields="""
+
+    def optimize(self, queryset):
+        params = self.request.query_params
+        return self.get_serializer_class().optimize_queryset(
+            queryset, parse_expand(params.get('expand')), parse_fields(params.get('fields'))
+        )
+
+    def get_queryset(self):
+        return self.optimize(super().get_queryset())
+
+class BulkViewSetMixin:
+    """POST/PATCH .../bulk/ - пакетное создание и изменение списком объектов"""
+    bulk_create = None
+    bulk_update = None
+
+    def history_user(self):
+        user = self.request.user
+        return user if user.is_authenticated else None
+
+    def bulk_response(self, handler, data, status):
+        try:
+            objects = handler(data, user=self.history_user())
+        except bulk.BulkValidationError as error:
+            return Response({'errors': error.errors}, status=400)
+        serializer = self.get_serializer_class()(objects, many=True, context=self.get_serializer_context())
+        return Response({'count': len(objects), 'results': serializer.data}, status=status)
+
+    @action(detail=False, methods=['post', 'patch'], url_path='bulk')
+    def bulk(self, request):
+        """Пакет до bulk.MAX_ITEMS объектов; при любой ошибке не сохраняется ничего"""
+        if request.method == 'POST':
+            return self.bulk_response(type(self).bulk_create, request.data, 201)
+        return self.bulk_response(type(self).bulk_update, request.data, 200)
+
+class RestaurantViewSet(ExpandableViewSetMixin, viewsets.ModelViewSet):
     queryset = Restaurant.objects.all()
     serializer_class = RestaurantSerializer
     
     # ✅ ПРАВИЛЬНАЯ НАСТРОЙКА ФИЛЬТРАЦИИ И ПОИСКА
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [DjangoFilterBackend, FullTextSearchFilter, OpenAtFilter, RankedOrderingFilter]
     
     # ✅ ФИЛЬТРАЦИЯ ПО КОНКРЕТНЫМ ПОЛЯМ
     filterset_fields = {
@@ -22,7 +98,7 @@ class RestaurantViewSet(viewsets.ModelViewSet):
         'tags': ['exact'],          # ФИЛЬТРАЦИЯ ПО ТЕГАМ
     }
     
-    # ✅ ПОИСК ПО НЕСКОЛЬКИМ ПОЛЯМ
+    # ✅ ПОИСК ПО НЕСКОЛЬКИМ ПОЛЯМ (полнотекстовый индекс: название, кухня, теги, адрес, описание)
     search_fields = ['name', 'description', 'address']
     
     # ✅ СОРТИРОВКА
@@ -32,12 +108,7 @@ class RestaurantViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def popular(self, request):
         """Популярные рестораны (с наибольшим количеством бронирований)"""
-        week_ago = timezone.now().date() - timedelta(days=7)
-        
-        popular_restaurants = Restaurant.objects.annotate(
-            reservation_count=Count('tables__reservations', 
-                                  filter=Q(tables__reservations__reservation_date__gte=week_ago))
-        ).filter(reservation_count__gt=0).order_by('-reservation_count')[:5]
+        popular_restaurants = self.optimize(top_restaurants(5))
         
         serializer = self.get_serializer(popular_restaurants, many=True)
         return Response({
@@ -46,6 +117,26 @@ class RestaurantViewSet(viewsets.ModelViewSet):
             'results': serializer.data
         })
     
+    @action(detail=True, methods=['get'])
+    def availability(self, request, pk=None):
+        """Сетка свободных слотов по столикам на диапазон дат.
+
+        ?start=ГГГГ-ММ-ДД (сегодня) &days=1..31 (7) &duration= &step=15|30|60 &guests=
+        Ответ с ETag; If-None-Match со списком etag дней отдаёт совпавшие
+        дни без сетки ("not_modified": true), а если не изменилось ничего - 304.
+        """
+        restaurant = get_object_or_404(
+            Restaurant.objects.only('id').prefetch_related('opening_intervals'), pk=pk
+        )
+        options, error = grid_options(request.query_params)
+        if error:
+            return Response({'error': error}, status=400)
+        grid = slot_grid(restaurant, **options)
+        etag, unchanged = grid_etag(grid, request.headers.get('If-None-Match', ''))
+        response = Response(status=304) if unchanged else Response(grid)
+        response['ETag'] = etag
+        return response
+
     # ✅ ВТОРОЕ КАСТОМНОЕ ДЕЙСТВИЕ
     @action(detail=True, methods=['post'])
     def add_tag(self, request, pk=None):
@@ -69,22 +160,48 @@ class RestaurantViewSet(viewsets.ModelViewSet):
             'tag_added': tag_name
         })
 
-class TableViewSet(viewsets.ModelViewSet):
+class TableViewSet(BulkViewSetMixin, ExpandableViewSetMixin, viewsets.ModelViewSet):
     queryset = Table.objects.all()
     serializer_class = TableSerializer
+    bulk_create = staticmethod(bulk.create_tables)
+    bulk_update = staticmethod(bulk.update_tables)
     
     # ✅ ФИЛЬТРАЦИЯ ДЛЯ СТОЛИКОВ
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['restaurant', 'capacity']
 
-class ReservationViewSet(viewsets.ModelViewSet):
+class ReservationViewSet(BulkViewSetMixin, ExpandableViewSetMixin, viewsets.ModelViewSet):
     queryset = Reservation.objects.all()
     serializer_class = ReservationSerializer
+    bulk_create = staticmethod(bulk.create_reservations)
+    bulk_update = staticmethod(bulk.update_reservations)
     
     # ✅ ФИЛЬТРАЦИЯ ДЛЯ БРОНИРОВАНИЙ
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['table', 'user', 'status', 'reservation_date']
     
+    def perform_create(self, serializer):
+        """Создание брони через безопасный от гонок путь"""
+        reservation = Reservation(**serializer.validated_data)
+        try:
+            serializer.instance = book_table(reservation)
+        except BookingConflict:
+            raise ValidationError({'table': 'Этот столик уже забронирован на выбранное время'})
+
+    def perform_update(self, serializer):
+        """Изменение активной брони - та же проверка пересечения под блокировкой"""
+        reservation = serializer.instance
+        for field, value in serializer.validated_data.items():
+            setattr(reservation, field, value)
+        if reservation.status not in Reservation.ACTIVE_STATUSES:
+            # отменённая бронь столик не занимает
+            reservation.save()
+            return
+        try:
+            book_table(reservation)
+        except BookingConflict:
+            raise ValidationError({'table': 'Этот столик уже забронирован на выбранное время'})
+
     @action(detail=True, methods=['post'])
     def cancel(self, request, pk=None):
         """Отмена бронирования"""
@@ -98,12 +215,21 @@ class ReservationViewSet(viewsets.ModelViewSet):
             'status': 'cancelled'
         })
     
+    @action(detail=False, methods=['post'])
+    def bulk_cancel(self, request):
+        """Отмена пачки бронирований: {"ids": [...]} или просто список id"""
+        ids = request.data.get('ids') if isinstance(request.data, dict) else request.data
+        response = self.bulk_response(bulk.cancel_reservations, ids, 200)
+        if response.status_code == 200:
+            response.data['message'] = 'Бронирования отменены'
+        return response
+    
     # ✅ ВТОРОЕ КАСТОМНОЕ ДЕЙСТВИЕ ДЛЯ БРОНИРОВАНИЙ
     @action(detail=False, methods=['get'])
     def upcoming(self, request):
         """Предстоящие бронирования"""
         today = timezone.now().date()
-        upcoming_reservations = Reservation.objects.filter(
+        upcoming_reservations = self.optimize(Reservation.objects.all()).filter(
             reservation_date__gte=today,
             status__in=['confirmed', 'pending']
         ).order_by('reservation_date', 'reservation_time')[:10]
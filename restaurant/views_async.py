@@ -0,0 +1,201 @@
+"""Асинхронные версии читающих страниц и API - для работы под ASGI.
+
+restobook/asgi.py подключает их через restobook.urls_async, под WSGI
+работают views.py и viewsets. Данные читаются асинхронным интерфейсом
+ORM, независимые запросы запускаются вместе через asyncio.gather.
+Шаблон рендерится в потоке (sync_to_async): при промахе кэша фрагментов
+ленивые значения (LazyTableStats) досчитываются обычным ORM.
+
+Запросы одного обработчика Django всё равно выполняет по очереди в
+потоке запроса, поэтому gather экономит не время БД, а переключения
+между потоком и циклом событий. Сравнение с WSGI - benchmark_async.
+
+API отдаёт тот же JSON, что и viewsets (JSONRenderer), но без
+браузерного интерфейса DRF.
+"""
+import asyncio
+from datetime import date
+
+from asgiref.sync import sync_to_async
+from django.db.models import Count
+from django.http import Http404, HttpResponse
+from django.shortcuts import aget_object_or_404, render
+from django.utils import timezone
+from django.views.decorators.http import require_GET
+from rest_framework.exceptions import NotFound
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from . import schedule, snapshot
+from .availability import aslot_grid
+from .dashboard import get_snapshot
+from .fragments import LazyTableStats
+from .models import Restaurant, Reservation
+from .pagination import apaginate
+from .popularity import top_restaurants
+from .search import asearch, asearch_results
+from .serializers import ReservationSerializer, RestaurantSerializer, parse_expand, parse_fields
+from .utils import alist, resolved
+from .views_api import grid_etag, grid_options
+
+arender = sync_to_async(render)
+
+
+async def search_list(query):
+    return await alist(await asearch(query))
+
+
+async def home(request):
+    today = date.today()
+    search_query = request.GET.get('q', '')
+    recently_viewed = await request.session.aget('recently_viewed_restaurants', [])
+
+    # Недавние, снимок главной (кэш) и поиск - независимы
+    recent_restaurants, dashboard, search_results = await asyncio.gather(
+        alist(Restaurant.objects.filter(id__in=recently_viewed)),
+        sync_to_async(get_snapshot)(),
+        search_list(search_query) if 'q' in request.GET else resolved(),
+    )
+
+    context = {
+        'popular_restaurants': dashboard['popular_restaurants'][:4],
+        'available_tables': dashboard['available_tables'],
+        'affordable_restaurants': dashboard['affordable_restaurants'],
+        'large_tables_restaurants': dashboard['large_tables_restaurants'],
+        'stats': dashboard['stats'],
+        'search_results': search_results,
+        'search_query': search_query,
+        'today': today,
+        'recent_restaurants': recent_restaurants,
+        'cuisine_stats': dashboard['cuisine_stats'],
+    }
+    return await arender(request, 'restaurant/home.html', context)
+
+
+async def all_restaurants(request):
+    restaurants, restaurant_data = await asyncio.gather(
+        apaginate(request, Restaurant.objects.order_by('name', 'id'), 6),
+        alist(Restaurant.objects.values('id', 'name', 'cuisine_type')[:10]),
+    )
+    context = {
+        'restaurants': restaurants,
+        'restaurant_data': restaurant_data,
+    }
+    return await arender(request, 'restaurant/all_restaurants.html', context)
+
+
+async def restaurant_detail(request, restaurant_id):
+    try:
+        recently_viewed, data = await asyncio.gather(
+            request.session.aget('recently_viewed_restaurants', []),
+            snapshot.aload(restaurant_id, timezone.now().date()),
+        )
+    except Restaurant.DoesNotExist:
+        raise Http404('Ресторан не найден')
+
+    if restaurant_id not in recently_viewed:
+        recently_viewed.insert(0, restaurant_id)
+        await request.session.aset('recently_viewed_restaurants', recently_viewed[:5])
+
+    context = {
+        'restaurant': data.restaurant,
+        'tables': data.tables,
+        'available_tables': data.available_tables,
+        'table_slots': data.table_slots,
+        'slots_version': data.slots_version,
+        'reservations': data.reservations,
+        'stats': data.stats,
+    }
+    return await arender(request, 'restaurant/restaurant_detail.html', context)
+
+
+async def search_restaurants(request):
+    restaurants = None
+    query = ''
+    open_now = bool(request.GET.get('open_now'))
+    search_stats = {}
+
+    if 'q' in request.GET:
+        query = request.GET['q']
+        candidates = Restaurant.objects.all()
+        if open_now:
+            candidates = schedule.open_at(candidates, timezone.localtime(), Reservation.DEFAULT_DURATION)
+        results, truncated = await asearch_results(query, candidates)
+        # страница, количество и разбивка по кухням - одновременно
+        restaurants, count, cuisine_types = await asyncio.gather(
+            apaginate(request, results, 8),
+            results.acount(),
+            alist(results.order_by().values('cuisine_type').annotate(count=Count('id'))),
+        )
+        LazyTableStats(restaurants)
+        if restaurants:
+            search_stats = {'count': count, 'cuisine_types': cuisine_types, 'truncated': truncated}
+
+    context = {
+        'restaurants': restaurants,
+        'query': query,
+        'open_now': open_now,
+        'search_stats': search_stats,
+    }
+    return await arender(request, 'restaurant/search.html', context)
+
+
+def api_response(data, status=200):
+    return HttpResponse(JSONRenderer().render(data), status=status, content_type='application/json')
+
+
+def serializer_kwargs(request):
+    """context с DRF-запросом: по нему сериализатор читает ?expand= и ?fields="""
+    return {'many': True, 'context': {'request': Request(request)}}
+
+
+def optimized(serializer_class, request, queryset):
+    return serializer_class.optimize_queryset(
+        queryset, parse_expand(request.GET.get('expand')), parse_fields(request.GET.get('fields'))
+    )
+
+
+@require_GET
+async def popular_restaurants(request):
+    """Как RestaurantViewSet.popular"""
+    restaurants = await alist(optimized(RestaurantSerializer, request, top_restaurants(5)))
+    serializer = RestaurantSerializer(restaurants, **serializer_kwargs(request))
+    return api_response({
+        'message': 'Самые популярные рестораны за неделю',
+        'count': len(restaurants),
+        'results': serializer.data,
+    })
+
+
+@require_GET
+async def upcoming_reservations(request):
+    """Как ReservationViewSet.upcoming"""
+    reservations = await alist(optimized(ReservationSerializer, request, Reservation.objects.all()).filter(
+        reservation_date__gte=timezone.now().date(),
+        status__in=Reservation.ACTIVE_STATUSES,
+    ).order_by('reservation_date', 'reservation_time')[:10])
+    serializer = ReservationSerializer(reservations, **serializer_kwargs(request))
+    return api_response({
+        'message': 'Предстоящие бронирования',
+        'count': len(reservations),
+        'results': serializer.data,
+    })
+
+
+@require_GET
+async def restaurant_availability(request, pk):
+    """Как RestaurantViewSet.availability"""
+    options, error = grid_options(request.GET)
+    if error:
+        return api_response({'error': error}, status=400)
+    try:
+        restaurant = await aget_object_or_404(
+            Restaurant.objects.only('id').prefetch_related('opening_intervals'), pk=pk
+        )
+    except Http404:
+        return api_response({'detail': NotFound.default_detail}, status=404)
+    grid = await aslot_grid(restaurant, **options)
+    etag, unchanged = grid_etag(grid, request.headers.get('If-None-Match', ''))
+    response = HttpResponse(status=304) if unchanged else api_response(grid)
+    response['ETag'] = etag
+    return response
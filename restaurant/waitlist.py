@@ -0,0 +1,263 @@
+"""Лист ожидания и назначение освободившихся столиков.
+
+Если выбранный столик занят, гость встаёт в очередь ресторана на дату
+(WaitlistEntry): подойдёт любой столик вместимостью не меньше числа
+гостей с началом в окне reservation_time ± flexibility. Каждая отмена
+(сигналы брони, отмена через update(), пакетная отмена) после коммита
+запускает проход сопоставления по затронутым (ресторан, дата).
+
+Проход - один на (ресторан, дату) и работает в памяти:
+
+- столики отсортированы по вместимости и перебираются от меньших к
+  большим (best-fit): освободившийся столик достаётся самой большой
+  помещающейся компании, среди равных - раньше вставшей в очередь;
+- очередь разложена по размеру компании (отсортированный список
+  размеров + bisect), так что компании, которые не помещаются, не
+  просматриваются вовсе;
+- занятость столика - отсортированные интервалы (Timeline), проверка
+  окна - bisect, новые назначения вставляются туда же.
+
+Брони дня, столики и очередь читаются по одному запросу под
+блокировкой столиков ресторана, назначения пишутся пачкой
+(bulk_create с историей) - число запросов не зависит от длины очереди.
+Созданные брони - в статусе pending: гость подтверждает, что придёт.
+"""
+from bisect import bisect_right
+from collections import defaultdict
+
+from django.db import transaction
+from django.utils import timezone
+from simple_history.utils import bulk_create_with_history
+
+from . import popularity, schedule, user_summary
+from .availability import SLOT_STEP, from_minutes, reserved_intervals, to_minutes
+from .booking import lock_tables
+from .dashboard import invalidate_snapshot
+from .models import Reservation, Restaurant, Table, WaitlistEntry
+from .sqlite_tuning import write_transaction
+
+BATCH_SIZE = 500
+
+
+class Timeline:
+    """Занятые интервалы одного столика [(start, end)], отсортированные по началу.
+
+    Активные брони столика не пересекаются, поэтому достаточно проверить
+    соседей по началу.
+    """
+
+    def __init__(self, intervals=()):
+        intervals = sorted(intervals)
+        self.starts = [start for start, _end in intervals]
+        self.ends = [end for _start, end in intervals]
+
+    def is_free(self, start, end):
+        i = bisect_right(self.starts, start)
+        if i and self.ends[i - 1] > start:
+            return False
+        return i == len(self.starts) or self.starts[i] >= end
+
+    def add(self, start, end):
+        i = bisect_right(self.starts, start)
+        self.starts.insert(i, start)
+        self.ends.insert(i, end)
+
+
+class Matcher:
+    """Сопоставление очереди ресторана на один день со столиками.
+
+    tables - [(id, вместимость)], intervals - {table_id: [(start, end)]}
+    (availability.reserved_intervals), is_open(start, duration) - часы
+    работы, earliest - минута, раньше которой начинать нельзя (сегодня).
+    """
+
+    def __init__(self, tables, intervals, is_open, earliest=0, step=SLOT_STEP):
+        self.tables = sorted((capacity, pk) for pk, capacity in tables)
+        self.timelines = {pk: Timeline(intervals.get(pk, ())) for _capacity, pk in self.tables}
+        self.is_open = is_open
+        self.earliest = earliest
+        self.step = step
+        self._starts = {}
+
+    def starts(self, entry):
+        """Начала в окне заявки: сначала желаемое, дальше - по удалению от него"""
+        if entry.pk not in self._starts:
+            desired = to_minutes(entry.reservation_time)
+            candidates = [desired]
+            for offset in range(self.step, entry.flexibility + 1, self.step):
+                candidates += [desired - offset, desired + offset]
+            self._starts[entry.pk] = [
+                start for start in candidates
+                if start >= self.earliest and self.is_open(start, entry.duration)
+            ]
+        return self._starts[entry.pk]
+
+    def first_fit(self, queue, timeline):
+        """Первая (по очереди) заявка, для которой столик свободен: (заявка, начало)"""
+        for entry in queue:
+            for start in self.starts(entry):
+                if timeline.is_free(start, start + entry.duration):
+                    return entry, start
+        return None
+
+    def assign(self, entries):
+        """[(заявка, table_id, начало)]; entries - в порядке очереди"""
+        queues = defaultdict(list)
+        for entry in entries:
+            queues[entry.guests_count].append(entry)
+        sizes = sorted(queues)
+
+        matches = []
+        for capacity, table_id in self.tables:
+            timeline = self.timelines[table_id]
+            # индекс за самым большим размером компании, который помещается
+            index = bisect_right(sizes, capacity)
+            while index:
+                size = sizes[index - 1]
+                found = self.first_fit(queues[size], timeline)
+                if found is None:
+                    index -= 1
+                    continue
+                entry, start = found
+                queues[size].remove(entry)
+                timeline.add(start, start + entry.duration)
+                matches.append((entry, table_id, start))
+                if not queues[size]:
+                    del sizes[index - 1]
+                    index -= 1
+            if not sizes:
+                break
+        return matches
+
+
+def waiting(restaurant_id, day):
+    """Очередь ресторана на дату"""
+    return WaitlistEntry.objects.filter(restaurant_id=restaurant_id, reservation_date=day, status='waiting')
+
+
+def join(reservation, flexibility=WaitlistEntry.DEFAULT_FLEXIBILITY):
+    """Поставить в очередь несохранённую бронь, которая не прошла проверку занятости.
+
+    Повторная заявка на то же время возвращает существующую. Проход
+    сопоставления запускается сразу после коммита - может найтись другой
+    подходящий столик.
+    """
+    restaurant_id = reservation.table.restaurant_id
+    with transaction.atomic():
+        entry, created = WaitlistEntry.objects.get_or_create(
+            user=reservation.user,
+            restaurant_id=restaurant_id,
+            reservation_date=reservation.reservation_date,
+            reservation_time=reservation.reservation_time,
+            status='waiting',
+            defaults={
+                'flexibility': flexibility,
+                'duration': reservation.duration,
+                'guests_count': reservation.guests_count,
+                'special_requests': reservation.special_requests,
+            },
+        )
+        if created:
+            user_summary.invalidate_on_commit([entry.user_id])
+            match_on_commit([(restaurant_id, entry.reservation_date)])
+    return entry
+
+
+def leave(user, entry_id):
+    """Убрать заявку пользователя из очереди; False, если её там уже нет"""
+    left = WaitlistEntry.objects.filter(pk=entry_id, user=user, status='waiting').update(status='cancelled')
+    if left:
+        user_summary.invalidate([user.pk])
+    return bool(left)
+
+
+def expire(today=None):
+    """Заявки на прошедшие даты - в 'expired'; возвращает их число"""
+    today = today or timezone.localdate()
+    stale = WaitlistEntry.objects.filter(status='waiting', reservation_date__lt=today)
+    user_ids = set(stale.values_list('user_id', flat=True))
+    expired = stale.update(status='expired')
+    user_summary.invalidate(user_ids)
+    return expired
+
+
+def match_day(restaurant_id, day, now=None):
+    """Проход сопоставления очереди ресторана на дату; возвращает созданные брони"""
+    now = timezone.localtime(now)
+    if day < now.date() or not waiting(restaurant_id, day).exists():
+        return []
+    restaurant = Restaurant.objects.prefetch_related('opening_intervals').filter(pk=restaurant_id).first()
+    if restaurant is None:
+        return []
+    earliest = to_minutes(now.time()) if day == now.date() else 0
+
+    with write_transaction():
+        tables = list(Table.objects.filter(restaurant_id=restaurant_id).values_list('id', 'capacity'))
+        # блокировки как у book_table: занятость читается уже под ними
+        lock_tables(pk for pk, _capacity in tables)
+        entries = list(waiting(restaurant_id, day).filter(
+            guests_count__lte=max((capacity for _pk, capacity in tables), default=0)
+        ).order_by('created_at', 'id'))
+        if not entries:
+            return []
+        matcher = Matcher(
+            tables, reserved_intervals(restaurant, day),
+            lambda start, duration: schedule.is_open_for(restaurant, day, start, duration),
+            earliest,
+        )
+        matches = matcher.assign(entries)
+        if not matches:
+            return []
+        return _write(restaurant_id, day, matches, now)
+
+
+def _write(restaurant_id, day, matches, now):
+    """Брони назначенных заявок и статусы заявок - пачкой"""
+    created = bulk_create_with_history([
+        Reservation(
+            user_id=entry.user_id,
+            table_id=table_id,
+            reservation_date=day,
+            reservation_time=from_minutes(start),
+            duration=entry.duration,
+            guests_count=entry.guests_count,
+            special_requests=entry.special_requests,
+            status='pending',
+        )
+        for entry, table_id, start in matches
+    ], Reservation, batch_size=BATCH_SIZE)
+    entries = []
+    for (entry, _table_id, _start), reservation in zip(matches, created):
+        entry.status = 'assigned'
+        entry.reservation = reservation
+        entry.assigned_at = now
+        entries.append(entry)
+    WaitlistEntry.objects.bulk_update(entries, ['status', 'reservation', 'assigned_at'], batch_size=BATCH_SIZE)
+    # bulk_create не вызывает сигналы
+    popularity.apply_bulk((None, (restaurant_id, day)) for _reservation in created)
+    transaction.on_commit(invalidate_snapshot)
+    user_summary.invalidate_on_commit(entry.user_id for entry in entries)
+    return created
+
+
+def match(keys, now=None):
+    """match_day для каждой пары (ресторан, дата); возвращает {пара: число назначений}"""
+    return {key: len(match_day(key[0], key[1], now)) for key in sorted(set(keys))}
+
+
+def match_on_commit(keys):
+    """Проход по освободившимся (ресторан, дата) после коммита текущей транзакции"""
+    keys = {key for key in keys if key is not None}
+    if keys:
+        # ошибка прохода не должна откатывать отмену - robust только логирует
+        transaction.on_commit(lambda: match(keys), robust=True)
+
+
+def pending_days(today=None):
+    """Пары (ресторан, дата) с непустой очередью, начиная с сегодня"""
+    today = today or timezone.localdate()
+    return list(
+        WaitlistEntry.objects.filter(status='waiting', reservation_date__gte=today)
+        .order_by('restaurant_id', 'reservation_date')
+        .values_list('restaurant_id', 'reservation_date').distinct()
+    )
@@ -22,6 +22,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'restaurant.profiling.ProfilingMiddleware',  # только при PROFILING_ENABLED
+    'restaurant.routing.ReplicaRoutingMiddleware',  # только при DATABASE_REPLICAS
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -31,7 +33,9 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
-ROOT_URLCONF = 'restobook.urls'
+# Под ASGI (asgi.py ставит ASYNC_VIEWS=1) читающие страницы и API - асинхронные
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS') == '1'
+ROOT_URLCONF = 'restobook.urls_async' if ASYNC_VIEWS else 'restobook.urls'
 
 TEMPLATES = [
     {
@@ -51,12 +55,124 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'restobook.wsgi.application'
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+# Соединения: под WSGI держим открытыми CONN_MAX_AGE секунд и проверяем
+# перед повторным использованием. Под ASGI поток у каждого запроса свой,
+# постоянные соединения копились бы - там CONN_MAX_AGE = 0, а для Postgres
+# переиспользование даёт пул psycopg (POSTGRES_POOL=1).
+CONN_MAX_AGE = 0 if ASYNC_VIEWS else int(os.environ.get('CONN_MAX_AGE', 60))
+POSTGRES_POOL = os.environ.get('POSTGRES_POOL') == '1'
+
+# Профили SQLite (restaurant/sqlite_tuning.py): PRAGMA на каждом соединении.
+# production - WAL (читатели не ждут писателя), synchronous=NORMAL
+# (fsync только при checkpoint), ожидание блокировки вместо ошибки,
+# mmap и кэш страниц; записи бронирования - BEGIN IMMEDIATE.
+# Включается SQLITE_PROFILE=production; WAL остаётся в файле БД.
+SQLITE_PROFILES = {
+    'production': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,             # мс
+        'mmap_size': 256 * 1024 * 1024,   # байт
+        'cache_size': -32000,             # минус - в КиБ
+        'temp_store': 'MEMORY',
+    },
 }
+SQLITE_PROFILE = os.environ.get('SQLITE_PROFILE', '')
+SQLITE_IMMEDIATE_WRITES = SQLITE_PROFILE in SQLITE_PROFILES
+
+
+def sqlite_options(read_only=False):
+    pragmas = dict(SQLITE_PROFILES.get(SQLITE_PROFILE, {}))
+    if read_only:
+        # режим журнала меняет файл - на реплике только читаем
+        pragmas.pop('journal_mode', None)
+    if not pragmas:
+        return {}
+    return {'init_command': ';'.join(f'PRAGMA {name}={value}' for name, value in pragmas.items())}
+
+
+def database(**overrides):
+    if os.environ.get('POSTGRES_DB'):
+        config = {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ['POSTGRES_DB'],
+            'USER': os.environ.get('POSTGRES_USER', 'postgres'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+        }
+        if POSTGRES_POOL:
+            # пул несовместим с CONN_MAX_AGE > 0
+            config['OPTIONS'] = {'pool': {'min_size': 2, 'max_size': 10}}
+    else:
+        config = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'OPTIONS': sqlite_options(),
+        }
+    config['CONN_MAX_AGE'] = 0 if POSTGRES_POOL else CONN_MAX_AGE
+    config['CONN_HEALTH_CHECKS'] = True
+    config.update(overrides)
+    return config
+
+
+DATABASES = {'default': database()}
+
+# Реплики для чтения (restaurant/routing.py). Postgres: POSTGRES_REPLICAS=host:port,...
+# SQLite: SQLITE_REPLICAS=путь,... - копии db.sqlite3, открываются только
+# на чтение, обновляются manage.py sync_replicas. В тестах реплики - зеркала default.
+if os.environ.get('POSTGRES_DB'):
+    _replicas = [
+        dict(zip(('HOST', 'PORT'), address.strip().split(':', 1)))
+        for address in os.environ.get('POSTGRES_REPLICAS', '').split(',') if address.strip()
+    ]
+else:
+    _replicas = [
+        {'NAME': f'file:{Path(path.strip()).resolve()}?mode=ro', 'OPTIONS': sqlite_options(read_only=True)}
+        for path in os.environ.get('SQLITE_REPLICAS', '').split(',') if path.strip()
+    ]
+for _number, _overrides in enumerate(_replicas, 1):
+    DATABASES[f'replica{_number}'] = database(TEST={'MIRROR': 'default'}, **_overrides)
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['restaurant.routing.ReplicaRouter']
+REPLICA_STICKY_SECONDS = 5       # после записи клиент читает с основной БД
+REPLICA_HEALTH_INTERVAL = 10     # секунд между проверками реплики
+
+# Кэш: locmem по умолчанию, в продакшене - Redis или файловый
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+elif os.environ.get('CACHE_DIR'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ['CACHE_DIR'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'restobook',
+        }
+    }
+
+# Снимок главной страницы (restaurant/dashboard.py)
+DASHBOARD_CACHE_ALIAS = 'default'
+DASHBOARD_TTL = 60          # секунд снимок считается свежим
+DASHBOARD_STALE_TTL = 600   # сколько ещё отдаём устаревший, пересчитывая в фоне
+DASHBOARD_ASYNC_REFRESH = True
+
+# Сводка броней пользователя для тегов и "Мои бронирования" (restaurant/user_summary.py)
+USER_SUMMARY_TTL = 3600
+
+# Профилирование запросов (restaurant/profiling.py), метрики - /metrics/
+PROFILING_ENABLED = os.environ.get('PROFILING') == '1'
+PROFILING_TOKEN = os.environ.get('PROFILING_TOKEN', '')
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -92,6 +208,17 @@ if DEBUG:
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# PDF-отчёты (restaurant/reports.py): кэш файлов и пул воркеров
+REPORTS_ROOT = os.path.join(MEDIA_ROOT, 'reports')
+REPORT_EXECUTOR = 'thread'  # или 'process' для рендера в отдельных процессах
+REPORT_WORKERS = 2
+REPORT_TIMEOUT = 10 * 60  # секунд; дольше - задание считается неудавшимся
+
+# Уменьшенные копии фотографий ресторанов (restaurant/images.py)
+IMAGE_VARIANTS_ROOT = os.path.join(MEDIA_ROOT, 'variants')
+IMAGE_EXECUTOR = 'thread'  # или 'process'
+IMAGE_WORKERS = 2
+
 # Перенаправления
 LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/'
@@ -103,8 +230,20 @@ LOGOUT_URL = '/admin/logout/'
 
 IMPORT_EXPORT_USE_TRANSACTIONS = True
 
+# История изменений (restaurant/history.py)
+SIMPLE_HISTORY_ENABLED = True
+HISTORY_BUFFERED = True          # в транзакции - одна вставка истории после коммита
+HISTORY_SKIP_UNCHANGED = True    # save() без изменений не пишет запись
+HISTORY_DISABLED_MODELS = []     # например ['restaurant.table']
+HISTORY_RETENTION_DAYS = 365     # manage.py prune_history
+HISTORY_ARCHIVE_DIR = os.path.join(BASE_DIR, 'history_archive')
+
+# Архив броней (restaurant/archive.py): старше горизонта - в отдельную таблицу
+RESERVATION_ARCHIVE_DAYS = 180   # manage.py archive_reservations
+
 REST_FRAMEWORK = {
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    # Keyset-пагинация: ?cursor=..., общее количество - по ?count=true
+    'DEFAULT_PAGINATION_CLASS': 'restaurant.pagination.KeysetPagination',
     'PAGE_SIZE': 10,
     
     # вкл ФИЛЬТРАЦИЮ
@@ -0,0 +1,17 @@
+"""URL для ASGI: читающие страницы и API - асинхронные, остальное - как в urls.py"""
+from django.urls import path
+
+from restaurant import views_async
+
+from . import urls
+
+urlpatterns = [
+    path('', views_async.home, name='home'),
+    path('search/', views_async.search_restaurants, name='search_restaurants'),
+    path('restaurants/', views_async.all_restaurants, name='all_restaurants'),
+    path('restaurants/<int:restaurant_id>/', views_async.restaurant_detail, name='restaurant_detail'),
+    path('api/restaurants/popular/', views_async.popular_restaurants, name='restaurant-popular'),
+    path('api/restaurants/<int:pk>/availability/', views_async.restaurant_availability,
+         name='restaurant-availability'),
+    path('api/reservations/upcoming/', views_async.upcoming_reservations, name='reservation-upcoming'),
+] + urls.urlpatterns